@@ -10,7 +10,7 @@ import pandas as pd
 from datetime import datetime, timedelta
 import json
 import os
-from database import AnalysisDatabase
+from analysis_repository import get_repository
 import plotly.graph_objects as go
 import plotly.express as px
 
@@ -191,7 +191,7 @@ ADMIN_CREDENTIALS = {
 }
 
 # ========== INITIALIZE DATABASE ==========
-db = AnalysisDatabase(os.getenv("DATABASE_FILE", "history.json"))
+db = get_repository(os.getenv("DATABASE_FILE", "history.json"))
 
 # ========== LOGIN CHECK ==========
 if "admin_logged_in" not in st.session_state:
@@ -272,13 +272,8 @@ with tab1:
             if st.form_submit_button("➕ เพิ่มผู้ใช้", use_container_width=True):
                 if new_username and new_password and new_name:
                     try:
-                        # Save to history.json (in production, use database)
-                        history_file = "history.json"
-                        if os.path.exists(history_file):
-                            with open(history_file, 'r', encoding='utf-8') as f:
-                                history = json.load(f)
-                        else:
-                            history = {}
+                        # Check existing users in the analysis database
+                        history = db.engine.user_counts()
                         
                         # Add new user if not exists
                         if new_username not in history:
@@ -364,12 +359,10 @@ with tab2:
         total_users = len(existing_users)
         total_files = 0
         
-        # Try to load data from JSON
-        if os.path.exists("history.json"):
-            with open("history.json", 'r', encoding='utf-8') as f:
-                history = json.load(f)
-                total_analyses = sum(len(analyses) for analyses in history.values())
-                total_files = sum(1 for analyses in history.values() for _ in analyses)
+        # Count from the storage engine index (no need to read analysis bodies)
+        user_counts = db.engine.user_counts()
+        total_analyses = sum(user_counts.values())
+        total_files = total_analyses
         
         # Summary metrics
         col1, col2, col3, col4 = st.columns(4)
@@ -465,39 +458,35 @@ with tab3:
         
         st.markdown("---")
         
-        # Load and display history
-        if os.path.exists("history.json"):
-            with open("history.json", 'r', encoding='utf-8') as f:
-                history = json.load(f)
-            
-            history_list = []
-            for username, analyses in history.items():
-                if filter_user == "ทั้งหมด" or filter_user == username:
-                    for analysis in analyses:
-                        history_list.append({
-                            "Username": username,
-                            "ชื่อไฟล์": analysis.get('file_name', 'N/A'),
-                            "วันเวลา": analysis.get('timestamp', 'N/A'),
-                            "ขนาดไฟล์": analysis.get('file_size_chars', 0),
-                            "สถานะ": "✅ สำเร็จ"
-                        })
+        # Load and display history (filtered through the repository index)
+        analyses = db.find(username=None if filter_user == "ทั้งหมด" else filter_user)
+        if sort_by == "เก่าสุดก่อน":
+            analyses.reverse()
+        
+        history_list = []
+        for analysis in analyses:
+            history_list.append({
+                "Username": analysis.get('username', 'N/A'),
+                "ชื่อไฟล์": analysis.get('file_name', 'N/A'),
+                "วันเวลา": analysis.get('timestamp', 'N/A'),
+                "ขนาดไฟล์": analysis.get('file_size_chars', 0),
+                "สถานะ": "✅ สำเร็จ"
+            })
+        
+        if history_list:
+            history_df = pd.DataFrame(history_list)
+            st.dataframe(history_df, use_container_width=True, hide_index=True)
             
-            if history_list:
-                history_df = pd.DataFrame(history_list)
-                st.dataframe(history_df, use_container_width=True, hide_index=True)
-                
-                # Summary
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("📋 ระเบียนทั้งหมด", len(history_list))
-                with col2:
-                    st.metric("📊 วันนี้", len([h for h in history_list if datetime.now().strftime('%Y-%m-%d') in h['วันเวลา']]))
-                with col3:
-                    st.metric("📈 ผู้ใช้ที่ใช้งาน", len(set(h['Username'] for h in history_list)))
-            else:
-                st.info("ไม่มีประวัติการใช้งาน")
+            # Summary
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("📋 ระเบียนทั้งหมด", len(history_list))
+            with col2:
+                st.metric("📊 วันนี้", len([h for h in history_list if datetime.now().strftime('%Y-%m-%d') in h['วันเวลา']]))
+            with col3:
+                st.metric("📈 ผู้ใช้ที่ใช้งาน", len(set(h['Username'] for h in history_list)))
         else:
-            st.info("ยังไม่มีไฟล์ประวัติ")
+            st.info("ไม่มีประวัติการใช้งาน")
     
     except Exception as e:
         st.error(f"Error loading history: {str(e)}")
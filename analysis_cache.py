@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache ของผลการวิเคราะห์จาก AI
+
+นักเรียนมักส่งไฟล์เดิมซ้ำหลายครั้ง ผลการวิเคราะห์จึงเก็บไว้ตาม
+SHA-256(ข้อความที่อ่านได้ + บทที่เลือก + เวอร์ชัน prompt + ชื่อ model)
+ถ้าพบใน cache จะตอบกลับได้ทันทีโดยไม่ใช้โควต้า API
+
+เก็บบนดิสก์ด้วย SQLite (ใช้ร่วมกันได้หลาย process) แบบ LRU:
+- ลบรายการที่ไม่ได้ใช้นานที่สุดเมื่อขนาดรวมเกินกำหนด
+- รายการหมดอายุตาม TTL
+- นับ hit / miss / eviction สำหรับหน้า Admin
+
+Usage:
+    python analysis_cache.py --stats
+    python analysis_cache.py --purge
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+
+class AnalysisCache:
+    """Cache ผลการวิเคราะห์บนดิสก์ (SQLite) แบบ LRU + TTL"""
+
+    def __init__(self,
+                 db_file: str = "analysis_cache.db",
+                 max_bytes: int = 200 * 1024 * 1024,
+                 ttl_seconds: float = 30 * 24 * 3600):
+        """
+        Args:
+            db_file: ไฟล์ SQLite ของ cache
+            max_bytes: ขนาดรวมสูงสุดของผลลัพธ์ที่เก็บ (ไบต์)
+            ttl_seconds: อายุของแต่ละรายการ (วินาที, 0 = ไม่หมดอายุ)
+        """
+        self.db_file = db_file
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._initialize_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _initialize_database(self):
+        """สร้างตารางถ้ายังไม่มี"""
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    prompt_version TEXT,
+                    result TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache_entries(last_access)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """)
+            conn.executemany(
+                "INSERT OR IGNORE INTO cache_counters(name, value) VALUES (?, 0)",
+                [("hits",), ("misses",), ("evictions",)]
+            )
+        conn.close()
+
+    @staticmethod
+    def make_key(text: str, chapter: str, prompt_version: str, model: str) -> str:
+        """
+        สร้าง cache key จากเนื้อหาเอกสารและการตั้งค่าที่มีผลต่อผลลัพธ์
+
+        Args:
+            text: ข้อความที่อ่านได้จากไฟล์
+            chapter: บทที่เลือกตรวจ (เช่น "all", "chapter1")
+            prompt_version: เวอร์ชันของ prompt template
+            model: ชื่อ model
+
+        Returns:
+            SHA-256 hex digest
+        """
+        digest = hashlib.sha256()
+        for part in (prompt_version, model, chapter):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _bump(conn: sqlite3.Connection, name: str, amount: int = 1):
+        conn.execute("UPDATE cache_counters SET value = value + ? WHERE name = ?", (amount, name))
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        ดึงผลลัพธ์จาก cache
+
+        Returns:
+            ผลการวิเคราะห์ หรือ None ถ้าไม่พบ/หมดอายุ
+        """
+        conn = None
+        try:
+            now = time.time()
+            conn = self._connect()
+            with conn:
+                row = conn.execute(
+                    "SELECT result, created_at FROM cache_entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                    conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                    row = None
+                if row is None:
+                    self._bump(conn, "misses")
+                    return None
+                conn.execute(
+                    "UPDATE cache_entries SET last_access = ?, hits = hits + 1 WHERE key = ?",
+                    (now, key)
+                )
+                self._bump(conn, "hits")
+                return row[0]
+        except sqlite3.Error as e:
+            print(f"Error reading analysis cache: {e}")
+            return None
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def put(self, key: str, result: str, model: str = "", prompt_version: str = "") -> bool:
+        """
+        บันทึกผลลัพธ์ลง cache แล้วลบรายการเก่าที่สุดถ้าขนาดรวมเกินกำหนด
+
+        Returns:
+            True ถ้าบันทึกสำเร็จ
+        """
+        size = len(result.encode("utf-8"))
+        if size > self.max_bytes:
+            return False
+        conn = None
+        try:
+            now = time.time()
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries"
+                    "(key, model, prompt_version, result, size, created_at, last_access, hits)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                    (key, model, prompt_version, result, size, now, now)
+                )
+                self._evict(conn)
+            return True
+        except sqlite3.Error as e:
+            print(f"Error writing analysis cache: {e}")
+            return False
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _evict(self, conn: sqlite3.Connection):
+        """ลบรายการหมดอายุ และรายการที่ใช้ล่าสุดนานที่สุดจนขนาดรวมไม่เกิน max_bytes"""
+        evicted = 0
+        if self.ttl_seconds:
+            evicted += conn.execute(
+                "DELETE FROM cache_entries WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total > self.max_bytes:
+            victims = []
+            for key, size in conn.execute("SELECT key, size FROM cache_entries ORDER BY last_access"):
+                if total <= self.max_bytes:
+                    break
+                victims.append((key,))
+                total -= size
+            conn.executemany("DELETE FROM cache_entries WHERE key = ?", victims)
+            evicted += len(victims)
+
+        if evicted:
+            self._bump(conn, "evictions", evicted)
+
+    def purge(self) -> int:
+        """
+        ลบทุกรายการใน cache (ตัวนับถูกรีเซ็ตด้วย)
+
+        Returns:
+            จำนวนรายการที่ลบ
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                removed = conn.execute("DELETE FROM cache_entries").rowcount
+                conn.execute("UPDATE cache_counters SET value = 0")
+            conn.execute("VACUUM")
+            return removed
+        finally:
+            conn.close()
+
+    def get_stats(self) -> Dict:
+        """
+        สถิติของ cache
+
+        Returns:
+            {entries, size_bytes, max_bytes, hits, misses, evictions, hit_rate}
+        """
+        conn = self._connect()
+        try:
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+            ).fetchone()
+            counters = dict(conn.execute("SELECT name, value FROM cache_counters").fetchall())
+        finally:
+            conn.close()
+
+        lookups = counters.get("hits", 0) + counters.get("misses", 0)
+        return {
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "hit_rate": counters.get("hits", 0) / lookups if lookups else 0.0
+        }
+
+
+_caches: Dict[str, AnalysisCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_analysis_cache(db_file: Optional[str] = None) -> AnalysisCache:
+    """
+    คืน AnalysisCache ที่ใช้ร่วมกันภายใน process
+
+    ตั้งค่าได้ด้วยตัวแปร ANALYSIS_CACHE_FILE, ANALYSIS_CACHE_MAX_MB, ANALYSIS_CACHE_TTL_DAYS
+    """
+    db_file = db_file or os.getenv("ANALYSIS_CACHE_FILE", "analysis_cache.db")
+    key = os.path.abspath(db_file)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = AnalysisCache(
+                db_file,
+                max_bytes=int(float(os.getenv("ANALYSIS_CACHE_MAX_MB", "200")) * 1024 * 1024),
+                ttl_seconds=float(os.getenv("ANALYSIS_CACHE_TTL_DAYS", "30")) * 24 * 3600
+            )
+        return _caches[key]
+
+
+if __name__ == "__main__":
+    cache = get_analysis_cache()
+    if len(sys.argv) >= 2 and sys.argv[1] == "--purge":
+        print(f"🗑️ Removed {cache.purge()} cached analyses")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "--stats":
+        for name, value in cache.get_stats().items():
+            print(f"{name}: {value}")
+    else:
+        print(__doc__)
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Analysis repository - ที่เก็บผลการวิเคราะห์กลางที่ทุกหน้าใช้ร่วมกัน
+
+รวม history.json สองรูปแบบเดิมให้เป็นรูปแบบเดียว:
+- {username: [entries]}      (AnalysisDatabase)
+- {"analyses": [entries]}    (pages/1_student_interface.py, pages/2_admin_panel.py)
+
+มี secondary index ตามผู้ใช้ (index หลักของ storage engine) และตามวันที่
+full-text search index (search_index.py) ที่อัพเดททุกครั้งที่บันทึก/ลบ
+เนื้อหาผลการวิเคราะห์เก็บแยกใน blob store (blob_store.py) record เก็บเพียง metadata
+พร้อมเครื่องมือย้ายข้อมูลจากไฟล์รูปแบบเดิม
+
+Usage:
+    python analysis_repository.py --migrate [history.json]
+    python analysis_repository.py --store-bodies [history.json]
+"""
+
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from database import BLOB_REF_SUFFIX, HEAVY_FIELDS, LEGACY_ANALYSES_KEY, AnalysisDatabase, normalize_entry
+from search_index import SearchIndex, get_search_index, make_snippet
+from storage_engine import RecordLocation, SecondaryIndex
+
+
+class DateIndex(SecondaryIndex):
+    """index ของ record ตามวันที่ (YYYY-MM-DD) -> {(username, id): timestamp}"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_date: Dict[str, Dict[tuple, str]] = {}
+
+    def reset(self):
+        with self._lock:
+            self._by_date = {}
+
+    def add(self, username: str, entry_id, location: RecordLocation):
+        with self._lock:
+            date_key = (location.timestamp or "")[:10]
+            self._by_date.setdefault(date_key, {})[(username, entry_id)] = location.timestamp or ""
+
+    def remove(self, username: str, entry_id, location: RecordLocation):
+        with self._lock:
+            date_key = (location.timestamp or "")[:10]
+            bucket = self._by_date.get(date_key)
+            if bucket is not None:
+                bucket.pop((username, entry_id), None)
+                if not bucket:
+                    del self._by_date[date_key]
+
+    def lookup(self, date_str: str) -> Dict[tuple, str]:
+        """คืน {(username, id): timestamp} ของวันที่ระบุ"""
+        with self._lock:
+            return dict(self._by_date.get(date_str, {}))
+
+
+class AnalysisRepository(AnalysisDatabase):
+    """ที่เก็บผลการวิเคราะห์กลาง (ต่อยอดจาก AnalysisDatabase พร้อม index ตามวันที่)"""
+
+    def __init__(self, db_file: str = "history.json", engine: Optional[str] = None,
+                 search_index: Optional[SearchIndex] = None):
+        """
+        Args:
+            db_file: Path to the history database file
+            engine: Storage engine ("log" หรือ "json")
+            search_index: full-text index (default: get_search_index())
+        """
+        super().__init__(db_file, engine)
+        self.date_index = self.engine.register_index("date", DateIndex())
+        self.search_index = search_index or get_search_index()
+
+    def add_analysis(self, username: str, file_name: str, result: str, **metadata) -> Optional[Dict]:
+        """
+        บันทึกผลการวิเคราะห์พร้อมข้อมูลเพิ่มเติม
+
+        Args:
+            username: ชื่อผู้ใช้
+            file_name: ชื่อไฟล์ที่วิเคราะห์
+            result: ผลการวิเคราะห์จาก AI (Markdown)
+            **metadata: ข้อมูลเพิ่มเติม เช่น chapter_checked, word_count, score, full_report
+
+        Returns:
+            record ที่บันทึก (มี id) หรือ None ถ้าล้มเหลว
+        """
+        try:
+            entry = dict(metadata)
+            entry.update({
+                "timestamp": datetime.now().isoformat(),
+                "username": username,
+                "file_name": file_name,
+                "file_size_chars": len(result),
+                "result": result
+            })
+            # record เก็บเฉพาะ metadata เนื้อหาอยู่ใน blob store
+            saved = dict(self.engine.append(username, self._store_bodies(entry)))
+            saved.update((field, entry[field]) for field in HEAVY_FIELDS if isinstance(entry.get(field), str))
+        except Exception as e:
+            print(f"Error saving analysis: {e}")
+            return None
+
+        try:
+            self.search_index.add(username, saved)
+        except Exception as e:
+            print(f"Error indexing analysis {saved.get('id')}: {e}")
+        return saved
+
+    def save_analysis(self, username: str, file_name: str, analysis_result: str) -> bool:
+        """บันทึกผลการวิเคราะห์ (ผ่าน add_analysis เพื่อให้ search index อัพเดทด้วย)"""
+        return self.add_analysis(username, file_name, analysis_result) is not None
+
+    def delete_analysis(self, username: str, analysis_id: int) -> bool:
+        """ลบการวิเคราะห์หนึ่งรายการ พร้อมลบออกจาก search index"""
+        deleted = super().delete_analysis(username, analysis_id)
+        if deleted:
+            try:
+                self.search_index.remove(username, analysis_id)
+            except Exception as e:
+                print(f"Error removing analysis {analysis_id} from search index: {e}")
+        return deleted
+
+    def delete_all_user_history(self, username: str) -> bool:
+        """ลบประวัติทั้งหมดของผู้ใช้ พร้อมลบออกจาก search index"""
+        deleted = super().delete_all_user_history(username)
+        if deleted:
+            try:
+                self.search_index.remove_user(username)
+            except Exception as e:
+                print(f"Error removing {username} from search index: {e}")
+        return deleted
+
+    def rebuild_search_index(self) -> int:
+        """สร้าง search index ใหม่จากข้อมูลทั้งหมด คืนจำนวน record ที่ index"""
+        return self.search_index.rebuild(
+            (username, self.load_bodies([entry], ("result",))[0])
+            for username, entries in self._read_db().items()
+            for entry in entries
+        )
+
+    def store_existing_bodies(self) -> int:
+        """
+        ย้ายเนื้อหาที่ยังเก็บอยู่ใน record (ข้อมูลก่อนมี blob store) ไปเก็บใน blob store
+
+        Returns:
+            จำนวน record ที่ย้าย
+        """
+        data = self._read_db()
+        moved = 0
+        for username, entries in data.items():
+            for i, entry in enumerate(entries):
+                if any(isinstance(entry.get(field), str) for field in HEAVY_FIELDS):
+                    entries[i] = self._store_bodies(entry)
+                    moved += 1
+        if moved:
+            self._write_db(data)
+        return moved
+
+    def collect_unused_bodies(self) -> int:
+        """ลบ blob ที่ไม่มี record อ้างถึง (หลังลบประวัติ) คืนจำนวนที่ลบ"""
+        live_refs = (
+            entry[field + BLOB_REF_SUFFIX]
+            for entries in self._read_db().values()
+            for entry in entries
+            for field in HEAVY_FIELDS
+            if entry.get(field + BLOB_REF_SUFFIX)
+        )
+        return self.blobs.gc(live_refs)
+
+    def search(self, query: str, username: Optional[str] = None, limit: int = 20,
+               offset: int = 0, include_result: bool = False) -> Dict:
+        """
+        ค้นหาในชื่อไฟล์และผลการวิเคราะห์ เรียงตามความเกี่ยวข้อง
+
+        Args:
+            query: คำค้น (ภาษาไทยหรืออังกฤษ)
+            username: จำกัดเฉพาะผู้ใช้ (None = ทั้งระบบ)
+            limit: จำนวนผลลัพธ์ต่อหน้า
+            offset: ข้ามผลลัพธ์กี่รายการ
+            include_result: True = ส่งผลการวิเคราะห์เต็มมาด้วย
+
+        Returns:
+            {"total": จำนวนที่พบ, "items": [record + relevance + snippet]}
+            (relevance คือความเกี่ยวข้องกับคำค้น แยกจาก "score" ซึ่งเป็นคะแนนเต็ม 100 ของ record)
+
+        Raises:
+            ValueError ถ้าคำค้นไม่ถูกต้อง
+        """
+        found = self.search_index.search(query, username, limit, offset)
+        self.engine.refresh()
+        # อ่านเนื้อหาเฉพาะผลลัพธ์ในหน้านี้ (ใช้ตัด snippet)
+        records = {
+            (entry.get("username"), entry.get("id")): entry
+            for entry in self.load_bodies(
+                self.engine.get_records([(hit["username"], hit["id"]) for hit in found["hits"]]),
+                HEAVY_FIELDS if include_result else ("result",)
+            )
+        }
+
+        items = []
+        for hit in found["hits"]:
+            entry = records.get((hit["username"], hit["id"]))
+            if entry is None:  # ถูกลบโดย process อื่นที่ยังไม่ได้อัพเดท index
+                continue
+            item = dict(entry, relevance=hit["relevance"], snippet=make_snippet(entry.get("result", ""), found["terms"]))
+            if not include_result:
+                item = {k: v for k, v in item.items() if k not in HEAVY_FIELDS}
+            items.append(item)
+        return {"total": found["total"], "items": items}
+
+    def list_users(self) -> List[str]:
+        """รายชื่อผู้ใช้ที่มีประวัติการวิเคราะห์อย่างน้อย 1 รายการ"""
+        return sorted(u for u, count in self.engine.user_counts().items() if count > 0)
+
+    def total_count(self) -> int:
+        """จำนวนการวิเคราะห์ทั้งหมด"""
+        return sum(self.engine.user_counts().values())
+
+    def count_on_date(self, date_str: str) -> int:
+        """จำนวนการวิเคราะห์ของวันที่ระบุ (YYYY-MM-DD)"""
+        self.engine.refresh()
+        return len(self.date_index.lookup(date_str))
+
+    def find(self, username: Optional[str] = None, date_str: Optional[str] = None) -> List[Dict]:
+        """
+        ค้นหาผลการวิเคราะห์ตามผู้ใช้และ/หรือวันที่ ผ่าน index
+
+        Args:
+            username: กรองตามผู้ใช้ (None = ทุกคน)
+            date_str: กรองตามวันที่ YYYY-MM-DD (None = ทุกวัน)
+
+        Returns:
+            List of analysis entries (metadata - ใช้ load_bodies เมื่อต้องการเนื้อหา) เรียงจากใหม่ไปเก่า
+        """
+        if date_str:
+            self.engine.refresh()
+            matches = self.date_index.lookup(date_str)
+            keys = [key for key in matches if username is None or key[0] == username]
+            keys.sort(key=lambda key: matches[key], reverse=True)
+            return self.engine.get_records(keys)
+
+        if username:
+            return self.get_user_history(username, include_result=False)
+
+        entries = []
+        for user, records in self._read_db().items():
+            for entry in records:
+                entry.setdefault("username", user)
+                entries.append(entry)
+        return sorted(entries, key=lambda x: x.get('timestamp', ''), reverse=True)
+
+
+def migrate_legacy_history(repository: AnalysisRepository, legacy_file: Optional[str] = None) -> int:
+    """
+    ย้ายข้อมูลจาก history.json รูปแบบเดิมเข้าสู่ repository (รันครั้งเดียว)
+
+    - แยก record ใน "analyses" ไปเก็บตาม username
+    - รวมกับข้อมูลที่มีอยู่แล้ว โดยข้าม record ซ้ำ (username, timestamp, file_name)
+    - กำหนด id ใหม่ให้ record ที่ id ไม่ใช่ตัวเลขหรือซ้ำกัน
+    - ถ้าใช้ engine แบบ log จะเปลี่ยนชื่อไฟล์เดิมเป็น .migrated เมื่อเสร็จ
+
+    Args:
+        repository: repository ปลายทาง
+        legacy_file: ไฟล์ JSON รูปแบบเดิม (default: ไฟล์ของ repository)
+
+    Returns:
+        จำนวน record หลังย้ายข้อมูล
+    """
+    legacy_file = legacy_file or repository.db_file
+    sources = [repository._read_db()]
+
+    uses_legacy_file_directly = os.path.abspath(getattr(repository.engine, "db_file", "")) == os.path.abspath(legacy_file)
+    if not uses_legacy_file_directly and os.path.exists(legacy_file):
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            sources.append(json.load(f))
+
+    merged: Dict[str, List[Dict]] = {}
+    used_ids: Dict[str, set] = {}
+    seen = set()
+    pending = []
+
+    for source in sources:
+        for key, entries in source.items():
+            if not isinstance(entries, list):
+                continue
+            if key != LEGACY_ANALYSES_KEY:
+                merged.setdefault(key, [])
+            for raw in entries:
+                username, entry = normalize_entry(key, raw)
+                signature = (username, entry["timestamp"], entry["file_name"])
+                if signature in seen:
+                    continue
+                seen.add(signature)
+                ids = used_ids.setdefault(username, set())
+                if "id" in entry and entry["id"] not in ids:
+                    ids.add(entry["id"])
+                else:
+                    entry.pop("id", None)
+                    pending.append(entry)
+                merged.setdefault(username, []).append(entry)
+
+    # กำหนด id ให้ record ที่ยังไม่มี (ต่อจาก id สูงสุดของผู้ใช้)
+    for entry in pending:
+        ids = used_ids[entry["username"]]
+        entry["id"] = max(ids, default=0) + 1
+        ids.add(entry["id"])
+
+    for username in merged:
+        merged[username].sort(key=lambda x: x.get("timestamp", ""))
+        merged[username] = [repository._store_bodies(entry) for entry in merged[username]]
+
+    repository._write_db(merged)
+
+    if not uses_legacy_file_directly and os.path.exists(legacy_file):
+        os.replace(legacy_file, legacy_file + ".migrated")
+
+    total = sum(len(entries) for entries in merged.values())
+    print(f"✅ Migrated history to repository: {total} records, {len(merged)} users")
+    return total
+
+
+def _needs_migration(repository: AnalysisRepository) -> bool:
+    """ตรวจว่ายังมีข้อมูลรูปแบบเดิมค้างอยู่หรือไม่"""
+    if LEGACY_ANALYSES_KEY in repository.engine.user_counts():
+        return True
+    uses_legacy_file_directly = hasattr(repository.engine, "db_file")
+    return not uses_legacy_file_directly and os.path.exists(repository.db_file)
+
+
+# repository ที่ใช้ร่วมกันภายใน process
+_repositories: Dict[str, AnalysisRepository] = {}
+_repositories_lock = threading.Lock()
+
+
+def get_repository(db_file: Optional[str] = None, engine: Optional[str] = None) -> AnalysisRepository:
+    """
+    เปิด repository ที่ใช้ร่วมกันภายใน process (ย้ายข้อมูลรูปแบบเดิมให้อัตโนมัติในครั้งแรก)
+
+    Args:
+        db_file: ไฟล์ฐานข้อมูล (default: ตัวแปร DATABASE_FILE หรือ history.json)
+        engine: Storage engine ("log" หรือ "json")
+
+    Returns:
+        AnalysisRepository
+    """
+    db_file = db_file or os.getenv("DATABASE_FILE", "history.json")
+    key = os.path.abspath(db_file)
+
+    with _repositories_lock:
+        if key not in _repositories:
+            repository = AnalysisRepository(db_file, engine)
+            if _needs_migration(repository):
+                migrate_legacy_history(repository)
+            # สร้าง search index ครั้งแรก (หรือเมื่อข้อมูลถูกเขียนโดยไม่ผ่าน repository)
+            if not repository.search_index.is_current or \
+                    repository.search_index.count() != repository.total_count():
+                repository.rebuild_search_index()
+            _repositories[key] = repository
+        return _repositories[key]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "--migrate":
+        target = sys.argv[2] if len(sys.argv) >= 3 else os.getenv("DATABASE_FILE", "history.json")
+        migrate_legacy_history(AnalysisRepository(target), target)
+    elif len(sys.argv) >= 2 and sys.argv[1] == "--store-bodies":
+        target = sys.argv[2] if len(sys.argv) >= 3 else os.getenv("DATABASE_FILE", "history.json")
+        repository = AnalysisRepository(target)
+        print(f"✅ Moved {repository.store_existing_bodies()} analysis bodies to {repository.blobs.directory}")
+        print(f"🗑️ Removed {repository.collect_unused_bodies()} unused blobs")
+    else:
+        print(__doc__)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Analysis service - ขั้นตอนวิเคราะห์โครงงานที่ใช้ร่วมกันระหว่าง api_server และ job worker
+
+prompt -> cache -> Gemini (async) -> บันทึกลง repository
+analyze_document_stream ทำขั้นตอนเดียวกันแต่ส่งข้อความทีละส่วนระหว่างที่ model ตอบ
+"""
+
+import asyncio
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from analysis_cache import get_analysis_cache
+from analysis_repository import get_repository
+from document_reader import extract_text as read_document
+from gemini_client import get_gemini_client
+from prompt_builder import condense_document, get_prompt_budget
+from report_store import get_report_store
+
+# เปลี่ยนเมื่อแก้ prompt เพื่อไม่ให้ใช้ผลใน cache เดิม
+ANALYZE_PROMPT_VERSION = "api-consistency-v2"
+
+# งบ token ของ prompt (เอกสารที่ยาวเกินงบจะสรุปทีละส่วนก่อน)
+PROMPT_BUDGET = get_prompt_budget()
+
+
+def build_analysis_prompt(file_content: str) -> str:
+    """สร้าง prompt ตรวจความสอดคล้องของโครงงาน (file_content ต้องอยู่ในงบ token แล้ว)"""
+    return f"""
+        Role: คุณคือครูที่ปรึกษาโครงงานผู้เชี่ยวชาญ
+        Task: วิเคราะห์ "ความสอดคล้อง" ของโครงงาน
+
+        Content:
+        {file_content}
+
+        Instructions:
+        1. หา "วัตถุประสงค์" และ "สรุปผล" จากข้อความ
+        2. เปรียบเทียบว่าสอดคล้องกันหรือไม่
+        3. ให้คะแนนและข้อแนะนำ
+
+        Output Format (ตอบเป็น Markdown ภาษาไทย):
+        ## ผลการวิเคราะห์
+        [ผลการวิเคราะห์]
+        """
+
+
+async def analyze_document(username: str, file_name: str, file_content: str, **metadata) -> Optional[Dict]:
+    """
+    วิเคราะห์เอกสารแล้วบันทึกผล (ใช้ผลใน cache ถ้าเคยวิเคราะห์เอกสารเดียวกันแล้ว)
+
+    Args:
+        username: ชื่อผู้ใช้
+        file_name: ชื่อไฟล์
+        file_content: ข้อความในเอกสาร
+        **metadata: ข้อมูลเพิ่มเติมที่บันทึกไปกับผลการวิเคราะห์
+
+    Returns:
+        record ที่บันทึก (มี id, timestamp, result) หรือ None ถ้าบันทึกไม่สำเร็จ
+
+    Raises:
+        asyncio.TimeoutError หรือ error จาก Gemini ถ้าวิเคราะห์ไม่สำเร็จ
+    """
+    gemini = get_gemini_client()
+    cache_key, analysis_result = await _cached_result(file_content)
+
+    # วิเคราะห์โดยไม่บล็อก event loop (fallback flash -> pro อยู่ใน client)
+    if analysis_result is None:
+        analysis_result = await gemini.generate(await _build_prompt(file_content))
+        await _cache_result(cache_key, analysis_result)
+
+    return await _save(username, file_name, analysis_result, metadata)
+
+
+async def analyze_document_stream(username: str, file_name: str, file_content: str,
+                                  **metadata) -> AsyncIterator[Dict]:
+    """
+    analyze_document แบบ streaming: ส่ง event ระหว่างวิเคราะห์ แล้วบันทึกผลเต็มเมื่อ model ตอบครบ
+
+    Yields:
+        {"event": "start", "cached": bool}
+        {"event": "chunk", "text": ข้อความส่วนถัดไป} (ผลจาก cache ส่งเป็น chunk เดียว)
+        {"event": "done", "record": record ที่บันทึก หรือ None ถ้าบันทึกไม่สำเร็จ}
+
+    Raises:
+        เหมือน analyze_document (ถ้า error หลังส่งข้อความไปแล้ว ผลบางส่วนจะไม่ถูกบันทึก)
+    """
+    gemini = get_gemini_client()
+    cache_key, analysis_result = await _cached_result(file_content)
+    yield {"event": "start", "cached": analysis_result is not None}
+
+    if analysis_result is None:
+        parts = []
+        async for text in gemini.stream(await _build_prompt(file_content)):
+            parts.append(text)
+            yield {"event": "chunk", "text": text}
+        analysis_result = "".join(parts)
+        await _cache_result(cache_key, analysis_result)
+    else:
+        yield {"event": "chunk", "text": analysis_result}
+
+    yield {"event": "done", "record": await _save(username, file_name, analysis_result, metadata)}
+
+
+async def _cached_result(file_content: str) -> Tuple[str, Optional[str]]:
+    """(cache key, ผลใน cache หรือ None)"""
+    analysis_cache = get_analysis_cache()
+    cache_key = analysis_cache.make_key(
+        file_content, "all", ANALYZE_PROMPT_VERSION, ",".join(get_gemini_client().models)
+    )
+    return cache_key, await asyncio.to_thread(analysis_cache.get, cache_key)
+
+
+async def _build_prompt(file_content: str) -> str:
+    # เอกสารที่เกินงบ: สรุปแต่ละส่วนพร้อมกัน (map) แล้ววิเคราะห์จากสรุป (reduce)
+    condensed = await condense_document(file_content, get_gemini_client().generate, PROMPT_BUDGET)
+    return build_analysis_prompt(condensed.content)
+
+
+async def _cache_result(cache_key: str, analysis_result: str):
+    await asyncio.to_thread(
+        get_analysis_cache().put, cache_key, analysis_result, get_gemini_client().models[0], ANALYZE_PROMPT_VERSION
+    )
+
+
+async def _save(username: str, file_name: str, analysis_result: str, metadata: Dict) -> Optional[Dict]:
+    # บันทึกลงฐานข้อมูล (file I/O ทำใน worker thread) แล้วสร้างรายงานล่วงหน้าเบื้องหลัง
+    saved = await asyncio.to_thread(
+        get_repository().add_analysis, username, file_name, analysis_result, **metadata
+    )
+    get_report_store().schedule_prerender(username, saved)
+    return saved
+
+
+def extract_text(data: bytes, file_name: str) -> str:
+    """
+    อ่านข้อความจากไฟล์ PDF / Word / ข้อความธรรมดา (เฉพาะส่วนที่จะส่งให้ AI)
+
+    Args:
+        data: เนื้อไฟล์
+        file_name: ชื่อไฟล์ (ใช้นามสกุลเลือกวิธีอ่าน)
+
+    Returns:
+        ข้อความในไฟล์
+    """
+    return read_document(data, file_name, max_chars=PROMPT_BUDGET.max_document_chars).text
@@ -0,0 +1,616 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API key pool ของ Gemini - กระจายการเรียกไปหลาย API key ตามโควต้าที่เหลือ
+
+- รายการ key มาจากหน้า Admin (system_settings.json: "gemini_api_keys") และตัวแปร
+  GOOGLE_API_KEYS (คั่นด้วย comma) / GOOGLE_API_KEY
+- แต่ละการเรียกเลือก key ที่ bucket ใน rate_limiter เหลือโควต้ามากที่สุด (หักคำขอที่รอคิวอยู่)
+  bucket แยกต่อ key จึงได้ throughput เพิ่มตามจำนวน key
+- key ที่ตอบ error สิทธิ์ (key ผิด/ถูกระงับ) หรือโควต้าเต็ม จะถูกพักไว้ตาม cooldown แล้วรับกลับอัตโนมัติ
+  สถานะ health เก็บใน SQLite ไฟล์เดียวกับ rate_limiter (ทุก process เห็นตรงกัน)
+- genai.configure() เป็นค่า global ของทั้ง process: pool จึงสร้าง GenerativeModel ที่ผูก client ของ key
+  นั้นเอง (ไม่แตะค่า global) การเรียกพร้อมกันด้วย key ต่างกันจึงไม่ปนกัน
+- แบบ streaming (stream / stream_async) สลับ key ได้เฉพาะก่อนได้ chunk แรก หลังจากนั้นส่งต่อทีละ chunk
+
+Usage:
+    python api_key_pool.py --stats
+    python api_key_pool.py --reset
+"""
+
+import asyncio
+import inspect
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+
+from rate_limiter import (RateLimiter, RateLimitTimeout, get_rate_limiter, is_daily_quota_error,
+                          is_rate_limit_error, key_id, retry_after_from_error)
+from write_coordinator import read_json_snapshot, update_json
+
+T = TypeVar("T")
+
+# ค่าบอกว่า iterator ไม่มี chunk เลย
+_END = object()
+
+# ค่าตัวอย่างใน .env ที่ไม่ใช่ key จริง
+_PLACEHOLDER_KEYS = {"", "your_api_key_here", "your_google_gemini_api_key_here"}
+
+_AUTH_PATTERN = re.compile(
+    r"API_KEY_INVALID|API key not valid|API key expired|PERMISSION_DENIED|UNAUTHENTICATED|\b40[13]\b",
+    re.IGNORECASE
+)
+
+
+def _check_sdk():
+    """
+    ตรวจว่า google-generativeai มีส่วนภายในที่ pool ใช้สร้าง client ต่อ key
+
+    SDK ไม่มี API สาธารณะสำหรับ client ต่อ key: pool ใช้ _ClientManager และกำหนด _client / _async_client
+    ของ GenerativeModel เอง ถ้าเวอร์ชันอื่นเปลี่ยนชื่อเหล่านี้ การกำหนดค่าจะไม่มีผลและทุกการเรียกจะล้มเหลว
+    จึงหยุดตั้งแต่ import (ใช้เวอร์ชันที่ระบุใน requirements.txt)
+    """
+    missing = []
+    manager = getattr(genai_client, "_ClientManager", None)
+    if manager is None:
+        missing.append("client._ClientManager")
+    else:
+        missing += [f"_ClientManager.{name}" for name in ("configure", "make_client") if not hasattr(manager, name)]
+    model = genai.GenerativeModel("gemini-pro")
+    missing += [f"GenerativeModel.{name}" for name in ("_client", "_async_client") if not hasattr(model, name)]
+    if "client" not in inspect.signature(genai.list_models).parameters:
+        missing.append("list_models(client=...)")
+    if missing:
+        raise ImportError(
+            f"google-generativeai {getattr(genai, '__version__', '?')} is not supported by api_key_pool "
+            f"(missing {', '.join(missing)}); install the version pinned in requirements.txt"
+        )
+
+
+_check_sdk()
+
+
+class NoApiKeyError(RuntimeError):
+    """ไม่มี API key ที่ใช้ได้ (ยังไม่ได้ตั้งค่า หรือทุก key ถูกพักเพราะ error สิทธิ์)"""
+
+
+def is_auth_error(error: BaseException) -> bool:
+    """error จาก key ไม่ถูกต้อง/ไม่มีสิทธิ์หรือไม่ (โควต้าเต็มไม่นับ)"""
+    return (not is_rate_limit_error(error) and not is_daily_quota_error(error)
+            and _AUTH_PATTERN.search(str(error)) is not None)
+
+
+def mask_key(api_key: str) -> str:
+    """ย่อ key สำหรับแสดงผล เช่น AIza…x9Qk"""
+    return f"{api_key[:4]}…{api_key[-4:]}" if len(api_key) > 8 else "…"
+
+
+def is_key_error(error: BaseException) -> bool:
+    """error ที่เกี่ยวกับ API key/โควต้า (pool จัดการเอง เปลี่ยน model ก็ไม่ช่วย)"""
+    return (isinstance(error, (NoApiKeyError, RateLimitTimeout))
+            or is_rate_limit_error(error) or is_daily_quota_error(error) or is_auth_error(error))
+
+
+def chunk_text(chunk) -> str:
+    """ข้อความของ chunk จาก generate_content(stream=True) ("" ถ้า chunk ไม่มีข้อความ เช่น chunk สุดท้าย)"""
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+def _split_keys(value: Optional[str]) -> List[str]:
+    return [k.strip() for k in (value or "").split(",") if k.strip()]
+
+
+class ApiKeyPool:
+    """เลือก API key ต่อการเรียก พร้อมติดตาม health และแยก client ต่อ key"""
+
+    def __init__(self,
+                 settings_file: str = "system_settings.json",
+                 limiter: Optional[RateLimiter] = None,
+                 cooldown: float = 3600.0,
+                 env_keys: Sequence[str] = ()):
+        """
+        Args:
+            settings_file: ไฟล์ตั้งค่าระบบที่หน้า Admin บันทึกรายการ key
+            limiter: RateLimiter ที่ใช้ (default: get_rate_limiter()) สถานะ health เก็บในไฟล์เดียวกัน
+            cooldown: เวลาพัก key ที่ error สิทธิ์ และเพดานเวลาพักเมื่อโควต้าเต็มซ้ำ ๆ (วินาที)
+            env_keys: key จากตัวแปรแวดล้อม (ใช้ร่วมกับ key ในไฟล์ตั้งค่า)
+        """
+        self.settings_file = settings_file
+        self.limiter = limiter or get_rate_limiter()
+        self.cooldown = cooldown
+        self.env_keys = [k for k in env_keys if k not in _PLACEHOLDER_KEYS]
+
+        self._managers: Dict[str, object] = {}
+        self._models: Dict[Tuple[str, str, bool], genai.GenerativeModel] = {}
+        # client แบบ async (grpc.aio) ผูกกับ event loop ที่สร้างมัน จึงแยกตาม loop (loop ที่ปิดแล้วถูกลบเอง)
+        self._async_models: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = \
+            weakref.WeakKeyDictionary()
+        self._models_lock = threading.Lock()
+        self._initialize_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.limiter.db_file, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _initialize_database(self):
+        """สร้างตารางถ้ายังไม่มี"""
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS api_key_health (
+                    key TEXT PRIMARY KEY,
+                    ejected_until REAL NOT NULL DEFAULT 0,
+                    reason TEXT,
+                    failures INTEGER NOT NULL DEFAULT 0,
+                    successes INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    updated_at REAL NOT NULL
+                )
+            """)
+        finally:
+            conn.close()
+
+    # ---------- รายการ key ----------
+
+    def keys(self) -> List[str]:
+        """key ทั้งหมดที่ตั้งค่าไว้ (ไฟล์ตั้งค่าก่อน แล้วตามด้วยตัวแปรแวดล้อม ไม่ซ้ำกัน)"""
+        settings = read_json_snapshot(self.settings_file, {})
+        configured = list(settings.get("gemini_api_keys", ())) + self.env_keys
+        return list(dict.fromkeys(k for k in configured if k not in _PLACEHOLDER_KEYS))
+
+    def add_key(self, api_key: str) -> bool:
+        """
+        เพิ่ม key ลงไฟล์ตั้งค่า
+
+        Returns:
+            True ถ้าเพิ่มแล้ว, False ถ้าว่าง/มีอยู่แล้ว
+        """
+        api_key = api_key.strip()
+        if api_key in _PLACEHOLDER_KEYS or api_key in self.keys():
+            return False
+
+        def add(settings: Dict):
+            settings["gemini_api_keys"] = list(settings.get("gemini_api_keys", [])) + [api_key]
+        update_json(self.settings_file, add, {})
+        return True
+
+    def remove_key(self, api_key: str) -> bool:
+        """
+        ลบ key ออกจากไฟล์ตั้งค่า (key จากตัวแปรแวดล้อมลบที่นี่ไม่ได้)
+
+        Returns:
+            True ถ้าลบแล้ว
+        """
+        removed = []
+
+        def remove(settings: Dict):
+            keys = list(settings.get("gemini_api_keys", []))
+            if api_key in keys:
+                keys.remove(api_key)
+                removed.append(api_key)
+            settings["gemini_api_keys"] = keys
+        update_json(self.settings_file, remove, {})
+        return bool(removed)
+
+    # ---------- client แยกต่อ key ----------
+
+    def _manager(self, api_key: str):
+        # _ClientManager เดียวกับที่ genai.configure() ใช้ แต่เป็นของ key นี้เท่านั้น
+        bucket = key_id(api_key)
+        if bucket not in self._managers:
+            manager = genai_client._ClientManager()
+            manager.configure(api_key=api_key)
+            self._managers[bucket] = manager
+        return self._managers[bucket]
+
+    def get_model(self, model_name: str, api_key: str, asynchronous: bool = False) -> genai.GenerativeModel:
+        """
+        คืน GenerativeModel ที่เรียก API ด้วย api_key นี้เสมอ (ไม่ขึ้นกับ genai.configure)
+
+        Args:
+            model_name: ชื่อ model
+            api_key: API key
+            asynchronous: True สำหรับ generate_content_async (client แบบ async)
+        """
+        cache_key = (key_id(api_key), model_name, asynchronous)
+        with self._models_lock:
+            models = self._models
+            if asynchronous:
+                try:
+                    models = self._async_models.setdefault(asyncio.get_running_loop(), {})
+                except RuntimeError:  # เรียกนอก event loop
+                    pass
+            if cache_key not in models:
+                manager = self._manager(api_key)
+                model = genai.GenerativeModel(model_name)
+                if asynchronous:
+                    model._async_client = manager.make_client("generative_async")
+                else:
+                    model._client = manager.make_client("generative")
+                models[cache_key] = model
+            return models[cache_key]
+
+    def model_client(self, api_key: str):
+        """client ของ ModelService (ใช้กับ genai.list_models(client=...)) ที่เรียก API ด้วย api_key นี้"""
+        with self._models_lock:
+            return self._manager(api_key).make_client("model")
+
+    # ---------- health ----------
+
+    def _health(self) -> Dict[str, Dict]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT key, ejected_until, reason, failures, successes, last_error FROM api_key_health"
+            ).fetchall()
+        finally:
+            conn.close()
+        return {
+            row[0]: {"ejected_until": row[1], "reason": row[2], "failures": row[3],
+                     "successes": row[4], "last_error": row[5]}
+            for row in rows
+        }
+
+    def _record(self, bucket: str, success: bool, reason: Optional[str] = None,
+                error: Optional[str] = None, cooldown: Optional[float] = None) -> float:
+        """
+        บันทึกผลการเรียกของ key
+
+        Returns:
+            เวลาพักที่ใช้จริง (วินาที, 0 ถ้าไม่ได้พัก)
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute("SELECT failures FROM api_key_health WHERE key = ?", (bucket,)).fetchone()
+            conn.execute(
+                "INSERT OR IGNORE INTO api_key_health(key, updated_at) VALUES (?, ?)", (bucket, now)
+            )
+            if success:
+                conn.execute(
+                    "UPDATE api_key_health SET failures = 0, successes = successes + 1, reason = NULL,"
+                    " ejected_until = 0, updated_at = ? WHERE key = ?",
+                    (now, bucket)
+                )
+                conn.execute("COMMIT")
+                return 0.0
+
+            failures = (row[0] if row else 0) + 1
+            if reason == "auth":
+                cooldown = self.cooldown
+            else:
+                # โควต้าเต็มซ้ำติดกัน (เช่นโควต้ารายวันหมด) พักนานขึ้นเท่าตัวทุกครั้ง
+                base = cooldown if cooldown is not None else self.limiter.default_retry_after
+                cooldown = min(max(base, self.limiter.default_retry_after * 2 ** (failures - 1)), self.cooldown)
+            conn.execute(
+                "UPDATE api_key_health SET failures = ?, reason = ?, last_error = ?, ejected_until = ?,"
+                " updated_at = ? WHERE key = ?",
+                (failures, reason, (error or "")[:500], now + cooldown, now, bucket)
+            )
+            conn.execute("COMMIT")
+            return cooldown
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"Error recording API key health: {e}")
+            return 0.0
+        finally:
+            conn.close()
+
+    def _handle_failure(self, api_key: str, error: BaseException) -> bool:
+        """
+        พัก key ตามชนิดของ error
+
+        Returns:
+            True ถ้าควรลองใหม่ด้วย key อื่น, False ถ้าเป็น error ที่ไม่เกี่ยวกับ key
+        """
+        bucket = key_id(api_key)
+        if is_rate_limit_error(error):
+            cooldown = self._record(bucket, False, "quota", str(error), retry_after_from_error(error))
+            self.limiter.penalize(bucket, cooldown or None)
+        elif is_daily_quota_error(error):
+            # โควต้ารายวันหมด: พัก key นี้นาน ๆ แล้วใช้ key อื่น (ไม่หยุด bucket ต่อนาทีของ key นี้)
+            self._record(bucket, False, "daily_quota", str(error), self.cooldown)
+        elif is_auth_error(error):
+            self._record(bucket, False, "auth", str(error))
+        else:
+            return False
+        print(f"API key {mask_key(api_key)} ejected: {error}")
+        return True
+
+    def reset_health(self, api_key: Optional[str] = None):
+        """รับ key กลับทันที (None = ทุก key)"""
+        conn = self._connect()
+        try:
+            if api_key is None:
+                conn.execute("DELETE FROM api_key_health")
+            else:
+                conn.execute("DELETE FROM api_key_health WHERE key = ?", (key_id(api_key),))
+        finally:
+            conn.close()
+
+    # ---------- การเลือก key ----------
+
+    def choose(self, keys: Optional[Sequence[str]] = None, exclude: Sequence[str] = ()) -> str:
+        """
+        เลือก key สำหรับการเรียกครั้งถัดไป
+
+        เลือกจาก key ที่ไม่ถูกพัก โดยเอาตัวที่ bucket เหลือ request มากที่สุด (หักคิว) แล้วสุ่มในกลุ่มที่เท่ากัน
+        ถ้าทุก key ถูกพักเพราะโควต้า จะคืน key ที่กลับมาใช้ได้เร็วที่สุด (rate_limiter จะรอให้)
+
+        Args:
+            keys: key ที่ใช้ได้ (default: keys())
+            exclude: key_id ที่ลองแล้วในการเรียกนี้ (เลี่ยงถ้ายังมี key อื่น)
+
+        Raises:
+            NoApiKeyError ถ้าไม่มี key หรือทุก key ถูกพักเพราะ error สิทธิ์
+        """
+        keys = list(keys) if keys is not None else self.keys()
+        if not keys:
+            raise NoApiKeyError("ยังไม่ได้ตั้งค่า Google API Key")
+
+        now = time.time()
+        health = self._health()
+        states = self.limiter.bucket_states([key_id(k) for k in keys])
+
+        ready, waiting = [], []
+        for api_key in keys:
+            bucket = key_id(api_key)
+            record = health.get(bucket, {})
+            state = states[bucket]
+            fresh = bucket not in exclude
+            resume_in = max(record.get("ejected_until", 0) - now, state["blocked_for"], 0.0)
+            if resume_in <= 0:
+                ready.append((fresh, state["requests"] - state["queue_depth"], state["tokens"], api_key))
+            elif record.get("reason") != "auth":
+                waiting.append((not fresh, resume_in, api_key))
+
+        if ready:
+            best = max(ready)[:3]
+            return random.choice([api_key for *score, api_key in ready if tuple(score) == best])
+        if waiting:
+            return min(waiting)[-1]
+        raise NoApiKeyError("API Key ทุกตัวถูกพักเพราะไม่ถูกต้องหรือไม่มีสิทธิ์ใช้งาน")
+
+    def _attempts(self, keys: Sequence[str]) -> int:
+        # ลองครบทุก key อย่างน้อยหนึ่งรอบ บวกจำนวนครั้งที่ rate_limiter ลองซ้ำตามปกติ
+        return len(keys) + self.limiter.max_attempts - 1
+
+    def run(self, call: Callable[[str], T], tokens: float = 0, keys: Optional[Sequence[str]] = None) -> T:
+        """
+        เรียก call(api_key) ด้วย key ที่เลือก รอคิวโควต้าของ key นั้น และสลับ key เมื่อ key ถูกพัก
+
+        Args:
+            call: ฟังก์ชันที่เรียก API โดยรับ api_key
+            tokens: จำนวน token โดยประมาณ
+            keys: ใช้ key ชุดนี้แทนที่ตั้งค่าไว้ (เช่น key ชั่วคราวของ session)
+
+        Raises:
+            NoApiKeyError, RateLimitTimeout หรือ error สุดท้ายของ call()
+        """
+        keys = list(keys) if keys is not None else self.keys()
+        tried: List[str] = []
+        last_error: Optional[BaseException] = None
+        for _ in range(max(self._attempts(keys), 1)):
+            api_key = self.choose(keys, tried)
+            bucket = key_id(api_key)
+            self.limiter.acquire(bucket, tokens)
+            try:
+                result = call(api_key)
+            except Exception as e:
+                if not self._handle_failure(api_key, e):
+                    raise
+                tried.append(bucket)
+                last_error = e
+                continue
+            self._record(bucket, True)
+            return result
+        raise last_error
+
+    async def run_async(self, call: Callable[[str], Awaitable[T]], tokens: float = 0,
+                        keys: Optional[Sequence[str]] = None) -> T:
+        """run สำหรับ coroutine (call(api_key) คืน awaitable)"""
+        keys = list(keys) if keys is not None else self.keys()
+        tried: List[str] = []
+        last_error: Optional[BaseException] = None
+        for _ in range(max(self._attempts(keys), 1)):
+            api_key = await asyncio.to_thread(self.choose, keys, tried)
+            bucket = key_id(api_key)
+            await self.limiter.acquire_async(bucket, tokens)
+            try:
+                result = await call(api_key)
+            except Exception as e:
+                if not await asyncio.to_thread(self._handle_failure, api_key, e):
+                    raise
+                tried.append(bucket)
+                last_error = e
+                continue
+            await asyncio.to_thread(self._record, bucket, True)
+            return result
+        raise last_error
+
+    def stream(self, call: Callable[[str], Iterable[T]], tokens: float = 0,
+               keys: Optional[Sequence[str]] = None) -> Iterator[T]:
+        """
+        run แบบ streaming: call(api_key) คืน iterable ของ chunk
+
+        สลับ key ได้จนกว่าจะได้ chunk แรก (error ของ key ส่วนใหญ่เกิดตอนเริ่ม) หลังจากนั้น error จะส่งต่อให้ผู้เรียก
+
+        Raises:
+            NoApiKeyError, RateLimitTimeout หรือ error สุดท้ายของ call()
+        """
+        keys = list(keys) if keys is not None else self.keys()
+        tried: List[str] = []
+        last_error: Optional[BaseException] = None
+        for _ in range(max(self._attempts(keys), 1)):
+            api_key = self.choose(keys, tried)
+            bucket = key_id(api_key)
+            self.limiter.acquire(bucket, tokens)
+            try:
+                chunks = iter(call(api_key))
+                first = next(chunks, _END)
+            except Exception as e:
+                if not self._handle_failure(api_key, e):
+                    raise
+                tried.append(bucket)
+                last_error = e
+                continue
+            self._record(bucket, True)
+            if first is not _END:
+                yield first
+                yield from chunks
+            return
+        raise last_error
+
+    async def stream_async(self, call: Callable[[str], Awaitable[AsyncIterable[T]]], tokens: float = 0,
+                           keys: Optional[Sequence[str]] = None) -> AsyncIterator[T]:
+        """stream สำหรับ async (call(api_key) คืน awaitable ของ async iterable)"""
+        keys = list(keys) if keys is not None else self.keys()
+        tried: List[str] = []
+        last_error: Optional[BaseException] = None
+        for _ in range(max(self._attempts(keys), 1)):
+            api_key = await asyncio.to_thread(self.choose, keys, tried)
+            bucket = key_id(api_key)
+            await self.limiter.acquire_async(bucket, tokens)
+            try:
+                chunks = (await call(api_key)).__aiter__()
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                await asyncio.to_thread(self._record, bucket, True)
+                return
+            except Exception as e:
+                if not await asyncio.to_thread(self._handle_failure, api_key, e):
+                    raise
+                tried.append(bucket)
+                last_error = e
+                continue
+            await asyncio.to_thread(self._record, bucket, True)
+            yield first
+            async for chunk in chunks:
+                yield chunk
+            return
+        raise last_error
+
+    def charge(self, api_key: str, tokens: float = 0, wait: bool = True) -> bool:
+        """
+        หักโควต้าของคำขอเพิ่มบน key ที่เลือกไว้แล้ว (hedge / fallback ของ model_router)
+
+        Args:
+            api_key: key ที่ใช้ส่งคำขอ
+            tokens: จำนวน token โดยประมาณ
+            wait: True = รอคิวตามปกติ (fallback), False = หักเฉพาะเมื่อมีโควต้าเหลือทันที (hedge)
+
+        Returns:
+            True ถ้าได้โควต้า (wait=True ได้เสมอ หรือ raise RateLimitTimeout)
+        """
+        bucket = key_id(api_key)
+        if wait:
+            self.limiter.acquire(bucket, tokens)
+            return True
+        return self.limiter.try_acquire(bucket, tokens)
+
+    async def charge_async(self, api_key: str, tokens: float = 0, wait: bool = True) -> bool:
+        """charge สำหรับ async"""
+        bucket = key_id(api_key)
+        if wait:
+            await self.limiter.acquire_async(bucket, tokens)
+            return True
+        return await asyncio.to_thread(self.limiter.try_acquire, bucket, tokens)
+
+    def queue_depth(self, keys: Optional[Sequence[str]] = None) -> int:
+        """จำนวนคำขอที่รอคิวอยู่รวมทุก key ใน pool"""
+        keys = list(keys) if keys is not None else self.keys()
+        states = self.limiter.bucket_states([key_id(k) for k in keys])
+        return sum(state["queue_depth"] for state in states.values())
+
+    def get_stats(self) -> Dict:
+        """
+        สถานะของแต่ละ key สำหรับหน้า Admin
+
+        Returns:
+            {total, healthy, keys: [{key, label, source, healthy, reason, ejected_for,
+                                    failures, successes, requests, tokens, queue_depth, last_error}]}
+        """
+        now = time.time()
+        settings_keys = set(read_json_snapshot(self.settings_file, {}).get("gemini_api_keys", ()))
+        keys = self.keys()
+        health = self._health()
+        states = self.limiter.bucket_states([key_id(k) for k in keys])
+
+        rows = []
+        for api_key in keys:
+            bucket = key_id(api_key)
+            record = health.get(bucket, {})
+            ejected_for = max(record.get("ejected_until", 0) - now, 0.0)
+            rows.append(dict(
+                states[bucket],
+                key=bucket,
+                label=mask_key(api_key),
+                source="settings" if api_key in settings_keys else "env",
+                healthy=ejected_for <= 0,
+                reason=record.get("reason") if ejected_for > 0 else None,
+                ejected_for=ejected_for,
+                failures=record.get("failures", 0),
+                successes=record.get("successes", 0),
+                last_error=record.get("last_error")
+            ))
+        return {
+            "total": len(rows),
+            "healthy": sum(1 for row in rows if row["healthy"]),
+            "keys": rows
+        }
+
+
+_pools: Dict[str, ApiKeyPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_api_key_pool(settings_file: Optional[str] = None) -> ApiKeyPool:
+    """
+    คืน ApiKeyPool ที่ใช้ร่วมกันภายใน process
+
+    ตั้งค่าได้ด้วยตัวแปร GOOGLE_API_KEYS (คั่นด้วย comma), GOOGLE_API_KEY, API_KEY_COOLDOWN (วินาที)
+    """
+    settings_file = settings_file or "system_settings.json"
+    key = os.path.abspath(settings_file)
+    with _pools_lock:
+        if key not in _pools:
+            env_keys = _split_keys(os.getenv("GOOGLE_API_KEYS")) + \
+                _split_keys(os.getenv("GOOGLE_API_KEY") or os.getenv("GOOGLE_GEMINI_API_KEY"))
+            _pools[key] = ApiKeyPool(
+                settings_file,
+                cooldown=float(os.getenv("API_KEY_COOLDOWN", "3600")),
+                env_keys=env_keys
+            )
+        return _pools[key]
+
+
+if __name__ == "__main__":
+    pool = get_api_key_pool()
+    if len(sys.argv) >= 2 and sys.argv[1] == "--reset":
+        pool.reset_health()
+        print("🗑️ API key health cleared")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "--stats":
+        stats = pool.get_stats()
+        print(f"keys: {stats['healthy']}/{stats['total']} healthy")
+        for row in stats["keys"]:
+            status = "ok" if row["healthy"] else f"{row['reason']} ({row['ejected_for']:.0f}s)"
+            print(f"{row['label']} [{row['source']}]: {status}, requests left {row['requests']:.1f}, "
+                  f"queue {row['queue_depth']}, ok {row['successes']}, failures {row['failures']}")
+    else:
+        print(__doc__)
@@ -5,17 +5,23 @@ REST API for LMS Integration
 Provides endpoints for Google Classroom, Blackboard, and Canvas integration
 """
 
-from fastapi import FastAPI, HTTPException, File, UploadFile, BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, HTTPException, File, UploadFile, Query, Response
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime
+import asyncio
 import os
 import json
-from database import AnalysisDatabase
-from report_generator import ReportGenerator
-import google.generativeai as genai
+from analysis_repository import get_repository
+from analysis_service import analyze_document, analyze_document_stream
+from report_generator import get_report_generator
+from report_store import REPORT_FORMATS, get_report_store
+from job_queue import get_job_queue, start_workers, stop_workers
+from rate_limiter import RateLimitTimeout
+from api_key_pool import NoApiKeyError
+from lms_download import UnsafeUrlError, validate_download_url
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -34,9 +40,14 @@ app.add_middleware(
 )
 
 # Initialize database and utilities
-db = AnalysisDatabase()
-report_gen = ReportGenerator()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+db = get_repository()
+report_gen = get_report_generator()
+report_store = get_report_store()
+job_queue = get_job_queue()
+
+# Job priorities (higher runs first)
+PRIORITY_INTERACTIVE = 10
+PRIORITY_LMS = 0
 
 
 # ========== MODELS ==========
@@ -57,12 +68,44 @@ class AnalysisResponse(BaseModel):
     status: str = "success"
 
 
+class JobAccepted(BaseModel):
+    """Response model for a queued job"""
+    job_id: int
+    status: str
+    status_url: str
+
+
+class JobStatus(BaseModel):
+    """Model for job status polling"""
+    job_id: int
+    kind: str
+    status: str
+    attempts: int
+    max_attempts: int
+    created_at: str
+    updated_at: str
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
+
 class HistoryItem(BaseModel):
-    """Model for history item"""
+    """Model for history item (result is omitted when fields=meta)"""
     id: int
     file_name: str
     timestamp: str
-    result: str
+    file_size_chars: Optional[int] = None
+    result: Optional[str] = None
+
+
+class SearchHit(BaseModel):
+    """Model for a full-text search result"""
+    id: int
+    username: str
+    file_name: str
+    timestamp: str
+    relevance: float
+    snippet: str
+    score: Optional[float] = None
 
 
 class UserStatistics(BaseModel):
@@ -83,6 +126,31 @@ class GradeSubmission(BaseModel):
     feedback: Optional[str] = None
 
 
+# ========== JOB WORKERS ==========
+
+_workers = None
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    """Start analysis worker processes (JOB_WORKERS=0 to run them separately via job_queue.py)"""
+    global _workers
+    count = int(os.getenv("JOB_WORKERS", "2"))
+    if count > 0:
+        _workers = start_workers(count, job_queue.db_file)
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    """Stop analysis worker processes"""
+    if _workers:
+        await asyncio.to_thread(stop_workers, *_workers)
+
+
+def _job_accepted(job_id: int) -> JobAccepted:
+    return JobAccepted(job_id=job_id, status="queued", status_url=f"/api/v1/jobs/{job_id}")
+
+
 # ========== ENDPOINTS ==========
 
 @app.get("/")
@@ -95,8 +163,11 @@ async def root():
         "endpoints": {
             "health": "/health",
             "analyze": "/api/v1/analyze",
+            "analyze_async": "/api/v1/analyze/async",
+            "jobs": "/api/v1/jobs/{job_id}",
             "history": "/api/v1/history/{username}",
             "statistics": "/api/v1/statistics/{username}",
+            "search": "/api/v1/search",
             "lms/google": "/api/v1/lms/google-classroom",
             "lms/blackboard": "/api/v1/lms/blackboard",
             "docs": "/docs"
@@ -125,79 +196,219 @@ async def analyze_project(request: AnalysisRequest):
         AnalysisResponse with analysis results
     """
     try:
-        # Prepare prompt for AI
-        prompt = f"""
-        Role: คุณคือครูที่ปรึกษาโครงงานผู้เชี่ยวชาญ
-        Task: วิเคราะห์ "ความสอดคล้อง" ของโครงงาน
-        
-        Content:
-        {request.file_content[:30000]}
-        
-        Instructions:
-        1. หา "วัตถุประสงค์" และ "สรุปผล" จากข้อความ
-        2. เปรียบเทียบว่าสอดคล้องกันหรือไม่
-        3. ให้คะแนนและข้อแนะนำ
-        
-        Output Format (ตอบเป็น Markdown ภาษาไทย):
-        ## ผลการวิเคราะห์
-        [ผลการวิเคราะห์]
-        """
-        
-        # Get AI model and analyze
+        # Cache lookup, non-blocking Gemini call (flash -> pro fallback) and save
         try:
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            response = model.generate_content(prompt)
-            analysis_result = response.text
-        except:
-            # Fallback model
-            model = genai.GenerativeModel('gemini-pro')
-            response = model.generate_content(prompt)
-            analysis_result = response.text
+            saved = await analyze_document(request.username, request.file_name, request.file_content)
+        except RateLimitTimeout:
+            raise HTTPException(status_code=503, detail="AI quota queue is full, please retry later",
+                                headers={"Retry-After": "60"})
+        except NoApiKeyError as e:
+            raise HTTPException(status_code=503, detail=f"No usable Gemini API key: {e}")
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="AI analysis timed out")
+        if saved is None:
+            raise HTTPException(status_code=500, detail="Failed to save analysis")
         
-        # Save to database
-        db.save_analysis(request.username, request.file_name, analysis_result)
-        
-        # Get the latest record
-        history = db.get_user_history(request.username)
-        if history:
-            latest = history[0]
-            return AnalysisResponse(
-                id=latest['id'],
-                username=request.username,
-                file_name=request.file_name,
-                timestamp=latest['timestamp'],
-                result=analysis_result,
-                status="success"
-            )
+        return AnalysisResponse(
+            id=saved['id'],
+            username=request.username,
+            file_name=request.file_name,
+            timestamp=saved['timestamp'],
+            result=saved['result'],
+            status="success"
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _sse(event: str, data: dict) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@app.post("/api/v1/analyze/stream")
+async def analyze_project_stream(request: AnalysisRequest):
+    """
+    Analyze a project file and stream the result as server-sent events
+    
+    Events: `start`, then `chunk` (Markdown text as the model writes it), then `done`
+    with the saved record. Failures after the stream has started arrive as an `error`
+    event because the HTTP status has already been sent.
+    
+    Args:
+        request: Analysis request with username, file_name, and file_content
+    
+    Returns:
+        text/event-stream response
+    """
+    async def events():
+        try:
+            async for event in analyze_document_stream(request.username, request.file_name, request.file_content):
+                name = event.pop("event")
+                if name == "done":
+                    saved = event["record"]
+                    if saved is None:
+                        yield _sse("error", {"status": 500, "detail": "Failed to save analysis"})
+                        return
+                    event = {"id": saved["id"], "timestamp": saved["timestamp"], "status": "success"}
+                yield _sse(name, event)
+        except RateLimitTimeout:
+            yield _sse("error", {"status": 503, "detail": "AI quota queue is full, please retry later",
+                                 "retry_after": 60})
+        except NoApiKeyError as e:
+            yield _sse("error", {"status": 503, "detail": f"No usable Gemini API key: {e}"})
+        except asyncio.TimeoutError:
+            yield _sse("error", {"status": 504, "detail": "AI analysis timed out"})
+        except Exception as e:
+            yield _sse("error", {"status": 500, "detail": str(e)})
+    
+    # no-cache / X-Accel-Buffering: keep proxies from holding back chunks
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/api/v1/analyze/async", response_model=JobAccepted, status_code=202)
+async def analyze_project_async(request: AnalysisRequest):
+    """
+    Queue a project file for analysis and return immediately
+    
+    Poll the returned status_url until status is "done" (result holds analysis_id) or "failed".
+    
+    Args:
+        request: Analysis request with username, file_name, and file_content
+    
+    Returns:
+        JobAccepted with job id and polling URL
+    """
+    try:
+        job_id = await asyncio.to_thread(
+            job_queue.enqueue, "analyze", request.dict(), PRIORITY_INTERACTIVE
+        )
+        return _job_accepted(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/v1/jobs/{job_id}", response_model=JobStatus)
+async def get_job_status(job_id: int):
+    """
+    Get the status of a queued analysis job
+    
+    Args:
+        job_id: Job ID returned by the analyze/async or LMS endpoints
+    
+    Returns:
+        JobStatus (queued, running, done or failed)
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatus(
+        job_id=job['id'],
+        kind=job['kind'],
+        status=job['status'],
+        attempts=job['attempts'],
+        max_attempts=job['max_attempts'],
+        created_at=datetime.fromtimestamp(job['created_at']).isoformat(),
+        updated_at=datetime.fromtimestamp(job['updated_at']).isoformat(),
+        result=job['result'],
+        error=job['error']
+    )
+
+
 @app.get("/api/v1/history/{username}", response_model=List[HistoryItem])
-async def get_user_history(username: str):
+async def get_user_history(
+    username: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    since: Optional[str] = None,
+    fields: str = "preview"
+):
     """
-    Get analysis history for a user
+    Get analysis history for a user, newest first, one page at a time
     
     Args:
         username: Username to retrieve history for
+        limit: Page size
+        cursor: Value of the X-Next-Cursor header from the previous page
+        since: Only return analyses newer than this ISO timestamp
+        fields: "preview" (first 200 chars of result) or "meta" (no result)
+    
+    Returns:
+        List of analysis records (X-Next-Cursor header is set when more pages exist)
+    """
+    if fields not in ("preview", "meta"):
+        raise HTTPException(status_code=400, detail="fields must be 'preview' or 'meta'")
+    
+    try:
+        if since:
+            datetime.fromisoformat(since)
+        page = await asyncio.to_thread(
+            db.get_history_page, username, limit, cursor, since, fields == "preview"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    return [
+        HistoryItem(
+            id=item['id'],
+            file_name=item['file_name'],
+            timestamp=item['timestamp'],
+            file_size_chars=item.get('file_size_chars'),
+            result=item['result'][:200] if 'result' in item else None  # Preview first 200 chars
+        )
+        for item in page["items"]
+    ]
+
+
+@app.get("/api/v1/search", response_model=List[SearchHit])
+async def search_analyses(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    username: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    """
+    Full-text search over file names and analysis results, most relevant first
+    
+    Args:
+        q: Search terms (Thai or English); "quoted phrase", -excluded
+        username: Only search this user's analyses (default: all users)
+        limit: Page size
+        offset: Number of results to skip
     
     Returns:
-        List of analysis records
+        Matching analyses with a highlighted snippet (X-Total-Count header holds the total)
     """
     try:
-        history = db.get_user_history(username)
-        return [
-            HistoryItem(
-                id=item['id'],
-                file_name=item['file_name'],
-                timestamp=item['timestamp'],
-                result=item['result'][:200]  # Preview first 200 chars
-            )
-            for item in history
-        ]
+        found = await asyncio.to_thread(db.search, q, username, limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    response.headers["X-Total-Count"] = str(found["total"])
+    return [
+        SearchHit(
+            id=item['id'],
+            username=item['username'],
+            file_name=item['file_name'],
+            timestamp=item['timestamp'],
+            relevance=item['relevance'],
+            score=item.get('score'),
+            snippet=item['snippet']
+        )
+        for item in found["items"]
+    ]
 
 
 @app.get("/api/v1/statistics/{username}", response_model=UserStatistics)
@@ -235,145 +446,121 @@ async def download_report(analysis_id: int, username: str, format: str = "docx")
     Returns:
         File download
     """
+    if format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format")
+    
     try:
-        record = db.get_analysis_by_id(username, analysis_id)
+        record = await asyncio.to_thread(db.get_analysis_by_id, username, analysis_id)
         if not record:
             raise HTTPException(status_code=404, detail="Analysis not found")
         
-        if format == "docx":
-            doc_buffer = report_gen.generate_word_report(
-                username=username,
-                file_name=record['file_name'],
-                analysis_result=record['result'],
-                timestamp=record['timestamp']
-            )
-            filename = report_gen.get_word_filename(record['file_name'], username)
-            return FileResponse(
-                doc_buffer,
-                media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                filename=filename
-            )
-        elif format == "pdf":
-            pdf_buffer = report_gen.generate_pdf_report(
-                username=username,
-                file_name=record['file_name'],
-                analysis_result=record['result'],
-                timestamp=record['timestamp']
-            )
-            filename = report_gen.get_pdf_filename(record['file_name'], username)
-            return FileResponse(
-                pdf_buffer,
-                media_type="application/pdf",
-                filename=filename
-            )
-        else:
-            raise HTTPException(status_code=400, detail="Invalid format")
-            
+        # ส่วนใหญ่ถูกสร้างล่วงหน้าแล้วหลังวิเคราะห์ จึงเป็นการส่งไฟล์บนดิสก์ (sendfile)
+        path = await asyncio.to_thread(report_store.render, username, record, format)
+        return FileResponse(
+            path,
+            media_type=REPORT_FORMATS[format][0],
+            filename=report_store.download_name(username, record, format)
+        )
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # ========== LMS INTEGRATION ENDPOINTS ==========
 
-@app.post("/api/v1/lms/google-classroom")
-async def google_classroom_webhook(submission: GradeSubmission, background_tasks: BackgroundTasks):
+async def enqueue_lms_submission(submission: GradeSubmission, lms: str) -> int:
+    """Queue an LMS submission for download and analysis"""
+    # file_url comes from an unauthenticated webhook: reject non-http(s) schemes, hosts outside
+    # LMS_ALLOWED_HOSTS and private addresses before queueing (the worker checks again on download)
+    try:
+        await asyncio.to_thread(validate_download_url, submission.file_url)
+    except UnsafeUrlError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid file_url: {e}")
+    payload = submission.dict()
+    payload["lms"] = lms
+    return await asyncio.to_thread(job_queue.enqueue, "lms_submission", payload, PRIORITY_LMS)
+
+
+@app.post("/api/v1/lms/google-classroom", status_code=202)
+async def google_classroom_webhook(submission: GradeSubmission):
     """
     Google Classroom integration endpoint
     
-    Receives submissions from Google Classroom and processes them
+    Receives submissions from Google Classroom and queues them for analysis
     """
     try:
-        # Process submission in background
-        background_tasks.add_task(
-            process_google_classroom_submission,
-            submission
-        )
+        job_id = await enqueue_lms_submission(submission, "google_classroom")
         
         return {
-            "status": "processing",
+            "status": "queued",
             "message": f"Submission received for student {submission.student_name}",
             "student_id": submission.student_id,
-            "assignment_id": submission.assignment_id
+            "assignment_id": submission.assignment_id,
+            "job_id": job_id,
+            "status_url": f"/api/v1/jobs/{job_id}"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/v1/lms/blackboard")
-async def blackboard_webhook(submission: GradeSubmission, background_tasks: BackgroundTasks):
+@app.post("/api/v1/lms/blackboard", status_code=202)
+async def blackboard_webhook(submission: GradeSubmission):
     """
     Blackboard integration endpoint
     
-    Receives submissions from Blackboard and processes them
+    Receives submissions from Blackboard and queues them for analysis
     """
     try:
-        # Process submission in background
-        background_tasks.add_task(
-            process_blackboard_submission,
-            submission
-        )
+        job_id = await enqueue_lms_submission(submission, "blackboard")
         
         return {
-            "status": "processing",
+            "status": "queued",
             "message": f"Submission received for student {submission.student_name}",
-            "student_id": submission.student_id
+            "student_id": submission.student_id,
+            "job_id": job_id,
+            "status_url": f"/api/v1/jobs/{job_id}"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/v1/lms/canvas")
-async def canvas_webhook(submission: GradeSubmission, background_tasks: BackgroundTasks):
+@app.post("/api/v1/lms/canvas", status_code=202)
+async def canvas_webhook(submission: GradeSubmission):
     """
     Canvas LMS integration endpoint
     
-    Receives submissions from Canvas and processes them
+    Receives submissions from Canvas and queues them for analysis
     """
     try:
-        background_tasks.add_task(
-            process_canvas_submission,
-            submission
-        )
+        job_id = await enqueue_lms_submission(submission, "canvas")
         
         return {
-            "status": "processing",
+            "status": "queued",
             "message": f"Submission received for student {submission.student_name}",
-            "student_id": submission.student_id
+            "student_id": submission.student_id,
+            "job_id": job_id,
+            "status_url": f"/api/v1/jobs/{job_id}"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# ========== BACKGROUND TASKS ==========
-
-async def process_google_classroom_submission(submission: GradeSubmission):
-    """Process Google Classroom submission"""
-    print(f"Processing Google Classroom submission: {submission.student_id}")
-    # Implement Google Classroom API integration
-    pass
-
-
-async def process_blackboard_submission(submission: GradeSubmission):
-    """Process Blackboard submission"""
-    print(f"Processing Blackboard submission: {submission.student_id}")
-    # Implement Blackboard API integration
-    pass
-
-
-async def process_canvas_submission(submission: GradeSubmission):
-    """Process Canvas submission"""
-    print(f"Processing Canvas submission: {submission.student_id}")
-    # Implement Canvas API integration
-    pass
-
-
 # ========== ERROR HANDLERS ==========
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     return JSONResponse(
         status_code=exc.status_code,
-        content={"detail": exc.detail}
+        content={"detail": exc.detail},
+        headers=getattr(exc, "headers", None)
     )
 
 
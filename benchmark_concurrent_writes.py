@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stress benchmark สำหรับการเขียนพร้อมกันหลาย process
+
+เปิด writer หลาย process (แต่ละ process มีหลาย thread) ให้เขียนพร้อมกันลง:
+- AnalysisDatabase (history + storage engine)
+- SatisfactionDatabase (satisfaction_data.json)
+- users_database.json ผ่าน update_json
+แล้วตรวจว่าไม่มี record หาย, id ไม่ซ้ำ และ id ที่ writer ได้รับตรงกับข้อมูลบนดิสก์
+
+Usage:
+    python benchmark_concurrent_writes.py --processes 8 --threads 4 --records 50
+    python benchmark_concurrent_writes.py --engine json
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+def _writer(args, worker_no: int, results):
+    """งานของ writer process หนึ่งตัว"""
+    from database import AnalysisDatabase
+    from satisfaction_database import SatisfactionDatabase
+    from write_coordinator import update_json
+
+    db = AnalysisDatabase(os.path.join(args.workdir, "history.json"), args.engine)
+    if hasattr(db.engine, "max_segment_bytes"):
+        # segment เล็กเพื่อให้เกิดการเปิด segment ใหม่และ compaction ระหว่างทดสอบ
+        db.engine.max_segment_bytes = args.segment_bytes
+    surveys = SatisfactionDatabase(os.path.join(args.workdir, "satisfaction_data.json"))
+    users_file = os.path.join(args.workdir, "users_database.json")
+
+    saved = []
+    saved_lock = threading.Lock()
+
+    def run(thread_no: int):
+        for i in range(args.records):
+            username = f"student{(worker_no + thread_no + i) % args.users}"
+            file_name = f"w{worker_no}_t{thread_no}_{i}.pdf"
+            entry = db.engine.append(username, {
+                "timestamp": f"2026-01-01T00:00:00.{worker_no:03d}{thread_no:03d}",
+                "username": username,
+                "file_name": file_name,
+                "result": "x" * 200
+            })
+            with saved_lock:
+                saved.append((username, entry["id"], file_name))
+
+            surveys.add_survey_response("student", username, f"W{worker_no}", {"q": i})
+
+            user_id = f"{worker_no}_{thread_no}_{i}"
+            update_json(users_file,
+                        lambda data: data["users"].append({"id": user_id}),
+                        {"users": []})
+
+    threads = [threading.Thread(target=run, args=(t,)) for t in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    committer = getattr(db.engine, "_committer", None)
+    results.put({
+        "saved": saved,
+        "batches": committer.batches if committer else None,
+        "appends": committer.records if committer else None
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress benchmark for concurrent JSON/log writers")
+    parser.add_argument("--processes", type=int, default=6)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--records", type=int, default=25, help="records per thread")
+    parser.add_argument("--users", type=int, default=3, help="จำนวน username ที่ใช้ร่วมกัน")
+    parser.add_argument("--engine", default="log", choices=["log", "json"])
+    parser.add_argument("--segment-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--keep", action="store_true", help="ไม่ลบโฟลเดอร์ทดสอบ")
+    args = parser.parse_args()
+    args.workdir = tempfile.mkdtemp(prefix="concurrent_writes_")
+
+    from database import AnalysisDatabase
+    from satisfaction_database import SatisfactionDatabase
+    from write_coordinator import read_json
+
+    # เปิดฐานข้อมูลใน process หลักด้วย (compaction ทำงานระหว่างที่ writer เขียน)
+    db = AnalysisDatabase(os.path.join(args.workdir, "history.json"), args.engine)
+
+    expected = args.processes * args.threads * args.records
+    print(f"📝 {args.processes} processes x {args.threads} threads x {args.records} records "
+          f"= {expected} writes per store (engine={args.engine})")
+
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_writer, args=(args, n, results))
+        for n in range(args.processes)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+
+    compactions = 0
+    outputs = []
+    while len(outputs) < len(workers):
+        if hasattr(db.engine, "compact") and db.engine.compact():
+            compactions += 1
+        try:
+            outputs.append(results.get(timeout=0.2))
+        except Exception:
+            if not any(worker.is_alive() for worker in workers) and results.empty():
+                break
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    # ---------- ตรวจผล ----------
+    errors = []
+    counts = db.engine.user_counts()
+    total = sum(counts.values())
+    if total != expected:
+        errors.append(f"history: expected {expected} records, found {total}")
+
+    for username in counts:
+        ids = [entry["id"] for entry in db.engine.get_user_records(username)]
+        if len(ids) != len(set(ids)):
+            errors.append(f"history: duplicate ids for {username}")
+
+    saved = [item for output in outputs for item in output["saved"]]
+    for username, entry_id, file_name in saved:
+        record = db.engine.get_record(username, entry_id)
+        if record is None or record.get("file_name") != file_name:
+            errors.append(f"history: {username}#{entry_id} does not match {file_name}")
+            break
+
+    survey_count = len(SatisfactionDatabase(os.path.join(args.workdir, "satisfaction_data.json")).get_all_surveys())
+    if survey_count != expected:
+        errors.append(f"surveys: expected {expected}, found {survey_count}")
+
+    users = read_json(os.path.join(args.workdir, "users_database.json"), {"users": []})["users"]
+    if len(users) != expected:
+        errors.append(f"users: expected {expected}, found {len(users)}")
+
+    # ---------- สรุป ----------
+    print(f"⏱️  {elapsed:.2f}s total, {3 * expected / elapsed:.0f} writes/s across all stores")
+    batches = [o["batches"] for o in outputs if o["batches"]]
+    if batches:
+        appends = sum(o["appends"] for o in outputs)
+        print(f"📦 group commit: {appends} appends in {sum(batches)} fsync batches "
+              f"({appends / sum(batches):.2f} per batch), {compactions} compactions")
+    print(f"📊 history={total} surveys={survey_count} users={len(users)}")
+
+    if not args.keep:
+        db.engine.close()
+        shutil.rmtree(args.workdir, ignore_errors=True)
+    else:
+        print(f"📁 {args.workdir}")
+
+    if errors:
+        for error in errors:
+            print(f"❌ {error}")
+        raise SystemExit(1)
+    print("✅ No lost or mismatched records")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark การย้าย history.json ไป SQLite
+
+สร้าง history.json จำลอง (id นับแยกต่อผู้ใช้ เหมือนข้อมูลจริง) แล้ววัดเวลา:
+- migrate_from_json (bulk_insert หลายพัน record ต่อ transaction, WAL)
+- วิธีเดิม: save_analysis ทีละ record (วัดจากตัวอย่าง --baseline รายการแล้วประมาณเวลาทั้งหมด)
+แล้วตรวจว่าจำนวน record, timestamp เดิม, id เดิม และตาราง user_stats ถูกต้อง
+
+Usage:
+    python benchmark_sqlite_migration.py --records 100000
+    python benchmark_sqlite_migration.py --records 100000 --batch-size 10000 --baseline 0
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def _write_history(path: str, records: int, users: int) -> dict:
+    """สร้าง history.json รูปแบบ {username: [entries]} คืนข้อมูลที่เขียน"""
+    started = datetime(2025, 6, 1, 8, 0, 0)
+    data = {f"student{u}": [] for u in range(users)}
+    for i in range(records):
+        username = f"student{i % users}"
+        entries = data[username]
+        result = f"## ผลการวิเคราะห์ #{i}\n- วัตถุประสงค์: ชัดเจน\n" + "รายละเอียด " * 20
+        entries.append({
+            "id": len(entries) + 1,
+            "timestamp": (started + timedelta(seconds=37 * i)).isoformat(),
+            "file_name": f"project_{i}.pdf",
+            "file_size_chars": len(result),
+            "result": result
+        })
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark history.json -> SQLite migration")
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--baseline", type=int, default=500,
+                        help="จำนวน record ที่ใช้วัดวิธีเดิม (0 = ไม่วัด)")
+    parser.add_argument("--keep", action="store_true", help="ไม่ลบโฟลเดอร์ทดสอบ")
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="sqlite_migration_")
+
+    from database_sqlite import AnalysisDatabaseSQLite, AnalysisRecord, UserStats
+
+    json_file = os.path.join(workdir, "history.json")
+    data = _write_history(json_file, args.records, args.users)
+    print(f"📝 {args.records} records, {args.users} users, "
+          f"{os.path.getsize(json_file) / 1024 / 1024:.1f} MB history.json")
+
+    # ---------- bulk migration ----------
+    db = AnalysisDatabaseSQLite(os.path.join(workdir, "bulk.db"))
+    start = time.perf_counter()
+    ok = AnalysisDatabaseSQLite.migrate_from_json(json_file, db, args.batch_size)
+    bulk_elapsed = time.perf_counter() - start
+    print(f"⏱️  bulk migration: {bulk_elapsed:.2f}s ({args.records / bulk_elapsed:,.0f} records/s)")
+
+    # ---------- วิธีเดิม (ทีละ record) ----------
+    if args.baseline:
+        baseline_db = AnalysisDatabaseSQLite(os.path.join(workdir, "baseline.db"))
+        sample = [(user, entry) for user, entries in data.items() for entry in entries][:args.baseline]
+        start = time.perf_counter()
+        for username, entry in sample:
+            baseline_db.save_analysis(username, entry["file_name"], entry["result"])
+        per_record = (time.perf_counter() - start) / len(sample)
+        estimate = per_record * args.records
+        print(f"🐢 save_analysis per record: {per_record * 1000:.2f} ms "
+              f"-> ~{estimate:.0f}s for {args.records} records ({estimate / bulk_elapsed:.0f}x slower)")
+
+    # ---------- ตรวจผล ----------
+    errors = []
+    if not ok:
+        errors.append("migrate_from_json returned False")
+    session = db.get_session()
+    try:
+        total = session.query(AnalysisRecord).count()
+        if total != args.records:
+            errors.append(f"expected {args.records} records, found {total}")
+
+        first_user = "student0"
+        for entry in data[first_user][:50]:
+            record = db.get_analysis_by_id(first_user, entry["id"])
+            if record is None or record["file_name"] != entry["file_name"]:
+                errors.append(f"{first_user}#{entry['id']} was not kept")
+                break
+            if record["timestamp"] != entry["timestamp"]:
+                errors.append(f"{first_user}#{entry['id']} timestamp {record['timestamp']} != {entry['timestamp']}")
+                break
+
+        stats_total = sum(count for (count,) in session.query(UserStats.analysis_count))
+        if stats_total != args.records:
+            errors.append(f"user_stats counts {stats_total} records")
+        expected_last = data[first_user][-1]["timestamp"]
+        if db.get_statistics(first_user).get("last_analysis_date") != expected_last:
+            errors.append(f"user_stats last timestamp for {first_user} is not {expected_last}")
+    finally:
+        session.close()
+
+    if not args.keep:
+        db.engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+    else:
+        print(f"📁 {workdir}")
+
+    if errors:
+        for error in errors:
+            print(f"❌ {error}")
+        raise SystemExit(1)
+    print("✅ Records, timestamps, ids and statistics match history.json")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Blob store - เก็บเนื้อหาผลการวิเคราะห์ (Markdown) แบบบีบอัด แยกจาก metadata
+
+- ชื่อไฟล์คือ SHA-256 ของเนื้อหา: ข้อความเดียวกัน (เช่น result กับ full_report) เก็บครั้งเดียว
+- บีบอัดด้วย zstd ถ้าติดตั้ง zstandard ไว้ ไม่เช่นนั้นใช้ zlib (อ่านได้ทั้งสองแบบ)
+- record ใน history เก็บเพียง reference ("result_blob") เนื้อหาถูกอ่านเมื่อต้องแสดงหรือสร้างรายงานเท่านั้น
+
+Usage:
+    python blob_store.py --stats
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import zlib
+from typing import Dict, Iterable, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# byte แรกของไฟล์บอกวิธีบีบอัด
+_CODEC_ZLIB = b"z"
+_CODEC_ZSTD = b"s"
+
+
+class BlobStore:
+    """ที่เก็บข้อความแบบ content-addressed และบีบอัด (ไฟล์ละหนึ่ง blob)"""
+
+    def __init__(self, directory: str = "history_blobs", level: int = 6):
+        """
+        Args:
+            directory: โฟลเดอร์เก็บ blob
+            level: ระดับการบีบอัด
+        """
+        self.directory = directory
+        self.level = level
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, ref: str) -> str:
+        # แยกโฟลเดอร์ย่อยตาม 2 ตัวแรก ไม่ให้ไฟล์ในโฟลเดอร์เดียวมากเกินไป
+        return os.path.join(self.directory, ref[:2], ref)
+
+    def _compress(self, data: bytes) -> bytes:
+        if zstandard is not None:
+            return _CODEC_ZSTD + zstandard.ZstdCompressor(level=self.level).compress(data)
+        return _CODEC_ZLIB + zlib.compress(data, self.level)
+
+    @staticmethod
+    def _decompress(blob: bytes) -> bytes:
+        codec, payload = blob[:1], blob[1:]
+        if codec == _CODEC_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read this blob")
+            return zstandard.ZstdDecompressor().decompress(payload)
+        return zlib.decompress(payload)
+
+    def put(self, text: str) -> str:
+        """
+        เก็บข้อความ (ถ้ามีเนื้อหาเดียวกันอยู่แล้วจะไม่เขียนซ้ำ)
+
+        Returns:
+            reference (SHA-256 hex)
+        """
+        data = text.encode('utf-8')
+        ref = hashlib.sha256(data).hexdigest()
+        path = self._path(ref)
+        if os.path.exists(path):
+            return ref
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._compress(data))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return ref
+
+    def get(self, ref: str) -> Optional[str]:
+        """อ่านข้อความตาม reference (None ถ้าไม่พบ)"""
+        try:
+            with open(self._path(ref), 'rb') as f:
+                return self._decompress(f.read()).decode('utf-8')
+        except FileNotFoundError:
+            return None
+
+    def _walk(self) -> Iterable[str]:
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(".tmp"):
+                    yield os.path.join(root, name)
+
+    def gc(self, live_refs: Iterable[str]) -> int:
+        """
+        ลบ blob ที่ไม่มี record ใดอ้างถึงแล้ว
+
+        Args:
+            live_refs: reference ที่ยังใช้อยู่ทั้งหมด
+
+        Returns:
+            จำนวน blob ที่ลบ
+        """
+        live = set(live_refs)
+        removed = 0
+        for path in self._walk():
+            if os.path.basename(path) not in live:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError as e:
+                    print(f"Error removing blob {path}: {e}")
+        return removed
+
+    def get_stats(self) -> Dict:
+        """จำนวนและขนาดรวมของ blob บนดิสก์"""
+        sizes = [os.path.getsize(path) for path in self._walk()]
+        return {
+            "blobs": len(sizes),
+            "size_bytes": sum(sizes),
+            "codec": "zstd" if zstandard is not None else "zlib"
+        }
+
+
+_stores: Dict[str, BlobStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_blob_store(directory: str) -> BlobStore:
+    """คืน BlobStore ที่ใช้ร่วมกันภายใน process (แยกตามโฟลเดอร์)"""
+    key = os.path.abspath(directory)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = BlobStore(directory)
+        return _stores[key]
+
+
+if __name__ == "__main__":
+    directory = os.path.splitext(os.getenv("DATABASE_FILE", "history.json"))[0] + "_blobs"
+    if len(sys.argv) >= 2 and sys.argv[1] == "--stats":
+        for name, value in get_blob_store(directory).get_stats().items():
+            print(f"{name}: {value}")
+    else:
+        print(__doc__)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chapter segmenter - แบ่งเอกสารโครงงานตามหัวข้อบท
+
+หาหัวข้อ บทคัดย่อ, บทที่ 1-5 (เลขอารบิกหรือเลขไทย) และ บรรณานุกรม/เอกสารอ้างอิง
+สร้าง index ตำแหน่ง (offset) ของแต่ละส่วน แล้วตัดเฉพาะส่วนที่ต้องการส่งให้ AI
+
+หัวข้อเดียวกันมักพบหลายครั้ง (สารบัญ, หัวกระดาษทุกหน้า) จึงเลือกตำแหน่งที่
+ส่วนนั้นยาวที่สุดก่อนถึงหัวข้อของส่วนอื่น
+"""
+
+import re
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+
+# ส่วนหนึ่งของเอกสาร: text[start:end]
+Section = namedtuple("Section", ["key", "title", "start", "end"])
+
+SECTION_TITLES = {
+    "abstract": "บทคัดย่อ",
+    "chapter1": "บทที่ 1: บทนำ",
+    "chapter2": "บทที่ 2: เอกสารและงานวิจัยที่เกี่ยวข้อง",
+    "chapter3": "บทที่ 3: วิธีดำเนินการวิจัย",
+    "chapter4": "บทที่ 4: ผลการวิจัย",
+    "chapter5": "บทที่ 5: สรุปและข้อเสนอแนะ",
+    "references": "บรรณานุกรม"
+}
+
+_THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+
+_HEADING_PATTERN = re.compile(
+    r"^[ \t]*(?:"
+    r"(?:บทที่|chapter)[ \t]*(?P<number>[1-5๑-๕])(?![0-9๐-๙])"
+    r"|(?P<abstract>บทคัดย่อ|abstract)"
+    r"|(?P<references>บรรณานุกรม|เอกสารอ้างอิง|references|bibliography)"
+    r")",
+    re.MULTILINE | re.IGNORECASE
+)
+
+# บรรทัดสารบัญ เช่น "บทที่ 1 บทนำ ........ 1"
+_TOC_LINE = re.compile(r"\.{4,}|…{2,}|_{4,}")
+
+
+def find_headings(text: str) -> List[Tuple[str, int]]:
+    """
+    หาตำแหน่งหัวข้อทั้งหมด (ไม่รวมบรรทัดสารบัญ)
+
+    Returns:
+        [(key, offset)] เรียงตามตำแหน่ง
+    """
+    headings = []
+    for match in _HEADING_PATTERN.finditer(text):
+        line_end = text.find("\n", match.start())
+        line = text[match.start():line_end if line_end != -1 else len(text)]
+        if _TOC_LINE.search(line):
+            continue
+        if match.group("number"):
+            key = f"chapter{match.group('number').translate(_THAI_DIGITS)}"
+        elif match.group("abstract"):
+            key = "abstract"
+        else:
+            key = "references"
+        headings.append((key, match.start()))
+    return headings
+
+
+class SectionIndex:
+    """index ของส่วนต่างๆ ในเอกสาร"""
+
+    def __init__(self, text: str):
+        """
+        Args:
+            text: ข้อความทั้งเอกสาร
+        """
+        self.text = text
+        self.sections: List[Section] = self._build(text)
+        self._by_key: Dict[str, Section] = {section.key: section for section in self.sections}
+
+    @staticmethod
+    def _build(text: str) -> List[Section]:
+        headings = find_headings(text)
+
+        # เลือกตำแหน่งเริ่มของแต่ละส่วน: ตำแหน่งที่ห่างจากหัวข้อของส่วนอื่นถัดไปมากที่สุด
+        best: Dict[str, Tuple[int, int]] = {}
+        for i, (key, offset) in enumerate(headings):
+            following = next((o for k, o in headings[i + 1:] if k != key), len(text))
+            length = following - offset
+            if key not in best or length > best[key][1]:
+                best[key] = (offset, length)
+
+        starts = sorted((offset, key) for key, (offset, _) in best.items())
+        sections = []
+        for i, (offset, key) in enumerate(starts):
+            end = starts[i + 1][0] if i + 1 < len(starts) else len(text)
+            sections.append(Section(key, SECTION_TITLES[key], offset, end))
+        return sections
+
+    def get(self, key: str) -> Optional[Section]:
+        """ส่วนตาม key เช่น "chapter3" (None ถ้าไม่พบ)"""
+        return self._by_key.get(key)
+
+    def slice(self, key: str) -> str:
+        """ข้อความของส่วนที่ระบุ ("" ถ้าไม่พบ)"""
+        section = self.get(key)
+        return self.text[section.start:section.end] if section else ""
+
+    def outline(self) -> List[Dict]:
+        """สรุปส่วนที่พบ [{key, title, chars}] สำหรับแสดงผล"""
+        return [
+            {"key": s.key, "title": s.title, "chars": s.end - s.start}
+            for s in self.sections
+        ]
+
+
+def select_content(text: str, chapter: str, budget: Optional[int] = None) -> Tuple[str, Optional[Section]]:
+    """
+    เลือกเนื้อหาที่จะส่งให้ AI ตามบทที่ต้องการตรวจ
+
+    Args:
+        text: ข้อความทั้งเอกสาร
+        chapter: "all" หรือ "chapter1".."chapter5"
+        budget: จำนวนตัวอักษรสูงสุด (None = ไม่จำกัด ให้ผู้เรียกจัดให้อยู่ในงบ token เอง)
+
+    Returns:
+        (เนื้อหา, Section ที่ใช้) - Section เป็น None ถ้าส่งทั้งเอกสาร
+        (เลือก "all" หรือหาหัวข้อบทไม่พบ)
+    """
+    if chapter == "all":
+        return text[:budget], None
+
+    section = SectionIndex(text).get(chapter)
+    if section is None:
+        return text[:budget], None
+    end = section.end if budget is None else min(section.end, section.start + budget)
+    return text[section.start:end], section
+
+
+if __name__ == "__main__":
+    # ตัวอย่างการใช้งาน
+    sample = "\n".join([
+        "สารบัญ",
+        "บทที่ 1 บทนำ .......... 1",
+        "บทที่ 2 เอกสารที่เกี่ยวข้อง .......... 5",
+        "บทคัดย่อ",
+        "โครงงานนี้ศึกษา...",
+        "บทที่ ๑ บทนำ",
+        "ความเป็นมา " * 50,
+        "บทที่ 2 เอกสารและงานวิจัยที่เกี่ยวข้อง",
+        "ทฤษฎี " * 80,
+        "บทที่ 3 วิธีดำเนินการวิจัย",
+        "ขั้นตอน " * 40,
+        "บทที่ 4 ผลการวิจัย",
+        "ผล " * 60,
+        "บทที่ 5 สรุปและข้อเสนอแนะ",
+        "สรุป " * 30,
+        "บรรณานุกรม",
+        "หนังสือ ก."
+    ])
+    index = SectionIndex(sample)
+    for item in index.outline():
+        print(f"{item['key']:<10} {item['chars']:>6} ตัวอักษร  {item['title']}")
+    content, used = select_content(sample, "chapter4", 15000)
+    print(f"\nchapter4 -> {used.title if used else 'ทั้งเอกสาร'}: {content[:40]!r}")
@@ -4,42 +4,179 @@
 Database module for storing and retrieving project analysis history
 """
 
+import base64
+import bisect
 import json
 import os
+import threading
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Iterable, List, Dict, Optional
+from blob_store import get_blob_store
+from storage_engine import RecordLocation, SecondaryIndex, open_engine
+
+# field ขนาดใหญ่ที่ไม่ส่งกลับเมื่อขอเฉพาะ metadata (include_result=False)
+# เก็บใน blob store แยกจาก record โดย record เก็บ reference ไว้ใน "<field>_blob"
+HEAVY_FIELDS = ("result", "full_report")
+BLOB_REF_SUFFIX = "_blob"
+
+# key ของรูปแบบเดิมที่ pages เขียนไว้ในไฟล์เดียวกับ AnalysisDatabase
+LEGACY_ANALYSES_KEY = "analyses"
+
+
+def encode_history_cursor(timestamp: str, analysis_id) -> str:
+    """สร้าง cursor (ตำแหน่งของรายการสุดท้ายในหน้า) สำหรับขอหน้าถัดไป"""
+    raw = json.dumps([timestamp, analysis_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_history_cursor(cursor: str) -> tuple:
+    """
+    แปลง cursor กลับเป็น (timestamp, id)
+
+    Raises:
+        ValueError ถ้า cursor ไม่ถูกต้อง
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, analysis_id = json.loads(raw)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return str(timestamp), analysis_id
+
+
+def normalize_entry(key: str, raw: Dict) -> tuple:
+    """แปลง record รูปแบบเดิมให้เป็นรูปแบบกลาง คืน (username, entry) (ใช้ร่วมกับ database_sqlite)"""
+    entry = dict(raw)
+    username = entry.get("username") if key == LEGACY_ANALYSES_KEY else key
+    username = username or "unknown"
+    entry["username"] = username
+
+    if "result" not in entry:
+        entry["result"] = entry.pop("analysis_result", "")
+    else:
+        entry.pop("analysis_result", None)
+    entry.setdefault("file_size_chars", len(entry["result"] or ""))
+    entry.setdefault("file_name", "-")
+    entry.setdefault("timestamp", "")
+
+    if not isinstance(entry.get("id"), int):
+        if entry.get("id") is not None:
+            entry["legacy_id"] = entry["id"]
+        entry.pop("id", None)
+    return username, entry
+
+
+def _id_key(analysis_id) -> tuple:
+    # id ปกติเป็น int แต่ข้อมูลเก่าอาจมี id ชนิดอื่น จึงแยกกลุ่มไม่ให้เปรียบเทียบข้ามชนิด
+    return (0, analysis_id) if isinstance(analysis_id, int) else (1, str(analysis_id))
+
+
+class TimelineIndex(SecondaryIndex):
+    """index ของ record แต่ละผู้ใช้เรียงตาม (timestamp, id) สำหรับแบ่งหน้าประวัติ"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_user: Dict[str, List[tuple]] = {}
+
+    def reset(self):
+        with self._lock:
+            self._by_user = {}
+
+    def add(self, username: str, entry_id, location: RecordLocation):
+        with self._lock:
+            key = (location.timestamp or "", _id_key(entry_id), entry_id)
+            bisect.insort(self._by_user.setdefault(username, []), key)
+
+    def remove(self, username: str, entry_id, location: RecordLocation):
+        with self._lock:
+            timeline = self._by_user.get(username)
+            if not timeline:
+                return
+            key = (location.timestamp or "", _id_key(entry_id), entry_id)
+            position = bisect.bisect_left(timeline, key)
+            if position < len(timeline) and timeline[position] == key:
+                del timeline[position]
+
+    def page(self, username: str, limit: Optional[int] = None,
+             before: Optional[tuple] = None, since: Optional[str] = None) -> tuple:
+        """
+        id ของ record จากใหม่ไปเก่า
+
+        Args:
+            username: ชื่อผู้ใช้
+            limit: จำนวนสูงสุด (None = ทั้งหมด)
+            before: (timestamp, id) - เอาเฉพาะรายการที่เก่ากว่านี้
+            since: timestamp - เอาเฉพาะรายการที่ใหม่กว่านี้
+
+        Returns:
+            ([(timestamp, id)], มีรายการเก่ากว่านี้อีกหรือไม่)
+        """
+        with self._lock:
+            timeline = self._by_user.get(username, [])
+            end = bisect.bisect_left(timeline, (before[0], _id_key(before[1]))) if before else len(timeline)
+            start = bisect.bisect_right(timeline, (since, (2,))) if since else 0
+            first = start if limit is None else max(start, end - limit)
+            return [(ts, entry_id) for ts, _, entry_id in reversed(timeline[first:end])], first > start
 
 
 class AnalysisDatabase:
     """คลาสสำหรับจัดการข้อมูลประวัติการวิเคราะห์โครงงาน"""
     
-    def __init__(self, db_file: str = "history.json"):
+    def __init__(self, db_file: str = "history.json", engine: Optional[str] = None):
         """
         Initialize the database
         
         Args:
             db_file: Path to the JSON database file (default: history.json)
+            engine: Storage engine - "log" (append-only segments) หรือ "json" (ไฟล์เดียวแบบเดิม)
+                    ถ้าไม่ระบุจะใช้ตัวแปร STORAGE_ENGINE (default: log)
         """
         self.db_file = db_file
-        self._ensure_db_exists()
+        self.engine = open_engine(db_file, engine)
+        self.timeline_index = self.engine.register_index("timeline", TimelineIndex())
+        self.blobs = get_blob_store(os.path.splitext(db_file)[0] + "_blobs")
     
-    def _ensure_db_exists(self):
-        """สร้างไฟล์ database ถ้ายังไม่มี"""
-        if not os.path.exists(self.db_file):
-            self._write_db({})
+    def _store_bodies(self, entry: Dict) -> Dict:
+        """ย้ายเนื้อหาใน HEAVY_FIELDS ไปเก็บใน blob store คืน record ที่เหลือเพียง reference"""
+        slim = dict(entry)
+        for field in HEAVY_FIELDS:
+            if isinstance(slim.get(field), str):
+                slim[field + BLOB_REF_SUFFIX] = self.blobs.put(slim.pop(field))
+        return slim
+    
+    def load_bodies(self, entries: Iterable[Dict], fields: Iterable[str] = HEAVY_FIELDS) -> List[Dict]:
+        """
+        อ่านเนื้อหาจาก blob store ใส่กลับเข้า record (ใช้เมื่อต้องแสดงผลหรือสร้างรายงานเท่านั้น)
+        
+        Args:
+            entries: record แบบ metadata (มี reference "<field>_blob")
+            fields: field ที่ต้องการอ่าน
+        
+        Returns:
+            สำเนาของ record พร้อมเนื้อหา
+        """
+        loaded = []
+        for entry in entries:
+            entry = dict(entry)
+            for field in fields:
+                ref = entry.get(field + BLOB_REF_SUFFIX)
+                if field not in entry and ref:
+                    body = self.blobs.get(ref)
+                    entry[field] = body if body is not None else ""
+            loaded.append(entry)
+        return loaded
     
     def _read_db(self) -> Dict:
         """อ่านข้อมูลจาก database"""
         try:
-            with open(self.db_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
+            return self.engine.read_all()
+        except Exception as e:
+            print(f"Error reading database: {e}")
             return {}
     
     def _write_db(self, data: Dict):
         """บันทึกข้อมูลลง database"""
-        with open(self.db_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        self.engine.write_all(data)
     
     def save_analysis(self, username: str, file_name: str, analysis_result: str) -> bool:
         """
@@ -54,50 +191,71 @@ class AnalysisDatabase:
             True ถ้าบันทึกสำเร็จ, False ถ้าล้มเหลว
         """
         try:
-            db_data = self._read_db()
-            
-            # สร้างรายการใหม่สำหรับผู้ใช้นี้ถ้ายังไม่มี
-            if username not in db_data:
-                db_data[username] = []
-            
-            # สร้างรูปแบบข้อมูลการวิเคราะห์
+            # สร้างรูปแบบข้อมูลการวิเคราะห์ (engine เป็นผู้กำหนด id)
             analysis_entry = {
-                "id": len(db_data[username]) + 1,
                 "timestamp": datetime.now().isoformat(),
+                "username": username,
                 "file_name": file_name,
                 "file_size_chars": len(analysis_result),
                 "result": analysis_result
             }
             
-            # เพิ่มเข้าประวัติ
-            db_data[username].append(analysis_entry)
-            
-            # บันทึกลง database
-            self._write_db(db_data)
+            # เขียนต่อท้ายประวัติ
+            self.engine.append(username, self._store_bodies(analysis_entry))
             return True
             
         except Exception as e:
             print(f"Error saving analysis: {e}")
             return False
     
-    def get_user_history(self, username: str) -> List[Dict]:
+    def get_user_history(self, username: str, include_result: bool = True) -> List[Dict]:
         """
         ดึงประวัติการวิเคราะห์ของผู้ใช้คนหนึ่ง
         
         Args:
             username: ชื่อผู้ใช้ที่ต้องการดูประวัติ
+            include_result: False = metadata เท่านั้น (ไม่อ่านเนื้อหาจาก blob store)
         
         Returns:
             List of analysis entries, sorted by most recent first
         """
-        db_data = self._read_db()
+        # เรียงจากใหม่ไปเก่าตาม timeline index (ไม่ต้อง sort ทุกครั้ง)
+        return self.get_history_page(username, limit=None, include_result=include_result)["items"]
+    
+    def get_history_page(self,
+                         username: str,
+                         limit: Optional[int] = 50,
+                         cursor: Optional[str] = None,
+                         since: Optional[str] = None,
+                         include_result: bool = True) -> Dict:
+        """
+        ดึงประวัติทีละหน้า (จากใหม่ไปเก่า) โดยอ่านเฉพาะ record ในหน้านั้น
         
-        if username not in db_data:
-            return []
+        Args:
+            username: ชื่อผู้ใช้
+            limit: จำนวนรายการต่อหน้า (None = ทั้งหมด)
+            cursor: next_cursor จากหน้าก่อน (None = หน้าแรก)
+            since: timestamp ISO - เอาเฉพาะรายการที่ใหม่กว่านี้ (สำหรับ sync เฉพาะส่วนที่เพิ่ม)
+            include_result: False = ไม่ส่งผลการวิเคราะห์ (metadata เท่านั้น)
+        
+        Returns:
+            {"items": [...], "next_cursor": str หรือ None}
         
-        # เรียงลำดับจากใหม่ไปเก่า
-        history = db_data[username]
-        return sorted(history, key=lambda x: x['timestamp'], reverse=True)
+        Raises:
+            ValueError ถ้า cursor ไม่ถูกต้อง
+        """
+        before = decode_history_cursor(cursor) if cursor else None
+        self.engine.refresh()
+        keys, has_more = self.timeline_index.page(username, limit, before, since)
+        items = self.engine.get_records([(username, entry_id) for _, entry_id in keys])
+        if include_result:
+            items = self.load_bodies(items)
+        else:
+            # record เดิมที่ยังเก็บเนื้อหาไว้ใน record เอง
+            items = [{k: v for k, v in entry.items() if k not in HEAVY_FIELDS} for entry in items]
+        
+        next_cursor = encode_history_cursor(*keys[-1]) if has_more and keys else None
+        return {"items": items, "next_cursor": next_cursor}
     
     def get_analysis_by_id(self, username: str, analysis_id: int) -> Optional[Dict]:
         """
@@ -110,13 +268,8 @@ class AnalysisDatabase:
         Returns:
             Analysis entry dict หรือ None ถ้าไม่เจอ
         """
-        history = self.get_user_history(username)
-        
-        for entry in history:
-            if entry['id'] == analysis_id:
-                return entry
-        
-        return None
+        record = self.engine.get_record(username, analysis_id)
+        return self.load_bodies([record])[0] if record else None
     
     def delete_analysis(self, username: str, analysis_id: int) -> bool:
         """
@@ -130,19 +283,7 @@ class AnalysisDatabase:
             True ถ้าลบสำเร็จ, False ถ้าล้มเหลว
         """
         try:
-            db_data = self._read_db()
-            
-            if username not in db_data:
-                return False
-            
-            # ค้นหาและลบ
-            db_data[username] = [
-                entry for entry in db_data[username]
-                if entry['id'] != analysis_id
-            ]
-            
-            self._write_db(db_data)
-            return True
+            return self.engine.delete(username, analysis_id)
             
         except Exception as e:
             print(f"Error deleting analysis: {e}")
@@ -159,12 +300,7 @@ class AnalysisDatabase:
             True ถ้าลบสำเร็จ
         """
         try:
-            db_data = self._read_db()
-            
-            if username in db_data:
-                db_data[username] = []
-            
-            self._write_db(db_data)
+            self.engine.clear_user(username)
             return True
             
         except Exception as e:
@@ -181,7 +317,7 @@ class AnalysisDatabase:
         Returns:
             Dictionary with statistics: total_analyses, last_analysis_date, avg_file_size, etc.
         """
-        history = self.get_user_history(username)
+        history = self.get_user_history(username, include_result=False)
         
         if not history:
             return {
@@ -208,15 +344,16 @@ class AnalysisDatabase:
         Returns:
             Dictionary with system-wide statistics
         """
-        db_data = self._read_db()
+        # นับจาก index ของ engine โดยไม่ต้องอ่านเนื้อหาผลการวิเคราะห์
+        counts = self.engine.user_counts()
         
-        total_users = len([u for u in db_data if len(db_data[u]) > 0])
-        total_analyses = sum([len(db_data[u]) for u in db_data])
+        total_users = len([u for u in counts if counts[u] > 0])
+        total_analyses = sum(counts.values())
         
         return {
             "total_users": total_users,
             "total_analyses": total_analyses,
-            "users": {u: len(db_data[u]) for u in db_data if len(db_data[u]) > 0}
+            "users": {u: counts[u] for u in counts if counts[u] > 0}
         }
 
 
@@ -3,15 +3,30 @@
 """
 SQLite database module for storing and retrieving project analysis history
 Uses SQLAlchemy ORM for better data management
+
+Engine profile (ใช้ร่วมกันทุก session ใน process ผ่าน get_sqlite_engine):
+- journal_mode=WAL: ผู้อ่านไม่ถูกบล็อกระหว่างเขียน (Streamlit หลาย session + API workers)
+- synchronous=NORMAL, mmap_size, busy_timeout
+- connection pool แทนการเปิดไฟล์ใหม่ทุกครั้ง
 """
 
 import json
 import os
+import sys
+import threading
+from collections import defaultdict
 from datetime import datetime
-from typing import List, Dict, Optional
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, func
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import create_engine, event, Column, Index, Integer, String, DateTime, Text, and_, func, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from database import decode_history_cursor, encode_history_cursor, normalize_entry
+
+# จำนวน record ต่อ transaction ของ bulk_insert
+BULK_BATCH_SIZE = 5000
 
 # Database base
 Base = declarative_base()
@@ -20,6 +35,8 @@ Base = declarative_base()
 class AnalysisRecord(Base):
     """โมเดล SQLAlchemy สำหรับเก็บข้อมูลการวิเคราะห์"""
     __tablename__ = "analyses"
+    # สำหรับแบ่งหน้าประวัติของผู้ใช้ตามเวลา (ORDER BY timestamp DESC, id DESC)
+    __table_args__ = (Index("idx_analyses_user_timestamp", "username", "timestamp", "id"),)
     
     id = Column(Integer, primary_key=True)
     username = Column(String(50), nullable=False, index=True)
@@ -40,6 +57,65 @@ class AnalysisRecord(Base):
         }
 
 
+class UserStats(Base):
+    """สถิติสะสมต่อผู้ใช้ อัพเดทใน transaction เดียวกับการบันทึก/ลบผลการวิเคราะห์"""
+    __tablename__ = "user_stats"
+    
+    username = Column(String(50), primary_key=True)
+    analysis_count = Column(Integer, default=0, nullable=False, index=True)
+    total_size_chars = Column(Integer, default=0, nullable=False)
+    last_timestamp = Column(DateTime, nullable=True)
+
+
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_sqlite_engine(db_file: str = "analysis.db") -> Engine:
+    """
+    คืน SQLAlchemy engine (พร้อม connection pool) ที่ใช้ร่วมกันภายใน process แยกตามไฟล์
+    
+    ตั้งค่าได้ด้วยตัวแปร SQLITE_POOL_SIZE, SQLITE_MMAP_MB, SQLITE_BUSY_TIMEOUT_MS
+    """
+    key = os.path.abspath(db_file)
+    with _engines_lock:
+        if key in _engines:
+            return _engines[key]
+        
+        busy_timeout_ms = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+        mmap_bytes = int(float(os.getenv("SQLITE_MMAP_MB", "256")) * 1024 * 1024)
+        engine = create_engine(
+            f"sqlite:///{db_file}",
+            poolclass=QueuePool,
+            pool_size=int(os.getenv("SQLITE_POOL_SIZE", "5")),
+            max_overflow=10,
+            connect_args={"check_same_thread": False, "timeout": busy_timeout_ms / 1000}
+        )
+        
+        @event.listens_for(engine, "connect")
+        def _set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA mmap_size={mmap_bytes}")
+            cursor.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.close()
+        
+        _engines[key] = engine
+        return engine
+
+
+def _parse_timestamp(value) -> datetime:
+    """แปลง timestamp จาก JSON (ISO หรือ "YYYY-MM-DD HH:MM:SS") ใช้เวลาปัจจุบันถ้าอ่านไม่ได้"""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return datetime.now()
+
+
 class AnalysisDatabaseSQLite:
     """SQLite ฐานข้อมูลสำหรับจัดการข้อมูลประวัติการวิเคราะห์"""
     
@@ -51,14 +127,158 @@ class AnalysisDatabaseSQLite:
             db_file: Path to SQLite database file
         """
         self.db_file = db_file
-        self.engine = create_engine(f"sqlite:///{db_file}")
+        self.engine = get_sqlite_engine(db_file)
         Base.metadata.create_all(self.engine)
+        # ฐานข้อมูลเดิมที่สร้างก่อนมี index
+        for index in AnalysisRecord.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
         self.SessionLocal = sessionmaker(bind=self.engine)
+        
+        # ฐานข้อมูลเดิมที่มีข้อมูลแต่ยังไม่มีตารางสถิติ
+        session = self.get_session()
+        try:
+            needs_rebuild = session.query(UserStats.username).first() is None and \
+                session.query(AnalysisRecord.id).first() is not None
+        finally:
+            session.close()
+        if needs_rebuild:
+            self.rebuild_statistics()
     
     def get_session(self) -> Session:
         """Get database session"""
         return self.SessionLocal()
     
+    @staticmethod
+    def _stats_added(session: Session, username: str, count: int, size_chars: int, last_timestamp: datetime):
+        """เพิ่มจำนวน/ขนาดรวม และเลื่อนเวลาล่าสุดของผู้ใช้ (upsert ใน session ที่ส่งมา)"""
+        stmt = sqlite_insert(UserStats).values(
+            username=username,
+            analysis_count=count,
+            total_size_chars=size_chars,
+            last_timestamp=last_timestamp
+        )
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=[UserStats.username],
+            set_={
+                "analysis_count": UserStats.analysis_count + stmt.excluded.analysis_count,
+                "total_size_chars": UserStats.total_size_chars + stmt.excluded.total_size_chars,
+                "last_timestamp": func.max(
+                    func.coalesce(UserStats.last_timestamp, stmt.excluded.last_timestamp),
+                    stmt.excluded.last_timestamp
+                )
+            }
+        ))
+    
+    @staticmethod
+    def _stats_removed(session: Session, username: str, count: int, size_chars: int):
+        """ลดจำนวน/ขนาดรวม แล้วหาเวลาล่าสุดใหม่จาก index (username, timestamp, id)"""
+        last_timestamp = session.query(func.max(AnalysisRecord.timestamp))\
+            .filter(AnalysisRecord.username == username)\
+            .scalar()
+        session.query(UserStats)\
+            .filter(UserStats.username == username)\
+            .update({
+                UserStats.analysis_count: UserStats.analysis_count - count,
+                UserStats.total_size_chars: UserStats.total_size_chars - size_chars,
+                UserStats.last_timestamp: last_timestamp
+            }, synchronize_session=False)
+    
+    def rebuild_statistics(self) -> int:
+        """
+        คำนวณตาราง user_stats ใหม่ทั้งหมดจากตาราง analyses
+        
+        Returns:
+            จำนวนผู้ใช้ในตารางสถิติ
+        """
+        session = self.get_session()
+        try:
+            session.query(UserStats).delete()
+            rows = session.query(
+                AnalysisRecord.username,
+                func.count(AnalysisRecord.id),
+                func.coalesce(func.sum(AnalysisRecord.file_size_chars), 0),
+                func.max(AnalysisRecord.timestamp)
+            ).group_by(AnalysisRecord.username).all()
+            session.add_all([
+                UserStats(username=user, analysis_count=count, total_size_chars=size, last_timestamp=last)
+                for user, count, size, last in rows
+            ])
+            session.commit()
+            return len(rows)
+        finally:
+            session.close()
+    
+    def bulk_insert(self, entries: Iterable[Dict], batch_size: int = BULK_BATCH_SIZE) -> Dict:
+        """
+        นำเข้าหลาย record ครั้งละ batch_size รายการต่อ transaction (executemany ด้วย statement เดียว)
+        
+        เก็บ timestamp เดิม และ id เดิมถ้าเป็นตัวเลขที่ยังไม่ถูกใช้
+        (id ใน history.json นับแยกต่อผู้ใช้ จึงอาจชนกัน record ที่ชนจะได้ id ใหม่)
+        
+        Args:
+            entries: record ที่มี username, file_name, result และอาจมี id, timestamp, file_size_chars
+            batch_size: จำนวน record ต่อ transaction
+        
+        Returns:
+            {"inserted": จำนวนที่นำเข้า, "renumbered": จำนวนที่ได้ id ใหม่}
+        """
+        table = AnalysisRecord.__table__
+        with self.engine.connect() as conn:
+            used_ids = set(conn.execute(table.select().with_only_columns(table.c.id)).scalars())
+        
+        inserted = 0
+        renumbered = 0
+        
+        def flush(rows: List[Dict]):
+            keep_id = [row for row in rows if "id" in row]
+            new_id = [row for row in rows if "id" not in row]
+            totals = defaultdict(lambda: [0, 0, None])
+            for row in rows:
+                total = totals[row["username"]]
+                total[0] += 1
+                total[1] += row["file_size_chars"]
+                total[2] = max(total[2] or row["timestamp"], row["timestamp"])
+            
+            session = self.get_session()
+            try:
+                if keep_id:
+                    session.execute(table.insert(), keep_id)
+                if new_id:
+                    session.execute(table.insert(), new_id)
+                for username, (count, size, last) in totals.items():
+                    self._stats_added(session, username, count, size, last)
+                session.commit()
+            finally:
+                session.close()
+        
+        batch: List[Dict] = []
+        for entry in entries:
+            result = entry.get("result") or ""
+            row = {
+                "username": entry["username"],
+                "file_name": entry.get("file_name") or "-",
+                "timestamp": _parse_timestamp(entry.get("timestamp")),
+                "file_size_chars": entry.get("file_size_chars") or len(result),
+                "result": result
+            }
+            entry_id = entry.get("id")
+            if isinstance(entry_id, int) and entry_id not in used_ids:
+                row["id"] = entry_id
+                used_ids.add(entry_id)
+            else:
+                renumbered += entry_id is not None or "legacy_id" in entry
+            batch.append(row)
+            
+            if len(batch) >= batch_size:
+                flush(batch)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            flush(batch)
+            inserted += len(batch)
+        
+        return {"inserted": inserted, "renumbered": renumbered}
+    
     def save_analysis(self, username: str, file_name: str, analysis_result: str) -> bool:
         """
         บันทึกผลการวิเคราะห์ลงฐานข้อมูล
@@ -77,11 +297,13 @@ class AnalysisDatabaseSQLite:
             record = AnalysisRecord(
                 username=username,
                 file_name=file_name,
+                timestamp=datetime.now(),
                 file_size_chars=len(analysis_result),
                 result=analysis_result
             )
             
             session.add(record)
+            self._stats_added(session, username, 1, record.file_size_chars, record.timestamp)
             session.commit()
             session.close()
             return True
@@ -126,6 +348,66 @@ class AnalysisDatabaseSQLite:
             print(f"❌ Error retrieving history: {e}")
             return []
     
+    def get_history_page(self,
+                         username: str,
+                         limit: Optional[int] = 50,
+                         cursor: Optional[str] = None,
+                         since: Optional[str] = None,
+                         include_result: bool = True) -> Dict:
+        """
+        ดึงประวัติทีละหน้า (จากใหม่ไปเก่า) ผ่าน index (username, timestamp, id)
+        
+        Args:
+            username: ชื่อผู้ใช้
+            limit: จำนวนรายการต่อหน้า (None = ทั้งหมด)
+            cursor: next_cursor จากหน้าก่อน (None = หน้าแรก)
+            since: timestamp ISO - เอาเฉพาะรายการที่ใหม่กว่านี้
+            include_result: False = ไม่อ่านคอลัมน์ result (metadata เท่านั้น)
+        
+        Returns:
+            {"items": [...], "next_cursor": str หรือ None}
+        
+        Raises:
+            ValueError ถ้า cursor ไม่ถูกต้อง
+        """
+        columns = [AnalysisRecord.id, AnalysisRecord.timestamp, AnalysisRecord.file_name, AnalysisRecord.file_size_chars]
+        if include_result:
+            columns.append(AnalysisRecord.result)
+        
+        session = self.get_session()
+        try:
+            query = session.query(*columns).filter(AnalysisRecord.username == username)
+            if cursor:
+                timestamp, analysis_id = decode_history_cursor(cursor)
+                timestamp = datetime.fromisoformat(timestamp)
+                query = query.filter(or_(
+                    AnalysisRecord.timestamp < timestamp,
+                    and_(AnalysisRecord.timestamp == timestamp, AnalysisRecord.id < analysis_id)
+                ))
+            if since:
+                query = query.filter(AnalysisRecord.timestamp > datetime.fromisoformat(since))
+            query = query.order_by(AnalysisRecord.timestamp.desc(), AnalysisRecord.id.desc())
+            rows = query.limit(limit + 1).all() if limit is not None else query.all()
+        finally:
+            session.close()
+        
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        items = []
+        for row in rows:
+            item = {
+                "id": row.id,
+                "timestamp": row.timestamp.isoformat(),
+                "file_name": row.file_name,
+                "file_size_chars": row.file_size_chars
+            }
+            if include_result:
+                item["result"] = row.result
+            items.append(item)
+        
+        next_cursor = encode_history_cursor(items[-1]["timestamp"], items[-1]["id"]) if has_more else None
+        return {"items": items, "next_cursor": next_cursor}
+    
     def get_analysis_by_id(self, username: str, analysis_id: int) -> Optional[Dict]:
         """ดึงผลการวิเคราะห์ครั้งใดครั้งหนึ่ง"""
         try:
@@ -148,9 +430,14 @@ class AnalysisDatabaseSQLite:
         try:
             session = self.get_session()
             
-            session.query(AnalysisRecord)\
+            record = session.query(AnalysisRecord.file_size_chars)\
                 .filter(AnalysisRecord.id == analysis_id, AnalysisRecord.username == username)\
-                .delete()
+                .first()
+            if record is not None:
+                session.query(AnalysisRecord)\
+                    .filter(AnalysisRecord.id == analysis_id, AnalysisRecord.username == username)\
+                    .delete()
+                self._stats_removed(session, username, 1, record.file_size_chars or 0)
             
             session.commit()
             session.close()
@@ -168,6 +455,9 @@ class AnalysisDatabaseSQLite:
             session.query(AnalysisRecord)\
                 .filter(AnalysisRecord.username == username)\
                 .delete()
+            session.query(UserStats)\
+                .filter(UserStats.username == username)\
+                .delete()
             
             session.commit()
             session.close()
@@ -178,37 +468,23 @@ class AnalysisDatabaseSQLite:
             return False
     
     def get_statistics(self, username: str) -> Dict:
-        """ดึงสถิติของผู้ใช้"""
+        """ดึงสถิติของผู้ใช้ (อ่านจากตาราง user_stats แถวเดียว)"""
         try:
             session = self.get_session()
+            stats = session.get(UserStats, username)
+            session.close()
             
-            count = session.query(func.count(AnalysisRecord.id))\
-                .filter(AnalysisRecord.username == username)\
-                .scalar()
-            
-            if count == 0:
-                session.close()
+            if stats is None or stats.analysis_count <= 0:
                 return {
                     "total_analyses": 0,
                     "last_analysis_date": "ยังไม่มีการวิเคราะห์",
                     "avg_file_size": 0
                 }
             
-            last_record = session.query(AnalysisRecord)\
-                .filter(AnalysisRecord.username == username)\
-                .order_by(AnalysisRecord.timestamp.desc())\
-                .first()
-            
-            avg_size = session.query(func.avg(AnalysisRecord.file_size_chars))\
-                .filter(AnalysisRecord.username == username)\
-                .scalar()
-            
-            session.close()
-            
             return {
-                "total_analyses": count,
-                "last_analysis_date": last_record.timestamp.isoformat() if last_record else None,
-                "avg_file_size": int(avg_size) if avg_size else 0
+                "total_analyses": stats.analysis_count,
+                "last_analysis_date": stats.last_timestamp.isoformat() if stats.last_timestamp else None,
+                "avg_file_size": int(stats.total_size_chars / stats.analysis_count)
             }
             
         except Exception as e:
@@ -216,28 +492,20 @@ class AnalysisDatabaseSQLite:
             return {}
     
     def get_all_statistics(self) -> Dict:
-        """ดึงสถิติระบบทั้งหมด"""
+        """ดึงสถิติระบบทั้งหมด (query เดียวบนตาราง user_stats)"""
         try:
             session = self.get_session()
             
-            total_users = session.query(func.count(func.distinct(AnalysisRecord.username))).scalar()
-            total_analyses = session.query(func.count(AnalysisRecord.id)).scalar()
-            
-            user_counts = {}
-            users = session.query(func.distinct(AnalysisRecord.username)).all()
-            
-            for (user,) in users:
-                count = session.query(func.count(AnalysisRecord.id))\
-                    .filter(AnalysisRecord.username == user)\
-                    .scalar()
-                if count > 0:
-                    user_counts[user] = count
+            rows = session.query(UserStats.username, UserStats.analysis_count)\
+                .filter(UserStats.analysis_count > 0)\
+                .all()
             
             session.close()
             
+            user_counts = {user: count for user, count in rows}
             return {
-                "total_users": total_users or 0,
-                "total_analyses": total_analyses or 0,
+                "total_users": len(user_counts),
+                "total_analyses": sum(user_counts.values()),
                 "users": user_counts
             }
             
@@ -246,13 +514,17 @@ class AnalysisDatabaseSQLite:
             return {}
     
     @staticmethod
-    def migrate_from_json(json_file: str, sqlite_db: "AnalysisDatabaseSQLite") -> bool:
+    def migrate_from_json(json_file: str, sqlite_db: "AnalysisDatabaseSQLite",
+                          batch_size: int = BULK_BATCH_SIZE) -> bool:
         """
         Migrate data from JSON file to SQLite
         
+        ใช้ bulk_insert: เก็บ timestamp และ id เดิม และรองรับรูปแบบ {"analyses": [...]} เดิม
+        
         Args:
             json_file: Path to JSON database file
             sqlite_db: SQLite database instance
+            batch_size: จำนวน record ต่อ transaction
         
         Returns:
             True if migration successful
@@ -265,26 +537,29 @@ class AnalysisDatabaseSQLite:
             with open(json_file, 'r', encoding='utf-8') as f:
                 json_data = json.load(f)
             
-            migrated_count = 0
-            for username, analyses in json_data.items():
-                for entry in analyses:
-                    sqlite_db.save_analysis(
-                        username=username,
-                        file_name=entry['file_name'],
-                        analysis_result=entry['result']
-                    )
-                    migrated_count += 1
+            entries = (
+                normalize_entry(key, raw)[1]
+                for key, records in json_data.items() if isinstance(records, list)
+                for raw in records if isinstance(raw, dict)
+            )
+            summary = sqlite_db.bulk_insert(entries, batch_size)
             
-            print(f"✅ Migrated {migrated_count} records from JSON to SQLite")
+            print(f"✅ Migrated {summary['inserted']} records from JSON to SQLite "
+                  f"({summary['renumbered']} received new ids)")
             return True
             
         except Exception as e:
             print(f"❌ Migration error: {e}")
             return False
 
-
 # ตัวอย่างการใช้งาน
 if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "--rebuild-stats":
+        target = sys.argv[2] if len(sys.argv) >= 3 else "analysis.db"
+        users = AnalysisDatabaseSQLite(target).rebuild_statistics()
+        print(f"✅ Rebuilt statistics for {users} users in {target}")
+        sys.exit(0)
+    
     print("SQLite Database Module")
     print("-" * 50)
     
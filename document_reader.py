@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Document reader - อ่านข้อความจาก PDF / Word แบบทีละหน้า
+
+- อ่านหน้าแบบ lazy (generator) และหยุดเมื่อได้ข้อความครบงบของ prompt
+- รวมข้อความด้วย list + join (ไม่ต่อ string ซ้ำใน loop)
+- ไฟล์ PDF ขนาดใหญ่กระจายการอ่านหน้าไปยัง process pool ได้
+- เก็บเวลาที่ใช้อ่านแต่ละหน้า
+
+Usage:
+    python document_reader.py thesis.pdf [max_chars] [workers]
+"""
+
+import io
+import os
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Dict, Iterator, List, Optional, Union
+
+# ข้อความของหน้าหนึ่งหน้า (DOCX ไม่มีหน้าจริง จึงนับทุก DOCX_PARAGRAPHS_PER_PAGE ย่อหน้าเป็นหนึ่งหน้า)
+PageText = namedtuple("PageText", ["number", "text", "seconds"])
+
+DOCX_PARAGRAPHS_PER_PAGE = 30
+
+# จำนวนหน้าขั้นต่ำที่จะใช้ process pool และจำนวนหน้าที่ส่งให้ worker ต่อครั้ง
+PARALLEL_MIN_PAGES = 40
+PARALLEL_CHUNK_PAGES = 8
+
+Source = Union[bytes, IO[bytes], str]
+
+
+class ExtractionResult:
+    """ผลการอ่านเอกสาร"""
+
+    def __init__(self, text: str, num_pages: int, pages: List[PageText], truncated: bool, seconds: float):
+        self.text = text
+        self.num_pages = num_pages
+        self.pages_read = len(pages)
+        self.truncated = truncated
+        self.is_empty = not any(page.text.strip() for page in pages)
+        self.seconds = seconds
+        self.page_timings = [(page.number, page.seconds) for page in pages]
+
+    def slowest_pages(self, count: int = 3) -> List[tuple]:
+        """หน้าที่ใช้เวลาอ่านนานที่สุด [(หน้า, วินาที)]"""
+        return sorted(self.page_timings, key=lambda item: item[1], reverse=True)[:count]
+
+    def summary(self) -> str:
+        """ข้อความสรุปสำหรับแสดงผล"""
+        text = f"อ่าน {self.pages_read}/{self.num_pages} หน้า ใน {self.seconds:.2f} วินาที"
+        slowest = self.slowest_pages(1)
+        if slowest:
+            text += f" (ช้าสุด: หน้า {slowest[0][0]}, {slowest[0][1]:.2f} วินาที)"
+        if self.truncated:
+            text += " - หยุดอ่านเมื่อครบความยาวที่ส่งให้ AI"
+        return text
+
+
+def _read_bytes(source: Source) -> bytes:
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read()
+    source.seek(0)
+    return source.read()
+
+
+def _open_stream(source: Source):
+    if isinstance(source, bytes):
+        return io.BytesIO(source)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+# ========== PDF ==========
+
+def count_pdf_pages(source: Source) -> int:
+    """จำนวนหน้าของ PDF (ไม่อ่านข้อความ)"""
+    import PyPDF2
+    return len(PyPDF2.PdfReader(_open_stream(source)).pages)
+
+
+def iter_pdf_pages(source: Source, reader=None) -> Iterator[PageText]:
+    """อ่าน PDF ทีละหน้าตามลำดับ (หน้าเริ่มที่ 1)"""
+    if reader is None:
+        import PyPDF2
+        reader = PyPDF2.PdfReader(_open_stream(source))
+    for index in range(len(reader.pages)):
+        began = time.perf_counter()
+        text = reader.pages[index].extract_text() or ""
+        yield PageText(index + 1, text, time.perf_counter() - began)
+
+
+# reader ที่เปิดค้างไว้ใน worker process (เปิดไฟล์ครั้งเดียวต่อ worker)
+_worker_readers: Dict[str, object] = {}
+
+
+def _extract_pdf_range(path: str, start: int, stop: int) -> List[PageText]:
+    """อ่านหน้า [start, stop) ใน worker process"""
+    import PyPDF2
+    reader = _worker_readers.get(path)
+    if reader is None:
+        reader = _worker_readers[path] = PyPDF2.PdfReader(path)
+    pages = []
+    for index in range(start, min(stop, len(reader.pages))):
+        began = time.perf_counter()
+        text = reader.pages[index].extract_text() or ""
+        pages.append(PageText(index + 1, text, time.perf_counter() - began))
+    return pages
+
+
+def iter_pdf_pages_parallel(source: Source, workers: int, num_pages: Optional[int] = None) -> Iterator[PageText]:
+    """
+    อ่าน PDF ด้วย process pool แต่ยังคืนหน้าตามลำดับ
+
+    ส่งงานล่วงหน้าไม่เกิน 2 ช่วงต่อ worker ผู้เรียกจึงหยุดอ่านกลางทางได้โดยไม่เสียงานมาก
+    """
+    if num_pages is None:
+        num_pages = count_pdf_pages(source)
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_read_bytes(source))
+
+        ranges = iter(range(0, num_pages, PARALLEL_CHUNK_PAGES))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = []
+            for start in ranges:
+                pending.append(pool.submit(_extract_pdf_range, path, start, start + PARALLEL_CHUNK_PAGES))
+                if len(pending) >= workers * 2:
+                    break
+            try:
+                while pending:
+                    pages = pending.pop(0).result()
+                    start = next(ranges, None)
+                    if start is not None:
+                        pending.append(pool.submit(_extract_pdf_range, path, start, start + PARALLEL_CHUNK_PAGES))
+                    yield from pages
+            finally:
+                for future in pending:
+                    future.cancel()
+    finally:
+        os.remove(path)
+
+
+# ========== DOCX ==========
+
+def iter_docx_pages(source: Source, paragraphs=None) -> Iterator[PageText]:
+    """อ่าน Word ทีละกลุ่มย่อหน้า (DOCX_PARAGRAPHS_PER_PAGE ย่อหน้าต่อหน้า)"""
+    began = time.perf_counter()
+    if paragraphs is None:
+        from docx import Document
+        paragraphs = Document(_open_stream(source)).paragraphs
+    for index in range(0, max(len(paragraphs), 1), DOCX_PARAGRAPHS_PER_PAGE):
+        text = "\n".join(para.text for para in paragraphs[index:index + DOCX_PARAGRAPHS_PER_PAGE])
+        yield PageText(index // DOCX_PARAGRAPHS_PER_PAGE + 1, text, time.perf_counter() - began)
+        began = time.perf_counter()
+
+
+# ========== PUBLIC API ==========
+
+def extract_text(source: Source,
+                 file_name: str,
+                 max_chars: Optional[int] = None,
+                 page_headers: bool = False,
+                 workers: Optional[int] = None) -> ExtractionResult:
+    """
+    อ่านข้อความจากไฟล์ PDF / Word / ข้อความธรรมดา
+
+    Args:
+        source: bytes, file-like object (เช่น UploadedFile ของ Streamlit) หรือ path
+        file_name: ชื่อไฟล์ (ใช้นามสกุลเลือกวิธีอ่าน)
+        max_chars: หยุดอ่านเมื่อได้ข้อความอย่างน้อยเท่านี้ (None = อ่านทั้งไฟล์)
+        page_headers: ใส่หัว "=== หน้า N ===" ก่อนข้อความแต่ละหน้า
+        workers: จำนวน process สำหรับ PDF ที่มีหน้ามาก
+                 (default: ตัวแปร EXTRACT_WORKERS, 0/1 = อ่านใน process นี้)
+
+    Returns:
+        ExtractionResult
+    """
+    began = time.perf_counter()
+    extension = os.path.splitext(file_name)[1].lower()
+    if workers is None:
+        workers = int(os.getenv("EXTRACT_WORKERS", "0"))
+
+    if extension == ".pdf":
+        import PyPDF2
+        reader = PyPDF2.PdfReader(_open_stream(source))
+        num_pages = len(reader.pages)
+        if workers > 1 and num_pages >= PARALLEL_MIN_PAGES:
+            pages_iter = iter_pdf_pages_parallel(source, workers, num_pages)
+        else:
+            pages_iter = iter_pdf_pages(source, reader)
+    elif extension == ".docx":
+        from docx import Document
+        paragraphs = Document(_open_stream(source)).paragraphs
+        num_pages = len(paragraphs) // DOCX_PARAGRAPHS_PER_PAGE + 1
+        pages_iter = iter_docx_pages(source, paragraphs)
+    else:
+        text = _read_bytes(source).decode("utf-8", errors="replace")
+        pages_iter = iter([PageText(1, text, 0.0)])
+        num_pages = 1
+
+    parts: List[str] = []
+    pages: List[PageText] = []
+    length = 0
+    truncated = False
+    try:
+        for page in pages_iter:
+            part = f"\n=== หน้า {page.number} ===\n{page.text}\n" if page_headers else page.text
+            parts.append(part)
+            pages.append(page)
+            length += len(part)
+            if max_chars is not None and length >= max_chars:
+                truncated = page.number < num_pages
+                break
+    finally:
+        if hasattr(pages_iter, "close"):
+            pages_iter.close()
+
+    separator = "" if page_headers else "\n"
+    return ExtractionResult(separator.join(parts), num_pages, pages, truncated, time.perf_counter() - began)
+
+
+if __name__ == "__main__":
+    # ตัวอย่างการใช้งาน
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(0)
+    path = sys.argv[1]
+    budget = int(sys.argv[2]) if len(sys.argv) >= 3 else None
+    pool_size = int(sys.argv[3]) if len(sys.argv) >= 4 else 0
+    result = extract_text(path, path, max_chars=budget, workers=pool_size)
+    print(f"✅ {result.summary()}")
+    print(f"📝 {len(result.text):,} ตัวอักษร")
+    for number, seconds in result.slowest_pages(5):
+        print(f"   หน้า {number}: {seconds * 1000:.1f} ms")
@@ -9,6 +9,7 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 import os
+import threading
 
 
 class EmailNotifier:
@@ -211,6 +212,19 @@ class EmailNotifier:
             return False
 
 
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_email_notifier() -> EmailNotifier:
+    """คืน EmailNotifier ที่ใช้ร่วมกันภายใน process (อ่านค่าจาก environment ครั้งเดียว)"""
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = EmailNotifier()
+        return _notifier
+
+
 # ตัวอย่างการใช้งาน
 if __name__ == "__main__":
     print("Email Notifier Module")
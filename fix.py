@@ -6,7 +6,7 @@ print("🔧 กำลังเริ่มกระบวนการซ่อ
 print(f"📍 กำลังติดตั้งลงที่: {sys.executable}")
 
 # รายชื่อเครื่องมือที่ต้องใช้
-libraries = ["google-generativeai", "streamlit", "PyPDF2", "python-docx"]
+libraries = ["google-generativeai==0.8.5", "streamlit", "PyPDF2", "python-docx"]
 
 # วนลูปติดตั้งทีละตัว แบบระบุพิกัดแม่นยำ
 for lib in libraries:
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Async Gemini client สำหรับ api_server
+
+- ใช้ GenerativeModel ซ้ำ (model pool ต่อชื่อ model และ API key) แทนการสร้างใหม่ทุก request
+- จำกัดจำนวน request ที่เรียก Gemini พร้อมกันด้วย semaphore
+- timeout ต่อการเรียกแต่ละครั้ง
+- เลือก model ต่อคำขอผ่าน model_router (fallback ตามลำดับ, circuit breaker และ hedged request เมื่อเกิน p95)
+- โควต้าต่อนาทีของ API key ผ่าน rate_limiter (เข้าคิวแทน error, รอตาม retry-after)
+- กระจายการเรียกไปหลาย API key ผ่าน api_key_pool (ไม่ใช้ genai.configure แบบ global)
+- streaming (stream) ส่งข้อความทีละส่วนทันทีที่ model ตอบ
+- prompt เดียวกันที่กำลังเรียกอยู่ใช้ผลร่วมกัน (singleflight) ไม่เรียก Gemini ซ้ำ
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+from typing import AsyncIterable, AsyncIterator, Awaitable, Dict, List, Optional, Sequence
+
+import google.generativeai as genai
+
+from api_key_pool import chunk_text, get_api_key_pool, is_key_error
+from model_router import get_model_router
+from prompt_builder import estimate_tokens
+from singleflight import flight_key, get_singleflight
+
+# ลำดับ model ที่ลองเรียก (ตัวแรกคือหลัก ที่เหลือคือ fallback)
+DEFAULT_MODELS = ("gemini-1.5-flash", "gemini-pro")
+
+
+class GeminiClient:
+    """Client แบบ async ที่เรียก Gemini โดยไม่บล็อก event loop"""
+
+    def __init__(self,
+                 models: Sequence[str] = DEFAULT_MODELS,
+                 max_concurrency: int = 4,
+                 timeout: float = 120.0,
+                 api_key: Optional[str] = None):
+        """
+        Args:
+            models: ชื่อ model ตามลำดับที่จะลอง (fallback/hedge)
+            max_concurrency: จำนวนการเรียก Gemini พร้อมกันสูงสุด
+            timeout: เวลาสูงสุด (วินาที) ต่อการเรียกแต่ละ model
+            api_key: ใช้ API key นี้เท่านั้น (default: ทุก key ใน api_key_pool)
+        """
+        self.models: List[str] = list(models)
+        self.router = get_model_router(self.models)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+        self.key_pool = get_api_key_pool()
+        self.api_keys: Optional[List[str]] = [api_key] if api_key else None
+
+        # loop ที่ปิดแล้ว (เช่น asyncio.run ต่อครั้งใน Streamlit) ถูกลบออกเองพร้อม semaphore ของมัน
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+
+    def get_model(self, name: str, api_key: str) -> genai.GenerativeModel:
+        """คืน GenerativeModel ของ key นี้จาก pool (สร้างครั้งแรกที่ใช้)"""
+        return self.key_pool.get_model(name, api_key, asynchronous=True)
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # semaphore ผูกกับ event loop จึงแยกตาม loop ที่เรียก (worker ของ job_queue ใช้ loop เดียวต่อ process
+        # จำนวนการเรียกพร้อมกันจึงจำกัดทั้ง process)
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    async def _call_model(self, name: str, prompt: str, api_key: str) -> str:
+        response = await self.get_model(name, api_key).generate_content_async(prompt)
+        return response.text
+
+    async def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        """
+        สร้างคำตอบจาก prompt โดยลอง model ตามลำดับของ router จนกว่าจะสำเร็จ
+
+        Args:
+            prompt: ข้อความ prompt
+            timeout: timeout ต่อ model (default: ค่าของ client)
+
+        Returns:
+            ข้อความคำตอบจาก model
+
+        Raises:
+            RateLimitTimeout ถ้ารอคิวโควต้านานเกินกำหนด
+            NoApiKeyError ถ้าไม่มี API key ที่ใช้ได้
+            asyncio.TimeoutError หรือ error สุดท้าย ถ้าทุก model ล้มเหลว
+        """
+        # คำขอ prompt เดียวกันที่มาระหว่างนี้ (เช่นไฟล์ template เดียวกัน) รอผลของการเรียกนี้
+        return await get_singleflight().do_async(
+            self._flight_key("generate", prompt), lambda: self._generate(prompt, timeout)
+        )
+
+    def _flight_key(self, kind: str, prompt: str) -> str:
+        return flight_key(kind, ",".join(self.models), ",".join(self.api_keys or ()), prompt)
+
+    async def _generate(self, prompt: str, timeout: Optional[float]) -> str:
+        timeout = timeout or self.timeout
+        tokens = estimate_tokens(prompt)
+
+        async with self._semaphore():
+            # pool เลือก key และรอคิวโควต้าก่อน แล้ว router จึงแข่ง model ด้วย key นั้น
+            # (timeout และ latency ของ model นับเฉพาะการเรียก model ไม่รวมเวลารอคิว)
+            # hedge/fallback หักโควต้าของ key เดียวกันเพิ่ม
+            return await self.key_pool.run_async(
+                lambda api_key: self.router.run(
+                    lambda name: asyncio.wait_for(self._call_model(name, prompt, api_key), timeout),
+                    is_key_error,
+                    lambda hedge: self.key_pool.charge_async(api_key, tokens, wait=not hedge)
+                ),
+                tokens,
+                self.api_keys
+            )
+
+    async def _open_stream(self, name: str, prompt: str, api_key: str, timeout: float) -> AsyncIterator:
+        response = await asyncio.wait_for(
+            self.get_model(name, api_key).generate_content_async(prompt, stream=True), timeout
+        )
+        return _chunks_with_timeout(response, timeout)
+
+    async def stream(self, prompt: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        สร้างคำตอบแบบ streaming คืนข้อความทีละส่วนทันทีที่ model ส่งมา
+
+        fallback/hedge ไป model ถัดไปได้เฉพาะก่อนส่งข้อความส่วนแรก (ส่งไปแล้วเปลี่ยน model กลางทางไม่ได้)
+
+        Args:
+            prompt: ข้อความ prompt
+            timeout: เวลารอสูงสุดระหว่าง chunk (default: ค่าของ client)
+
+        Raises:
+            เหมือน generate()
+        """
+        chunks = get_singleflight().stream_async(
+            self._flight_key("stream", prompt), lambda: self._stream(prompt, timeout)
+        )
+        async for text in chunks:
+            yield text
+
+    async def _stream(self, prompt: str, timeout: Optional[float]) -> AsyncIterator[str]:
+        timeout = timeout or self.timeout
+        tokens = estimate_tokens(prompt)
+
+        async def open_routed(api_key: str) -> AsyncIterable:
+            return self.router.stream_async(
+                lambda name: _opened(self._open_stream(name, prompt, api_key, timeout)),
+                is_key_error,
+                lambda hedge: self.key_pool.charge_async(api_key, tokens, wait=not hedge)
+            )
+
+        async with self._semaphore():
+            chunks = self.key_pool.stream_async(open_routed, tokens, self.api_keys)
+            async for chunk in chunks:
+                text = chunk_text(chunk)
+                if text:
+                    yield text
+
+
+async def _opened(stream: Awaitable[AsyncIterable]) -> AsyncIterator:
+    """async iterable จาก coroutine ที่เปิด stream (ให้ router เริ่มนับเวลาถึง chunk แรกตั้งแต่เปิด)"""
+    async for chunk in await stream:
+        yield chunk
+
+
+async def _chunks_with_timeout(response, timeout: float) -> AsyncIterator:
+    """วน chunk ของ response โดยจำกัดเวลารอแต่ละ chunk"""
+    iterator = response.__aiter__()
+    while True:
+        try:
+            chunk = await asyncio.wait_for(iterator.__anext__(), timeout)
+        except StopAsyncIteration:
+            return
+        yield chunk
+
+
+_client: Optional[GeminiClient] = None
+_client_lock = threading.Lock()
+
+
+def get_gemini_client() -> GeminiClient:
+    """
+    คืน GeminiClient ที่ใช้ร่วมกันภายใน process
+
+    ตั้งค่าได้ด้วยตัวแปร GEMINI_MODELS (คั่นด้วย comma), GEMINI_MAX_CONCURRENCY, GEMINI_TIMEOUT
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            models = os.getenv("GEMINI_MODELS")
+            _client = GeminiClient(
+                models=[m.strip() for m in models.split(",") if m.strip()] if models else DEFAULT_MODELS,
+                max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "4")),
+                timeout=float(os.getenv("GEMINI_TIMEOUT", "120"))
+            )
+        return _client
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Durable job queue (SQLite) สำหรับงานวิเคราะห์เบื้องหลัง
+
+- enqueue งานพร้อม priority (ค่ามากทำก่อน)
+- worker หลาย process ดึงงานผ่าน transaction (BEGIN IMMEDIATE) จึงไม่มีงานซ้ำ
+- งานล้มเหลวจะลองใหม่แบบ exponential backoff จนครบ max_attempts
+  (ยกเว้น PermanentJobError เช่น URL ไม่ปลอดภัย ซึ่งลองใหม่ก็ไม่สำเร็จ)
+- worker ต่อ lease ของงานเป็นระยะระหว่างทำ งานที่ worker ตาย (lease หมดอายุ) จะถูกนำกลับมาทำใหม่
+  หรือถูกบันทึกว่าล้มเหลวถ้าครบ max_attempts แล้ว
+- ดูสถานะงานได้ผ่าน get() (api_server: GET /api/v1/jobs/{id})
+
+Usage:
+    python job_queue.py --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# สถานะของงาน
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class PermanentJobError(Exception):
+    """งานล้มเหลวด้วยเหตุที่ลองใหม่ก็ไม่สำเร็จ (ข้อมูลของงานไม่ถูกต้อง) จึงไม่ต้องลองใหม่"""
+
+
+class JobQueue:
+    """คิวงานบนไฟล์ SQLite ที่ใช้ร่วมกันได้หลาย process"""
+
+    def __init__(self,
+                 db_file: str = "jobs.db",
+                 lease_seconds: float = 600.0,
+                 backoff_seconds: float = 5.0):
+        """
+        Args:
+            db_file: ไฟล์ SQLite ของคิว
+            lease_seconds: เวลาที่ worker ถืองานได้โดยไม่ต่อ lease ก่อนถือว่า worker ตาย
+            backoff_seconds: เวลารอก่อนลองใหม่ครั้งแรก (ครั้งต่อไปเพิ่มเป็น 2 เท่า)
+        """
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        self.backoff_seconds = backoff_seconds
+        self._initialize_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _initialize_database(self):
+        """สร้างตารางถ้ายังไม่มี"""
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 3,
+                    run_after REAL NOT NULL,
+                    lease_until REAL,
+                    worker TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, priority DESC, id)")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def enqueue(self, kind: str, payload: Dict, priority: int = 0, max_attempts: int = 3) -> int:
+        """
+        เพิ่มงานเข้าคิว
+
+        Args:
+            kind: ชนิดงาน (ชื่อ handler)
+            payload: ข้อมูลของงาน (ต้อง serialize เป็น JSON ได้)
+            priority: ความสำคัญ (ค่ามากทำก่อน)
+            max_attempts: จำนวนครั้งสูงสุดที่จะลองทำ
+
+        Returns:
+            id ของงาน
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO jobs(kind, payload, priority, status, max_attempts, run_after, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), priority, STATUS_QUEUED,
+                 max_attempts, now, now, now)
+            )
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        """
+        ดึงงานถัดไปที่พร้อมทำ (priority สูงสุด, เก่าสุดก่อน) และจองไว้ให้ worker
+
+        งานที่ lease หมดอายุ (worker ตาย) และครบ max_attempts แล้วจะถูกบันทึกว่าล้มเหลวแทนการทำซ้ำ
+
+        Returns:
+            งาน หรือ None ถ้าไม่มีงานพร้อม
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ?"
+                " WHERE status = ? AND lease_until < ? AND attempts >= max_attempts",
+                (STATUS_FAILED, "Worker lease expired on the last attempt", now, STATUS_RUNNING, now)
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs"
+                " WHERE (status = ? AND run_after <= ?) OR (status = ? AND lease_until < ?)"
+                " ORDER BY priority DESC, id LIMIT 1",
+                (STATUS_QUEUED, now, STATUS_RUNNING, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, worker = ?, updated_at = ?"
+                " WHERE id = ?",
+                (STATUS_RUNNING, now + self.lease_seconds, worker, now, row["id"])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        job = self._to_dict(row)
+        job["status"] = STATUS_RUNNING
+        job["attempts"] += 1
+        return job
+
+    def renew(self, job_id: int, worker: str) -> bool:
+        """
+        ต่อ lease ของงานที่ worker กำลังทำอีก lease_seconds
+
+        Returns:
+            False ถ้างานไม่ได้อยู่กับ worker นี้แล้ว (เช่น lease หมดอายุและถูก worker อื่นนำไปทำ)
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND status = ? AND worker = ?",
+                (now + self.lease_seconds, now, job_id, STATUS_RUNNING, worker)
+            )
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def complete(self, job_id: int, result: Dict):
+        """บันทึกว่างานเสร็จพร้อมผลลัพธ์"""
+        self._update(job_id, status=STATUS_DONE, result=json.dumps(result, ensure_ascii=False),
+                     error=None, lease_until=None)
+
+    def fail(self, job_id: int, error: str, permanent: bool = False):
+        """
+        บันทึกว่างานล้มเหลว: ถ้ายังไม่ครบ max_attempts จะกลับเข้าคิวพร้อม backoff
+
+        Args:
+            job_id: id ของงาน
+            error: ข้อความ error
+            permanent: True = ไม่ลองใหม่ (ลองใหม่ก็ไม่สำเร็จ)
+        """
+        job = self.get(job_id)
+        if job is None:
+            return
+        if not permanent and job["attempts"] < job["max_attempts"]:
+            delay = self.backoff_seconds * (2 ** (job["attempts"] - 1))
+            self._update(job_id, status=STATUS_QUEUED, error=error,
+                         run_after=time.time() + delay, lease_until=None)
+        else:
+            self._update(job_id, status=STATUS_FAILED, error=error, lease_until=None)
+
+    def _update(self, job_id: int, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        conn = self._connect()
+        try:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+        finally:
+            conn.close()
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        """ดึงงานตาม id"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return self._to_dict(row) if row else None
+
+    def get_statistics(self) -> Dict[str, int]:
+        """จำนวนงานแยกตามสถานะ"""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        finally:
+            conn.close()
+        return {status: count for status, count in rows}
+
+
+# ========== HANDLERS ==========
+
+_worker_loops = threading.local()
+
+
+def run_async(coro):
+    """
+    รัน coroutine บน event loop เดียวของ worker (สร้างครั้งแรกที่ใช้ แล้วใช้ซ้ำทุกงาน)
+
+    asyncio.run() ต่องานจะสร้างและปิด loop ทุกครั้ง: semaphore ของ gemini_client ไม่จำกัดข้ามงาน
+    และ async client ของ genai ที่ api_key_pool เก็บไว้จะผูกกับ loop ที่ปิดไปแล้ว
+    """
+    loop = getattr(_worker_loops, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _worker_loops.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    return loop.run_until_complete(coro)
+
+
+# ชนิดงาน -> ฟังก์ชันที่รับ payload แล้วคืนผลลัพธ์ (dict)
+HANDLERS: Dict[str, Callable[[Dict], Dict]] = {}
+
+
+def register_handler(kind: str):
+    """Decorator ลงทะเบียน handler ของงานชนิดหนึ่ง"""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+@register_handler("analyze")
+def handle_analyze(payload: Dict) -> Dict:
+    """วิเคราะห์ข้อความที่ส่งมากับงาน"""
+    from analysis_service import analyze_document
+
+    saved = run_async(analyze_document(payload["username"], payload["file_name"], payload["file_content"]))
+    if saved is None:
+        raise RuntimeError("Failed to save analysis")
+    return {"analysis_id": saved["id"], "username": payload["username"], "timestamp": saved["timestamp"]}
+
+
+@register_handler("lms_submission")
+def handle_lms_submission(payload: Dict) -> Dict:
+    """ดาวน์โหลดไฟล์งานที่ส่งจาก LMS แล้ววิเคราะห์"""
+    from analysis_service import analyze_document, extract_text
+    from lms_download import UnsafeUrlError, download_file
+
+    file_name = os.path.basename(payload["file_url"].split("?")[0]) or "submission"
+    try:
+        data = download_file(payload["file_url"])
+    except UnsafeUrlError as e:
+        raise PermanentJobError(str(e)) from e
+    text = extract_text(data, file_name)
+    if not text.strip():
+        raise PermanentJobError(f"No text extracted from {payload['file_url']}")
+
+    saved = run_async(analyze_document(
+        payload["student_id"], file_name, text,
+        lms=payload.get("lms"),
+        course_id=payload.get("course_id"),
+        assignment_id=payload.get("assignment_id"),
+        student_name=payload.get("student_name")
+    ))
+    if saved is None:
+        raise RuntimeError("Failed to save analysis")
+    return {"analysis_id": saved["id"], "username": payload["student_id"], "timestamp": saved["timestamp"]}
+
+
+# ========== WORKERS ==========
+
+def _keep_lease(queue: JobQueue, job_id: int, worker: str, done: threading.Event):
+    """ต่อ lease ของงานทุก 1/3 ของ lease_seconds จนกว่างานจะเสร็จ"""
+    while not done.wait(queue.lease_seconds / 3):
+        try:
+            if not queue.renew(job_id, worker):
+                print(f"Error renewing lease of job {job_id}: job is no longer held by {worker}")
+                return
+        except sqlite3.Error as e:
+            print(f"Error renewing lease of job {job_id}: {e}")
+
+def run_worker(db_file: Optional[str] = None,
+               poll_interval: float = 1.0,
+               stop_event=None,
+               handlers: Optional[Dict[str, Callable[[Dict], Dict]]] = None):
+    """
+    วนดึงงานจากคิวและทำจนกว่า stop_event จะถูกตั้ง
+
+    Args:
+        db_file: ไฟล์คิว (default: ตัวแปร JOB_QUEUE_FILE หรือ jobs.db)
+        poll_interval: เวลารอ (วินาที) เมื่อคิวว่าง
+        stop_event: threading/multiprocessing Event สำหรับหยุด worker
+        handlers: handler ที่ใช้ (default: HANDLERS)
+    """
+    queue = get_job_queue(db_file)
+    handlers = handlers or HANDLERS
+    worker = f"{os.getpid()}:{threading.get_ident()}"
+
+    while stop_event is None or not stop_event.is_set():
+        try:
+            job = queue.claim(worker)
+        except sqlite3.Error as e:
+            print(f"Error claiming job: {e}")
+            job = None
+        if job is None:
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+
+        handler = handlers.get(job["kind"])
+        # งานที่ใช้เวลานานกว่า lease_seconds ต้องไม่ถูก worker อื่นนำไปทำซ้ำ
+        done = threading.Event()
+        keeper = threading.Thread(target=_keep_lease, args=(queue, job["id"], worker, done),
+                                  name=f"job-lease-{job['id']}", daemon=True)
+        keeper.start()
+        try:
+            try:
+                if handler is None:
+                    raise PermanentJobError(f"Unknown job kind: {job['kind']}")
+                result = handler(job["payload"])
+            finally:
+                done.set()
+                keeper.join()
+            queue.complete(job["id"], result)
+        except Exception as e:
+            print(f"Error running job {job['id']} ({job['kind']}): {e}")
+            queue.fail(job["id"], str(e), permanent=isinstance(e, PermanentJobError))
+
+    loop = getattr(_worker_loops, "loop", None)
+    if loop is not None and not loop.is_closed():
+        loop.close()
+
+
+def start_workers(count: int, db_file: Optional[str] = None) -> tuple:
+    """
+    เริ่ม worker process
+
+    Returns:
+        (processes, stop_event) สำหรับ stop_workers()
+    """
+    stop_event = multiprocessing.Event()
+    processes: List[multiprocessing.Process] = []
+    for number in range(count):
+        process = multiprocessing.Process(
+            target=run_worker,
+            kwargs={"db_file": db_file, "stop_event": stop_event},
+            name=f"job-worker-{number + 1}",
+            daemon=True
+        )
+        process.start()
+        processes.append(process)
+    return processes, stop_event
+
+
+def stop_workers(processes: List[multiprocessing.Process], stop_event, timeout: float = 10.0):
+    """หยุด worker (งานที่กำลังทำอยู่จะทำจนเสร็จก่อน)"""
+    stop_event.set()
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+
+
+_queues: Dict[str, JobQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_job_queue(db_file: Optional[str] = None) -> JobQueue:
+    """คืน JobQueue ที่ใช้ร่วมกันภายใน process (default: ตัวแปร JOB_QUEUE_FILE หรือ jobs.db)"""
+    db_file = db_file or os.getenv("JOB_QUEUE_FILE", "jobs.db")
+    key = os.path.abspath(db_file)
+    with _queues_lock:
+        if key not in _queues:
+            _queues[key] = JobQueue(db_file)
+        return _queues[key]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run analysis job workers")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("JOB_WORKERS", "2")))
+    parser.add_argument("--db", default=None, help="ไฟล์คิว (default: JOB_QUEUE_FILE หรือ jobs.db)")
+    args = parser.parse_args()
+
+    workers, stop = start_workers(args.workers, args.db)
+    print(f"✅ Started {args.workers} job workers")
+    try:
+        for worker_process in workers:
+            worker_process.join()
+    except KeyboardInterrupt:
+        stop_workers(workers, stop)
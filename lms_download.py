@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LMS download - ดาวน์โหลดไฟล์งานที่ส่งจาก LMS อย่างปลอดภัย
+
+file_url มาจาก webhook ของ LMS ที่ไม่มีการยืนยันตัวตน จึงต้องตรวจก่อนดาวน์โหลดทุกครั้ง
+(รวมทุก URL ที่ถูก redirect ไป) ไม่เช่นนั้นผู้ส่งจะให้ server อ่านไฟล์ในเครื่อง (file:///...) หรือ
+เรียก service ภายในเครือข่าย แล้วส่งเนื้อหาไปวิเคราะห์ที่ Gemini ได้
+
+- รับเฉพาะ http / https
+- host ต้องอยู่ใน LMS_ALLOWED_HOSTS (คั่นด้วย comma, ขึ้นต้นด้วย "." = ทุก subdomain)
+- ทุก IP ที่ host resolve ได้ต้องเป็น public (ไม่ใช่ private / loopback / link-local / reserved)
+- จำกัดขนาดไฟล์ที่ LMS_MAX_DOWNLOAD_MB
+"""
+
+import ipaddress
+import os
+import socket
+import urllib.parse
+import urllib.request
+from typing import List, Optional, Sequence
+
+# host ของ LMS ที่รองรับ (Google Classroom, Canvas cloud, Blackboard SaaS)
+DEFAULT_ALLOWED_HOSTS = (
+    "classroom.google.com", "drive.google.com", "docs.google.com", ".googleusercontent.com",
+    ".instructure.com", ".blackboard.com"
+)
+
+
+class UnsafeUrlError(ValueError):
+    """URL ของไฟล์ไม่อยู่ในเงื่อนไขที่อนุญาตให้ดาวน์โหลด"""
+
+
+def allowed_hosts() -> List[str]:
+    """host ที่อนุญาต (ตัวแปร LMS_ALLOWED_HOSTS หรือ DEFAULT_ALLOWED_HOSTS)"""
+    hosts = os.getenv("LMS_ALLOWED_HOSTS")
+    if not hosts:
+        return list(DEFAULT_ALLOWED_HOSTS)
+    return [h.strip().lower().lstrip("*") for h in hosts.split(",") if h.strip()]
+
+
+def max_download_bytes() -> int:
+    """ขนาดไฟล์สูงสุดที่ดาวน์โหลด (ตัวแปร LMS_MAX_DOWNLOAD_MB, default 50 MB)"""
+    return int(float(os.getenv("LMS_MAX_DOWNLOAD_MB", "50")) * 1024 * 1024)
+
+
+def _host_allowed(host: str, allowed: Sequence[str]) -> bool:
+    for entry in allowed:
+        if entry.startswith("."):
+            if host.endswith(entry) or host == entry[1:]:
+                return True
+        elif host == entry:
+            return True
+    return False
+
+
+def _check_addresses(host: str, port: int):
+    """ทุก IP ของ host ต้องเป็น public"""
+    try:
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise UnsafeUrlError(f"Cannot resolve host {host}: {e}")
+    if not infos:
+        raise UnsafeUrlError(f"Cannot resolve host {host}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if not address.is_global:
+            raise UnsafeUrlError(f"Host {host} resolves to a non-public address ({address})")
+
+
+def validate_download_url(url: str, allowed: Optional[Sequence[str]] = None) -> str:
+    """
+    ตรวจว่า URL ดาวน์โหลดได้อย่างปลอดภัย
+
+    Args:
+        url: URL ของไฟล์
+        allowed: host ที่อนุญาต (default: allowed_hosts())
+
+    Returns:
+        url เดิม
+
+    Raises:
+        UnsafeUrlError ถ้า scheme, host หรือ IP ไม่อยู่ในเงื่อนไข
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme.lower() not in ("http", "https"):
+        raise UnsafeUrlError(f"Only http/https file URLs are allowed, got {parsed.scheme or 'no'} scheme")
+    host = (parsed.hostname or "").rstrip(".").lower()
+    if not host:
+        raise UnsafeUrlError("File URL has no host")
+    if parsed.username or parsed.password:
+        raise UnsafeUrlError("File URL must not contain credentials")
+    if not _host_allowed(host, allowed if allowed is not None else allowed_hosts()):
+        raise UnsafeUrlError(f"Host {host} is not in LMS_ALLOWED_HOSTS")
+    try:
+        port = parsed.port or (443 if parsed.scheme.lower() == "https" else 80)
+    except ValueError as e:
+        raise UnsafeUrlError(f"Invalid port in file URL: {e}")
+    _check_addresses(host, port)
+    return url
+
+
+class _CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """ตรวจ URL ปลายทางของทุก redirect ด้วยเงื่อนไขเดียวกับ URL แรก"""
+
+    def __init__(self, allowed: Sequence[str]):
+        self.allowed = allowed
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        validate_download_url(urllib.parse.urljoin(req.full_url, newurl), self.allowed)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def download_file(url: str, timeout: float = 60.0, max_bytes: Optional[int] = None) -> bytes:
+    """
+    ดาวน์โหลดไฟล์งานที่ส่งจาก LMS
+
+    Args:
+        url: URL ของไฟล์ (จาก webhook)
+        timeout: เวลาสูงสุดต่อการเชื่อมต่อ (วินาที)
+        max_bytes: ขนาดไฟล์สูงสุด (default: max_download_bytes())
+
+    Raises:
+        UnsafeUrlError ถ้า URL (หรือ redirect) ไม่อยู่ในเงื่อนไข
+        ValueError ถ้าไฟล์ใหญ่เกินกำหนด
+    """
+    allowed = allowed_hosts()
+    max_bytes = max_bytes or max_download_bytes()
+    validate_download_url(url, allowed)
+
+    opener = urllib.request.build_opener(_CheckedRedirectHandler(allowed))
+    with opener.open(url, timeout=timeout) as response:
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise ValueError(f"File too large: {url} ({int(length):,} bytes)")
+        data = response.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f"File too large: {url}")
+    return data
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Model registry - ค้นหาและเลือก Gemini model ครั้งเดียวต่อ process
+
+Streamlit รันสคริปต์ใหม่ทุกครั้งที่ผู้ใช้กดปุ่ม แต่ module ที่ import ไว้ยังอยู่
+registry จึงเก็บผล genai.list_models() และชื่อ model ที่เลือกไว้ที่นี่
+(การเรียก model ทำผ่าน api_key_pool / model_router ที่ใช้ client แยกต่อ key)
+
+- ค้นหา model ด้วย key ที่ api_key_pool เลือก (ไม่ใช้ genai.configure ที่เป็นค่า global)
+  key ที่ไม่ถูกต้องจะถูกพักและสลับไป key ถัดไป
+
+- รีเฟรชเมื่อเกิน TTL ใน thread เบื้องหลัง (ระหว่างนั้นยังใช้ model เดิม)
+- นับความล้มเหลวต่อเนื่อง ถ้าถึงเกณฑ์จะข้าม model นั้นและเลือก model ถัดไป
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import google.generativeai as genai
+
+from api_key_pool import NoApiKeyError, get_api_key_pool
+
+# ลำดับ model ที่ต้องการ
+DEFAULT_CANDIDATES = ('gemini-2.0-flash', 'gemini-1.5-pro', 'gemini-1.5-flash', 'gemini-pro')
+
+
+class ModelRegistry:
+    """เก็บผลการค้นหา model และชื่อ model ที่เลือกไว้ พร้อมสถานะ health"""
+
+    def __init__(self,
+                 keys: Optional[Sequence[str]] = None,
+                 candidates: Sequence[str] = DEFAULT_CANDIDATES,
+                 ttl_seconds: float = 3600,
+                 failure_threshold: int = 3,
+                 retry_seconds: float = 30):
+        """
+        Args:
+            keys: API key ที่ใช้ค้นหา model (default: key ทั้งหมดใน api_key_pool)
+            candidates: ชื่อ model ตามลำดับที่ต้องการ
+            ttl_seconds: อายุของผลการค้นหา model ก่อนรีเฟรชเบื้องหลัง
+            failure_threshold: จำนวนครั้งที่ล้มเหลวติดกันก่อนเปลี่ยน model
+            retry_seconds: ระยะห่างขั้นต่ำระหว่างการรีเฟรชเมื่อ model ไม่ healthy
+        """
+        self.keys = list(keys) if keys else None
+        self.candidates = list(candidates)
+        self.ttl_seconds = ttl_seconds
+        self.failure_threshold = failure_threshold
+        self.retry_seconds = retry_seconds
+
+        self.model_name: Optional[str] = None
+        self.available_names: List[str] = []
+        self.last_refresh = 0.0
+        self.last_error: Optional[str] = None
+        self.consecutive_failures = 0
+
+        self._excluded: Set[str] = set()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+    def _select(self, available: List[str]) -> Optional[str]:
+        """เลือก model แรกตามลำดับที่ใช้ได้และยังไม่ถูกข้าม"""
+        preferred = [c for c in self.candidates if c not in self._excluded]
+        if available:
+            preferred = [c for c in preferred if c in available] + \
+                        [n for n in available if n not in self._excluded and n not in preferred]
+        return preferred[0] if preferred else None
+
+    def _list_models(self) -> List[str]:
+        """
+        ชื่อ model ที่รองรับ generateContent
+
+        เรียกผ่าน client ของ key ที่ api_key_pool เลือก (key ที่ไม่ถูกต้องจะถูกพักและลอง key ถัดไป)
+
+        Raises:
+            NoApiKeyError ถ้าไม่มี key ที่ใช้ได้
+        """
+        pool = get_api_key_pool()
+
+        def list_with(api_key: str) -> List[str]:
+            return [
+                m.name.split('/')[-1] for m in genai.list_models(client=pool.model_client(api_key))
+                if 'generateContent' in m.supported_generation_methods
+            ]
+        try:
+            return pool.run(list_with, keys=self.keys)
+        except NoApiKeyError:
+            raise
+        except Exception as e:
+            print(f"Error listing Gemini models: {e}")
+            return []
+
+    def refresh(self) -> bool:
+        """
+        ค้นหา model ที่ใช้ได้แล้วเลือกใหม่ (เรียก Google API)
+
+        Returns:
+            True ถ้าได้ model ที่ใช้ได้
+        """
+        with self._refresh_lock:
+            try:
+                try:
+                    available = self._list_models()
+                except NoApiKeyError as e:
+                    with self._lock:
+                        self.last_refresh = time.time()
+                        self.last_error = str(e)
+                    return False
+
+                name = self._select(available)
+                with self._lock:
+                    self.available_names = available
+                    self.last_refresh = time.time()
+                    if name is not None:
+                        if name != self.model_name:
+                            self.consecutive_failures = 0
+                        self.model_name = name
+                        return True
+                    if self.model_name is None:
+                        self.last_error = self.last_error or "ไม่พบ Model ที่ใช้ได้"
+                    return False
+            finally:
+                self._refreshing = False
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, name="model-registry-refresh", daemon=True).start()
+
+    def get_model_name(self) -> Optional[str]:
+        """
+        คืนชื่อ model ที่เลือกไว้
+
+        ค้นหาแบบรอผลเฉพาะครั้งแรก หลังจากนั้นรีเฟรชเบื้องหลังเมื่อเกิน TTL หรือ model ไม่ healthy
+        (รวมถึงเมื่อยังไม่มี key ที่ใช้ได้ เช่น key ถูกพักอยู่ชั่วคราว)
+
+        Returns:
+            ชื่อ model หรือ None ถ้ายังไม่มี model ที่ใช้ได้
+        """
+        if self.model_name is None and not self.last_refresh:
+            self.refresh()
+        elif time.time() - self.last_refresh > self.ttl_seconds:
+            # ให้โอกาส model ที่เคยถูกข้ามอีกครั้งเมื่อครบ TTL
+            self._excluded.clear()
+            self._refresh_in_background()
+        elif not self.healthy and time.time() - self.last_refresh > self.retry_seconds:
+            self._refresh_in_background()
+        return self.model_name
+
+    def usable_candidates(self) -> List[str]:
+        """
+        ชื่อ model สำหรับ model_router: model ที่เลือกไว้ก่อน ตามด้วย candidates ที่ใช้ได้และไม่ถูกข้าม
+
+        Returns:
+            รายชื่อ model ตามลำดับ (ว่างถ้ายังไม่มี model ที่ใช้ได้)
+        """
+        with self._lock:
+            names = [self.model_name] if self.model_name else []
+            for name in self.candidates:
+                if name in names or name in self._excluded:
+                    continue
+                if self.available_names and name not in self.available_names:
+                    continue
+                names.append(name)
+            return names
+
+    @property
+    def healthy(self) -> bool:
+        return self.model_name is not None and self.consecutive_failures < self.failure_threshold
+
+    def record_success(self):
+        """บันทึกว่าการเรียก model สำเร็จ"""
+        with self._lock:
+            self.consecutive_failures = 0
+
+    def record_failure(self, error: Exception):
+        """บันทึกว่าการเรียก model ล้มเหลว (ถึงเกณฑ์แล้วจะข้าม model นี้ในการรีเฟรชครั้งถัดไป)"""
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error)
+            if self.consecutive_failures >= self.failure_threshold and self.model_name:
+                self._excluded.add(self.model_name)
+
+    def get_status(self) -> Dict:
+        """สถานะสำหรับแสดงผล"""
+        return {
+            "model_name": self.model_name,
+            "available_names": list(self.available_names),
+            "healthy": self.healthy,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "age_seconds": time.time() - self.last_refresh if self.last_refresh else None
+        }
+
+
+_registries: Dict[Tuple[str, ...], ModelRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_model_registry(keys: Optional[Sequence[str]] = None) -> ModelRegistry:
+    """
+    คืน ModelRegistry ที่ใช้ร่วมกันภายใน process (แยกตามชุด API key, default: key ทั้งหมดใน api_key_pool)
+
+    ตั้งค่าได้ด้วยตัวแปร GEMINI_CANDIDATES (คั่นด้วย comma), MODEL_REGISTRY_TTL (วินาที)
+    """
+    registry_key = tuple(keys) if keys else ()
+    with _registries_lock:
+        if registry_key not in _registries:
+            candidates = os.getenv("GEMINI_CANDIDATES")
+            _registries[registry_key] = ModelRegistry(
+                keys,
+                candidates=[c.strip() for c in candidates.split(",") if c.strip()] if candidates else DEFAULT_CANDIDATES,
+                ttl_seconds=float(os.getenv("MODEL_REGISTRY_TTL", "3600"))
+            )
+        return _registries[registry_key]
+
+
+if __name__ == "__main__":
+    # ตัวอย่างการใช้งาน
+    registry = get_model_registry()
+    for attempt in range(3):
+        began = time.perf_counter()
+        registry.get_model_name()
+        print(f"get_model_name #{attempt + 1}: {(time.perf_counter() - began) * 1000:.1f} ms")
+    for name, value in registry.get_status().items():
+        print(f"{name}: {value}")
@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Model router - เลือก Gemini model ต่อคำขอ พร้อม circuit breaker และ hedged request
+
+- เก็บผลล่าสุดของแต่ละ model (สำเร็จ/ล้มเหลว และ latency) แบบ rolling window ใช้ร่วมกันทั้ง process
+- circuit breaker: model ที่ error rate ถึงเกณฑ์จะถูกพัก (open) ครบเวลาแล้วให้ลอง 1 คำขอ (half-open)
+  สำเร็จจึงกลับมาใช้ตามปกติ ล้มเหลวก็พักต่อ; model ที่ถูกพักอยู่ท้ายลำดับ (ใช้เมื่อไม่มีตัวเลือกอื่น)
+- hedged request: ถ้า model หลักยังไม่ตอบเมื่อเกิน p95 latency ของมัน จะส่งคำขอเดียวกันไป model ถัดไป
+  ตัวที่ตอบก่อนชนะ ตัวที่แพ้ถูกยกเลิก (ลด tail latency ช่วงที่ผู้ให้บริการช้าเป็นบางช่วง)
+- model ล้มเหลวจะ fallback ไป model ถัดไปทันที
+- ทุกคำขอที่ส่งจริงหักโควต้าของ API key (admit): fallback รอคิวตามปกติ ส่วน hedge ส่งเฉพาะเมื่อโควต้ายังเหลือ
+  (ช่วงที่ต้อง hedge บ่อยจึงไม่ทำให้คำขอจริงต่อ key เพิ่มเกินโควต้าของ rate_limiter)
+- streaming นับ latency ถึง chunk แรก และ hedge/fallback ได้เฉพาะก่อนได้ chunk แรก
+
+Usage:
+    python model_router.py      # จำลอง brownout ของ model หลัก แล้วเปรียบเทียบ p99 แบบมี/ไม่มี hedge
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import (AsyncIterable, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, Iterator,
+                    List, Optional, Sequence, Tuple, TypeVar)
+
+from singleflight import flight_key, get_singleflight
+
+T = TypeVar("T")
+
+# ค่าบอกว่า stream ไม่มี chunk เลย
+_END = object()
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class _ModelHealth:
+    """ผลล่าสุดและสถานะ circuit ของ model หนึ่งตัว"""
+
+    def __init__(self, window: int):
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        # latency แยกตามชนิด: "call" = ทั้งคำขอ, "first_chunk" = ถึง chunk แรกของ stream
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.window = window
+        self.state = CLOSED
+        self.opened_until = 0.0
+        self.probing = False
+        self.hedges = 0
+        self.hedge_wins = 0
+        # hedge ที่ไม่ได้ส่งเพราะโควต้าของ key ไม่เหลือ
+        self.hedges_skipped = 0
+
+    def percentile(self, kind: str, fraction: float) -> Optional[float]:
+        samples = sorted(self.latencies.get(kind, ()))
+        if not samples:
+            return None
+        return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class ModelRouter:
+    """ลำดับ model ต่อคำขอตาม health พร้อม hedge และ fallback"""
+
+    def __init__(self,
+                 candidates: Sequence[str],
+                 window: int = 50,
+                 min_samples: int = 5,
+                 error_threshold: float = 0.5,
+                 open_seconds: float = 30.0,
+                 hedge_after: float = 20.0,
+                 min_hedge_after: float = 1.0,
+                 hedge: bool = True):
+        """
+        Args:
+            candidates: ชื่อ model ตามลำดับที่ต้องการ
+            window: จำนวนผลล่าสุดที่ใช้คำนวณ error rate และ p95 ต่อ model
+            min_samples: จำนวนผลขั้นต่ำก่อนเปิด circuit หรือใช้ p95 เป็นเวลา hedge
+            error_threshold: error rate ที่ทำให้ circuit เปิด
+            open_seconds: เวลาพัก model เมื่อ circuit เปิด (วินาที)
+            hedge_after: เวลารอก่อน hedge เมื่อยังมีข้อมูล latency ไม่พอ (วินาที)
+            min_hedge_after: เวลารอขั้นต่ำก่อน hedge (กัน p95 ต่ำผิดปกติจนส่งซ้ำทุกคำขอ)
+            hedge: False = ปิด hedge (fallback อย่างเดียว)
+        """
+        self.candidates = list(dict.fromkeys(candidates))
+        self.window = window
+        self.min_samples = min_samples
+        self.error_threshold = error_threshold
+        self.open_seconds = open_seconds
+        self.hedge_after = hedge_after
+        self.min_hedge_after = min_hedge_after
+        self.hedge = hedge
+
+    # ---------- health ----------
+
+    def _health(self, model: str) -> _ModelHealth:
+        with _model_health_lock:
+            if model not in _model_health:
+                _model_health[model] = _ModelHealth(self.window)
+            return _model_health[model]
+
+    def order(self) -> List[str]:
+        """
+        ลำดับ model สำหรับคำขอนี้: model ที่ circuit ปิด (หรือถึงเวลาลอง half-open) ตามลำดับที่ต้องการก่อน
+        แล้วจึงเป็น model ที่ถูกพัก เรียงตามเวลาที่จะกลับมา
+        """
+        now = time.time()
+        ready, resting = [], []
+        with _model_health_lock:
+            for model in self.candidates:
+                health = _model_health.get(model)
+                if health is None or health.state == CLOSED:
+                    ready.append(model)
+                elif health.state == OPEN and now >= health.opened_until:
+                    health.state = HALF_OPEN
+                    ready.append(model)
+                elif health.state == HALF_OPEN and not health.probing:
+                    ready.append(model)
+                else:
+                    resting.append((health.opened_until, model))
+        return ready + [model for _, model in sorted(resting)]
+
+    def _begin(self, model: str):
+        health = self._health(model)
+        with _model_health_lock:
+            if health.state == HALF_OPEN:
+                health.probing = True
+
+    def _abandon(self, model: str):
+        """คำขอถูกยกเลิก (แพ้ hedge) ไม่นับเป็นผลของ model"""
+        health = self._health(model)
+        with _model_health_lock:
+            health.probing = False
+
+    def record(self, model: str, kind: str, latency: float, ok: bool):
+        """บันทึกผลของคำขอหนึ่งครั้ง และเปิด/ปิด circuit ตามผล"""
+        health = self._health(model)
+        with _model_health_lock:
+            health.probing = False
+            health.outcomes.append(ok)
+            if ok:
+                health.latencies.setdefault(kind, deque(maxlen=health.window)).append(latency)
+                if health.state != CLOSED:
+                    # probe สำเร็จ: ปิด circuit และเริ่มนับใหม่
+                    health.state = CLOSED
+                    health.outcomes.clear()
+            elif health.state == HALF_OPEN or (
+                    len(health.outcomes) >= self.min_samples and health.error_rate >= self.error_threshold):
+                if health.state != OPEN:
+                    print(f"Circuit opened for {model} (error rate {health.error_rate:.0%})")
+                health.state = OPEN
+                health.opened_until = time.time() + self.open_seconds
+
+    def hedge_delay(self, model: str, kind: str) -> float:
+        """เวลารอ model นี้ก่อนส่ง hedge (p95 latency ถ้ามีข้อมูลพอ)"""
+        health = self._health(model)
+        with _model_health_lock:
+            p95 = health.percentile(kind, 0.95) if len(health.latencies.get(kind, ())) >= self.min_samples else None
+        return max(p95 if p95 is not None else self.hedge_after, self.min_hedge_after)
+
+    # ---------- async ----------
+
+    async def _race(self, attempt: Callable[[str], Awaitable[T]], kind: str,
+                    fatal: Optional[Callable[[BaseException], bool]],
+                    admit: Optional[Callable[[bool], Awaitable[bool]]]) -> Tuple[str, T]:
+        """ส่งคำขอตามลำดับ model โดย hedge เมื่อเกิน p95 และ fallback เมื่อล้มเหลว คืน (model ที่ชนะ, ผล)"""
+        models = self.order()
+        pending: Dict[asyncio.Task, Tuple[str, float]] = {}
+        next_index = 0
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        async def launch(hedge: bool = False) -> bool:
+            nonlocal next_index
+            # คำขอที่ 2 เป็นต้นไปต้องได้โควต้าของตัวเองก่อน (hedge ที่ไม่มีโควต้าเหลือจะไม่ส่ง)
+            if next_index and admit is not None and not await admit(hedge):
+                return False
+            model = models[next_index]
+            next_index += 1
+            self._begin(model)
+            pending[asyncio.ensure_future(attempt(model))] = (model, time.monotonic())
+            return True
+
+        await launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and not hedged and next_index < len(models):
+                    model, started = min(pending.values(), key=lambda item: item[1])
+                    timeout = max(self.hedge_delay(model, kind) - (time.monotonic() - started), 0.0)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    if await launch(hedge=True):
+                        self._health(model).hedges += 1
+                    else:
+                        self._health(model).hedges_skipped += 1
+                    continue
+
+                # ผลที่สำเร็จชนะ fatal error ที่เสร็จในรอบเดียวกันเสมอ (done เป็น set ไม่มีลำดับ)
+                winner = None
+                fatal_error: Optional[BaseException] = None
+                for task in done:
+                    model, started = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        self.record(model, kind, time.monotonic() - started, True)
+                        if winner is None:
+                            winner = (model, task.result())
+                    elif fatal is not None and fatal(error):
+                        # error ที่ไม่เกี่ยวกับ model (เช่นโควต้า/API key) ลอง model อื่นก็ไม่ช่วย
+                        self._abandon(model)
+                        fatal_error = fatal_error or error
+                    else:
+                        self.record(model, kind, time.monotonic() - started, False)
+                        print(f"Error calling {model}: {error!r}")
+                        last_error = error
+                if winner is not None:
+                    if hedged and winner[0] != models[0]:
+                        self._health(winner[0]).hedge_wins += 1
+                    return winner
+                if fatal_error is not None:
+                    raise fatal_error
+                if not pending and next_index < len(models):
+                    await launch()
+            raise last_error
+        finally:
+            # ยกเลิกคำขอที่แพ้ (หรือทั้งหมดถ้าผู้เรียกถูกยกเลิก)
+            for task, (model, _) in pending.items():
+                task.cancel()
+                self._abandon(model)
+
+    async def run(self, call: Callable[[str], Awaitable[T]],
+                  fatal: Optional[Callable[[BaseException], bool]] = None,
+                  admit: Optional[Callable[[bool], Awaitable[bool]]] = None) -> T:
+        """
+        เรียก call(model_name) ตามลำดับ model พร้อม hedge และ fallback
+
+        Args:
+            call: coroutine function ที่เรียก model ตามชื่อ
+            fatal: ฟังก์ชันบอกว่า error ไหนส่งต่อทันทีโดยไม่ลอง model อื่นและไม่นับเป็นความล้มเหลวของ model
+                   (เช่น error ของ API key ที่ api_key_pool จัดการ)
+            admit: เรียกก่อนส่งคำขอที่ 2 เป็นต้นไป (True = hedge, False = fallback) เพื่อหักโควต้าของคำขอนั้น
+                   คืน False = ไม่ส่ง hedge ครั้งนี้
+
+        Raises:
+            error ใน fatal หรือ error สุดท้ายเมื่อทุก model ล้มเหลว
+        """
+        return (await self._race(call, "call", fatal, admit))[1]
+
+    async def stream_async(self, factory: Callable[[str], AsyncIterable[T]],
+                           fatal: Optional[Callable[[BaseException], bool]] = None,
+                           admit: Optional[Callable[[bool], Awaitable[bool]]] = None) -> AsyncIterator[T]:
+        """
+        stream จาก model ที่ส่ง chunk แรกก่อน (hedge/fallback ตามเวลาถึง chunk แรก)
+
+        Args:
+            factory: ฟังก์ชันที่เริ่ม stream จาก model ตามชื่อ
+            fatal, admit: เหมือน run()
+        """
+        async def first(model: str):
+            chunks = factory(model).__aiter__()
+            try:
+                return chunks, await chunks.__anext__()
+            except StopAsyncIteration:
+                return chunks, _END
+
+        _, (chunks, chunk) = await self._race(first, "first_chunk", fatal, admit)
+        if chunk is _END:
+            return
+        yield chunk
+        async for chunk in chunks:
+            yield chunk
+
+    # ---------- sync (Streamlit) ----------
+
+    def stream(self, factory: Callable[[str], Iterable[T]],
+               fatal: Optional[Callable[[BaseException], bool]] = None,
+               admit: Optional[Callable[[bool], bool]] = None) -> Iterator[T]:
+        """
+        stream แบบ sync: แต่ละ model รอ chunk แรกใน thread ของตัวเอง ตัวแรกที่ได้ chunk ชนะ
+        ตัวที่แพ้ถูกปิด stream ทันทีที่มันตอบ
+
+        Args:
+            factory: ฟังก์ชันที่เริ่ม stream จาก model ตามชื่อ (คืน iterator)
+            fatal: เหมือน run()
+            admit: เหมือน run() แต่เป็นฟังก์ชันธรรมดา
+        """
+        models = self.order()
+        results: "queue.Queue" = queue.Queue()
+        lock = threading.Lock()
+        finished = []
+        pending: Dict[str, float] = {}
+        next_index = 0
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        def attempt(model: str):
+            chunks, chunk, error = None, None, None
+            try:
+                chunks = iter(factory(model))
+                chunk = next(chunks, _END)
+            except Exception as e:
+                error = e
+            with lock:
+                if not finished:
+                    results.put((model, chunks, chunk, error))
+                    return
+            # มีผู้ชนะแล้ว: ปิด stream ที่แพ้
+            if chunks is not None and hasattr(chunks, "close"):
+                chunks.close()
+            self._abandon(model)
+
+        def launch(hedge: bool = False) -> bool:
+            nonlocal next_index
+            if next_index and admit is not None and not admit(hedge):
+                return False
+            model = models[next_index]
+            next_index += 1
+            self._begin(model)
+            pending[model] = time.monotonic()
+            threading.Thread(target=attempt, args=(model,), name="model-router-hedge", daemon=True).start()
+            return True
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and not hedged and next_index < len(models):
+                    model, started = min(pending.items(), key=lambda item: item[1])
+                    timeout = max(self.hedge_delay(model, "first_chunk") - (time.monotonic() - started), 0.0)
+                try:
+                    model, chunks, chunk, error = results.get(timeout=timeout)
+                except queue.Empty:
+                    hedged = True
+                    if launch(hedge=True):
+                        self._health(model).hedges += 1
+                    else:
+                        self._health(model).hedges_skipped += 1
+                    continue
+
+                latency = time.monotonic() - pending.pop(model)
+                if error is None:
+                    self.record(model, "first_chunk", latency, True)
+                    if hedged and model != models[0]:
+                        self._health(model).hedge_wins += 1
+                    with lock:
+                        finished.append(model)
+                    if chunk is not _END:
+                        yield chunk
+                        yield from chunks
+                    return
+                if fatal is not None and fatal(error):
+                    self._abandon(model)
+                    raise error
+                self.record(model, "first_chunk", latency, False)
+                print(f"Error calling {model}: {error!r}")
+                last_error = error
+                if not pending and next_index < len(models):
+                    launch()
+            raise last_error
+        finally:
+            with lock:
+                finished.append(None)
+            # ผลที่ส่งเข้ามาก่อนได้ผู้ชนะ: ปิดทิ้ง
+            while True:
+                try:
+                    model, chunks, _, _ = results.get_nowait()
+                except queue.Empty:
+                    break
+                if chunks is not None and hasattr(chunks, "close"):
+                    chunks.close()
+                self._abandon(model)
+
+    def stream_text(self, prompt: str, keys: Optional[Sequence[str]] = None) -> Iterator[str]:
+        """
+        ข้อความของ prompt แบบ streaming (ใช้กับ st.write_stream)
+
+        api_key_pool เลือก key และรอคิวโควต้าก่อน แล้ว router จึงแข่ง model ด้วย key นั้น
+        (เวลารอคิวจึงไม่ถูกนับเป็น latency ของ model) hedge/fallback หักโควต้าของ key เดียวกันเพิ่ม
+        prompt เดียวกันที่กำลัง stream อยู่ใช้ stream เดียวกัน
+
+        Args:
+            prompt: ข้อความ prompt
+            keys: ใช้ key ชุดนี้แทน key ที่ตั้งค่าไว้
+        """
+        # import เมื่อใช้ เพื่อให้ทดสอบ router กับ model จำลองได้โดยไม่ต้องมี google-generativeai
+        from api_key_pool import chunk_text, get_api_key_pool, is_key_error
+        from prompt_builder import estimate_tokens
+        pool = get_api_key_pool()
+        tokens = estimate_tokens(prompt)
+
+        def texts() -> Iterator[str]:
+            chunks = pool.stream(
+                lambda api_key: self.stream(
+                    lambda model: pool.get_model(model, api_key).generate_content(prompt, stream=True),
+                    is_key_error,
+                    lambda hedge: pool.charge(api_key, tokens, wait=not hedge)
+                ),
+                tokens,
+                keys
+            )
+            for chunk in chunks:
+                text = chunk_text(chunk)
+                if text:
+                    yield text
+        return get_singleflight().stream(
+            flight_key("stream", ",".join(self.candidates), ",".join(keys or ()), prompt), texts
+        )
+
+    def get_stats(self) -> List[Dict]:
+        """สถานะของ model ใน candidates (ดู get_router_stats)"""
+        return [row for row in get_router_stats() if row["model"] in self.candidates]
+
+
+_model_health: Dict[str, _ModelHealth] = {}
+_model_health_lock = threading.RLock()
+
+_routers: Dict[Tuple[str, ...], ModelRouter] = {}
+_routers_lock = threading.Lock()
+
+
+def get_router_stats() -> List[Dict]:
+    """
+    สถานะของทุก model ที่เคยใช้ใน process นี้ (สำหรับหน้า Admin)
+
+    Returns:
+        [{model, state, opened_for, error_rate, samples, p50, p95, first_chunk_p95, hedges, hedge_wins,
+          hedges_skipped}]
+    """
+    now = time.time()
+    rows = []
+    with _model_health_lock:
+        for model, health in sorted(_model_health.items()):
+            rows.append({
+                "model": model,
+                "state": health.state,
+                "opened_for": max(health.opened_until - now, 0.0) if health.state == OPEN else 0.0,
+                "error_rate": health.error_rate,
+                "samples": len(health.outcomes),
+                "p50": health.percentile("call", 0.5),
+                "p95": health.percentile("call", 0.95),
+                "first_chunk_p95": health.percentile("first_chunk", 0.95),
+                "hedges": health.hedges,
+                "hedge_wins": health.hedge_wins,
+                "hedges_skipped": health.hedges_skipped
+            })
+    return rows
+
+
+def get_model_router(candidates: Sequence[str]) -> ModelRouter:
+    """
+    คืน ModelRouter ของรายชื่อ model นี้ (health ของแต่ละ model ใช้ร่วมกันทุก router ใน process)
+
+    ตั้งค่าได้ด้วยตัวแปร GEMINI_HEDGE_AFTER (วินาที, 0 = ปิด hedge), GEMINI_CIRCUIT_OPEN_SECONDS
+    """
+    key = tuple(dict.fromkeys(candidates))
+    with _routers_lock:
+        if key not in _routers:
+            hedge_after = float(os.getenv("GEMINI_HEDGE_AFTER", "20"))
+            _routers[key] = ModelRouter(
+                key,
+                open_seconds=float(os.getenv("GEMINI_CIRCUIT_OPEN_SECONDS", "30")),
+                hedge_after=hedge_after or 20.0,
+                hedge=hedge_after > 0
+            )
+        return _routers[key]
+
+
+if __name__ == "__main__":
+    # จำลอง brownout: model หลักช้าผิดปกติ 10% ของคำขอ (3 วินาที แทน 0.1 วินาที)
+    import random
+
+    random.seed(7)
+
+    async def fake_call(model: str) -> str:
+        if model == "primary" and random.random() < 0.1:
+            await asyncio.sleep(3.0)
+        else:
+            await asyncio.sleep(0.1 + random.random() * 0.05)
+        return model
+
+    async def measure(router: ModelRouter, requests: int = 200) -> List[float]:
+        latencies = []
+
+        async def one():
+            started = time.perf_counter()
+            await router.run(fake_call)
+            latencies.append(time.perf_counter() - started)
+        for _ in range(requests // 20):
+            await asyncio.gather(*[one() for _ in range(20)])
+        return sorted(latencies)
+
+    for hedge in (False, True):
+        _model_health.clear()
+        router = ModelRouter(("primary", "secondary"), hedge_after=0.5, min_hedge_after=0.05, hedge=hedge)
+        latencies = asyncio.run(measure(router))
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f"hedge={'on ' if hedge else 'off'}: p50 {p50 * 1000:.0f} ms, p99 {p99 * 1000:.0f} ms")
+    for row in get_router_stats():
+        print(row)
@@ -45,9 +45,34 @@ except:
 import streamlit as st
 from dotenv import load_dotenv
 
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_repository import get_repository
+from analysis_cache import get_analysis_cache
+from chapter_segmenter import SECTION_TITLES, select_content
+from rate_limiter import RateLimitTimeout, is_daily_quota_error, is_rate_limit_error
+from api_key_pool import NoApiKeyError, get_api_key_pool, is_auth_error
+from model_registry import DEFAULT_CANDIDATES
+from model_router import get_model_router
+from prompt_builder import condense_document_sync, estimate_tokens, get_prompt_budget, model_generator
+from report_store import get_report_store
+from document_reader import extract_text
+from write_coordinator import read_json_snapshot, update_json
+
 # Load environment variables
 load_dotenv()
 
+# Model และเวอร์ชันของ prompt (เปลี่ยนเวอร์ชันเมื่อแก้ prompt เพื่อไม่ให้ใช้ผลใน cache เดิม)
+ANALYSIS_MODEL = 'gemini-2.5-flash'
+# model สำรองเมื่อ ANALYSIS_MODEL ช้าเกิน p95 (hedge) หรือถูกพักเพราะ error บ่อย (circuit breaker)
+ANALYSIS_MODELS = (ANALYSIS_MODEL,) + DEFAULT_CANDIDATES
+ANALYSIS_PROMPT_VERSION = "semantic-3level-v2"
+
+# งบ token ของเนื้อหาใน prompt: เอกสาร/บทที่ยาวเกินงบจะถูกสรุปทีละส่วน (map-reduce)
+# แทนการตัดตามจำนวนตัวอักษร ซึ่งทำให้บทสรุปท้ายเอกสารหายไป
+PROMPT_BUDGET = get_prompt_budget()
+
 # ========== PAGE CONFIG ==========
 st.set_page_config(
     page_title="Student Interface - ระบบตรวจโครงงาน AI",
@@ -158,13 +183,10 @@ if not st.session_state.student_logged_in:
             if submitted:
                 if username and password:
                     # ตรวจสอบจาก users_database.json
-                    import json
                     try:
                         users_db_file = "users_database.json"
-                        if os.path.exists(users_db_file):
-                            with open(users_db_file, 'r', encoding='utf-8') as f:
-                                users_db = json.load(f)
-                            
+                        users_db = read_json_snapshot(users_db_file)
+                        if users_db is not None:
                             # ค้นหา user
                             found_user = None
                             if "users" in users_db:
@@ -181,10 +203,15 @@ if not st.session_state.student_logged_in:
                                 st.session_state.student_name = found_user.get("name", username)
                                 st.session_state.student_role = found_user.get("role", "student")
                                 
-                                # อัพเดท last_login
-                                found_user["last_login"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                                with open(users_db_file, 'w', encoding='utf-8') as f:
-                                    json.dump(users_db, f, ensure_ascii=False, indent=2)
+                                # อัพเดท last_login บนข้อมูลล่าสุดในไฟล์ (ไม่ทับการแก้ไขจาก session อื่น)
+                                last_login = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+                                def set_last_login(latest_db):
+                                    for user in latest_db.get("users", []):
+                                        if user.get("username") == username:
+                                            user["last_login"] = last_login
+
+                                update_json(users_db_file, set_last_login, {"users": []})
                                 
                                 st.success("✅ เข้าสู่ระบบสำเร็จ!")
                                 time.sleep(1)
@@ -212,28 +239,30 @@ else:
         st.markdown("## 📂 อัปโหลดไฟล์โครงงาน")
         
         # ตรวจสอบ API Key จากหลายแหล่ง
-        def get_api_key():
-            # 1. จาก Environment Variable (.env file) - รองรับทั้ง 2 ชื่อ
-            env_key = os.environ.get("GOOGLE_API_KEY") or os.environ.get("GOOGLE_GEMINI_API_KEY")
-            if env_key and env_key != "your_api_key_here":
-                return env_key
+        def get_api_keys():
+            # 1. จาก key pool: Environment Variable (.env file) และ key ที่ผู้ดูแลเพิ่มในหน้า Admin
+            pool_keys = get_api_key_pool().keys()
+            if pool_keys:
+                return pool_keys
             
             # 2. จาก Streamlit Secrets (สำหรับ deployment)
             try:
                 if hasattr(st, 'secrets'):
-                    return st.secrets.get('GOOGLE_API_KEY') or st.secrets.get('GOOGLE_GEMINI_API_KEY')
+                    secret_key = st.secrets.get('GOOGLE_API_KEY') or st.secrets.get('GOOGLE_GEMINI_API_KEY')
+                    if secret_key:
+                        return [secret_key]
             except:
                 pass
             
             # 3. จาก Session State
             if 'gemini_api_key' in st.session_state:
-                return st.session_state.gemini_api_key
+                return [st.session_state.gemini_api_key]
             
-            return None
+            return []
         
         # ตรวจสอบ API Key แต่ไม่แสดง
-        current_api_key = get_api_key()
-        if not current_api_key:
+        current_api_keys = get_api_keys()
+        if not current_api_keys:
             st.warning("⚠️ ยังไม่มี API Key กรุณาตั้งค่า")
             
             with st.expander("🔑 ตั้งค่า Google Gemini API Key", expanded=True):
@@ -333,80 +362,85 @@ else:
                 try:
                     # อ่านเนื้อหาไฟล์จริง
                     with st.spinner("📄 กำลังอ่านไฟล์..."):
-                        file_content = ""
-                        num_pages = 0
-                        
-                        if uploaded_file.type == "application/pdf":
-                            try:
-                                import PyPDF2
-                                uploaded_file.seek(0)
-                                pdf_reader = PyPDF2.PdfReader(uploaded_file)
-                                num_pages = len(pdf_reader.pages)
-                                
-                                for page_num, page in enumerate(pdf_reader.pages):
-                                    text = page.extract_text()
-                                    file_content += f"\n=== หน้า {page_num + 1} ===\n{text}\n"
-                                
-                                if not file_content.strip():
-                                    st.error("❌ ไม่สามารถอ่านข้อความจาก PDF ได้")
-                                    st.stop()
-                            except Exception as e:
-                                st.error(f"❌ เกิดข้อผิดพลาดในการอ่านไฟล์ PDF: {str(e)}")
-                                st.stop()
+                        file_types = {
+                            "application/pdf": "PDF",
+                            "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "Word"
+                        }
+                        if uploaded_file.type not in file_types:
+                            st.error("❌ รองรับเฉพาะไฟล์ PDF และ Word เท่านั้น")
+                            st.stop()
                         
-                        elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-                            try:
-                                from docx import Document
-                                uploaded_file.seek(0)
-                                doc = Document(uploaded_file)
-                                num_pages = len(doc.paragraphs) // 30 + 1  # ประมาณการ
-                                
-                                for para in doc.paragraphs:
-                                    file_content += para.text + "\n"
-                                
-                                if not file_content.strip():
-                                    st.error("❌ ไม่สามารถอ่านข้อความจาก Word ได้")
-                                    st.stop()
-                            except Exception as e:
-                                st.error(f"❌ เกิดข้อผิดพลาดในการอ่านไฟล์ Word: {str(e)}")
-                                st.stop()
+                        # อ่านทีละหน้าจนครบ PROMPT_BUDGET.max_document_chars (ส่วนที่เกินงบ token จะถูกสรุปภายหลัง)
+                        try:
+                            extraction = extract_text(uploaded_file, uploaded_file.name,
+                                                      max_chars=PROMPT_BUDGET.max_document_chars,
+                                                      page_headers=True)
+                        except Exception as e:
+                            st.error(f"❌ เกิดข้อผิดพลาดในการอ่านไฟล์ {file_types[uploaded_file.type]}: {str(e)}")
+                            st.stop()
                         
-                        else:
-                            st.error("❌ รองรับเฉพาะไฟล์ PDF และ Word เท่านั้น")
+                        file_content = extraction.text
+                        num_pages = extraction.num_pages
+                        if extraction.is_empty:
+                            st.error(f"❌ ไม่สามารถอ่านข้อความจาก {file_types[uploaded_file.type]} ได้")
                             st.stop()
                         
-                        # ตรวจสอบความยาว
+                        # ตรวจสอบความยาว (นับจากส่วนที่อ่าน)
                         word_count = len(file_content.split())
                         char_count = len(file_content)
                         
                         st.success(f"✅ อ่านไฟล์สำเร็จ: {num_pages} หน้า, {word_count:,} คำ, {char_count:,} ตัวอักษร")
+                        st.caption(f"⏱️ {extraction.summary()}")
+                        
+                        # ตัดเฉพาะบทที่เลือกตามหัวข้อ "บทที่ N" (ไม่พบหัวข้อ = ส่งตั้งแต่ต้นเอกสาร)
+                        selected_content, chapter_section = select_content(file_content, chapter_value)
+                        selected_tokens = estimate_tokens(selected_content)
+                        if chapter_section is not None:
+                            section_chars = chapter_section.end - chapter_section.start
+                            st.caption(f"📑 พบ {chapter_section.title}: {section_chars:,} ตัวอักษร ~{selected_tokens:,} tokens (ส่งเฉพาะบทนี้ให้ AI)")
+                        else:
+                            if chapter_value != "all":
+                                st.warning(f"⚠️ ไม่พบหัวข้อ {SECTION_TITLES[chapter_value]} ในเอกสาร จะส่งเนื้อหาตั้งแต่ต้นเอกสารแทน")
+                    
+                    # ค้นหาผลการวิเคราะห์เดิมใน cache (ไฟล์เดิม + บทเดิม + prompt เดิม ไม่ใช้โควต้า API)
+                    analysis_cache = get_analysis_cache()
+                    cache_key = analysis_cache.make_key(selected_content, chapter_value, ANALYSIS_PROMPT_VERSION, ANALYSIS_MODEL)
+                    cached_analysis = analysis_cache.get(cache_key)
                     
                     # ตรวจสอบ API Key
-                    api_key = get_api_key()
-                    if not api_key:
+                    api_keys = get_api_keys()
+                    if not api_keys and cached_analysis is None:
                         st.error("❌ กรุณาใส่ Google Gemini API Key ก่อนวิเคราะห์")
                         st.info("💡 กลับไปด้านบนเพื่อตั้งค่า API Key")
                         st.stop()
                     
                     # ใช้ AI วิเคราะห์จริง
                     chapter_focus = ""
-                    if chapter_value != "all":
-                        chapter_names = {
-                            "chapter1": "บทที่ 1: บทนำ",
-                            "chapter2": "บทที่ 2: เอกสารและงานวิจัยที่เกี่ยวข้อง",
-                            "chapter3": "บทที่ 3: วิธีดำเนินการวิจัย",
-                            "chapter4": "บทที่ 4: ผลการวิจัย",
-                            "chapter5": "บทที่ 5: สรุปและข้อเสนอแนะ"
-                        }
-                        chapter_focus = f"\n\n**⚠️ หมายเหตุ:** กรุณาวิเคราะห์เฉพาะ {chapter_names.get(chapter_value, '')} เท่านั้น\n"
+                    if chapter_value != "all" and chapter_section is None:
+                        chapter_focus = f"\n\n**⚠️ หมายเหตุ:** กรุณาวิเคราะห์เฉพาะ {SECTION_TITLES[chapter_value]} เท่านั้น\n"
+                    elif chapter_section is not None:
+                        chapter_focus = f"\n\n**หมายเหตุ:** เนื้อหาด้านล่างคือ {chapter_section.title} ที่ตัดมาจากเอกสาร\n"
                     
-                    with st.spinner(f"🤖 กำลังใช้ AI วิเคราะห์{' ' + selected_chapter if chapter_value != 'all' else 'ทั้งหมด'}..."):
-                        # ใช้ SDK
-                        genai.configure(api_key=api_key)
-                        model = genai.GenerativeModel('gemini-2.5-flash')
-                                
-                        # สร้าง Prompt สำหรับ Semantic Analysis 3 ระดับ
-                        analysis_prompt = f"""
+                    if cached_analysis is not None:
+                        ai_analysis = cached_analysis
+                        ai_model_used = "Google Gemini Pro (Real AI, จาก cache)"
+                        st.info("⚡ พบผลการวิเคราะห์ของไฟล์นี้ใน cache (ไม่ใช้โควต้า API)")
+                    else:
+                        # โควต้าต่อนาทีของแต่ละ key ใช้ร่วมกันทุก session: เกินแล้วรอคิวแทนการ error
+                        # มีหลาย key จะส่งไปที่ key ที่เหลือโควต้ามากที่สุด
+                        key_pool = get_api_key_pool()
+                        queued = key_pool.queue_depth(api_keys)
+                        if queued:
+                            st.info(f"⏳ มีคำขอรอคิว AI อยู่ {queued} รายการ ระบบจะส่งให้อัตโนมัติเมื่อถึงคิว")
+                        # map: สรุปแต่ละส่วนพร้อมกันเมื่อเนื้อหาเกินงบ token, reduce: วิเคราะห์จากสรุป
+                        with st.spinner(f"🧩 กำลังจัดเนื้อหา ~{selected_tokens:,} tokens ให้อยู่ในงบ..."):
+                            condensed = condense_document_sync(selected_content, model_generator(ANALYSIS_MODEL, api_keys), PROMPT_BUDGET)
+                        st.caption(f"🧩 {condensed.summary()}")
+                        prompt_content = condensed.content
+                        content_condensed = condensed.mode == "map_reduce"
+                        with st.spinner(f"🤖 กำลังใช้ AI วิเคราะห์{' ' + selected_chapter if chapter_value != 'all' else 'ทั้งหมด'}..."):
+                            # สร้าง Prompt สำหรับ Semantic Analysis 3 ระดับ
+                            analysis_prompt = f"""
 คุณคือผู้เชี่ยวชาญด้านการตรวจสอบและประเมินโครงงานวิทยาศาสตร์ ให้วิเคราะห์เอกสารโครงงานนี้แบบ Semantic Analysis 3 ระดับ:
 
 **ข้อมูลไฟล์:**
@@ -417,9 +451,10 @@ else:
 {chapter_focus}
 
 **เนื้อหาเอกสาร:**
-{file_content[:15000]}
+{prompt_content}
 
-{"... (เนื้อหาถูกตัดเนื่องจากความยาว)" if len(file_content) > 15000 else ""}
+{"... (เนื้อหาด้านบนเป็นสรุปของแต่ละส่วน เนื่องจากเอกสารยาวเกินงบ)" if content_condensed else ""}
+{"... (อ่านไฟล์ได้ไม่ครบ เนื่องจากไฟล์ยาวเกินขีดจำกัด)" if extraction.truncated else ""}
 
 ---
 
@@ -456,10 +491,19 @@ else:
 กรุณาวิเคราะห์อย่างละเอียดและให้คำแนะนำที่เป็นประโยชน์จริง ๆ
 """
                         
-                        # ส่งไปให้ AI วิเคราะห์
-                        response = model.generate_content(analysis_prompt)
-                        ai_analysis = response.text
-                        ai_model_used = "Google Gemini Pro (Real AI)"
+                            # ส่งไปให้ AI วิเคราะห์แบบ streaming: แสดงข้อความทันทีที่ model เริ่มตอบ
+                            # (รอคิวตามโควต้า สลับ key หรือลองใหม่ตาม retry-after ถ้าถูกจำกัดก่อนเริ่มตอบ)
+                            # model ผูก client กับ key ที่เลือกเอง ไม่ใช้ genai.configure ที่เป็นค่า global
+                            # model ตอบช้าเกิน p95 จะส่งคำขอซ้ำไป model สำรอง ใครตอบก่อนใช้ตัวนั้น
+                            live_output = st.empty()
+                            ai_analysis = live_output.write_stream(
+                                get_model_router(ANALYSIS_MODELS).stream_text(analysis_prompt, api_keys)
+                            )
+                            # ผลเต็มแสดงในรายงานด้านล่าง
+                            live_output.empty()
+                            ai_model_used = "Google Gemini Pro (Real AI)"
+                            
+                            analysis_cache.put(cache_key, ai_analysis, ANALYSIS_MODEL, ANALYSIS_PROMPT_VERSION)
                     
                     # สร้างรายงานฉบับสมบูรณ์
                     analysis_result = f"""
@@ -491,20 +535,6 @@ else:
                     
                     # บันทึกผลการวิเคราะห์ลงฐานข้อมูล
                     try:
-                        import json
-                        
-                        # อ่านฐานข้อมูล
-                        history_file = "history.json"
-                        if os.path.exists(history_file):
-                            with open(history_file, 'r', encoding='utf-8') as f:
-                                history_data = json.load(f)
-                        else:
-                            history_data = {}
-                        
-                        # ตรวจสอบว่ามี key "analyses" หรือไม่
-                        if "analyses" not in history_data:
-                            history_data["analyses"] = []
-                        
                         # อัพเดทความคืบหน้าของบทที่ตรวจ
                         if user_key not in st.session_state.chapter_progress:
                             st.session_state.chapter_progress[user_key] = {}
@@ -539,28 +569,25 @@ else:
                             score = None
                         
                         # เพิ่มข้อมูลใหม่
-                        new_entry = {
-                            "id": f"ANALYSIS_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-                            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                            "username": st.session_state.student_username,
-                            "file_name": uploaded_file.name,
-                            "chapter_checked": selected_chapter,
-                            "chapter_value": chapter_value,
-                            "file_size": uploaded_file.size,
-                            "num_pages": num_pages,
-                            "word_count": word_count,
-                            "char_count": char_count,
-                            "score": score,
-                            "analysis_result": ai_analysis,
-                            "full_report": analysis_result,
-                            "chapter_progress": st.session_state.chapter_progress[user_key]
-                        }
-                        
-                        history_data["analyses"].append(new_entry)
-                        
-                        # บันทึกกลับ
-                        with open(history_file, 'w', encoding='utf-8') as f:
-                            json.dump(history_data, f, ensure_ascii=False, indent=2)
+                        saved = get_repository().add_analysis(
+                            username=st.session_state.student_username,
+                            file_name=uploaded_file.name,
+                            result=ai_analysis,
+                            chapter_checked=selected_chapter,
+                            chapter_value=chapter_value,
+                            file_size=uploaded_file.size,
+                            num_pages=num_pages,
+                            word_count=word_count,
+                            char_count=char_count,
+                            score=score,
+                            full_report=analysis_result,
+                            chapter_progress=st.session_state.chapter_progress[user_key]
+                        )
+                        if saved is None:
+                            st.warning("⚠️ ไม่สามารถบันทึกลงฐานข้อมูลได้")
+                        else:
+                            # สร้างรายงาน Word/PDF ล่วงหน้าเบื้องหลัง (ดาวน์โหลดภายหลังไม่ต้องรอ)
+                            get_report_store().schedule_prerender(st.session_state.student_username, saved)
                         
                     except Exception as e:
                         st.warning(f"⚠️ ไม่สามารถบันทึกลงฐานข้อมูลได้: {str(e)}")
@@ -572,16 +599,20 @@ else:
                     error_msg = str(e)
                     st.error(f"❌ เกิดข้อผิดพลาดในการวิเคราะห์: {error_msg}")
                     
-                    if "API_KEY_INVALID" in error_msg or "API key not valid" in error_msg:
+                    rate_limited = isinstance(e, RateLimitTimeout) or is_rate_limit_error(e) or is_daily_quota_error(e)
+                    if isinstance(e, RateLimitTimeout):
+                        st.warning("⏳ ขณะนี้มีผู้ใช้ส่งงานจำนวนมาก คิว AI ยาวเกินกำหนด กรุณาลองใหม่ในอีกไม่กี่นาที")
+                    elif isinstance(e, NoApiKeyError) or is_auth_error(e):
                         st.error("🔑 API Key ไม่ถูกต้อง กรุณาตรวจสอบและใส่ใหม่")
                         st.info("💡 ไปที่ [Google AI Studio](https://makersuite.google.com/app/apikey) เพื่อสร้าง API Key ใหม่")
-                    elif "RESOURCE_EXHAUSTED" in error_msg or "quota" in error_msg.lower():
-                        st.error("⚠️ API Key หมดโควต้าแล้ว กรุณาใช้ API Key ใหม่หรือรอ 24 ชั่วโมง")
+                    elif rate_limited:
+                        st.error("⚠️ โควต้า API ยังเต็มหลังจากระบบรอคิวและลองใหม่แล้ว กรุณาลองใหม่ในอีกสักครู่ "
+                                 "(ถ้าเป็นโควต้ารายวันของ API Key ให้ใช้ API Key อื่น)")
                     else:
                         st.error("กรุณาตรวจสอบ Google API Key หรือลองใหม่อีกครั้ง")
                     
-                    # ลบ API Key เก่าออก
-                    if 'gemini_api_key' in st.session_state:
+                    # ลบ API Key เก่าออก (ยกเว้นกรณีโควต้าเต็ม ซึ่ง key ยังใช้ได้)
+                    if not rate_limited and 'gemini_api_key' in st.session_state:
                         del st.session_state.gemini_api_key
                         
                     st.stop()
@@ -609,66 +640,47 @@ else:
     with tab2:
         st.markdown("## 📜 ประวัติการวิเคราะห์")
         
-        # อ่านประวัติจาก history.json
+        # อ่านประวัติจาก repository (เรียงจากใหม่ไปเก่าแล้ว)
         try:
-            import json
-            history_file = "history.json"
+            user_analyses = get_repository().get_user_history(st.session_state.student_username, include_result=False)
             
-            if os.path.exists(history_file):
-                with open(history_file, 'r', encoding='utf-8') as f:
-                    history_data = json.load(f)
+            if user_analyses:
+                # แสดงเป็นตาราง
+                display_data = {
+                    "ไฟล์": [entry.get("file_name", "-") for entry in user_analyses],
+                    "บทที่ตรวจ": [entry.get("chapter_checked", "ทั้งหมด") for entry in user_analyses],
+                    "วันที่": [entry.get("timestamp", "-") for entry in user_analyses],
+                    "จำนวนคำ": [f"{entry.get('word_count', 0):,}" for entry in user_analyses],
+                    "สถานะ": ["✅ สำเร็จ" for _ in user_analyses]
+                }
                 
-                # กรองเฉพาะของ user ที่ login
-                if "analyses" in history_data:
-                    user_analyses = [
-                        entry for entry in history_data["analyses"]
-                        if entry.get("username") == st.session_state.student_username
-                    ]
-                    
-                    if user_analyses:
-                        # เรียงจากใหม่ไปเก่า
-                        user_analyses.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-                        
-                        # แสดงเป็นตาราง
-                        display_data = {
-                            "ไฟล์": [entry.get("file_name", "-") for entry in user_analyses],
-                            "บทที่ตรวจ": [entry.get("chapter_checked", "ทั้งหมด") for entry in user_analyses],
-                            "วันที่": [entry.get("timestamp", "-") for entry in user_analyses],
-                            "จำนวนคำ": [f"{entry.get('word_count', 0):,}" for entry in user_analyses],
-                            "สถานะ": ["✅ สำเร็จ" for _ in user_analyses]
-                        }
-                        
-                        st.dataframe(display_data, use_container_width=True)
+                st.dataframe(display_data, use_container_width=True)
+                
+                # แสดงรายละเอียดเพิ่มเติม
+                st.markdown("---")
+                st.markdown("### 📊 รายละเอียดการวิเคราะห์แต่ละครั้ง")
+                
+                for i, entry in enumerate(user_analyses[:5], 1):  # แสดงแค่ 5 รายการล่าสุด
+                    with st.expander(f"📄 {entry.get('file_name', 'ไม่ระบุ')} - {entry.get('timestamp', '-')}"):
+                        col_a, col_b = st.columns(2)
+                        with col_a:
+                            st.markdown(f"**บทที่ตรวจ:** {entry.get('chapter_checked', 'ทั้งหมด')}")
+                            st.markdown(f"**จำนวนคำ:** {entry.get('word_count', 0):,} คำ")
+                        with col_b:
+                            st.markdown(f"**จำนวนหน้า:** {entry.get('num_pages', 0)} หน้า")
+                            st.markdown(f"**ขนาดไฟล์:** {entry.get('file_size', 0) / 1024:.2f} KB")
                         
-                        # แสดงรายละเอียดเพิ่มเติม
-                        st.markdown("---")
-                        st.markdown("### 📊 รายละเอียดการวิเคราะห์แต่ละครั้ง")
+                        # แสดงความคืบหน้า
+                        if 'chapter_progress' in entry:
+                            progress = entry['chapter_progress']
+                            completed = sum(1 for v in progress.values() if v)
+                            total = 5
+                            st.progress(completed / total)
+                            st.markdown(f"**ความคืบหน้า:** {completed}/{total} บท ({completed/total*100:.0f}%)")
                         
-                        for i, entry in enumerate(user_analyses[:5], 1):  # แสดงแค่ 5 รายการล่าสุด
-                            with st.expander(f"📄 {entry.get('file_name', 'ไม่ระบุ')} - {entry.get('timestamp', '-')}"):
-                                col_a, col_b = st.columns(2)
-                                with col_a:
-                                    st.markdown(f"**บทที่ตรวจ:** {entry.get('chapter_checked', 'ทั้งหมด')}")
-                                    st.markdown(f"**จำนวนคำ:** {entry.get('word_count', 0):,} คำ")
-                                with col_b:
-                                    st.markdown(f"**จำนวนหน้า:** {entry.get('num_pages', 0)} หน้า")
-                                    st.markdown(f"**ขนาดไฟล์:** {entry.get('file_size', 0) / 1024:.2f} KB")
-                                
-                                # แสดงความคืบหน้า
-                                if 'chapter_progress' in entry:
-                                    progress = entry['chapter_progress']
-                                    completed = sum(1 for v in progress.values() if v)
-                                    total = 5
-                                    st.progress(completed / total)
-                                    st.markdown(f"**ความคืบหน้า:** {completed}/{total} บท ({completed/total*100:.0f}%)")
-                                
-                                # แสดงผลการวิเคราะห์
-                                if st.button(f"📖 ดูผลการวิเคราะห์", key=f"view_{i}"):
-                                    st.markdown(entry.get('analysis_result', 'ไม่มีข้อมูล'))
-                    else:
-                        st.info("ℹ️ ยังไม่มีประวัติการวิเคราะห์")
-                else:
-                    st.info("ℹ️ ยังไม่มีประวัติการวิเคราะห์")
+                        # แสดงผลการวิเคราะห์
+                        if st.button(f"📖 ดูผลการวิเคราะห์", key=f"view_{i}"):
+                            st.markdown(get_repository().load_bodies([entry])[0].get('result', 'ไม่มีข้อมูล'))
             else:
                 st.info("ℹ️ ยังไม่มีประวัติการวิเคราะห์")
                 
@@ -679,11 +691,8 @@ else:
     with tab3:
         st.markdown("## 📊 สถิติของคุณ")
         
-        # อ่านข้อมูลจริงจาก history.json
+        # อ่านข้อมูลจริงจาก repository
         try:
-            import json
-            history_file = "history.json"
-            
             total_files = 0
             total_words = 0
             total_pages = 0
@@ -691,32 +700,23 @@ else:
             score_count = 0
             chapter_stats = {}
             
-            if os.path.exists(history_file):
-                with open(history_file, 'r', encoding='utf-8') as f:
-                    history_data = json.load(f)
+            user_analyses = get_repository().get_user_history(st.session_state.student_username, include_result=False)
+            
+            # คำนวณสถิติ
+            total_files = len(user_analyses)
+            
+            for entry in user_analyses:
+                total_words += entry.get('word_count', 0)
+                total_pages += entry.get('num_pages', 0)
                 
-                # กรองเฉพาะของ user ที่ login
-                if "analyses" in history_data:
-                    user_analyses = [
-                        entry for entry in history_data["analyses"]
-                        if entry.get("username") == st.session_state.student_username
-                    ]
-                    
-                    # คำนวณสถิติ
-                    total_files = len(user_analyses)
-                    
-                    for entry in user_analyses:
-                        total_words += entry.get('word_count', 0)
-                        total_pages += entry.get('num_pages', 0)
-                        
-                        # นับคะแนน
-                        if entry.get('score') is not None:
-                            total_score += entry.get('score', 0)
-                            score_count += 1
-                        
-                        # นับบทที่ตรวจ
-                        chapter = entry.get('chapter_checked', 'ไม่ระบุ')
-                        chapter_stats[chapter] = chapter_stats.get(chapter, 0) + 1
+                # นับคะแนน
+                if entry.get('score') is not None:
+                    total_score += entry.get('score', 0)
+                    score_count += 1
+                
+                # นับบทที่ตรวจ
+                chapter = entry.get('chapter_checked', 'ไม่ระบุ')
+                chapter_stats[chapter] = chapter_stats.get(chapter, 0) + 1
             
             # แสดงสถิติ
             col1, col2, col3 = st.columns(3)
@@ -10,8 +10,20 @@ import pandas as pd
 from datetime import datetime, timedelta
 import json
 import os
+import sys
 import time
 
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_repository import get_repository
+from analysis_cache import get_analysis_cache
+from rate_limiter import get_rate_limiter
+from api_key_pool import get_api_key_pool, mask_key
+from singleflight import get_singleflight
+from model_router import get_router_stats
+from write_coordinator import atomic_write_json, file_lock, get_snapshot_cache, read_json, read_json_snapshot, update_json
+
 # ========== PAGE CONFIG ==========
 st.set_page_config(
     page_title="Admin Panel - ระบบตรวจโครงงาน AI",
@@ -142,10 +154,8 @@ if not st.session_state.admin_logged_in:
                 if username and password:
                     # ตรวจสอบจาก database
                     users_file = "users_database.json"
-                    if os.path.exists(users_file):
-                        with open(users_file, 'r', encoding='utf-8') as f:
-                            users_data = json.load(f)
-                        
+                    users_data = read_json_snapshot(users_file)
+                    if users_data is not None:
                         # หา user ที่ตรงกัน
                         user_found = False
                         for user in users_data.get("users", []):
@@ -195,74 +205,72 @@ else:
         
         # ฟังก์ชันจัดการฐานข้อมูลผู้ใช้
         def load_users():
-            """โหลดข้อมูลผู้ใช้จากไฟล์"""
-            import json
-            users_file = "users_database.json"
-            try:
-                if os.path.exists(users_file):
-                    with open(users_file, 'r', encoding='utf-8') as f:
-                        return json.load(f)
-                else:
-                    return {"users": []}
-            except:
-                return {"users": []}
+            """โหลดข้อมูลผู้ใช้จากไฟล์ (snapshot แบบอ่านอย่างเดียว)"""
+            return read_json_snapshot("users_database.json", {"users": []})
+        
+        def load_users_for_update():
+            """โหลดข้อมูลผู้ใช้แบบแก้ไขได้ (เรียกภายใต้ file lock)"""
+            return read_json("users_database.json", {"users": []})
         
         def save_users(users_data):
-            """บันทึกข้อมูลผู้ใช้ลงไฟล์"""
-            import json
+            """บันทึกข้อมูลผู้ใช้ลงไฟล์ (atomic rename ภายใต้ file lock)"""
             users_file = "users_database.json"
-            with open(users_file, 'w', encoding='utf-8') as f:
-                json.dump(users_data, f, ensure_ascii=False, indent=2)
+            with file_lock(users_file):
+                atomic_write_json(users_file, users_data)
         
+        # add/update/delete ถือ lock ตลอด read-modify-write กันการแก้ไขจาก session อื่นหาย
         def add_user(username, password, name, role):
             """เพิ่มผู้ใช้ใหม่"""
-            users_data = load_users()
-            
-            # ตรวจสอบว่า username ซ้ำหรือไม่
-            for user in users_data["users"]:
-                if user["username"] == username:
-                    return False, "ชื่อผู้ใช้นี้มีอยู่แล้ว"
-            
-            # สร้าง ID ใหม่
-            user_id = f"user_{len(users_data['users']) + 1:03d}"
-            
-            new_user = {
-                "id": user_id,
-                "username": username,
-                "password": password,
-                "name": name,
-                "role": role,
-                "status": "active",
-                "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "last_login": None
-            }
-            
-            users_data["users"].append(new_user)
-            save_users(users_data)
+            with file_lock("users_database.json"):
+                users_data = load_users_for_update()
+                
+                # ตรวจสอบว่า username ซ้ำหรือไม่
+                for user in users_data["users"]:
+                    if user["username"] == username:
+                        return False, "ชื่อผู้ใช้นี้มีอยู่แล้ว"
+                
+                # สร้าง ID ใหม่
+                user_id = f"user_{len(users_data['users']) + 1:03d}"
+                
+                new_user = {
+                    "id": user_id,
+                    "username": username,
+                    "password": password,
+                    "name": name,
+                    "role": role,
+                    "status": "active",
+                    "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    "last_login": None
+                }
+                
+                users_data["users"].append(new_user)
+                save_users(users_data)
             return True, "เพิ่มผู้ใช้สำเร็จ"
         
         def update_user(user_id, username, password, name, role, status):
             """แก้ไขข้อมูลผู้ใช้"""
-            users_data = load_users()
-            
-            for user in users_data["users"]:
-                if user["id"] == user_id:
-                    user["username"] = username
-                    if password:  # เปลี่ยนรหัสผ่านเฉพาะเมื่อใส่ค่าใหม่
-                        user["password"] = password
-                    user["name"] = name
-                    user["role"] = role
-                    user["status"] = status
-                    save_users(users_data)
-                    return True, "แก้ไขข้อมูลสำเร็จ"
+            with file_lock("users_database.json"):
+                users_data = load_users_for_update()
+                
+                for user in users_data["users"]:
+                    if user["id"] == user_id:
+                        user["username"] = username
+                        if password:  # เปลี่ยนรหัสผ่านเฉพาะเมื่อใส่ค่าใหม่
+                            user["password"] = password
+                        user["name"] = name
+                        user["role"] = role
+                        user["status"] = status
+                        save_users(users_data)
+                        return True, "แก้ไขข้อมูลสำเร็จ"
             
             return False, "ไม่พบผู้ใช้"
         
         def delete_user(user_id):
             """ลบผู้ใช้"""
-            users_data = load_users()
-            users_data["users"] = [u for u in users_data["users"] if u["id"] != user_id]
-            save_users(users_data)
+            with file_lock("users_database.json"):
+                users_data = load_users_for_update()
+                users_data["users"] = [u for u in users_data["users"] if u["id"] != user_id]
+                save_users(users_data)
             return True, "ลบผู้ใช้สำเร็จ"
         
         # โหลดข้อมูลผู้ใช้
@@ -402,40 +410,43 @@ else:
     with tab3:
         st.markdown("## 📜 ประวัติการใช้งาน")
         
-        # อ่านข้อมูลจาก history.json
+        # อ่านข้อมูลผ่าน repository (กรองด้วย index ตามผู้ใช้/วันที่)
         try:
-            history_file = "history.json"
-            all_analyses = []
-            
-            if os.path.exists(history_file):
-                with open(history_file, 'r', encoding='utf-8') as f:
-                    history_data = json.load(f)
-                
-                if "analyses" in history_data:
-                    all_analyses = history_data["analyses"]
+            repository = get_repository()
             
             # ดึงรายชื่อ user ทั้งหมด
-            all_users = list(set([entry.get("username", "-") for entry in all_analyses]))
+            all_users = repository.list_users()
             all_users.insert(0, "ทั้งหมด")
             
+            search_text = st.text_input(
+                "🔍 ค้นหาในผลการวิเคราะห์ทั้งระบบ",
+                placeholder='เช่น ไม่มีสถิติความพึงพอใจ, "บทที่ 3" -ครบถ้วน'
+            )
             col1, col2 = st.columns(2)
             with col1:
                 filter_user = st.selectbox("กรองตามผู้ใช้", all_users)
             with col2:
-                filter_date = st.date_input("กรองตามวันที่", datetime.now())
-            
-            # กรองข้อมูล
-            filtered_analyses = all_analyses
+                filter_date = st.date_input("กรองตามวันที่", datetime.now(), disabled=bool(search_text.strip()))
             
-            if filter_user != "ทั้งหมด":
-                filtered_analyses = [a for a in filtered_analyses if a.get("username") == filter_user]
-            
-            if filter_date:
-                filter_date_str = filter_date.strftime('%Y-%m-%d')
-                filtered_analyses = [
-                    a for a in filtered_analyses 
-                    if a.get("timestamp", "").startswith(filter_date_str)
-                ]
+            if search_text.strip():
+                # ค้นหาผ่าน full-text index (ไม่กรองตามวันที่)
+                try:
+                    found = repository.search(
+                        search_text,
+                        username=None if filter_user == "ทั้งหมด" else filter_user,
+                        limit=200
+                    )
+                    filtered_analyses = found["items"]
+                    st.caption(f"พบ {found['total']:,} รายการ (แสดง {len(filtered_analyses)} รายการที่เกี่ยวข้องที่สุด)")
+                except ValueError as e:
+                    st.warning(f"⚠️ คำค้นไม่ถูกต้อง: {e}")
+                    filtered_analyses = []
+            else:
+                # กรองข้อมูลผ่าน index
+                filtered_analyses = repository.find(
+                    username=None if filter_user == "ทั้งหมด" else filter_user,
+                    date_str=filter_date.strftime('%Y-%m-%d') if filter_date else None
+                )
             
             # แสดงข้อมูลเป็นตาราง
             if filtered_analyses:
@@ -457,6 +468,8 @@ else:
                 
                 for i, entry in enumerate(filtered_analyses[:10], 1):  # แสดง 10 รายการล่าสุด
                     with st.expander(f"📄 {entry.get('username', '-')} - {entry.get('file_name', '-')} ({entry.get('timestamp', '-')})"):
+                        if entry.get('snippet'):
+                            st.markdown(f"🔍 {entry['snippet']}")
                         col_a, col_b = st.columns(2)
                         with col_a:
                             st.markdown(f"**ผู้ใช้:** {entry.get('username', '-')}")
@@ -477,7 +490,7 @@ else:
                         
                         # แสดงผลการวิเคราะห์
                         if st.button(f"📖 ดูผลการวิเคราะห์", key=f"admin_view_{i}"):
-                            st.markdown(entry.get('analysis_result', 'ไม่มีข้อมูล'))
+                            st.markdown(repository.load_bodies([entry])[0].get('result', 'ไม่มีข้อมูล'))
             else:
                 st.info("ℹ️ ไม่พบข้อมูลตามเงื่อนไขที่เลือก")
             
@@ -485,14 +498,14 @@ else:
             col1, col2, col3 = st.columns(3)
             
             # นับระเบียนทั้งหมด
-            total_records = len(all_analyses)
+            total_records = repository.total_count()
             
             # นับระเบียนวันนี้
             today_str = datetime.now().strftime('%Y-%m-%d')
-            today_records = len([a for a in all_analyses if a.get("timestamp", "").startswith(today_str)])
+            today_records = repository.count_on_date(today_str)
             
             # นับผู้ใช้ที่ใช้งาน (unique users)
-            active_users = len(set([a.get("username", "-") for a in all_analyses]))
+            active_users = len(all_users) - 1
             
             with col1:
                 st.metric("📋 ระเบียนทั้งหมด", f"{total_records}")
@@ -503,7 +516,7 @@ else:
                 
         except Exception as e:
             st.error(f"❌ ไม่สามารถโหลดประวัติได้: {str(e)}")
-            st.info("ℹ️ กรุณาตรวจสอบไฟล์ history.json")
+            st.info("ℹ️ กรุณาตรวจสอบฐานข้อมูลประวัติการวิเคราะห์")
     
     # ========== TAB 4: SETTINGS ==========
     with tab4:
@@ -533,13 +546,16 @@ else:
                     elif new_pass != confirm_pass:
                         st.error("❌ รหัสผ่านไม่ตรงกัน")
                     else:
-                        # รีเซ็ตรหัสผ่านจริง
-                        for user in users_data['users']:
-                            if user['username'] == reset_user:
-                                user['password'] = new_pass
-                                save_users(users_data)
-                                st.success(f"✅ รีเซ็ตรหัสผ่านสำหรับ '{reset_user}' สำเร็จ!")
-                                break
+                        # รีเซ็ตรหัสผ่านจริง (read-modify-write ภายใต้ file lock)
+                        def reset_password(data):
+                            for user in data['users']:
+                                if user['username'] == reset_user:
+                                    user['password'] = new_pass
+                                    return True
+                            return False
+                        
+                        if update_json("users_database.json", reset_password, {"users": []}):
+                            st.success(f"✅ รีเซ็ตรหัสผ่านสำหรับ '{reset_user}' สำเร็จ!")
             else:
                 st.info("ไม่พบผู้ใช้ในระบบ")
             
@@ -552,6 +568,76 @@ else:
                     st.success("✅ ล้างแคชสำเร็จ!")
                 except Exception as e:
                     st.error(f"❌ เกิดข้อผิดพลาด: {str(e)}")
+            
+            st.markdown("#### ⚡ แคชผลการวิเคราะห์ AI")
+            analysis_cache = get_analysis_cache()
+            cache_stats = analysis_cache.get_stats()
+            col_c1, col_c2, col_c3 = st.columns(3)
+            col_c1.metric("รายการ", f"{cache_stats['entries']:,}")
+            col_c2.metric("ขนาด", f"{cache_stats['size_bytes'] / 1024 / 1024:.1f} / {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB")
+            col_c3.metric("Hit rate", f"{cache_stats['hit_rate'] * 100:.0f}%")
+            st.caption(f"Hit: {cache_stats['hits']:,} | Miss: {cache_stats['misses']:,} | Evicted: {cache_stats['evictions']:,}")
+            snapshot_stats = get_snapshot_cache().get_stats()
+            st.caption(
+                f"📄 JSON snapshot cache: {snapshot_stats['files']} ไฟล์ | "
+                f"Hit rate {snapshot_stats['hit_rate'] * 100:.0f}% "
+                f"({snapshot_stats['hits']:,} hit / {snapshot_stats['misses']:,} parse)"
+            )
+            
+            st.markdown("#### 🚦 คิวการเรียก Gemini")
+            limiter_stats = get_rate_limiter().get_stats()
+            col_r1, col_r2, col_r3, col_r4 = st.columns(4)
+            col_r1.metric("รอคิวอยู่", f"{limiter_stats['queue_depth']:,}")
+            col_r2.metric("เวลารอเฉลี่ย", f"{limiter_stats['avg_wait']:.1f} s")
+            col_r3.metric("เวลารอ p95", f"{limiter_stats['p95_wait']:.1f} s")
+            col_r4.metric("ถูก API จำกัด", f"{limiter_stats['throttled']:,}")
+            st.caption(
+                f"โควต้าต่อ key: {limiter_stats['rpm']:.0f} requests/นาที, {limiter_stats['tpm']:,.0f} tokens/นาที | "
+                f"เรียกแล้ว {limiter_stats['acquired']:,} ครั้ง (ต้องรอคิว {limiter_stats['queued']:,}) | "
+                f"รอนานสุด {limiter_stats['max_wait']:.1f} s | รอเกินกำหนด {limiter_stats['timeouts']:,}"
+            )
+            flight_stats = get_singleflight().get_stats()
+            st.caption(
+                f"🔗 คำขอซ้ำที่ใช้ผลร่วมกับคำขอที่กำลังทำอยู่ (process นี้): {flight_stats['coalesced']:,} | "
+                f"เรียก Gemini จริง {flight_stats['leaders']:,} | กำลังทำอยู่ {flight_stats['in_flight']:,}"
+            )
+            router_stats = get_router_stats()
+            if router_stats:
+                # circuit breaker และ hedged request ต่อ model (process นี้)
+                state_labels = {"closed": "🟢 ปกติ", "half_open": "🟡 กำลังทดสอบ", "open": "🔴 พักอยู่"}
+                st.dataframe([
+                    {
+                        "Model": row["model"],
+                        "สถานะ": state_labels.get(row["state"], row["state"]),
+                        "พักอีก (s)": round(row["opened_for"]),
+                        "Error rate": f"{row['error_rate'] * 100:.0f}% ({row['samples']})",
+                        "p50 (s)": round(row["p50"], 1) if row["p50"] is not None else None,
+                        "p95 (s)": round(row["p95"], 1) if row["p95"] is not None else None,
+                        "p95 ถึง chunk แรก (s)": (round(row["first_chunk_p95"], 1)
+                                                 if row["first_chunk_p95"] is not None else None),
+                        "Hedge (ชนะ)": f"{row['hedges']:,} ({row['hedge_wins']:,})",
+                        "Hedge ที่ข้าม (โควต้าไม่พอ)": row["hedges_skipped"]
+                    }
+                    for row in router_stats
+                ], use_container_width=True, hide_index=True)
+            if limiter_stats["keys"]:
+                st.dataframe([
+                    {
+                        "API key (hash)": bucket["key"],
+                        "requests คงเหลือ": round(bucket["requests"], 1),
+                        "tokens คงเหลือ": round(bucket["tokens"]),
+                        "รอคิว": bucket["queue_depth"],
+                        "หยุดส่งอีก (วินาที)": round(bucket["blocked_for"])
+                    }
+                    for bucket in limiter_stats["keys"]
+                ], use_container_width=True)
+            if st.button("🗑️ ล้างแคชผลการวิเคราะห์", use_container_width=True, type="secondary", key="purge_analysis_cache_btn"):
+                try:
+                    removed = analysis_cache.purge()
+                    st.success(f"✅ ลบผลการวิเคราะห์ใน cache แล้ว {removed:,} รายการ")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"❌ เกิดข้อผิดพลาด: {str(e)}")
         
         with col2:
             st.markdown("### 📧 การแจ้งเตือน")
@@ -560,14 +646,10 @@ else:
             
             # โหลดการตั้งค่าอีเมล
             settings_file = "system_settings.json"
-            if os.path.exists(settings_file):
-                with open(settings_file, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-            else:
-                settings = {
-                    "email_enabled": False,
-                    "email_address": ""
-                }
+            settings = read_json_snapshot(settings_file, {
+                "email_enabled": False,
+                "email_address": ""
+            })
             
             email_enabled = st.checkbox("เปิดใช้การแจ้งเตือนผ่านอีเมล", 
                                        value=settings.get("email_enabled", False), 
@@ -582,10 +664,9 @@ else:
                 with col_email1:
                     if st.button("💾 บันทึกการตั้งค่า", use_container_width=True, key="save_email_btn"):
                         if email:
-                            settings["email_enabled"] = True
-                            settings["email_address"] = email
-                            with open(settings_file, 'w', encoding='utf-8') as f:
-                                json.dump(settings, f, ensure_ascii=False, indent=2)
+                            update_json(settings_file,
+                                        lambda saved: saved.update(email_enabled=True, email_address=email),
+                                        {})
                             st.success("✅ บันทึกการตั้งค่าสำเร็จ!")
                         else:
                             st.error("❌ กรุณากรอกอีเมล")
@@ -600,9 +681,56 @@ else:
             else:
                 # บันทึกการปิดใช้งาน
                 if settings.get("email_enabled", False):
-                    settings["email_enabled"] = False
-                    with open(settings_file, 'w', encoding='utf-8') as f:
-                        json.dump(settings, f, ensure_ascii=False, indent=2)
+                    update_json(settings_file, lambda saved: saved.update(email_enabled=False), {})
+            
+            st.markdown("---")
+            st.markdown("#### 🔑 API Keys ของ Gemini")
+            
+            # key จาก .env และที่เพิ่มที่นี่ใช้ร่วมกัน แต่ละการเรียกส่งไปที่ key ที่เหลือโควต้ามากที่สุด
+            key_pool = get_api_key_pool(settings_file)
+            pool_stats = key_pool.get_stats()
+            st.caption(f"ใช้งานได้ {pool_stats['healthy']}/{pool_stats['total']} key | "
+                       f"โควต้ารวมเพิ่มตามจำนวน key (key ที่ error จะถูกพักแล้วรับกลับอัตโนมัติ)")
+            if pool_stats["keys"]:
+                reasons = {"auth": "⛔ key ไม่ถูกต้อง/ไม่มีสิทธิ์", "quota": "⏳ โควต้าเต็ม",
+                           "daily_quota": "📅 โควต้ารายวันหมด"}
+                st.dataframe([
+                    {
+                        "API key": row["label"],
+                        "ที่มา": "หน้า Admin" if row["source"] == "settings" else ".env",
+                        "สถานะ": "✅ ใช้งานได้" if row["healthy"] else
+                                 f"{reasons.get(row['reason'], row['reason'])} (พักอีก {row['ejected_for']:.0f} s)",
+                        "requests คงเหลือ": round(row["requests"], 1),
+                        "รอคิว": row["queue_depth"],
+                        "สำเร็จ": row["successes"],
+                        "ล้มเหลวติดกัน": row["failures"]
+                    }
+                    for row in pool_stats["keys"]
+                ], use_container_width=True)
+            
+            new_api_key = st.text_input("เพิ่ม API Key", type="password", placeholder="AIzaSy...",
+                                        key="new_api_key_input")
+            col_key1, col_key2 = st.columns(2)
+            with col_key1:
+                if st.button("➕ เพิ่ม Key", use_container_width=True, key="add_api_key_btn"):
+                    if key_pool.add_key(new_api_key):
+                        st.success("✅ เพิ่ม API Key แล้ว")
+                        st.rerun()
+                    else:
+                        st.error("❌ API Key ว่างหรือมีอยู่แล้ว")
+            with col_key2:
+                if st.button("♻️ รับ key ที่ถูกพักกลับทันที", use_container_width=True, key="reset_api_key_health_btn"):
+                    key_pool.reset_health()
+                    st.rerun()
+            
+            saved_keys = {mask_key(k): k for k in settings.get("gemini_api_keys", [])}
+            if saved_keys:
+                remove_label = st.selectbox("ลบ API Key (เฉพาะที่เพิ่มในหน้านี้)", list(saved_keys),
+                                            key="remove_api_key_select")
+                if st.button("🗑️ ลบ Key", use_container_width=True, key="remove_api_key_btn"):
+                    if key_pool.remove_key(saved_keys[remove_label]):
+                        st.success(f"✅ ลบ API Key {remove_label} แล้ว")
+                        st.rerun()
             
             st.markdown("---")
             st.markdown("#### 💾 ฐานข้อมูล")
@@ -631,6 +759,12 @@ else:
                             shutil.copy2(file, backup_name)
                             backed_up.append(file)
                     
+                    # สำรอง segment files ของ storage engine แบบ log
+                    segments_folder = "history_segments"
+                    if os.path.isdir(segments_folder):
+                        shutil.copytree(segments_folder, f"{backup_folder}/{segments_folder}_{timestamp}")
+                        backed_up.append(segments_folder)
+                    
                     if backed_up:
                         st.success(f"✅ สำรองฐานข้อมูลสำเร็จ! ({len(backed_up)} ไฟล์)")
                         st.info(f"📁 ตำแหน่ง: {backup_folder}/")
@@ -685,9 +819,11 @@ else:
             sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
             
             from satisfaction_database import SatisfactionDatabase
+            from survey_analytics import get_survey_analytics
             
             db = SatisfactionDatabase()
             all_surveys = db.get_all_surveys()
+            analytics = get_survey_analytics(db)
             
             # ตรวจสอบว่า all_surveys เป็น list และไม่ว่าง
             if not all_surveys or not isinstance(all_surveys, list):
@@ -716,19 +852,7 @@ else:
                     st.metric("👨‍🎓 นักเรียน", len(student_surveys))
                 
                 with col_stat4:
-                    # คำนวณคะแนนเฉลี่ยอย่างปลอดภัย
-                    try:
-                        avg_scores = []
-                        for s in all_surveys:
-                            if isinstance(s, dict) and 'average_score' in s:
-                                score = s.get('average_score', 0)
-                                if isinstance(score, (int, float)):
-                                    avg_scores.append(score)
-                        
-                        avg_satisfaction = sum(avg_scores) / len(avg_scores) if avg_scores else 0
-                        st.metric("⭐ คะแนนเฉลี่ย", f"{avg_satisfaction:.2f}/5.0")
-                    except:
-                        st.metric("⭐ คะแนนเฉลี่ย", "N/A")
+                    st.metric("⭐ คะแนนเฉลี่ย", f"{analytics.overall_mean():.2f}/5.0")
                 
                 st.markdown("---")
                 
@@ -743,37 +867,20 @@ else:
                 with tab_overview:
                     st.markdown("### 📊 เปรียบเทียบความพึงพอใจ")
                     
-                    # สถิติแบบละเอียด
-                    teacher_stats = db.calculate_statistics("teacher")
-                    student_stats = db.calculate_statistics("student")
+                    # สถิติรายหมวด (response matrix, คำนวณครั้งเดียวต่อข้อมูลชุดหนึ่ง)
+                    teacher_categories = analytics.category_summary("teacher")
+                    student_categories = analytics.category_summary("student")
                     
-                    if teacher_stats and student_stats:
+                    if teacher_categories and student_categories:
                         # กราฟแท่งเปรียบเทียบ
                         import plotly.graph_objects as go
                         
-                        categories = []
-                        teacher_scores = []
-                        student_scores = []
-                        
-                        # รวมหมวดหมู่จาก teacher และ student
-                        all_categories = set(list(teacher_stats.keys()) + list(student_stats.keys()))
-                        
-                        for cat in sorted(all_categories):
-                            if cat != 'overall':
-                                categories.append(cat)
-                                
-                                # ตรวจสอบว่า value เป็น dict จริงก่อนเรียก .get()
-                                teacher_val = teacher_stats.get(cat, {})
-                                if isinstance(teacher_val, dict):
-                                    teacher_scores.append(teacher_val.get('mean', 0))
-                                else:
-                                    teacher_scores.append(0)
-                                
-                                student_val = student_stats.get(cat, {})
-                                if isinstance(student_val, dict):
-                                    student_scores.append(student_val.get('mean', 0))
-                                else:
-                                    student_scores.append(0)
+                        # รวมหมวดหมู่จาก teacher และ student (ตามลำดับของแบบสอบถาม)
+                        category_keys = [c for c in analytics.categories
+                                         if c in teacher_categories or c in student_categories]
+                        categories = [(teacher_categories.get(c) or student_categories[c])["label"] for c in category_keys]
+                        teacher_scores = [teacher_categories.get(c, {}).get("mean", 0) for c in category_keys]
+                        student_scores = [student_categories.get(c, {}).get("mean", 0) for c in category_keys]
                         
                         fig = go.Figure()
                         fig.add_trace(go.Bar(
@@ -807,10 +914,15 @@ else:
                         # แสดงตารางเปรียบเทียบ
                         st.markdown("#### 📋 สรุปคะแนนเฉลี่ยรายหมวด")
                         
+                        comparison = analytics.compare_groups("teacher", "student")
                         comparison_data = {
                             "หมวดหมู่": categories,
                             "ครู (คะแนนเฉลี่ย)": [f"{s:.2f}" for s in teacher_scores],
-                            "นักเรียน (คะแนนเฉลี่ย)": [f"{s:.2f}" for s in student_scores]
+                            "นักเรียน (คะแนนเฉลี่ย)": [f"{s:.2f}" for s in student_scores],
+                            "Welch's t": [
+                                f"{comparison[c]['t']:.2f}" if c in comparison and comparison[c]["t"] is not None else "-"
+                                for c in category_keys
+                            ]
                         }
                         
                         st.dataframe(comparison_data, use_container_width=True)
@@ -819,60 +931,28 @@ else:
                     st.markdown("---")
                     st.markdown("### 📈 การกระจายของคะแนนความพึงพอใจ")
                     
-                    all_scores_teacher = []
-                    all_scores_student = []
-                    
-                    # ดึงคะแนนจากครูอย่างปลอดภัย
-                    for survey in teacher_surveys:
-                        if isinstance(survey, dict):
-                            responses = survey.get('responses', {})
-                            if isinstance(responses, dict):
-                                for k, v in responses.items():
-                                    if k.startswith('q') and isinstance(v, (int, float)):
-                                        all_scores_teacher.append(v)
-                    
-                    # ดึงคะแนนจากนักเรียนอย่างปลอดภัย
-                    for survey in student_surveys:
-                        if isinstance(survey, dict):
-                            responses = survey.get('responses', {})
-                            if isinstance(responses, dict):
-                                for k, v in responses.items():
-                                    if k.startswith('q') and isinstance(v, (int, float)):
-                                        all_scores_student.append(v)
+                    teacher_distribution = analytics.score_distribution("teacher")
+                    student_distribution = analytics.score_distribution("student")
                     
-                    if all_scores_teacher or all_scores_student:
-                        try:
-                            import pandas as pd
-                            import plotly.express as px
-                            
-                            # สร้าง DataFrame
-                            data = []
-                            for score in all_scores_teacher:
-                                data.append({"คะแนน": score, "กลุ่ม": "ครู"})
-                            for score in all_scores_student:
-                                data.append({"คะแนน": score, "กลุ่ม": "นักเรียน"})
-                            
-                            df = pd.DataFrame(data)
-                            
-                            fig = px.histogram(
-                                df, 
-                                x="คะแนน", 
-                                color="กลุ่ม",
-                                barmode="overlay",
-                                nbins=5,
-                                color_discrete_map={"ครู": "#E8B4D4", "นักเรียน": "#D4A5C8"}
-                            )
-                            
-                            fig.update_layout(
-                                title="การกระจายของคะแนน (1-5)",
-                                xaxis_title="คะแนน",
-                                yaxis_title="จำนวน",
-                                height=400
-                            )
-                            
-                            st.plotly_chart(fig, use_container_width=True)
-                        except Exception as e:
-                            st.warning(f"⚠️ ไม่สามารถสร้างกราฟได้: {str(e)}")
+                    if sum(teacher_distribution.values()) or sum(student_distribution.values()):
+                        import plotly.graph_objects as go
+                        
+                        fig = go.Figure(data=[
+                            go.Bar(name="ครู", x=list(teacher_distribution.keys()),
+                                   y=list(teacher_distribution.values()), marker_color="#E8B4D4"),
+                            go.Bar(name="นักเรียน", x=list(student_distribution.keys()),
+                                   y=list(student_distribution.values()), marker_color="#D4A5C8")
+                        ])
+                        
+                        fig.update_layout(
+                            title="การกระจายของคะแนน (1-5)",
+                            xaxis_title="คะแนน",
+                            yaxis_title="จำนวน",
+                            barmode="group",
+                            height=400
+                        )
+                        
+                        st.plotly_chart(fig, use_container_width=True)
                     else:
                         st.info("📭 ไม่มีข้อมูลคะแนนเพียงพอในการสร้างกราฟ")
                 
@@ -883,23 +963,21 @@ else:
                         st.info("📭 ยังไม่มีการประเมินจากครู")
                     else:
                         # แสดงสถิติครู
-                        teacher_stats = db.calculate_statistics("teacher")
+                        teacher_categories = analytics.category_summary("teacher")
                         
-                        if teacher_stats and isinstance(teacher_stats, dict):
+                        if teacher_categories:
                             st.markdown("#### 📊 คะแนนเฉลี่ยแต่ละหมวดหมู่")
                             
-                            for category, stats in teacher_stats.items():
-                                if category != 'overall' and isinstance(stats, dict):
-                                    col1, col2, col3 = st.columns(3)
-                                    with col1:
-                                        mean_val = stats.get('mean', 0)
-                                        st.metric(f"📌 {category}", f"{mean_val:.2f}/5.0")
-                                    with col2:
-                                        max_val = stats.get('max', 0)
-                                        st.metric("สูงสุด", f"{max_val:.2f}")
-                                    with col3:
-                                        min_val = stats.get('min', 0)
-                                        st.metric("ต่ำสุด", f"{min_val:.2f}")
+                            for category, stats in teacher_categories.items():
+                                col1, col2, col3 = st.columns(3)
+                                with col1:
+                                    st.metric(f"📌 {stats['label']}", f"{stats['mean']:.2f}/5.0")
+                                with col2:
+                                    st.metric("SD", f"{stats['std']:.2f}")
+                                with col3:
+                                    alpha = stats['alpha']
+                                    st.metric("Cronbach's α", f"{alpha:.3f}" if alpha is not None else "-",
+                                              help=f"{stats['questions']} ข้อ, {stats['respondents']} คน")
                         
                         st.markdown("---")
                         
@@ -935,23 +1013,21 @@ else:
                         st.info("📭 ยังไม่มีการประเมินจากนักเรียน")
                     else:
                         # แสดงสถิตินักเรียน
-                        student_stats = db.calculate_statistics("student")
+                        student_categories = analytics.category_summary("student")
                         
-                        if student_stats and isinstance(student_stats, dict):
+                        if student_categories:
                             st.markdown("#### 📊 คะแนนเฉลี่ยแต่ละหมวดหมู่")
                             
-                            for category, stats in student_stats.items():
-                                if category != 'overall' and isinstance(stats, dict):
-                                    col1, col2, col3 = st.columns(3)
-                                    with col1:
-                                        mean_val = stats.get('mean', 0)
-                                        st.metric(f"📌 {category}", f"{mean_val:.2f}/5.0")
-                                    with col2:
-                                        max_val = stats.get('max', 0)
-                                        st.metric("สูงสุด", f"{max_val:.2f}")
-                                    with col3:
-                                        min_val = stats.get('min', 0)
-                                        st.metric("ต่ำสุด", f"{min_val:.2f}")
+                            for category, stats in student_categories.items():
+                                col1, col2, col3 = st.columns(3)
+                                with col1:
+                                    st.metric(f"📌 {stats['label']}", f"{stats['mean']:.2f}/5.0")
+                                with col2:
+                                    st.metric("SD", f"{stats['std']:.2f}")
+                                with col3:
+                                    alpha = stats['alpha']
+                                    st.metric("Cronbach's α", f"{alpha:.3f}" if alpha is not None else "-",
+                                              help=f"{stats['questions']} ข้อ, {stats['respondents']} คน")
                         
                         st.markdown("---")
                         
@@ -1056,12 +1132,13 @@ else:
                         
                         with col_summary1:
                             st.markdown("##### 📊 สถิติการตอบแบบสอบถาม")
+                            survey_metadata = db.get_metadata()
                             summary_stats = {
                                 "การตอบแบบสอบถามทั้งหมด": len(all_surveys),
                                 "ครูที่ตอบแบบสอบถาม": len(teacher_surveys),
                                 "นักเรียนที่ตอบแบบสอบถาม": len(student_surveys),
-                                "วันที่สร้างข้อมูล": db._load_data().get('metadata', {}).get('created_at', 'N/A'),
-                                "อัพเดทล่าสุด": db._load_data().get('metadata', {}).get('last_updated', 'N/A')
+                                "วันที่สร้างข้อมูล": survey_metadata.get('created_at', 'N/A'),
+                                "อัพเดทล่าสุด": survey_metadata.get('last_updated', 'N/A')
                             }
                             
                             for key, value in summary_stats.items():
@@ -1070,45 +1147,26 @@ else:
                         with col_summary2:
                             st.markdown("##### ⭐ คะแนนเฉลี่ยตามหมวดหมู่")
                             
-                            # คำนวณคะแนนเฉลี่ยรวมทั้งครูและนักเรียน
-                            teacher_stats = db.calculate_statistics("teacher")
-                            student_stats = db.calculate_statistics("student")
+                            # คะแนนเฉลี่ยรวมทั้งครูและนักเรียน
+                            combined_categories = analytics.category_summary()
+                            teacher_categories = analytics.category_summary("teacher")
+                            student_categories = analytics.category_summary("student")
                             
-                            # แสดงคะแนนเฉลี่ยรวม
-                            if teacher_stats and student_stats:
-                                all_categories = set(list(teacher_stats.keys()) + list(student_stats.keys()))
-                                
-                                for cat in sorted(all_categories):
-                                    if cat != 'overall_mean' and cat != 'overall':
-                                        teacher_val = teacher_stats.get(cat, {})
-                                        student_val = student_stats.get(cat, {})
-                                        
-                                        teacher_mean = teacher_val.get('mean', 0) if isinstance(teacher_val, dict) else 0
-                                        student_mean = student_val.get('mean', 0) if isinstance(student_val, dict) else 0
-                                        
-                                        # คำนวณค่าเฉลี่ยรวม
-                                        if teacher_mean > 0 and student_mean > 0:
-                                            combined_mean = (teacher_mean + student_mean) / 2
-                                        elif teacher_mean > 0:
-                                            combined_mean = teacher_mean
-                                        elif student_mean > 0:
-                                            combined_mean = student_mean
-                                        else:
-                                            combined_mean = 0
-                                        
-                                        st.metric(
-                                            f"{cat}", 
-                                            f"{combined_mean:.2f}/5.0",
-                                            help=f"ครู: {teacher_mean:.2f}, นักเรียน: {student_mean:.2f}"
-                                        )
+                            for category, stats in combined_categories.items():
+                                teacher_mean = teacher_categories.get(category, {}).get("mean", 0)
+                                student_mean = student_categories.get(category, {}).get("mean", 0)
+                                st.metric(
+                                    stats["label"],
+                                    f"{stats['mean']:.2f}/5.0",
+                                    help=f"ครู: {teacher_mean:.2f}, นักเรียน: {student_mean:.2f}"
+                                )
                         
                         st.markdown("---")
                         
                         # แสดง metadata แบบ JSON
                         st.markdown("##### 🔍 ข้อมูล Metadata (JSON)")
                         with st.expander("แสดงข้อมูล Metadata แบบละเอียด"):
-                            metadata = db._load_data().get('metadata', {})
-                            st.json(metadata)
+                            st.json(db.get_metadata())
                         
                         # แสดงคำแนะนำ
                         st.info("""
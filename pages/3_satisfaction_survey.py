@@ -13,7 +13,7 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from satisfaction_database import SatisfactionDatabase
-import json
+from write_coordinator import read_json_snapshot
 
 # Page config
 st.set_page_config(
@@ -118,12 +118,7 @@ satisfaction_db = SatisfactionDatabase()
 
 # Load users function
 def load_users():
-    try:
-        with open('users_database.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get('users', [])
-    except:
-        return []
+    return read_json_snapshot('users_database.json', {}).get('users', [])
 
 def get_user(username):
     users = load_users()
@@ -9,7 +9,6 @@ import streamlit as st
 import sys
 import os
 import plotly.graph_objects as go
-import plotly.express as px
 from datetime import datetime
 import pandas as pd
 
@@ -17,6 +16,8 @@ import pandas as pd
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from satisfaction_database import SatisfactionDatabase
+from survey_analytics import get_survey_analytics
+from write_coordinator import read_json_snapshot
 import json
 
 # Page config
@@ -122,12 +123,7 @@ satisfaction_db = SatisfactionDatabase()
 
 # Load users function
 def load_users():
-    try:
-        with open('users_database.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get('users', [])
-    except:
-        return []
+    return read_json_snapshot('users_database.json', {}).get('users', [])
 
 def get_user(username):
     users = load_users()
@@ -136,6 +132,25 @@ def get_user(username):
             return user
     return None
 
+def show_category(category_stats, question_stats, category, title):
+    """แสดงคะแนนเฉลี่ย, Cronbach's alpha และคะแนนรายข้อของหมวด"""
+    stats = category_stats.get(category)
+    if not stats:
+        return
+    st.markdown(f"#### {title}")
+    st.metric("คะแนนเฉลี่ย", f"{stats['mean']:.2f}/5.00")
+    if stats["alpha"] is not None:
+        st.caption(f"SD {stats['std']:.2f} | Cronbach's α = {stats['alpha']:.3f} ({stats['questions']} ข้อ)")
+    
+    for key, data in question_stats.items():
+        if key.startswith(f"{category}_"):
+            st.write(f"• {data['mean']:.2f}/5.00 (SD {data['std']:.2f}, {data['count']} คน)")
+
+def radar_series(category_stats, categories):
+    """(ค่าเฉลี่ย, ชื่อหมวด) สำหรับกราฟเรดาร์ เฉพาะหมวดที่มีข้อมูล"""
+    present = [c for c in categories if c in category_stats]
+    return [category_stats[c]["mean"] for c in present], [category_stats[c]["label"] for c in present]
+
 # Check login - รองรับทั้ง logged_in และ student_logged_in
 is_logged_in = (
     (st.session_state.get('logged_in', False)) or 
@@ -190,10 +205,11 @@ tab1, tab2, tab3, tab4 = st.tabs(["📊 ภาพรวม", "👨‍🏫 คร
 with tab1:
     st.markdown("## 📊 สรุปผลภาพรวม")
     
-    # Calculate overall statistics
+    # Calculate statistics (จาก aggregate สะสม ใช้ร่วมกันทุกแท็บ)
     overall_stats = satisfaction_db.calculate_statistics()
     teacher_stats = satisfaction_db.calculate_statistics("teacher")
     student_stats = satisfaction_db.calculate_statistics("student")
+    analytics = get_survey_analytics(satisfaction_db)
     
     # Display overall satisfaction
     col1, col2, col3 = st.columns(3)
@@ -264,37 +280,50 @@ with tab1:
         )
         
         st.plotly_chart(fig, use_container_width=True)
+        
+        # ตารางเปรียบเทียบรายหมวด (Welch's t)
+        comparison = analytics.compare_groups("teacher", "student")
+        if comparison:
+            st.markdown("#### 📋 เปรียบเทียบรายหมวด (ครู - นักเรียน)")
+            st.dataframe(pd.DataFrame([
+                {
+                    "หมวด": row["label"],
+                    "ครู": round(row["mean_a"], 2),
+                    "นักเรียน": round(row["mean_b"], 2),
+                    "ผลต่าง": round(row["difference"], 2),
+                    "Welch's t": round(row["t"], 2) if row["t"] is not None else None,
+                    "df": round(row["df"], 1) if row["df"] is not None else None
+                }
+                for row in comparison.values()
+            ]), use_container_width=True, hide_index=True)
     
     # Distribution chart
     st.markdown("### 📈 การกระจายของคะแนนความพึงพอใจ")
     
-    all_surveys = satisfaction_db.get_all_surveys()
-    all_scores = []
-    
-    for survey in all_surveys:
-        responses = survey.get("responses", {})
-        for key, value in responses.items():
-            if isinstance(value, (int, float)) and value > 0:
-                all_scores.append({
-                    'user_type': 'ครู' if survey['user_type'] == 'teacher' else 'นักเรียน',
-                    'score': value
-                })
+    teacher_distribution = analytics.score_distribution("teacher")
+    student_distribution = analytics.score_distribution("student")
     
-    if all_scores:
-        df_scores = pd.DataFrame(all_scores)
+    if sum(teacher_distribution.values()) or sum(student_distribution.values()):
+        fig = go.Figure(data=[
+            go.Bar(
+                name='ครู',
+                x=list(teacher_distribution.keys()),
+                y=list(teacher_distribution.values()),
+                marker_color='#E8B4D4'
+            ),
+            go.Bar(
+                name='นักเรียน',
+                x=list(student_distribution.keys()),
+                y=list(student_distribution.values()),
+                marker_color='#D4A5C8'
+            )
+        ])
         
-        fig = px.histogram(
-            df_scores,
-            x='score',
-            color='user_type',
+        fig.update_layout(
             barmode='group',
-            nbins=5,
             title='การกระจายของคะแนน (1-5)',
-            labels={'score': 'คะแนน', 'user_type': 'กลุ่ม', 'count': 'จำนวน'},
-            color_discrete_map={'ครู': '#E8B4D4', 'นักเรียน': '#D4A5C8'}
-        )
-        
-        fig.update_layout(
+            xaxis_title='คะแนน',
+            yaxis_title='จำนวน',
             font=dict(family="Prompt", size=14),
             height=400
         )
@@ -308,8 +337,6 @@ with tab2:
     if teacher_responses == 0:
         st.info("ยังไม่มีครูตอบแบบสอบถาม")
     else:
-        teacher_stats = satisfaction_db.calculate_statistics("teacher")
-        
         if teacher_stats:
             # Overall satisfaction
             teacher_mean = teacher_stats.get("overall_mean", 0)
@@ -330,86 +357,26 @@ with tab2:
             # Detailed scores by category
             st.markdown("### 📊 คะแนนแยกตามหมวดหมู่")
             
-            categories = teacher_stats.get("categories", {})
-            
-            # Group by category
-            usability_scores = {}
-            effectiveness_scores = {}
-            adoption_scores = {}
-            overall_scores = {}
-            
-            for key, data in categories.items():
-                if key.startswith("usability_"):
-                    usability_scores[key] = data
-                elif key.startswith("effectiveness_"):
-                    effectiveness_scores[key] = data
-                elif key.startswith("adoption_"):
-                    adoption_scores[key] = data
-                elif key.startswith("overall_"):
-                    overall_scores[key] = data
+            category_stats = analytics.category_summary("teacher")
+            question_stats = teacher_stats.get("categories", {})
             
             # Display categories
             col1, col2 = st.columns(2)
             
             with col1:
-                if usability_scores:
-                    st.markdown("#### 1️⃣ ด้านการใช้งาน")
-                    avg_usability = sum(d["mean"] for d in usability_scores.values()) / len(usability_scores)
-                    st.metric("คะแนนเฉลี่ย", f"{avg_usability:.2f}/5.00")
-                    
-                    for key, data in usability_scores.items():
-                        st.write(f"• {data['mean']:.2f}/5.00 ({data['count']} คน)")
-                
-                if adoption_scores:
-                    st.markdown("#### 3️⃣ ด้านการนำไปใช้")
-                    avg_adoption = sum(d["mean"] for d in adoption_scores.values()) / len(adoption_scores)
-                    st.metric("คะแนนเฉลี่ย", f"{avg_adoption:.2f}/5.00")
-                    
-                    for key, data in adoption_scores.items():
-                        st.write(f"• {data['mean']:.2f}/5.00 ({data['count']} คน)")
+                show_category(category_stats, question_stats, "usability", "1️⃣ ด้านการใช้งาน")
+                show_category(category_stats, question_stats, "adoption", "3️⃣ ด้านการนำไปใช้")
             
             with col2:
-                if effectiveness_scores:
-                    st.markdown("#### 2️⃣ ด้านประสิทธิภาพ")
-                    avg_effectiveness = sum(d["mean"] for d in effectiveness_scores.values()) / len(effectiveness_scores)
-                    st.metric("คะแนนเฉลี่ย", f"{avg_effectiveness:.2f}/5.00")
-                    
-                    for key, data in effectiveness_scores.items():
-                        st.write(f"• {data['mean']:.2f}/5.00 ({data['count']} คน)")
-                
-                if overall_scores:
-                    st.markdown("#### 4️⃣ ความพึงพอใจโดยรวม")
-                    avg_overall = sum(d["mean"] for d in overall_scores.values()) / len(overall_scores)
-                    st.metric("คะแนนเฉลี่ย", f"{avg_overall:.2f}/5.00")
-                    
-                    for key, data in overall_scores.items():
-                        st.write(f"• {data['mean']:.2f}/5.00 ({data['count']} คน)")
+                show_category(category_stats, question_stats, "effectiveness", "2️⃣ ด้านประสิทธิภาพ")
+                show_category(category_stats, question_stats, "overall", "4️⃣ ความพึงพอใจโดยรวม")
             
             # Radar chart
             st.markdown("### 🎯 กราฟเรดาร์แสดงความพึงพอใจแต่ละด้าน (ครู)")
             
-            category_means = []
-            category_names = []
-            
-            if usability_scores:
-                avg_usability = sum(d["mean"] for d in usability_scores.values()) / len(usability_scores)
-                category_means.append(avg_usability)
-                category_names.append("การใช้งาน")
-            
-            if effectiveness_scores:
-                avg_effectiveness = sum(d["mean"] for d in effectiveness_scores.values()) / len(effectiveness_scores)
-                category_means.append(avg_effectiveness)
-                category_names.append("ประสิทธิภาพ")
-            
-            if adoption_scores:
-                avg_adoption = sum(d["mean"] for d in adoption_scores.values()) / len(adoption_scores)
-                category_means.append(avg_adoption)
-                category_names.append("การนำไปใช้")
-            
-            if overall_scores:
-                avg_overall = sum(d["mean"] for d in overall_scores.values()) / len(overall_scores)
-                category_means.append(avg_overall)
-                category_names.append("โดยรวม")
+            category_means, category_names = radar_series(
+                category_stats, ["usability", "effectiveness", "adoption", "overall"]
+            )
             
             if category_means:
                 fig = go.Figure()
@@ -465,8 +432,6 @@ with tab3:
     if student_responses == 0:
         st.info("ยังไม่มีนักเรียนตอบแบบสอบถาม")
     else:
-        student_stats = satisfaction_db.calculate_statistics("student")
-        
         if student_stats:
             # Overall satisfaction
             student_mean = student_stats.get("overall_mean", 0)
@@ -487,70 +452,26 @@ with tab3:
             # Detailed scores by category
             st.markdown("### 📊 คะแนนแยกตามหมวดหมู่")
             
-            categories = student_stats.get("categories", {})
-            
-            # Group by category
-            usability_scores = {}
-            benefits_scores = {}
-            overall_scores = {}
-            
-            for key, data in categories.items():
-                if key.startswith("usability_"):
-                    usability_scores[key] = data
-                elif key.startswith("benefits_"):
-                    benefits_scores[key] = data
-                elif key.startswith("overall_"):
-                    overall_scores[key] = data
+            category_stats = analytics.category_summary("student")
+            question_stats = student_stats.get("categories", {})
             
             # Display categories
             col1, col2 = st.columns(2)
             
             with col1:
-                if usability_scores:
-                    st.markdown("#### 1️⃣ ด้านการใช้งาน")
-                    avg_usability = sum(d["mean"] for d in usability_scores.values()) / len(usability_scores)
-                    st.metric("คะแนนเฉลี่ย", f"{avg_usability:.2f}/5.00")
-                    
-                    for key, data in usability_scores.items():
-                        st.write(f"• {data['mean']:.2f}/5.00 ({data['count']} คน)")
+                show_category(category_stats, question_stats, "usability", "1️⃣ ด้านการใช้งาน")
             
             with col2:
-                if benefits_scores:
-                    st.markdown("#### 2️⃣ ด้านประโยชน์ที่ได้รับ")
-                    avg_benefits = sum(d["mean"] for d in benefits_scores.values()) / len(benefits_scores)
-                    st.metric("คะแนนเฉลี่ย", f"{avg_benefits:.2f}/5.00")
-                    
-                    for key, data in benefits_scores.items():
-                        st.write(f"• {data['mean']:.2f}/5.00 ({data['count']} คน)")
-            
-            if overall_scores:
-                st.markdown("#### 3️⃣ ความพึงพอใจโดยรวม")
-                avg_overall = sum(d["mean"] for d in overall_scores.values()) / len(overall_scores)
-                st.metric("คะแนนเฉลี่ย", f"{avg_overall:.2f}/5.00")
-                
-                for key, data in overall_scores.items():
-                    st.write(f"• {data['mean']:.2f}/5.00 ({data['count']} คน)")
+                show_category(category_stats, question_stats, "benefits", "2️⃣ ด้านประโยชน์ที่ได้รับ")
+            
+            show_category(category_stats, question_stats, "overall", "3️⃣ ความพึงพอใจโดยรวม")
             
             # Radar chart
             st.markdown("### 🎯 กราฟเรดาร์แสดงความพึงพอใจแต่ละด้าน (นักเรียน)")
             
-            category_means = []
-            category_names = []
-            
-            if usability_scores:
-                avg_usability = sum(d["mean"] for d in usability_scores.values()) / len(usability_scores)
-                category_means.append(avg_usability)
-                category_names.append("การใช้งาน")
-            
-            if benefits_scores:
-                avg_benefits = sum(d["mean"] for d in benefits_scores.values()) / len(benefits_scores)
-                category_means.append(avg_benefits)
-                category_names.append("ประโยชน์")
-            
-            if overall_scores:
-                avg_overall = sum(d["mean"] for d in overall_scores.values()) / len(overall_scores)
-                category_means.append(avg_overall)
-                category_names.append("โดยรวม")
+            category_means, category_names = radar_series(
+                category_stats, ["usability", "benefits", "overall"]
+            )
             
             if category_means:
                 fig = go.Figure()
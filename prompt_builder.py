@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prompt builder - จัดเนื้อหาเอกสารให้อยู่ในงบ token ของ prompt
+
+- ประมาณจำนวน token จากจำนวนอักษรไทย/อักษรอื่น (แทนการตัดตามจำนวนตัวอักษร)
+- เอกสารที่ไม่เกินงบ: ส่งทั้งเอกสาร
+- เอกสารที่เกินงบ: map-reduce
+    map    = แบ่งเอกสารตามบท/ย่อหน้า แล้วให้ Gemini สรุปแต่ละส่วนพร้อมกัน (จำกัด fan-out)
+    reduce = ผู้เรียกนำสรุปทุกส่วนไปใส่ใน prompt วิเคราะห์ตามปกติ
+  ส่วนท้ายเอกสาร (สรุปผล/อภิปรายผล) จึงไม่ถูกตัดทิ้ง
+
+ตั้งค่าด้วยตัวแปร PROMPT_TOKEN_BUDGET, MAP_CHUNK_TOKENS, MAP_MAX_CHUNKS, MAP_FAN_OUT
+"""
+
+import asyncio
+import math
+import os
+import re
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+from chapter_segmenter import SectionIndex
+
+# ประมาณการ: อักษรไทยราว 2 ตัวต่อ token, อักษรอื่นราว 4 ตัวต่อ token
+THAI_CHARS_PER_TOKEN = 2.0
+OTHER_CHARS_PER_TOKEN = 4.0
+
+_THAI_CHAR = re.compile(r"[฀-๿]")
+
+# คำสั่งสำหรับขั้น map: เก็บข้อมูลที่การตรวจความสอดคล้องต้องใช้
+CONSISTENCY_MAP_FOCUS = (
+    "วัตถุประสงค์ทุกข้อ ขอบเขต วิธีดำเนินการโดยย่อ ผลการดำเนินงาน "
+    "ตัวเลข/ค่าสถิติ (เช่น ค่าเฉลี่ย ร้อยละ ความพึงพอใจ ประสิทธิภาพ) และข้อสรุป/อภิปรายผล"
+)
+
+Generate = Callable[[str], Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    """ประมาณจำนวน token ของข้อความ"""
+    thai = len(_THAI_CHAR.findall(text))
+    return math.ceil(thai / THAI_CHARS_PER_TOKEN + (len(text) - thai) / OTHER_CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """ตัดข้อความให้ไม่เกิน max_tokens (ประมาณการ)"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # ตัดตามสัดส่วนแล้วลดลงทีละน้อยจนไม่เกินงบ
+    end = int(len(text) * max_tokens / estimate_tokens(text))
+    while end > 0 and estimate_tokens(text[:end]) > max_tokens:
+        end = int(end * 0.95)
+    return text[:end]
+
+
+class PromptBudget:
+    """งบ token ของ prompt และขีดจำกัดของขั้น map"""
+
+    def __init__(self,
+                 prompt_tokens: int = 8000,
+                 chunk_tokens: int = 6000,
+                 max_chunks: int = 16,
+                 fan_out: int = 4,
+                 summary_words: int = 250):
+        """
+        Args:
+            prompt_tokens: งบ token ของเนื้อหาเอกสารใน prompt วิเคราะห์
+            chunk_tokens: ขนาดเป้าหมายของแต่ละส่วนในขั้น map
+            max_chunks: จำนวนส่วนสูงสุด (เอกสารยาวมากจะได้ส่วนที่ใหญ่ขึ้นแทน)
+            fan_out: จำนวนการเรียก Gemini พร้อมกันในขั้น map
+            summary_words: ความยาวสรุปต่อส่วนที่ขอจาก model
+        """
+        self.prompt_tokens = prompt_tokens
+        self.chunk_tokens = chunk_tokens
+        self.max_chunks = max_chunks
+        self.fan_out = fan_out
+        self.summary_words = summary_words
+
+    @property
+    def max_document_chars(self) -> int:
+        """จำนวนตัวอักษรสูงสุดที่ควรอ่านจากไฟล์ (ใช้เป็น max_chars ของ document_reader)"""
+        return int(self.max_chunks * self.chunk_tokens * OTHER_CHARS_PER_TOKEN)
+
+
+def get_prompt_budget() -> PromptBudget:
+    """
+    PromptBudget จากตัวแปร PROMPT_TOKEN_BUDGET, MAP_CHUNK_TOKENS, MAP_MAX_CHUNKS, MAP_FAN_OUT
+    """
+    return PromptBudget(
+        prompt_tokens=int(os.getenv("PROMPT_TOKEN_BUDGET", "8000")),
+        chunk_tokens=int(os.getenv("MAP_CHUNK_TOKENS", "6000")),
+        max_chunks=int(os.getenv("MAP_MAX_CHUNKS", "16")),
+        fan_out=int(os.getenv("MAP_FAN_OUT", "4"))
+    )
+
+
+def _split_paragraphs(text: str, max_tokens: int) -> List[str]:
+    """รวมย่อหน้าต่อกันเป็นส่วนละไม่เกิน max_tokens"""
+    chunks: List[str] = []
+    parts: List[str] = []
+    size = 0
+    for paragraph in text.split("\n"):
+        tokens = estimate_tokens(paragraph) + 1
+        if parts and size + tokens > max_tokens:
+            chunks.append("\n".join(parts))
+            parts, size = [], 0
+        # ย่อหน้าเดียวที่ยาวเกินงบ ตัดเป็นช่วงๆ
+        while tokens > max_tokens:
+            head = truncate_to_tokens(paragraph, max_tokens)
+            chunks.append(head)
+            paragraph = paragraph[len(head):]
+            tokens = estimate_tokens(paragraph) + 1
+        parts.append(paragraph)
+        size += tokens
+    if parts and "\n".join(parts).strip():
+        chunks.append("\n".join(parts))
+    return chunks
+
+
+def split_into_chunks(text: str, chunk_tokens: int, max_chunks: int) -> List[str]:
+    """
+    แบ่งเอกสารเป็นส่วนๆ ตามหัวข้อบท (ถ้าพบ) และย่อหน้า
+
+    Args:
+        text: ข้อความทั้งเอกสาร
+        chunk_tokens: ขนาดเป้าหมายต่อส่วน
+        max_chunks: จำนวนส่วนสูงสุด
+
+    Returns:
+        รายการข้อความของแต่ละส่วน ตามลำดับในเอกสาร
+    """
+    sections = SectionIndex(text).sections
+    if sections:
+        bounds = [0] + [s.start for s in sections] + [len(text)]
+        blocks = [text[a:b] for a, b in zip(bounds, bounds[1:]) if text[a:b].strip()]
+    else:
+        blocks = [text]
+
+    size = max(chunk_tokens, math.ceil(estimate_tokens(text) / max_chunks))
+    while True:
+        chunks = [chunk for block in blocks for chunk in _split_paragraphs(block, size)]
+        if len(chunks) <= max_chunks:
+            return chunks
+        # ส่วนมากเกินไป: รวมเป็นก้อนตามขนาดแทนการแยกตามบท
+        blocks = [text]
+        size = int(size * 1.25) + 1
+
+
+class CondensedDocument:
+    """เนื้อหาที่พร้อมใส่ใน prompt"""
+
+    def __init__(self, content: str, mode: str, tokens: int, chunks: int = 0, failed_chunks: int = 0):
+        self.content = content
+        self.mode = mode                    # "full" หรือ "map_reduce"
+        self.tokens = tokens                # token โดยประมาณของเอกสารต้นฉบับ
+        self.chunks = chunks
+        self.failed_chunks = failed_chunks
+
+    def summary(self) -> str:
+        """ข้อความสรุปสำหรับแสดงผล"""
+        if self.mode == "full":
+            return f"ส่งทั้งเอกสาร (~{self.tokens:,} tokens)"
+        text = f"เอกสารยาว (~{self.tokens:,} tokens) สรุปทีละส่วน {self.chunks} ส่วนก่อนวิเคราะห์"
+        if self.failed_chunks:
+            text += f" (สรุปไม่สำเร็จ {self.failed_chunks} ส่วน)"
+        return text
+
+
+def build_map_prompt(chunk: str, index: int, total: int, focus: str, summary_words: int) -> str:
+    """prompt ขั้น map: สรุปเอกสารส่วนที่ index"""
+    return f"""
+        Role: คุณคือผู้ช่วยอ่านเอกสารโครงงาน
+        Task: สรุปเอกสารส่วนที่ {index}/{total} ให้กระชับ ไม่เกิน {summary_words} คำ
+
+        ให้เก็บข้อมูลต่อไปนี้ไว้ให้ครบถ้าปรากฏในส่วนนี้ (คัดลอกตัวเลขตามต้นฉบับ):
+        {focus}
+
+        ถ้าส่วนนี้ไม่มีข้อมูลดังกล่าว ให้ตอบสั้นๆ ว่าส่วนนี้เกี่ยวกับอะไร
+
+        Content:
+        {chunk}
+        """
+
+
+async def condense_document(text: str,
+                            generate: Generate,
+                            budget: Optional[PromptBudget] = None,
+                            focus: str = CONSISTENCY_MAP_FOCUS) -> CondensedDocument:
+    """
+    จัดเนื้อหาเอกสารให้อยู่ในงบ token (ขั้น map ของ map-reduce)
+
+    Args:
+        text: ข้อความทั้งเอกสาร
+        generate: coroutine function ที่รับ prompt แล้วคืนคำตอบจาก model
+        budget: งบ token (default: get_prompt_budget())
+        focus: ข้อมูลที่ต้องเก็บไว้ในสรุปแต่ละส่วน
+
+    Returns:
+        CondensedDocument (content คือข้อความเต็ม หรือสรุปของแต่ละส่วนต่อกัน)
+
+    Raises:
+        error สุดท้ายจาก generate ถ้าสรุปไม่สำเร็จทุกส่วน
+    """
+    budget = budget or get_prompt_budget()
+    tokens = estimate_tokens(text)
+    if tokens <= budget.prompt_tokens:
+        return CondensedDocument(text, "full", tokens)
+
+    chunks = split_into_chunks(text, budget.chunk_tokens, budget.max_chunks)
+    semaphore = asyncio.Semaphore(max(budget.fan_out, 1))
+
+    async def summarize(index: int, chunk: str) -> str:
+        async with semaphore:
+            return await generate(build_map_prompt(chunk, index, len(chunks), focus, budget.summary_words))
+
+    results = await asyncio.gather(
+        *(summarize(i + 1, chunk) for i, chunk in enumerate(chunks)),
+        return_exceptions=True
+    )
+
+    parts = []
+    failed = 0
+    for i, result in enumerate(results):
+        if isinstance(result, BaseException):
+            print(f"Error summarizing chunk {i + 1}/{len(chunks)}: {result}")
+            failed += 1
+            continue
+        parts.append(f"### ส่วนที่ {i + 1}/{len(chunks)}\n{result.strip()}")
+    if not parts:
+        raise results[-1]
+
+    content = truncate_to_tokens("\n\n".join(parts), budget.prompt_tokens)
+    return CondensedDocument(content, "map_reduce", tokens, len(chunks), failed)
+
+
+def condense_document_sync(text: str,
+                           generate: Generate,
+                           budget: Optional[PromptBudget] = None,
+                           focus: str = CONSISTENCY_MAP_FOCUS) -> CondensedDocument:
+    """condense_document สำหรับโค้ดที่ไม่ใช่ async (เช่น Streamlit)"""
+    return asyncio.run(condense_document(text, generate, budget, focus))
+
+
+def model_generator(model_name: str, keys: Optional[Sequence[str]] = None) -> Generate:
+    """
+    แปลงชื่อ model เป็น coroutine function (เรียกใน worker thread)
+
+    ทุกการเรียกผ่าน api_key_pool: เลือก key ที่เหลือโควต้ามากที่สุด และเข้าคิวเมื่อเกินโควต้าต่อนาที
+
+    Args:
+        model_name: ชื่อ Gemini model
+        keys: ใช้ key ชุดนี้แทน key ที่ตั้งค่าไว้
+    """
+    # import เมื่อใช้ เพื่อให้ส่วนอื่นของ module ใช้ได้โดยไม่ต้องมี google-generativeai
+    from api_key_pool import get_api_key_pool
+    from singleflight import flight_key, get_singleflight
+    pool = get_api_key_pool()
+
+    async def call(prompt: str) -> str:
+        response = await pool.run_async(
+            lambda api_key: asyncio.to_thread(pool.get_model(model_name, api_key).generate_content, prompt),
+            estimate_tokens(prompt),
+            keys
+        )
+        return response.text
+
+    async def generate(prompt: str) -> str:
+        # ส่วนเดียวกันของเอกสารเดียวกันจากหลาย session ที่สรุปพร้อมกัน เรียก Gemini ครั้งเดียว
+        return await get_singleflight().do_async(flight_key("generate", model_name, prompt), lambda: call(prompt))
+    return generate
+
+
+if __name__ == "__main__":
+    # ตัวอย่างการใช้งาน (ใช้ model จำลอง ไม่เรียก API)
+    import time
+
+    async def fake_generate(prompt: str) -> str:
+        await asyncio.sleep(0.2)
+        return f"สรุป: {estimate_tokens(prompt)} tokens"
+
+    document = "\n".join(
+        [f"บทที่ {n}\n" + ("เนื้อหาของโครงงานวิทยาศาสตร์ " * 600) for n in range(1, 6)]
+    )
+    demo_budget = PromptBudget(prompt_tokens=4000, chunk_tokens=3000, max_chunks=8, fan_out=4)
+    print(f"เอกสาร: {len(document):,} ตัวอักษร ~{estimate_tokens(document):,} tokens")
+
+    began = time.perf_counter()
+    condensed = condense_document_sync(document, fake_generate, demo_budget)
+    print(f"{condensed.summary()} ใน {time.perf_counter() - began:.2f} วินาที")
+    print(f"เนื้อหาใน prompt: ~{estimate_tokens(condensed.content):,} tokens")
@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rate limiter ของการเรียก Gemini (token bucket ต่อ API key ใช้ร่วมกันทุก process)
+
+- จำกัด requests-per-minute และ tokens-per-minute ต่อ API key (เก็บเฉพาะ hash ของ key)
+- คำขอที่เกินโควต้าจะเข้าคิว (FIFO ต่อ key) และรอจน bucket เติม แทนการ error
+  คำขอในคิวได้โควต้าเมื่อ bucket พอสำหรับตัวเองและทุกคำขอที่มาก่อน (คำขอหลังแซงคิวไม่ได้)
+- เมื่อ Gemini ตอบ RESOURCE_EXHAUSTED/429 จะหยุดส่งตาม retry-after ที่แนบมา แล้วลองใหม่
+  (ดูจากชนิด/status code ของ error; โควต้ารายวันหมดไม่ลองใหม่)
+- สถานะ bucket, คิว และเวลารอเก็บใน SQLite ทุก process (Streamlit + api_server + worker) จึงเห็นโควต้าเดียวกัน
+
+Usage:
+    python rate_limiter.py --stats
+    python rate_limiter.py --reset
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, Sequence, TypeVar
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:  # ใช้ rate_limiter ได้โดยไม่ต้องมี google-api-core
+    google_exceptions = None
+
+T = TypeVar("T")
+
+# ผู้รอคิวที่ไม่อัพเดท heartbeat นานกว่านี้ถือว่า process ตายแล้ว (วินาที)
+STALE_WAITER_SECONDS = 30.0
+
+# จำนวนเวลารอล่าสุดที่เก็บไว้คำนวณสถิติ
+WAIT_LOG_SIZE = 1000
+
+_RETRY_PATTERNS = (
+    re.compile(r"retry in ([0-9.]+)\s*s", re.IGNORECASE),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*([0-9]+)", re.IGNORECASE),
+    re.compile(r"retry[- ]after[\"':\s]*([0-9.]+)", re.IGNORECASE)
+)
+
+
+class RateLimitTimeout(TimeoutError):
+    """รอคิวนานเกิน max_wait"""
+
+
+def key_id(api_key: Optional[str]) -> str:
+    """ชื่อของ bucket สำหรับ API key (hash ไม่เก็บ key จริง)"""
+    if not api_key:
+        return "default"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def _is_too_many_requests(error: BaseException) -> bool:
+    # ResourceExhausted ของ google-api-core เป็น subclass ของ TooManyRequests (HTTP 429 / gRPC RESOURCE_EXHAUSTED)
+    if google_exceptions is not None and isinstance(error, google_exceptions.TooManyRequests):
+        return True
+    code = getattr(error, "code", None)
+    if callable(code):  # grpc.RpcError
+        try:
+            code = code()
+        except Exception:
+            return False
+    return code == 429 or getattr(code, "name", None) == "RESOURCE_EXHAUSTED"
+
+
+def is_daily_quota_error(error: BaseException) -> bool:
+    """
+    429 จากโควต้ารายวัน (หรือโควต้ารวมของ project) หมด: รอไม่กี่วินาทีแล้วลองใหม่ไม่ช่วย
+
+    ดูจาก QuotaFailure ใน details ของ error (quota_id เช่น GenerateRequestsPerDayPerProjectPerModel)
+    """
+    if not _is_too_many_requests(error):
+        return False
+    for detail in getattr(error, "details", None) or ():
+        for violation in getattr(detail, "violations", None) or ():
+            quota = f"{getattr(violation, 'quota_id', '')} {getattr(violation, 'quota_metric', '')}"
+            if "perday" in quota.lower().replace("_", "").replace("-", ""):
+                return True
+    return False
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """error 429 / RESOURCE_EXHAUSTED จากอัตราการเรียกต่อนาที (รอตาม retry-after แล้วลองใหม่ได้)"""
+    return _is_too_many_requests(error) and not is_daily_quota_error(error)
+
+
+def retry_after_from_error(error: BaseException) -> Optional[float]:
+    """เวลาที่ API แนะนำให้รอก่อนลองใหม่ (วินาที) หรือ None ถ้าไม่มี"""
+    retry_after = getattr(error, "retry_after", None)
+    if isinstance(retry_after, (int, float)):
+        return float(retry_after)
+    message = str(error)
+    for pattern in _RETRY_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class RateLimiter:
+    """Token bucket (requests + tokens ต่อนาที) ต่อ API key บน SQLite"""
+
+    def __init__(self,
+                 db_file: str = "rate_limits.db",
+                 rpm: float = 15,
+                 tpm: float = 1_000_000,
+                 max_wait: float = 300.0,
+                 default_retry_after: float = 30.0,
+                 max_attempts: int = 3):
+        """
+        Args:
+            db_file: ไฟล์ SQLite ที่เก็บสถานะ (ใช้ร่วมกันหลาย process)
+            rpm: จำนวน request ต่อนาทีต่อ key
+            tpm: จำนวน token ต่อนาทีต่อ key
+            max_wait: เวลารอคิวสูงสุดต่อการเรียก (วินาที) เกินแล้ว raise RateLimitTimeout
+            default_retry_after: เวลาหยุดส่งเมื่อถูกจำกัดแต่ API ไม่ได้บอก retry-after (วินาที)
+            max_attempts: จำนวนครั้งที่ลองเรียกใหม่เมื่อถูกจำกัด (run / run_async)
+        """
+        self.db_file = db_file
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait = max_wait
+        self.default_retry_after = default_retry_after
+        self.max_attempts = max_attempts
+        self._initialize_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _initialize_database(self):
+        """สร้างตารางถ้ายังไม่มี"""
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_buckets (
+                    key TEXT PRIMARY KEY,
+                    requests REAL NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    blocked_until REAL NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_waiters (
+                    ticket INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL,
+                    tokens REAL NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    heartbeat REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_waiters_key ON rate_waiters(key, ticket)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_waits (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL,
+                    finished_at REAL NOT NULL,
+                    waited REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """)
+            conn.executemany(
+                "INSERT OR IGNORE INTO rate_counters(name, value) VALUES (?, 0)",
+                [("acquired",), ("queued",), ("throttled",), ("timeouts",)]
+            )
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _bump(conn: sqlite3.Connection, name: str, amount: int = 1):
+        conn.execute("UPDATE rate_counters SET value = value + ? WHERE name = ?", (amount, name))
+
+    def _refill(self, row: Optional[tuple], now: float):
+        """(requests, tokens, blocked_until) หลังเติม bucket ตามเวลาที่ผ่านไป"""
+        if row is None:
+            return float(self.rpm), float(self.tpm), 0.0
+        requests, tokens, updated_at, blocked_until = row
+        elapsed = max(now - updated_at, 0.0)
+        return (min(self.rpm, requests + elapsed * self.rpm / 60.0),
+                min(self.tpm, tokens + elapsed * self.tpm / 60.0),
+                blocked_until)
+
+    @staticmethod
+    def _save(conn: sqlite3.Connection, key: str, requests: float, tokens: float,
+              now: float, blocked_until: float):
+        conn.execute(
+            "INSERT OR REPLACE INTO rate_buckets(key, requests, tokens, updated_at, blocked_until)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (key, requests, tokens, now, blocked_until)
+        )
+
+    def _enqueue(self, key: str, tokens: float) -> int:
+        conn = self._connect()
+        try:
+            now = time.time()
+            return conn.execute(
+                "INSERT INTO rate_waiters(key, tokens, enqueued_at, heartbeat) VALUES (?, ?, ?, ?)",
+                (key, tokens, now, now)
+            ).lastrowid
+        finally:
+            conn.close()
+
+    def _try_take(self, key: str, ticket: int, tokens: float) -> float:
+        """
+        ลองหักโควต้าให้ ticket นี้ (ต้องเหลือพอสำหรับทุก ticket ที่มาก่อนด้วย)
+
+        Returns:
+            0 ถ้าได้โควต้าแล้ว ไม่เช่นนั้นคือเวลาที่ควรรอก่อนลองใหม่ (วินาที)
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            conn.execute("DELETE FROM rate_waiters WHERE heartbeat < ?", (now - STALE_WAITER_SECONDS,))
+            conn.execute("UPDATE rate_waiters SET heartbeat = ? WHERE ticket = ?", (now, ticket))
+            ahead, ahead_tokens = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM rate_waiters WHERE key = ? AND ticket < ?",
+                (key, ticket)
+            ).fetchone()
+            need_requests = ahead + 1
+            need_tokens = ahead_tokens + tokens
+
+            row = conn.execute(
+                "SELECT requests, tokens, updated_at, blocked_until FROM rate_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            requests, available_tokens, blocked_until = self._refill(row, now)
+
+            if now < blocked_until:
+                wait = blocked_until - now
+            elif requests >= need_requests and available_tokens >= need_tokens:
+                requests -= 1
+                available_tokens -= tokens
+                conn.execute("DELETE FROM rate_waiters WHERE ticket = ?", (ticket,))
+                wait = 0.0
+            else:
+                wait = max((need_requests - requests) * 60.0 / self.rpm,
+                           (need_tokens - available_tokens) * 60.0 / self.tpm, 0.01)
+
+            self._save(conn, key, requests, available_tokens, now, blocked_until)
+            conn.execute("COMMIT")
+            return wait
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _finish(self, key: str, ticket: int, waited: Optional[float]):
+        """บันทึกเวลารอ (waited=None = ออกจากคิวโดยไม่ได้โควต้า)"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if waited is None:
+                conn.execute("DELETE FROM rate_waiters WHERE ticket = ?", (ticket,))
+                self._bump(conn, "timeouts")
+            else:
+                self._bump(conn, "acquired")
+                if waited > 0.05:
+                    self._bump(conn, "queued")
+                conn.execute(
+                    "INSERT INTO rate_waits(key, finished_at, waited) VALUES (?, ?, ?)", (key, time.time(), waited)
+                )
+                conn.execute(
+                    "DELETE FROM rate_waits WHERE id <= (SELECT MAX(id) FROM rate_waits) - ?", (WAIT_LOG_SIZE,)
+                )
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"Error recording rate limiter wait: {e}")
+        finally:
+            conn.close()
+
+    def _next_sleep(self, key: str, ticket: int, tokens: float, started: float) -> float:
+        wait = self._try_take(key, ticket, tokens)
+        if wait <= 0:
+            return 0.0
+        if time.time() - started + min(wait, 1.0) > self.max_wait:
+            raise RateLimitTimeout(f"Rate limit queue wait exceeded {self.max_wait:.0f}s")
+        # ตื่นอย่างน้อยทุกวินาทีเพื่ออัพเดท heartbeat
+        return min(wait, 1.0)
+
+    def acquire(self, key: str = "default", tokens: float = 0) -> float:
+        """
+        รอจนได้โควต้า 1 request + tokens (บล็อก thread)
+
+        Args:
+            key: ชื่อ bucket (จาก key_id())
+            tokens: จำนวน token โดยประมาณของการเรียก
+
+        Returns:
+            เวลาที่รอ (วินาที)
+
+        Raises:
+            RateLimitTimeout ถ้ารอนานเกิน max_wait
+        """
+        tokens = min(tokens, self.tpm)
+        started = time.time()
+        ticket = self._enqueue(key, tokens)
+        try:
+            while True:
+                sleep = self._next_sleep(key, ticket, tokens, started)
+                if not sleep:
+                    break
+                time.sleep(sleep)
+        except BaseException:
+            self._finish(key, ticket, None)
+            raise
+        waited = time.time() - started
+        self._finish(key, ticket, waited)
+        return waited
+
+    async def acquire_async(self, key: str = "default", tokens: float = 0) -> float:
+        """acquire สำหรับ async (ไม่บล็อก event loop)"""
+        tokens = min(tokens, self.tpm)
+        started = time.time()
+        ticket = await asyncio.to_thread(self._enqueue, key, tokens)
+        try:
+            while True:
+                sleep = await asyncio.to_thread(self._next_sleep, key, ticket, tokens, started)
+                if not sleep:
+                    break
+                await asyncio.sleep(sleep)
+        except BaseException:
+            await asyncio.to_thread(self._finish, key, ticket, None)
+            raise
+        waited = time.time() - started
+        await asyncio.to_thread(self._finish, key, ticket, waited)
+        return waited
+
+    def try_acquire(self, key: str = "default", tokens: float = 0) -> bool:
+        """
+        หักโควต้าเฉพาะเมื่อมีเหลือทันที (ไม่รอ และไม่แซงคำขอที่รอคิวอยู่)
+
+        ใช้กับคำขอเสริมที่ข้ามได้ เช่น hedged request ของ model_router
+
+        Returns:
+            True ถ้าได้โควต้า
+        """
+        tokens = min(tokens, self.tpm)
+        ticket = self._enqueue(key, tokens)
+        taken = False
+        try:
+            taken = self._try_take(key, ticket, tokens) <= 0
+        finally:
+            if taken:
+                self._finish(key, ticket, 0.0)
+            else:
+                self._dequeue(ticket)
+        return taken
+
+    def _dequeue(self, ticket: int):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM rate_waiters WHERE ticket = ?", (ticket,))
+        finally:
+            conn.close()
+
+    def penalize(self, key: str, retry_after: Optional[float] = None):
+        """
+        หยุดส่งคำขอของ key ชั่วคราวหลัง API ตอบว่าเกินโควต้า
+
+        Args:
+            key: ชื่อ bucket
+            retry_after: เวลาที่ API แนะนำ (None = default_retry_after)
+        """
+        retry_after = retry_after if retry_after is not None else self.default_retry_after
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(
+                "SELECT requests, tokens, updated_at, blocked_until FROM rate_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            _, tokens, blocked_until = self._refill(row, now)
+            # โควต้าฝั่ง API หมดแล้ว: bucket ฝั่งเราเริ่มนับใหม่หลังพ้นช่วงหยุด
+            self._save(conn, key, 0.0, tokens, now, max(blocked_until, now + retry_after))
+            self._bump(conn, "throttled")
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"Error updating rate limiter: {e}")
+        finally:
+            conn.close()
+
+    def run(self, key: str, call: Callable[[], T], tokens: float = 0) -> T:
+        """
+        เรียก call() เมื่อได้โควต้า ถ้าถูกจำกัดจะรอตาม retry-after แล้วเข้าคิวใหม่
+
+        Args:
+            key: ชื่อ bucket (จาก key_id())
+            call: ฟังก์ชันที่เรียก API
+            tokens: จำนวน token โดยประมาณ
+
+        Raises:
+            RateLimitTimeout หรือ error ของ call() (หลังลองครบ max_attempts)
+        """
+        for attempt in range(self.max_attempts):
+            self.acquire(key, tokens)
+            try:
+                return call()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_attempts - 1:
+                    raise
+                print(f"Rate limited (attempt {attempt + 1}): {e}")
+                self.penalize(key, retry_after_from_error(e))
+
+    async def run_async(self, key: str, call: Callable[[], Awaitable[T]], tokens: float = 0) -> T:
+        """run สำหรับ coroutine (call คืน awaitable)"""
+        for attempt in range(self.max_attempts):
+            await self.acquire_async(key, tokens)
+            try:
+                return await call()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_attempts - 1:
+                    raise
+                print(f"Rate limited (attempt {attempt + 1}): {e}")
+                await asyncio.to_thread(self.penalize, key, retry_after_from_error(e))
+
+    def queue_depth(self, key: Optional[str] = None) -> int:
+        """จำนวนคำขอที่รอคิวอยู่ (None = ทุก key)"""
+        conn = self._connect()
+        try:
+            since = time.time() - STALE_WAITER_SECONDS
+            if key is None:
+                return conn.execute("SELECT COUNT(*) FROM rate_waiters WHERE heartbeat >= ?", (since,)).fetchone()[0]
+            return conn.execute(
+                "SELECT COUNT(*) FROM rate_waiters WHERE key = ? AND heartbeat >= ?", (key, since)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def bucket_states(self, keys: Optional[Sequence[str]] = None) -> Dict[str, Dict]:
+        """
+        โควต้าที่เหลือของแต่ละ bucket ณ ตอนนี้ (ไม่หักโควต้า)
+
+        Args:
+            keys: ชื่อ bucket ที่ต้องการ (None = ทุก bucket ที่เคยใช้) bucket ที่ยังไม่เคยใช้คือโควต้าเต็ม
+
+        Returns:
+            {key: {requests, tokens, blocked_for, queue_depth}}
+        """
+        conn = self._connect()
+        try:
+            now = time.time()
+            rows = {key: tuple(row) for key, *row in conn.execute(
+                "SELECT key, requests, tokens, updated_at, blocked_until FROM rate_buckets"
+            )}
+            depths = dict(conn.execute(
+                "SELECT key, COUNT(*) FROM rate_waiters WHERE heartbeat >= ? GROUP BY key",
+                (now - STALE_WAITER_SECONDS,)
+            ).fetchall())
+        finally:
+            conn.close()
+
+        states = {}
+        for key in (sorted(rows) if keys is None else keys):
+            requests, tokens, blocked_until = self._refill(rows.get(key), now)
+            states[key] = {
+                "requests": requests,
+                "tokens": tokens,
+                "blocked_for": max(blocked_until - now, 0.0),
+                "queue_depth": depths.get(key, 0)
+            }
+        return states
+
+    def reset(self):
+        """ล้างสถานะทั้งหมด (bucket, คิว, สถิติ)"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for table in ("rate_buckets", "rate_waiters", "rate_waits"):
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("UPDATE rate_counters SET value = 0")
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def get_stats(self) -> Dict:
+        """
+        สถิติสำหรับหน้า Admin
+
+        Returns:
+            {rpm, tpm, queue_depth, acquired, queued, throttled, timeouts,
+             avg_wait, p95_wait, max_wait, keys: [{key, requests, tokens, blocked_for, queue_depth}]}
+        """
+        conn = self._connect()
+        try:
+            waits = [w for (w,) in conn.execute("SELECT waited FROM rate_waits ORDER BY waited")]
+            counters = dict(conn.execute("SELECT name, value FROM rate_counters").fetchall())
+        finally:
+            conn.close()
+
+        keys = [dict(state, key=key) for key, state in self.bucket_states().items()]
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "queue_depth": sum(state["queue_depth"] for state in keys),
+            "acquired": counters.get("acquired", 0),
+            "queued": counters.get("queued", 0),
+            "throttled": counters.get("throttled", 0),
+            "timeouts": counters.get("timeouts", 0),
+            "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+            "p95_wait": waits[min(int(len(waits) * 0.95), len(waits) - 1)] if waits else 0.0,
+            "max_wait": waits[-1] if waits else 0.0,
+            "keys": keys
+        }
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(db_file: Optional[str] = None) -> RateLimiter:
+    """
+    คืน RateLimiter ที่ใช้ร่วมกันภายใน process
+
+    ตั้งค่าได้ด้วยตัวแปร RATE_LIMIT_FILE, GEMINI_RPM, GEMINI_TPM, GEMINI_MAX_QUEUE_WAIT
+    """
+    db_file = db_file or os.getenv("RATE_LIMIT_FILE", "rate_limits.db")
+    key = os.path.abspath(db_file)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(
+                db_file,
+                rpm=float(os.getenv("GEMINI_RPM", "15")),
+                tpm=float(os.getenv("GEMINI_TPM", "1000000")),
+                max_wait=float(os.getenv("GEMINI_MAX_QUEUE_WAIT", "300"))
+            )
+        return _limiters[key]
+
+
+if __name__ == "__main__":
+    limiter = get_rate_limiter()
+    if len(sys.argv) >= 2 and sys.argv[1] == "--reset":
+        limiter.reset()
+        print("🗑️ Rate limiter state cleared")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "--stats":
+        for name, value in limiter.get_stats().items():
+            print(f"{name}: {value}")
+    else:
+        print(__doc__)
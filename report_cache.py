@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Report cache - สร้างไฟล์รายงาน (Word/PDF) เมื่อผู้ใช้ขอ แล้วเก็บ bytes ไว้ในหน่วยความจำ
+
+ถ้ายังไม่มีในหน่วยความจำ จะอ่านจาก report_store (ไฟล์ที่สร้างล่วงหน้าไว้) ก่อนสร้างใหม่
+
+key = (username, analysis id, รูปแบบไฟล์, SHA-1 ของผลการวิเคราะห์)
+ผลการวิเคราะห์ที่ถูกแก้จะได้ key ใหม่ รายงานเก่าจึงไม่ถูกส่งซ้ำ
+จำกัดขนาดรวมแบบ LRU (ลบรายงานที่ไม่ได้ใช้นานที่สุดก่อน)
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from report_generator import ReportGenerator, get_report_generator
+from report_store import REPORT_FORMATS, ReportStore, get_report_store
+
+
+class ReportCache:
+    """LRU cache ของไฟล์รายงานที่สร้างแล้ว (ต่อ process)"""
+
+    def __init__(self,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 generator: Optional[ReportGenerator] = None,
+                 store: Optional[ReportStore] = None):
+        """
+        Args:
+            max_bytes: ขนาดรวมสูงสุดของรายงานที่เก็บ (ไบต์)
+            generator: ReportGenerator (default: get_report_generator())
+            store: ที่เก็บรายงานบนดิสก์ (default: get_report_store())
+        """
+        self.max_bytes = max_bytes
+        self.generator = generator or get_report_generator()
+        self.store = store or get_report_store()
+        self._entries: "OrderedDict[tuple, Tuple[bytes, str]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.renders = 0
+
+    @staticmethod
+    def make_key(username: str, entry: Dict, fmt: str) -> tuple:
+        """key ของรายงาน จาก record ผลการวิเคราะห์"""
+        result_hash = hashlib.sha1(entry.get('result', '').encode('utf-8')).hexdigest()
+        return (username, entry.get('id'), fmt, result_hash)
+
+    def contains(self, username: str, entry: Dict, fmt: str) -> bool:
+        """มีรายงานนี้ใน cache แล้วหรือไม่"""
+        with self._lock:
+            return self.make_key(username, entry, fmt) in self._entries
+
+    def render(self, username: str, entry: Dict, fmt: str) -> Tuple[bytes, str]:
+        """
+        คืนไฟล์รายงาน (สร้างใหม่เฉพาะเมื่อยังไม่มีใน cache)
+
+        Args:
+            username: ชื่อผู้ใช้
+            entry: record ผลการวิเคราะห์ (ต้องมี id, file_name, result, timestamp)
+            fmt: "docx" หรือ "pdf"
+
+        Returns:
+            (bytes ของไฟล์, ชื่อไฟล์สำหรับดาวน์โหลด)
+        """
+        key = self.make_key(username, entry, fmt)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+
+        # ไฟล์บนดิสก์ (สร้างล่วงหน้าหลังวิเคราะห์ หรือสร้างตอนนี้ถ้ายังไม่มี)
+        with open(self.store.render(username, entry, fmt), 'rb') as f:
+            data = f.read()
+        report = (data, self.store.download_name(username, entry, fmt))
+
+        with self._lock:
+            self.renders += 1
+            if key not in self._entries and len(report[0]) <= self.max_bytes:
+                self._entries[key] = report
+                self._size += len(report[0])
+                while self._size > self.max_bytes:
+                    _, (data, _) = self._entries.popitem(last=False)
+                    self._size -= len(data)
+        return report
+
+    def get_stats(self) -> Dict:
+        """สถิติของ cache"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "renders": self.renders
+            }
+
+
+_report_cache: Optional[ReportCache] = None
+_report_cache_lock = threading.Lock()
+
+
+def get_report_cache() -> ReportCache:
+    """
+    คืน ReportCache ที่ใช้ร่วมกันภายใน process
+
+    ตั้งค่าขนาดได้ด้วยตัวแปร REPORT_CACHE_MAX_MB
+    """
+    global _report_cache
+    with _report_cache_lock:
+        if _report_cache is None:
+            _report_cache = ReportCache(
+                max_bytes=int(float(os.getenv("REPORT_CACHE_MAX_MB", "64")) * 1024 * 1024)
+            )
+        return _report_cache
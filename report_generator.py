@@ -5,6 +5,7 @@ Report generator module for exporting analysis results to Word and PDF formats
 """
 
 import io
+import threading
 from datetime import datetime
 from docx import Document
 from docx.shared import Inches, Pt, RGBColor
@@ -393,6 +394,19 @@ class ReportGenerator:
         return doc_buffer
 
 
+_report_generator = None
+_report_generator_lock = threading.Lock()
+
+
+def get_report_generator() -> ReportGenerator:
+    """คืน ReportGenerator ที่ใช้ร่วมกันภายใน process (ไม่สร้างใหม่ทุกครั้งที่ Streamlit rerun)"""
+    global _report_generator
+    with _report_generator_lock:
+        if _report_generator is None:
+            _report_generator = ReportGenerator()
+        return _report_generator
+
+
 # ตัวอย่างการใช้งาน
 if __name__ == "__main__":
     print("Report Generator Module")
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Report store - เก็บไฟล์รายงาน (Word/PDF) ที่สร้างแล้วไว้บนดิสก์
+
+- สร้างรายงานล่วงหน้าใน thread เบื้องหลังทันทีหลังบันทึกผลการวิเคราะห์
+- การดาวน์โหลดจึงเป็นการส่งไฟล์ที่มีอยู่แล้ว (FileResponse / sendfile)
+- ชื่อไฟล์มี hash ของผลการวิเคราะห์ ผลที่ถูกแก้จะได้ไฟล์ใหม่
+- ลบไฟล์ที่เก่าเกินกำหนด และไฟล์ที่ใช้ล่าสุดนานที่สุดเมื่อขนาดรวมเกินกำหนด
+
+Usage:
+    python report_store.py --stats
+    python report_store.py --evict
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Sequence
+
+from report_generator import ReportGenerator, get_report_generator
+
+# รูปแบบรายงาน: (mime type, ชื่อเมธอดสร้างไฟล์, ชื่อเมธอดตั้งชื่อไฟล์)
+REPORT_FORMATS = {
+    "docx": ("application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+             "generate_word_report", "get_word_filename"),
+    "pdf": ("application/pdf", "generate_pdf_report", "get_pdf_filename")
+}
+
+# ตรวจการลบไฟล์ไม่บ่อยกว่านี้ (วินาที)
+EVICT_INTERVAL_SECONDS = 60
+
+
+class ReportStore:
+    """ไฟล์รายงานบนดิสก์ แยกตาม analysis id และรูปแบบไฟล์"""
+
+    def __init__(self,
+                 directory: str = "reports",
+                 max_bytes: int = 500 * 1024 * 1024,
+                 max_age_seconds: float = 30 * 24 * 3600,
+                 workers: int = 1,
+                 generator: Optional[ReportGenerator] = None):
+        """
+        Args:
+            directory: โฟลเดอร์เก็บรายงาน
+            max_bytes: ขนาดรวมสูงสุดของรายงานทั้งหมด (ไบต์)
+            max_age_seconds: อายุสูงสุดของไฟล์นับจากการใช้ครั้งล่าสุด (0 = ไม่หมดอายุ)
+            workers: จำนวน thread ที่สร้างรายงานเบื้องหลัง
+            generator: ReportGenerator (default: get_report_generator())
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.generator = generator or get_report_generator()
+        os.makedirs(directory, exist_ok=True)
+
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="report-prerender")
+        self._render_locks: Dict[str, threading.Lock] = {}
+        self._render_locks_lock = threading.Lock()
+        self._last_evict = 0.0
+
+    def path_for(self, username: str, entry: Dict, fmt: str) -> str:
+        """path ของไฟล์รายงาน (ไม่ว่าจะมีไฟล์อยู่แล้วหรือไม่)"""
+        user_hash = hashlib.sha1(username.encode('utf-8')).hexdigest()[:12]
+        result_hash = hashlib.sha1(entry.get('result', '').encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f"{user_hash}_{entry.get('id')}_{result_hash}.{fmt}")
+
+    def get(self, username: str, entry: Dict, fmt: str) -> Optional[str]:
+        """
+        path ของรายงานที่สร้างไว้แล้ว
+
+        Returns:
+            path หรือ None ถ้ายังไม่มี
+        """
+        path = self.path_for(username, entry, fmt)
+        try:
+            os.utime(path)  # ใช้ mtime เป็นเวลาใช้ล่าสุดสำหรับการลบแบบ LRU
+            return path
+        except OSError:
+            return None
+
+    def _lock_for(self, path: str) -> threading.Lock:
+        with self._render_locks_lock:
+            return self._render_locks.setdefault(path, threading.Lock())
+
+    def render(self, username: str, entry: Dict, fmt: str) -> str:
+        """
+        คืน path ของรายงาน (สร้างและบันทึกถ้ายังไม่มี)
+
+        Args:
+            username: ชื่อผู้ใช้
+            entry: record ผลการวิเคราะห์ (ต้องมี id, file_name, result, timestamp)
+            fmt: "docx" หรือ "pdf"
+
+        Returns:
+            path ของไฟล์รายงาน
+        """
+        _, generate_name, _ = REPORT_FORMATS[fmt]
+        path = self.path_for(username, entry, fmt)
+        # ป้องกันการสร้างไฟล์เดียวกันซ้ำพร้อมกัน (เช่น ผู้ใช้กดดาวน์โหลดระหว่าง pre-render)
+        with self._lock_for(path):
+            existing = self.get(username, entry, fmt)
+            if existing:
+                return existing
+            buffer = getattr(self.generator, generate_name)(
+                username=username,
+                file_name=entry['file_name'],
+                analysis_result=entry['result'],
+                timestamp=entry.get('timestamp')
+            )
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(buffer.getvalue())
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        with self._render_locks_lock:
+            self._render_locks.pop(path, None)
+
+        if time.time() - self._last_evict > EVICT_INTERVAL_SECONDS:
+            self.evict()
+        return path
+
+    def download_name(self, username: str, entry: Dict, fmt: str) -> str:
+        """ชื่อไฟล์สำหรับผู้ดาวน์โหลด"""
+        return getattr(self.generator, REPORT_FORMATS[fmt][2])(entry['file_name'], username)
+
+    def _prerender(self, username: str, entry: Dict, formats: Sequence[str]):
+        for fmt in formats:
+            try:
+                self.render(username, entry, fmt)
+            except Exception as e:
+                print(f"Error pre-rendering {fmt} report for analysis {entry.get('id')}: {e}")
+
+    def schedule_prerender(self, username: str, entry: Optional[Dict],
+                           formats: Sequence[str] = ("docx", "pdf")) -> Optional[Future]:
+        """
+        สร้างรายงานล่วงหน้าใน thread เบื้องหลัง (เรียกหลังบันทึกผลการวิเคราะห์)
+
+        Args:
+            username: ชื่อผู้ใช้
+            entry: record ที่เพิ่งบันทึก (None = ไม่ทำอะไร)
+            formats: รูปแบบที่ต้องการสร้าง
+
+        Returns:
+            Future ของงาน หรือ None
+        """
+        if not entry or entry.get('id') is None:
+            return None
+        return self._executor.submit(self._prerender, username, dict(entry), tuple(formats))
+
+    def evict(self) -> int:
+        """
+        ลบไฟล์ที่หมดอายุ และไฟล์ที่ใช้ล่าสุดนานที่สุดจนขนาดรวมไม่เกิน max_bytes
+
+        Returns:
+            จำนวนไฟล์ที่ลบ
+        """
+        self._last_evict = time.time()
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        removed = 0
+        total = sum(size for _, size, _ in files)
+        cutoff = time.time() - self.max_age_seconds if self.max_age_seconds else None
+        for mtime, size, path in files:
+            if not (cutoff and mtime < cutoff) and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+                total -= size
+            except OSError as e:
+                print(f"Error removing report {path}: {e}")
+        return removed
+
+    def get_stats(self) -> Dict:
+        """สถิติของที่เก็บรายงาน"""
+        sizes = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".tmp"):
+                try:
+                    sizes.append(os.path.getsize(os.path.join(self.directory, name)))
+                except OSError:
+                    pass
+        return {"files": len(sizes), "size_bytes": sum(sizes), "max_bytes": self.max_bytes}
+
+
+_stores: Dict[str, ReportStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_report_store(directory: Optional[str] = None) -> ReportStore:
+    """
+    คืน ReportStore ที่ใช้ร่วมกันภายใน process
+
+    ตั้งค่าได้ด้วยตัวแปร REPORT_STORE_DIR, REPORT_STORE_MAX_MB, REPORT_STORE_MAX_AGE_DAYS, REPORT_PRERENDER_WORKERS
+    """
+    directory = directory or os.getenv("REPORT_STORE_DIR", "reports")
+    key = os.path.abspath(directory)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = ReportStore(
+                directory,
+                max_bytes=int(float(os.getenv("REPORT_STORE_MAX_MB", "500")) * 1024 * 1024),
+                max_age_seconds=float(os.getenv("REPORT_STORE_MAX_AGE_DAYS", "30")) * 24 * 3600,
+                workers=int(os.getenv("REPORT_PRERENDER_WORKERS", "1"))
+            )
+        return _stores[key]
+
+
+if __name__ == "__main__":
+    store = get_report_store()
+    if len(sys.argv) >= 2 and sys.argv[1] == "--evict":
+        print(f"🗑️ Removed {store.evict()} reports")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "--stats":
+        for name, value in store.get_stats().items():
+            print(f"{name}: {value}")
+    else:
+        print(__doc__)
@@ -3,13 +3,18 @@
 """
 Satisfaction Survey Database Module
 เก็บข้อมูลแบบสอบถามความพึงพอใจสำหรับการวิจัย
+
+สถิติต่อคำถามเก็บเป็น aggregate สะสมในไฟล์ (key "statistics") และอัพเดททุกครั้งที่เพิ่มคำตอบ
+การคำนวณสถิติจึงไม่ต้องวนคำตอบทั้งหมด (ดู survey_statistics.py)
 """
 
-import json
 import os
 from datetime import datetime
 from typing import Dict, List, Optional
 
+from survey_statistics import add_response, build_aggregates, empty_group, merge_groups, summarize
+from write_coordinator import atomic_write_json, file_lock, read_json, read_json_snapshot
+
 
 class SatisfactionDatabase:
     """จัดการฐานข้อมูลแบบสอบถามความพึงพอใจ"""
@@ -19,41 +24,70 @@ class SatisfactionDatabase:
         self._initialize_database()
     
     def _initialize_database(self):
-        """สร้างไฟล์ฐานข้อมูลถ้ายังไม่มี"""
-        if not os.path.exists(self.db_file):
-            initial_data = {
-                "surveys": [],
-                "metadata": {
-                    "created_at": datetime.now().isoformat(),
-                    "total_responses": 0,
-                    "teacher_responses": 0,
-                    "student_responses": 0
+        """สร้างไฟล์ฐานข้อมูลถ้ายังไม่มี และสร้าง aggregate ให้ไฟล์รูปแบบเดิม"""
+        if os.path.exists(self.db_file) and self._statistics_current(self._load_data()):
+            return
+        with file_lock(self.db_file):
+            if not os.path.exists(self.db_file):
+                initial_data = {
+                    "surveys": [],
+                    "metadata": {
+                        "created_at": datetime.now().isoformat(),
+                        "total_responses": 0,
+                        "teacher_responses": 0,
+                        "student_responses": 0
+                    },
+                    "statistics": {}
                 }
-            }
-            self._save_data(initial_data)
+                self._save_data(initial_data)
+                return
+            
+            data = self._load_data(for_update=True)
+            if not self._statistics_current(data):
+                print("📊 Building survey statistics...")
+                data["statistics"] = build_aggregates(data.get("surveys", []))
+                self._save_data(data)
+    
+    @staticmethod
+    def _statistics_current(data: Dict) -> bool:
+        """aggregate ครอบคลุมคำตอบทุกรายการหรือไม่"""
+        statistics = data.get("statistics")
+        if statistics is None:
+            return False
+        counted = sum(group.get("responses", 0) for group in statistics.values())
+        return counted == len(data.get("surveys", []))
     
-    def _load_data(self) -> Dict:
-        """โหลดข้อมูลจากไฟล์"""
+    def _load_data(self, for_update: bool = False) -> Dict:
+        """
+        โหลดข้อมูลจากไฟล์
+        
+        Args:
+            for_update: True = อ่านสำเนาที่แก้ไขได้ (read-modify-write)
+                        False = snapshot แบบอ่านอย่างเดียวที่ใช้ร่วมกัน (parse ใหม่เมื่อไฟล์เปลี่ยนเท่านั้น)
+        """
         try:
-            with open(self.db_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            data = read_json(self.db_file) if for_update else read_json_snapshot(self.db_file)
+            if data is not None:
+                return data
+            print(f"Error loading database: cannot read {self.db_file}")
         except Exception as e:
             print(f"Error loading database: {e}")
-            return {
-                "surveys": [],
-                "metadata": {
-                    "created_at": datetime.now().isoformat(),
-                    "total_responses": 0,
-                    "teacher_responses": 0,
-                    "student_responses": 0
-                }
-            }
+        return {
+            "surveys": [],
+            "metadata": {
+                "created_at": datetime.now().isoformat(),
+                "total_responses": 0,
+                "teacher_responses": 0,
+                "student_responses": 0
+            },
+            "statistics": {}
+        }
     
     def _save_data(self, data: Dict):
-        """บันทึกข้อมูลลงไฟล์"""
+        """บันทึกข้อมูลลงไฟล์ (เขียนไฟล์ชั่วคราวแล้ว rename ภายใต้ file lock)"""
         try:
-            with open(self.db_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            with file_lock(self.db_file):
+                atomic_write_json(self.db_file, data)
         except Exception as e:
             print(f"Error saving database: {e}")
     
@@ -75,31 +109,37 @@ class SatisfactionDatabase:
             True ถ้าบันทึกสำเร็จ
         """
         try:
-            data = self._load_data()
-            
-            # สร้างรายการใหม่
-            survey_entry = {
-                "id": f"SURVEY_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{len(data['surveys']) + 1}",
-                "timestamp": datetime.now().isoformat(),
-                "user_type": user_type,
-                "username": username,
-                "name": name,
-                "responses": responses,
-                "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            
-            # เพิ่มลงในรายการ
-            data["surveys"].append(survey_entry)
-            
-            # อัพเดท metadata
-            data["metadata"]["total_responses"] = len(data["surveys"])
-            data["metadata"][f"{user_type}_responses"] = len([
-                s for s in data["surveys"] if s["user_type"] == user_type
-            ])
-            data["metadata"]["last_updated"] = datetime.now().isoformat()
-            
-            # บันทึก
-            self._save_data(data)
+            # ถือ lock ตลอดช่วง read-modify-write กันคำตอบของ process อื่นหาย
+            with file_lock(self.db_file):
+                data = self._load_data(for_update=True)
+                
+                # สร้างรายการใหม่
+                survey_entry = {
+                    "id": f"SURVEY_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{len(data['surveys']) + 1}",
+                    "timestamp": datetime.now().isoformat(),
+                    "user_type": user_type,
+                    "username": username,
+                    "name": name,
+                    "responses": responses,
+                    "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                }
+                
+                # เพิ่มลงในรายการ และอัพเดท aggregate ของประเภทผู้ใช้นี้
+                current = self._statistics_current(data)
+                data["surveys"].append(survey_entry)
+                if current:
+                    statistics = data.setdefault("statistics", {})
+                    add_response(statistics.setdefault(user_type, empty_group()), responses)
+                else:
+                    data["statistics"] = build_aggregates(data["surveys"])
+                
+                # อัพเดท metadata
+                data["metadata"]["total_responses"] = len(data["surveys"])
+                data["metadata"][f"{user_type}_responses"] = data["statistics"][user_type]["responses"]
+                data["metadata"]["last_updated"] = datetime.now().isoformat()
+                
+                # บันทึก
+                self._save_data(data)
             return True
             
         except Exception as e:
@@ -121,57 +161,36 @@ class SatisfactionDatabase:
         data = self._load_data()
         return data.get("metadata", {})
     
+    @staticmethod
+    def _select_aggregates(data: Dict, user_type: Optional[str] = None) -> Dict:
+        statistics = data.get("statistics", {})
+        if user_type:
+            return statistics.get(user_type, empty_group())
+        return merge_groups(statistics.values())
+    
+    def get_aggregates(self, user_type: Optional[str] = None) -> Dict:
+        """
+        ดึง aggregate สะสม (count/sum/sumsq/min/max/histogram ต่อคำถาม)
+        
+        ใช้รวมกับข้อมูลจากแหล่งอื่นได้ด้วย survey_statistics.merge_groups()
+        
+        Args:
+            user_type: ถ้าระบุจะคืนเฉพาะประเภทนั้น, ถ้าไม่ระบุจะรวมทุกประเภท
+        """
+        return self._select_aggregates(self._load_data(), user_type)
+    
     def calculate_statistics(self, user_type: Optional[str] = None) -> Dict:
         """
-        คำนวณสถิติความพึงพอใจ
+        คำนวณสถิติความพึงพอใจจาก aggregate สะสม (ไม่วนคำตอบทั้งหมด)
         
         Args:
             user_type: ถ้าระบุจะคำนวณเฉพาะประเภทนั้น, ถ้าไม่ระบุจะคำนวณทั้งหมด
         
         Returns:
-            Dict ของสถิติ
+            Dict ของสถิติ: total_responses, overall_mean, overall_std และ categories
+            (ต่อคำถาม: mean, std, ci95, min, max, count, histogram)
         """
-        surveys = self.get_surveys_by_type(user_type) if user_type else self.get_all_surveys()
-        
-        if not surveys:
-            return {}
-        
-        # เก็บคะแนนแต่ละด้าน
-        stats = {
-            "total_responses": len(surveys),
-            "categories": {}
-        }
-        
-        # รวบรวมคะแนนแต่ละคำถาม
-        question_scores = {}
-        
-        for survey in surveys:
-            responses = survey.get("responses", {})
-            for question_key, value in responses.items():
-                if isinstance(value, (int, float)) and value > 0:
-                    if question_key not in question_scores:
-                        question_scores[question_key] = []
-                    question_scores[question_key].append(value)
-        
-        # คำนวณค่าเฉลี่ย
-        for question_key, scores in question_scores.items():
-            if scores:
-                stats["categories"][question_key] = {
-                    "mean": sum(scores) / len(scores),
-                    "min": min(scores),
-                    "max": max(scores),
-                    "count": len(scores),
-                    "scores": scores
-                }
-        
-        # คำนวณค่าเฉลี่ยรวม
-        all_scores = [score for scores in question_scores.values() for score in scores]
-        if all_scores:
-            stats["overall_mean"] = sum(all_scores) / len(all_scores)
-        else:
-            stats["overall_mean"] = 0
-        
-        return stats
+        return summarize(self.get_aggregates(user_type))
     
     def get_satisfaction_level(self, score: float) -> str:
         """แปลงคะแนนเป็นระดับความพึงพอใจ"""
@@ -194,9 +213,9 @@ class SatisfactionDatabase:
             "export_date": datetime.now().isoformat(),
             "metadata": data.get("metadata", {}),
             "summary": {
-                "teacher_stats": self.calculate_statistics("teacher"),
-                "student_stats": self.calculate_statistics("student"),
-                "overall_stats": self.calculate_statistics()
+                "teacher_stats": summarize(self._select_aggregates(data, "teacher")),
+                "student_stats": summarize(self._select_aggregates(data, "student")),
+                "overall_stats": summarize(self._select_aggregates(data))
             },
             "raw_data": data.get("surveys", [])
         }
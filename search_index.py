@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Search index - ค้นหาข้อความเต็ม (full-text) ในชื่อไฟล์และผลการวิเคราะห์ด้วย SQLite FTS5
+
+ภาษาไทยไม่มีช่องว่างระหว่างคำ จึงตัดข้อความไทยเป็น bigram ของตัวอักษร
+(รวมสระบน/ล่างและวรรณยุกต์ไว้กับพยัญชนะ) ก่อนบันทึกลง index และตัดคำค้นแบบเดียวกัน
+คำค้นภาษาไทยจึงพบได้ไม่ว่าจะอยู่ตรงไหนของประโยค
+
+- เรียงผลด้วย bm25 (ชื่อไฟล์มีน้ำหนักมากกว่าเนื้อหา)
+- AnalysisRepository อัพเดท index ทุกครั้งที่บันทึก/ลบ (ใช้ร่วมกันได้หลาย process)
+- คำค้น: หลายคำ = ต้องพบทุกคำ, "วลี" = ต้องพบติดกัน, -คำ = ต้องไม่พบคำนี้
+
+Usage:
+    python search_index.py --rebuild
+    python search_index.py --query "ไม่มีสถิติความพึงพอใจ"
+"""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# เปลี่ยนเมื่อวิธีตัดคำเปลี่ยน (index เดิมจะถูกสร้างใหม่)
+SEGMENTER_VERSION = "thai-bigram-v1"
+
+_THAI_RUN = re.compile(r"[\u0e00-\u0e7f]+")
+_QUERY_TERM = re.compile(r'(-?)"([^"]+)"|(-?)(\S+)')
+
+
+def _thai_clusters(run: str) -> List[str]:
+    """แบ่งข้อความไทยเป็นกลุ่มตัวอักษร (พยัญชนะ + สระบน/ล่าง + วรรณยุกต์)"""
+    clusters: List[str] = []
+    for ch in run:
+        if clusters and unicodedata.category(ch).startswith("M"):
+            clusters[-1] += ch
+        else:
+            clusters.append(ch)
+    return clusters
+
+
+def segment_thai(text: str) -> str:
+    """
+    ตัดข้อความไทยเป็น bigram คั่นด้วยช่องว่าง (ข้อความภาษาอื่นคงเดิม)
+
+    เช่น "สถิติ" -> " สถิ ถิติ " ใช้ทั้งตอนบันทึกและตอนค้นหา
+    """
+    def split_run(match) -> str:
+        clusters = _thai_clusters(match.group(0))
+        if len(clusters) == 1:
+            return f" {clusters[0]} "
+        return " " + " ".join(a + b for a, b in zip(clusters, clusters[1:])) + " "
+
+    return _THAI_RUN.sub(split_run, text or "")
+
+
+def _phrase(term: str) -> Optional[str]:
+    """แปลงคำค้นหนึ่งคำเป็น phrase ของ FTS5"""
+    segmented = segment_thai(term).strip()
+    if not segmented:
+        return None
+    phrase = '"' + segmented.replace('"', '""') + '"'
+    # กลุ่มตัวอักษรไทยตัวเดียวไม่มีใน index (เก็บเป็น bigram) จึงค้นแบบ prefix
+    if _THAI_RUN.fullmatch(term) and len(_thai_clusters(term)) == 1:
+        phrase += " *"
+    return phrase
+
+
+def parse_query(query: str) -> Tuple[str, List[str]]:
+    """
+    แปลงคำค้นของผู้ใช้เป็น MATCH expression ของ FTS5
+
+    Returns:
+        (expression, คำค้นที่ต้องพบ สำหรับไฮไลต์ snippet)
+
+    Raises:
+        ValueError ถ้าไม่มีคำที่ต้องพบ
+    """
+    include, exclude, terms = [], [], []
+    for match in _QUERY_TERM.finditer(query or ""):
+        negative = match.group(1) or match.group(3)
+        term = match.group(2) or match.group(4)
+        phrase = _phrase(term)
+        if phrase is None:
+            continue
+        if negative:
+            exclude.append(phrase)
+        else:
+            include.append(phrase)
+            terms.append(term)
+
+    if not include:
+        raise ValueError("Search query must contain at least one term")
+    expression = " AND ".join(include)
+    for phrase in exclude:
+        expression = f"({expression}) NOT {phrase}"
+    return expression, terms
+
+
+def make_snippet(text: str, terms: List[str], width: int = 160) -> str:
+    """
+    ตัดข้อความรอบตำแหน่งแรกที่พบคำค้น แล้วไฮไลต์คำค้นด้วย **...**
+
+    Args:
+        text: ข้อความต้นฉบับ (ผลการวิเคราะห์)
+        terms: คำค้นที่ต้องพบ
+        width: ความยาวโดยประมาณของ snippet
+    """
+    text = " ".join((text or "").split())
+    lowered = text.lower()
+    positions = [p for p in (lowered.find(t.lower()) for t in terms) if p >= 0]
+    first = min(positions) if positions else 0
+
+    start = max(first - width // 3, 0)
+    end = min(start + width, len(text))
+    snippet = text[start:end]
+    for term in sorted(set(terms), key=len, reverse=True):
+        snippet = re.sub(re.escape(term), lambda m: f"**{m.group(0)}**", snippet, flags=re.IGNORECASE)
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(text) else "")
+
+
+class SearchIndex:
+    """FTS5 index ของผลการวิเคราะห์ (แยกไฟล์ SQLite จาก storage engine)"""
+
+    def __init__(self, db_file: str = "search_index.db"):
+        """
+        Args:
+            db_file: ไฟล์ SQLite ของ index
+        """
+        self.db_file = db_file
+        self._initialize_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _initialize_database(self):
+        """สร้างตารางถ้ายังไม่มี"""
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS search_docs (
+                    rowid INTEGER PRIMARY KEY,
+                    username TEXT NOT NULL,
+                    entry_id TEXT NOT NULL,
+                    timestamp TEXT,
+                    UNIQUE(username, entry_id)
+                )
+            """)
+            # เก็บเฉพาะข้อความที่ตัดคำแล้ว (ข้อความต้นฉบับอยู่ใน storage engine)
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+                    file_name, result,
+                    tokenize="unicode61 categories 'L* N* Co M*'"
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS search_meta (
+                    name TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+            conn.execute("INSERT OR IGNORE INTO search_meta(name, value) VALUES ('segmenter', ?)",
+                         (SEGMENTER_VERSION,))
+        conn.close()
+
+    @property
+    def is_current(self) -> bool:
+        """index สร้างด้วยวิธีตัดคำปัจจุบันหรือไม่"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value FROM search_meta WHERE name = 'segmenter'").fetchone()
+            return row is not None and row[0] == SEGMENTER_VERSION
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _delete(conn: sqlite3.Connection, username: str, entry_id):
+        row = conn.execute(
+            "SELECT rowid FROM search_docs WHERE username = ? AND entry_id = ?",
+            (username, json.dumps(entry_id))
+        ).fetchone()
+        if row:
+            conn.execute("DELETE FROM search_fts WHERE rowid = ?", row)
+            conn.execute("DELETE FROM search_docs WHERE rowid = ?", row)
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, username: str, entry: Dict):
+        cursor = conn.execute(
+            "INSERT INTO search_docs(username, entry_id, timestamp) VALUES (?, ?, ?)",
+            (username, json.dumps(entry.get('id')), entry.get('timestamp', ''))
+        )
+        conn.execute(
+            "INSERT INTO search_fts(rowid, file_name, result) VALUES (?, ?, ?)",
+            (cursor.lastrowid, segment_thai(entry.get('file_name', '')), segment_thai(entry.get('result', '')))
+        )
+
+    def add(self, username: str, entry: Dict):
+        """เพิ่ม (หรือแทนที่) record หนึ่งรายการใน index"""
+        with self._connect() as conn:
+            self._delete(conn, username, entry.get('id'))
+            self._insert(conn, username, entry)
+        conn.close()
+
+    def remove(self, username: str, entry_id):
+        """ลบ record หนึ่งรายการจาก index"""
+        with self._connect() as conn:
+            self._delete(conn, username, entry_id)
+        conn.close()
+
+    def remove_user(self, username: str):
+        """ลบทุก record ของผู้ใช้จาก index"""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM search_fts WHERE rowid IN (SELECT rowid FROM search_docs WHERE username = ?)",
+                (username,)
+            )
+            conn.execute("DELETE FROM search_docs WHERE username = ?", (username,))
+        conn.close()
+
+    def rebuild(self, records: Iterable[Tuple[str, Dict]]) -> int:
+        """
+        สร้าง index ใหม่ทั้งหมด
+
+        Args:
+            records: (username, record) ทุกรายการ
+
+        Returns:
+            จำนวน record ใน index
+        """
+        count = 0
+        with self._connect() as conn:
+            conn.execute("DELETE FROM search_fts")
+            conn.execute("DELETE FROM search_docs")
+            for username, entry in records:
+                self._insert(conn, username, entry)
+                count += 1
+            conn.execute("INSERT INTO search_fts(search_fts) VALUES ('optimize')")
+            conn.execute("INSERT OR REPLACE INTO search_meta(name, value) VALUES ('segmenter', ?)",
+                         (SEGMENTER_VERSION,))
+        conn.close()
+        return count
+
+    def count(self) -> int:
+        """จำนวน record ใน index"""
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM search_docs").fetchone()[0]
+        finally:
+            conn.close()
+
+    def search(self, query: str, username: Optional[str] = None,
+               limit: int = 20, offset: int = 0) -> Dict:
+        """
+        ค้นหาแบบเรียงตามความเกี่ยวข้อง
+
+        Args:
+            query: คำค้น
+            username: จำกัดเฉพาะผู้ใช้ (None = ทุกคน)
+            limit: จำนวนผลลัพธ์สูงสุด
+            offset: ข้ามผลลัพธ์กี่รายการ (แบ่งหน้า)
+
+        Returns:
+            {"total": จำนวนที่พบทั้งหมด, "terms": คำค้น,
+             "hits": [{"username", "id", "timestamp", "relevance"}]}
+
+        Raises:
+            ValueError ถ้าคำค้นไม่ถูกต้อง
+        """
+        expression, terms = parse_query(query)
+        user_filter = "AND d.username = ?" if username else ""
+        params = [expression] + ([username] if username else [])
+
+        conn = self._connect()
+        try:
+            total = conn.execute(f"""
+                SELECT COUNT(*) FROM search_fts JOIN search_docs d ON d.rowid = search_fts.rowid
+                WHERE search_fts MATCH ? {user_filter}
+            """, params).fetchone()[0]
+            rows = conn.execute(f"""
+                SELECT d.username, d.entry_id, d.timestamp, bm25(search_fts, 4.0, 1.0) AS rank
+                FROM search_fts JOIN search_docs d ON d.rowid = search_fts.rowid
+                WHERE search_fts MATCH ? {user_filter}
+                ORDER BY rank LIMIT ? OFFSET ?
+            """, params + [limit, offset]).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid search query: {e}")
+        finally:
+            conn.close()
+
+        return {
+            "total": total,
+            "terms": terms,
+            # bm25 ยิ่งน้อยยิ่งเกี่ยวข้อง กลับเครื่องหมายให้ค่ามากคือเกี่ยวข้องมาก
+            "hits": [
+                {"username": user, "id": json.loads(entry_id), "timestamp": timestamp, "relevance": -rank}
+                for user, entry_id, timestamp, rank in rows
+            ]
+        }
+
+
+_indexes: Dict[str, SearchIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_search_index(db_file: Optional[str] = None) -> SearchIndex:
+    """
+    คืน SearchIndex ที่ใช้ร่วมกันภายใน process
+
+    ตั้งค่าไฟล์ได้ด้วยตัวแปร SEARCH_INDEX_FILE
+    """
+    db_file = db_file or os.getenv("SEARCH_INDEX_FILE", "search_index.db")
+    key = os.path.abspath(db_file)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = SearchIndex(db_file)
+        return _indexes[key]
+
+
+if __name__ == "__main__":
+    from analysis_repository import get_repository
+
+    repository = get_repository()
+    if len(sys.argv) >= 2 and sys.argv[1] == "--rebuild":
+        print(f"✅ Indexed {repository.rebuild_search_index()} analyses")
+    elif len(sys.argv) >= 3 and sys.argv[1] == "--query":
+        began = time.perf_counter()
+        found = repository.search(sys.argv[2], limit=10)
+        print(f"🔍 {found['total']} results in {(time.perf_counter() - began) * 1000:.1f} ms")
+        for item in found["items"]:
+            print(f"- {item['username']} #{item['id']} {item['file_name']} ({item['relevance']:.2f})")
+            print(f"  {item['snippet']}")
+    else:
+        print(__doc__)
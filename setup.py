@@ -10,7 +10,7 @@ print("🔧 กำลังบังคับติดตั้งเครื
 # สั่งติดตั้งโดยใช้ Path ที่ระบุเจาะจง (ไม่มีทางพลาด)
 commands = [
     [python_path, "-m", "pip", "install", "--upgrade", "pip"],
-    [python_path, "-m", "pip", "install", "--upgrade", "google-generativeai"],
+    [python_path, "-m", "pip", "install", "google-generativeai==0.8.5"],
     [python_path, "-m", "pip", "install", "--upgrade", "streamlit"],
     [python_path, "-m", "pip", "install", "--upgrade", "PyPDF2"],
     [python_path, "-m", "pip", "install", "--upgrade", "python-docx"]
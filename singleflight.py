@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Singleflight - รวมคำขอที่เหมือนกันซึ่งกำลังทำงานอยู่ให้เหลือการเรียก model ครั้งเดียว
+
+เช่น นักเรียนทั้งห้องอัปโหลดไฟล์ template เดียวกัน หรือกดปุ่ม "เริ่มวิเคราะห์" ซ้ำสองครั้ง:
+คำขอแรก (leader) เรียก Gemini คำขอที่ตามมาด้วย key เดียวกันระหว่างนั้นรอผลของ leader แทนการเรียกซ้ำ
+
+- key คือ hash ของชื่อ model + prompt (flight_key)
+- ใช้ร่วมกันทั้ง process: ทุก session ของ Streamlit (คนละ thread) และทุก request ของ api_server
+  ทั้งแบบ sync (do), async (do_async) และ streaming (stream / stream_async) ผลของ leader ส่งข้าม thread
+  และข้าม event loop ผ่าน concurrent.futures.Future
+- error ของ leader ส่งให้ทุกคำขอที่รออยู่ (ไม่ลองซ้ำพร้อมกันหลายครั้ง)
+- งานของ leader ทำต่อจนเสร็จแม้ผู้เรียกคนแรกจะยกเลิก (Streamlit rerun / client ตัดการเชื่อมต่อ)
+- เมื่องานเสร็จ key จะถูกลบ คำขอหลังจากนั้นเรียกใหม่ (ผลที่เสร็จแล้วเป็นหน้าที่ของ analysis_cache)
+
+Usage:
+    python singleflight.py      # ทดสอบ 50 คำขอพร้อมกันกับ model จำลอง
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import threading
+from typing import (AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Set,
+                    Tuple, TypeVar)
+
+T = TypeVar("T")
+
+
+def flight_key(*parts: str) -> str:
+    """key ของคำขอ (SHA-256 ของทุกส่วน เช่น ชื่อ model และ prompt)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class _Broadcast:
+    """chunk ของ stream ที่ leader สร้าง ให้ผู้อ่านทุกคนอ่านตั้งแต่ต้น"""
+
+    def __init__(self):
+        self.chunks: List = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._condition = threading.Condition()
+        # ผู้อ่านแบบ async ที่รอ chunk ถัดไป: (event loop ของผู้อ่าน, future ที่ปลุก)
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def _notify(self):
+        """ปลุกผู้รอทุกคน (เรียกขณะถือ lock)"""
+        self._condition.notify_all()
+        waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            # ผู้ผลิตอาจอยู่คนละ thread/event loop กับผู้อ่าน
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:  # loop ของผู้อ่านปิดไปแล้ว
+                pass
+
+    def push(self, chunk):
+        with self._condition:
+            self.chunks.append(chunk)
+            self._notify()
+
+    def close(self, error: Optional[BaseException] = None):
+        with self._condition:
+            self.done = True
+            self.error = error
+            self._notify()
+
+    def wait(self, index: int, timeout: Optional[float] = None) -> bool:
+        """รอจนมี chunk ลำดับ index หรือ stream จบ (True ถ้ามีความคืบหน้า)"""
+        with self._condition:
+            return self._condition.wait_for(lambda: index < len(self.chunks) or self.done, timeout)
+
+    def read(self) -> Iterator:
+        index = 0
+        while True:
+            self.wait(index)
+            # อ่านนอก lock ได้: list มีแต่เพิ่มต่อท้าย
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+
+    async def read_async(self) -> AsyncIterator:
+        # รอด้วย future ของ event loop ตัวเอง (ไม่ใช้ thread ของ default executor ต่อผู้อ่าน)
+        loop = asyncio.get_running_loop()
+        index = 0
+        while True:
+            with self._condition:
+                waiter = None
+                if index >= len(self.chunks) and not self.done:
+                    waiter = loop.create_future()
+                    self._waiters.append((loop, waiter))
+            if waiter is not None:
+                try:
+                    await waiter
+                finally:
+                    with self._condition:
+                        if (loop, waiter) in self._waiters:
+                            self._waiters.remove((loop, waiter))
+                continue
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done and index >= len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """ตาราง in-flight ของคำขอต่อ key (ใช้ร่วมกันภายใน process)"""
+
+    def __init__(self):
+        self._calls: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        # event loop เก็บ task แบบ weak reference จึงต้องถือไว้จนกว่างานของ leader จะเสร็จ
+        self._tasks: Set[asyncio.Future] = set()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, key: str, factory: Callable[[], object]):
+        """(งานที่กำลังทำของ key นี้, True ถ้าผู้เรียกเป็น leader ที่ต้องเริ่มงานเอง)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = self._calls[key] = factory()
+            self.leaders += 1
+            return call, True
+
+    def _keep(self, task: asyncio.Future):
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _forget(self, key: str, call: object):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """
+        เรียก fn() ถ้ายังไม่มีคำขอ key เดียวกันค้างอยู่ ไม่เช่นนั้นรอผลของคำขอนั้น
+
+        Args:
+            key: key ของคำขอ (จาก flight_key())
+            fn: ฟังก์ชันที่เรียก model
+
+        Returns:
+            ผลของ fn() (ผู้รอทุกคนได้ object เดียวกัน)
+        """
+        future, leader = self._join(key, concurrent.futures.Future)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._forget(key, future)
+            future.set_exception(e)
+            raise
+        self._forget(key, future)
+        future.set_result(result)
+        return result
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """do สำหรับ coroutine (ผู้รออาจอยู่คนละ event loop หรือเป็น sync ก็ได้)"""
+        future, leader = self._join(key, concurrent.futures.Future)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        task = asyncio.ensure_future(fn())
+        self._keep(task)
+
+        def finish(done: asyncio.Future):
+            self._forget(key, future)
+            if done.cancelled():
+                future.set_exception(asyncio.CancelledError())
+            elif done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result())
+        task.add_done_callback(finish)
+        # ผู้เรียกถูกยกเลิกได้ แต่งานของ leader ทำต่อให้ผู้รอคนอื่น
+        return await asyncio.shield(task)
+
+    def stream(self, key: str, factory: Callable[[], Iterable[T]]) -> Iterator[T]:
+        """
+        stream ที่ใช้ร่วมกัน: ผู้ที่เข้ามาทีหลังได้ chunk ตั้งแต่ต้นแล้วตามต่อจนจบ
+
+        leader อ่าน factory() ใน thread เบื้องหลัง (ผู้อ่านคนไหนหยุดกลางทางก็ไม่กระทบคนอื่น)
+
+        Args:
+            key: key ของคำขอ
+            factory: ฟังก์ชันที่เริ่ม stream จาก model
+        """
+        broadcast, leader = self._join(key, _Broadcast)
+        if leader:
+            def produce():
+                try:
+                    for chunk in factory():
+                        broadcast.push(chunk)
+                except BaseException as e:
+                    self._forget(key, broadcast)
+                    broadcast.close(e)
+                else:
+                    self._forget(key, broadcast)
+                    broadcast.close()
+            threading.Thread(target=produce, name="singleflight-stream", daemon=True).start()
+        return broadcast.read()
+
+    async def stream_async(self, key: str, factory: Callable[[], AsyncIterable[T]]) -> AsyncIterator[T]:
+        """stream สำหรับ async iterable (leader อ่านเป็น task ของ event loop ปัจจุบัน)"""
+        broadcast, leader = self._join(key, _Broadcast)
+        if leader:
+            async def produce():
+                try:
+                    async for chunk in factory():
+                        broadcast.push(chunk)
+                except BaseException as e:
+                    self._forget(key, broadcast)
+                    broadcast.close(e)
+                    if isinstance(e, asyncio.CancelledError):
+                        raise
+                else:
+                    self._forget(key, broadcast)
+                    broadcast.close()
+            self._keep(asyncio.ensure_future(produce()))
+        async for chunk in broadcast.read_async():
+            yield chunk
+
+    def get_stats(self) -> Dict:
+        """สถิติสำหรับหน้า Admin: จำนวนการเรียกจริง และจำนวนคำขอที่ได้ผลร่วมกับคำขออื่น"""
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced
+            }
+
+
+_flight: Optional[SingleFlight] = None
+_flight_lock = threading.Lock()
+
+
+def get_singleflight() -> SingleFlight:
+    """คืน SingleFlight ที่ใช้ร่วมกันภายใน process"""
+    global _flight
+    with _flight_lock:
+        if _flight is None:
+            _flight = SingleFlight()
+        return _flight
+
+
+if __name__ == "__main__":
+    # ทดสอบ: 50 คำขอเหมือนกันพร้อมกัน ต้องเรียก model จำลองเพียงครั้งเดียว
+    import time
+
+    upstream_calls = []
+    upstream_lock = threading.Lock()
+
+    def fake_model(prompt: str) -> str:
+        with upstream_lock:
+            upstream_calls.append(prompt)
+        time.sleep(0.5)
+        return f"ผลการวิเคราะห์: {prompt}"
+
+    flight = SingleFlight()
+    key = flight_key("fake-model", "template.pdf")
+    barrier = threading.Barrier(50)
+    results = []
+
+    def request():
+        barrier.wait()
+        results.append(flight.do(key, lambda: fake_model("template.pdf")))
+
+    began = time.perf_counter()
+    threads = [threading.Thread(target=request) for _ in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"threads: 50 requests, {len(upstream_calls)} upstream call(s), "
+          f"{(time.perf_counter() - began) * 1000:.0f} ms")
+    assert len(upstream_calls) == 1, upstream_calls
+    assert len(results) == 50 and len(set(results)) == 1
+
+    async def fake_model_async(prompt: str) -> str:
+        upstream_calls.append(prompt)
+        await asyncio.sleep(0.5)
+        return f"ผลการวิเคราะห์: {prompt}"
+
+    async def fake_stream(prompt: str):
+        upstream_calls.append(prompt)
+        for word in prompt.split():
+            await asyncio.sleep(0.05)
+            yield word + " "
+
+    async def concurrent_requests():
+        upstream_calls.clear()
+        answers = await asyncio.gather(*[
+            flight.do_async(key, lambda: fake_model_async("template.pdf")) for _ in range(50)
+        ])
+        assert len(upstream_calls) == 1 and len(set(answers)) == 1
+        print(f"asyncio: 50 requests, {len(upstream_calls)} upstream call(s)")
+
+        upstream_calls.clear()
+        prompt = "วัตถุประสงค์ สอดคล้อง กับ สรุปผล"
+
+        async def read():
+            return "".join([chunk async for chunk in flight.stream_async(key, lambda: fake_stream(prompt))])
+        texts = await asyncio.gather(*[read() for _ in range(50)])
+        assert len(upstream_calls) == 1 and set(texts) == {prompt + " "}
+        print(f"stream: 50 readers, {len(upstream_calls)} upstream call(s)")
+
+    asyncio.run(concurrent_requests())
+    print(f"stats: {flight.get_stats()}")
+    print("✅ singleflight OK")
@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Storage engines for AnalysisDatabase
+
+- JsonFileEngine: เก็บทั้งหมดในไฟล์ JSON ไฟล์เดียว (รูปแบบเดิม, เขียนทับทั้งไฟล์ทุกครั้ง)
+- LogStructuredEngine: เขียนต่อท้าย (append-only) ลง segment files
+  พร้อม index ตำแหน่งในหน่วยความจำแยกตามผู้ใช้ และ compaction เบื้องหลัง
+"""
+
+import json
+import os
+import threading
+import uuid
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+from write_coordinator import GroupCommitter, atomic_write_json, file_lock, read_json, update_json
+
+
+# ตำแหน่งของ record หนึ่งรายการใน segment file (พร้อม timestamp สำหรับ secondary index)
+RecordLocation = namedtuple("RecordLocation", ["segment", "offset", "length", "timestamp"])
+
+
+class SecondaryIndex:
+    """index รองที่ engine อัพเดทให้ทุกครั้งที่มีการเพิ่ม/ลบ record"""
+
+    def reset(self):
+        """ล้าง index ทั้งหมด (เรียกก่อน engine สร้าง index ใหม่)"""
+        raise NotImplementedError
+
+    def add(self, username: str, entry_id, location: RecordLocation):
+        raise NotImplementedError
+
+    def remove(self, username: str, entry_id, location: RecordLocation):
+        raise NotImplementedError
+
+
+class StorageEngine:
+    """ส่วนต่อประสานของ storage engine ที่ AnalysisDatabase ใช้"""
+
+    _indexes: Dict[str, SecondaryIndex]
+
+    def refresh(self):
+        """อัพเดท index ให้ตรงกับข้อมูลล่าสุดบนดิสก์"""
+        pass
+
+    def register_index(self, name: str, index: SecondaryIndex) -> SecondaryIndex:
+        """
+        ลงทะเบียน secondary index (ถ้ามีชื่อนี้แล้วจะคืนตัวเดิม)
+
+        Returns:
+            index ที่ลงทะเบียนอยู่
+        """
+        raise NotImplementedError
+
+    def read_all(self) -> Dict[str, List[Dict]]:
+        """อ่านข้อมูลทั้งหมดในรูปแบบ {username: [entries]}"""
+        raise NotImplementedError
+
+    def write_all(self, data: Dict[str, List[Dict]]):
+        """เขียนข้อมูลทั้งหมดทับของเดิม"""
+        raise NotImplementedError
+
+    def append(self, username: str, entry: Dict) -> Dict:
+        """เพิ่ม record ใหม่ให้ผู้ใช้ (กำหนด id ให้อัตโนมัติ) แล้วคืน record ที่บันทึก"""
+        raise NotImplementedError
+
+    def get_user_records(self, username: str) -> List[Dict]:
+        """ดึง record ทั้งหมดของผู้ใช้ตามลำดับที่บันทึก"""
+        raise NotImplementedError
+
+    def get_record(self, username: str, analysis_id) -> Optional[Dict]:
+        """ดึง record เดียวตาม id"""
+        for entry in self.get_user_records(username):
+            if entry.get('id') == analysis_id:
+                return entry
+        return None
+
+    def get_records(self, keys: List[tuple]) -> List[Dict]:
+        """ดึงหลาย record ตามรายการ (username, id) คืนเฉพาะที่พบ"""
+        records = []
+        for username, analysis_id in keys:
+            entry = self.get_record(username, analysis_id)
+            if entry is not None:
+                records.append(entry)
+        return records
+
+    def delete(self, username: str, analysis_id) -> bool:
+        """ลบ record หนึ่งรายการ คืน False ถ้าไม่มีผู้ใช้นี้"""
+        raise NotImplementedError
+
+    def clear_user(self, username: str):
+        """ลบ record ทั้งหมดของผู้ใช้ (คงชื่อผู้ใช้ไว้)"""
+        raise NotImplementedError
+
+    def user_counts(self) -> Dict[str, int]:
+        """จำนวน record ของผู้ใช้แต่ละคน"""
+        return {u: len(entries) for u, entries in self.read_all().items()}
+
+    def close(self):
+        """ปิด engine และหยุดงานเบื้องหลัง"""
+        pass
+
+
+class JsonFileEngine(StorageEngine):
+    """
+    Engine แบบเดิม: อ่าน/เขียนทั้งไฟล์ JSON ทุกครั้ง
+
+    การแก้ไขทำแบบ read-modify-write ภายใต้ file lock และเขียนผ่าน os.replace
+    ผู้อ่านจึงไม่ต้องถือ lock
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._indexes = {}
+        self._indexed_stamp = None
+        with file_lock(self.db_file):
+            if not os.path.exists(self.db_file):
+                self.write_all({})
+
+    def read_all(self) -> Dict[str, List[Dict]]:
+        data = read_json(self.db_file, {})
+        self._sync_indexes(data)
+        return data
+
+    def write_all(self, data: Dict[str, List[Dict]]):
+        with file_lock(self.db_file):
+            atomic_write_json(self.db_file, data)
+
+    def refresh(self):
+        self.read_all()
+
+    def register_index(self, name: str, index: SecondaryIndex) -> SecondaryIndex:
+        if name not in self._indexes:
+            self._indexes[name] = index
+            self._indexed_stamp = None
+            self.refresh()
+        return self._indexes[name]
+
+    def _sync_indexes(self, data: Dict[str, List[Dict]]):
+        """สร้าง secondary index ใหม่เมื่อไฟล์เปลี่ยน (ดูจาก mtime และขนาดไฟล์)"""
+        if not self._indexes:
+            return
+        try:
+            stat = os.stat(self.db_file)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamp = None
+        if stamp is not None and stamp == self._indexed_stamp:
+            return
+        self._indexed_stamp = stamp
+        for index in self._indexes.values():
+            index.reset()
+            for user, entries in data.items():
+                if not isinstance(entries, list):
+                    continue
+                for entry in entries:
+                    location = RecordLocation(None, None, None, entry.get('timestamp', ''))
+                    index.add(user, entry.get('id'), location)
+
+    def append(self, username: str, entry: Dict) -> Dict:
+        def add(db_data):
+            records = db_data.setdefault(username, [])
+            saved = dict(entry, id=max((e.get('id', 0) for e in records if isinstance(e.get('id'), int)), default=0) + 1)
+            records.append(saved)
+            return saved
+
+        return update_json(self.db_file, add, {})
+
+    def get_user_records(self, username: str) -> List[Dict]:
+        return self.read_all().get(username, [])
+
+    def get_records(self, keys: List[tuple]) -> List[Dict]:
+        # อ่านไฟล์ครั้งเดียวสำหรับทุก key
+        data = self.read_all()
+        by_key = {
+            (user, entry.get('id')): entry
+            for user, entries in data.items() if isinstance(entries, list)
+            for entry in entries
+        }
+        return [by_key[key] for key in keys if key in by_key]
+
+    def delete(self, username: str, analysis_id) -> bool:
+        def remove(db_data):
+            if username not in db_data:
+                return False
+            db_data[username] = [
+                entry for entry in db_data[username]
+                if entry['id'] != analysis_id
+            ]
+            return True
+
+        return update_json(self.db_file, remove, {})
+
+    def clear_user(self, username: str):
+        def clear(db_data):
+            if username in db_data:
+                db_data[username] = []
+
+        update_json(self.db_file, clear, {})
+
+
+class LogStructuredEngine(StorageEngine):
+    """
+    Engine แบบ append-only log
+
+    แต่ละบรรทัดใน segment file คือ operation หนึ่งรายการ (JSON Lines):
+        {"op": "put", "user": ..., "entry": {...}}
+        {"op": "del", "user": ..., "id": ...}
+        {"op": "clear", "user": ...}
+        {"op": "seq", "user": ..., "next_id": ...}
+
+    - เขียน: ต่อท้าย segment ปัจจุบัน -> O(ขนาด record)
+    - อ่านประวัติผู้ใช้: seek ตาม index -> O(จำนวน record ของผู้ใช้)
+    - compaction: รวม segment ที่ปิดแล้วให้เหลือเฉพาะ record ที่ยังใช้อยู่
+    - MANIFEST.json เก็บ generation; เมื่อ compaction เปลี่ยนไฟล์ process อื่นจะ rebuild index
+
+    หลาย process ใช้โฟลเดอร์เดียวกันได้: ทุกการเขียนและการอ่าน index ถือ file lock ของโฟลเดอร์
+    record ใหม่ ("put" ที่ไม่มี id) ได้ id ตอน replay ตามลำดับใน log ทุก process จึงได้ id ตรงกัน
+    โดยไม่ต้องอ่านก่อนเขียน และการ append พร้อมกันหลาย thread ถูกรวมเป็น fsync เดียว (group commit)
+    """
+
+    SEGMENT_PREFIX = "segment_"
+    SEGMENT_SUFFIX = ".log"
+    MANIFEST_FILE = "MANIFEST.json"
+
+    def __init__(self,
+                 data_dir: str,
+                 legacy_json: Optional[str] = None,
+                 max_segment_bytes: int = 4 * 1024 * 1024,
+                 compaction_interval: float = 300.0):
+        """
+        Args:
+            data_dir: โฟลเดอร์เก็บ segment files
+            legacy_json: ไฟล์ JSON เดิมที่จะนำเข้าครั้งแรก (ถ้ายังไม่มี segment)
+            max_segment_bytes: ขนาดสูงสุดของ segment ก่อนเปิดไฟล์ใหม่
+            compaction_interval: ระยะเวลา (วินาที) ระหว่างการ compaction เบื้องหลัง (0 = ปิด)
+        """
+        self.data_dir = data_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.compaction_interval = compaction_interval
+
+        self._lock = threading.RLock()
+        self._index: Dict[str, Dict] = {}
+        self._indexes: Dict[str, SecondaryIndex] = {}
+        self._next_id: Dict[str, int] = {}
+        # next_id ณ ท้ายแต่ละ segment (compaction ต้องใช้ค่านี้ ไม่ใช่ค่าล่าสุด)
+        self._segment_next_id: Dict[int, Dict[str, int]] = {}
+        self._scanned: Dict[int, int] = {}
+        self._garbage_bytes = 0
+        self._generation = None
+        # token ของ record ที่ thread ใน process นี้กำลังรอ id -> id ที่ได้ตอน replay
+        self._waiting_tokens = set()
+        self._resolved_tokens: Dict[str, int] = {}
+
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._dir_lock = file_lock(os.path.join(self.data_dir, "LOCK"))
+        self._committer = GroupCommitter(self._dir_lock, self._active_segment_path)
+        with self._dir_lock, self._lock:
+            if not self._list_segments() and legacy_json and os.path.exists(legacy_json):
+                self._import_legacy(legacy_json)
+            self._rebuild()
+
+        self._stop_event = threading.Event()
+        self._compactor = None
+        if self.compaction_interval > 0:
+            self._compactor = threading.Thread(
+                target=self._compaction_loop,
+                name=f"compactor:{os.path.basename(data_dir)}",
+                daemon=True
+            )
+            self._compactor.start()
+
+    # ---------- segment files ----------
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.data_dir, f"{self.SEGMENT_PREFIX}{number:06d}{self.SEGMENT_SUFFIX}")
+
+    def _list_segments(self) -> List[int]:
+        numbers = []
+        for name in os.listdir(self.data_dir):
+            if name.startswith(self.SEGMENT_PREFIX) and name.endswith(self.SEGMENT_SUFFIX):
+                try:
+                    numbers.append(int(name[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(numbers)
+
+    def _active_segment(self) -> int:
+        """segment ที่ใช้เขียนต่อท้าย (เปิดไฟล์ใหม่เมื่อไฟล์เดิมเต็ม)"""
+        segments = self._list_segments()
+        if not segments:
+            return 1
+        last = segments[-1]
+        try:
+            if os.path.getsize(self._segment_path(last)) >= self.max_segment_bytes:
+                return last + 1
+        except OSError:
+            pass
+        return last
+
+    def _active_segment_path(self) -> str:
+        return self._segment_path(self._active_segment())
+
+    def _read_generation(self) -> int:
+        manifest = read_json(os.path.join(self.data_dir, self.MANIFEST_FILE), {})
+        return manifest.get("generation", 0)
+
+    def _bump_generation(self):
+        manifest = os.path.join(self.data_dir, self.MANIFEST_FILE)
+        atomic_write_json(manifest, {"generation": self._read_generation() + 1}, indent=None)
+
+    @staticmethod
+    def _encode(op: Dict) -> bytes:
+        return (json.dumps(op, ensure_ascii=False) + "\n").encode('utf-8')
+
+    # ---------- index ----------
+
+    def _rebuild(self):
+        """สร้าง index ใหม่จาก segment ทั้งหมด (ผู้เรียกต้องถือ _dir_lock และ _lock)"""
+        self._index = {}
+        self._next_id = {}
+        self._segment_next_id = {}
+        self._scanned = {}
+        self._garbage_bytes = 0
+        self._generation = self._read_generation()
+        for index in self._indexes.values():
+            index.reset()
+        for number in self._list_segments():
+            self._scan_segment(number)
+
+    def _refresh(self):
+        """
+        ตามอ่านข้อมูลที่ process อื่นเขียนต่อท้ายไว้ (หรือ rebuild ถ้ามี compaction)
+
+        ผู้เรียกต้องถือ _dir_lock และ _lock เพื่อไม่ให้ชนกับ compaction ของ process อื่น
+        """
+        if self._read_generation() != self._generation:
+            self._rebuild()
+            return
+        for number in self._list_segments():
+            try:
+                size = os.path.getsize(self._segment_path(number))
+            except OSError:
+                continue
+            if size > self._scanned.get(number, 0):
+                self._scan_segment(number)
+
+    def _scan_segment(self, number: int):
+        """อ่าน operation ใน segment ตั้งแต่ตำแหน่งที่อ่านค้างไว้"""
+        offset = self._scanned.get(number, 0)
+        try:
+            with open(self._segment_path(number), 'rb') as f:
+                f.seek(offset)
+                while True:
+                    line = f.readline()
+                    # บรรทัดที่ยังเขียนไม่เสร็จ (ไม่มี newline) จะอ่านใหม่รอบหน้า
+                    if not line or not line.endswith(b"\n"):
+                        break
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        self._garbage_bytes += len(line)
+                    else:
+                        timestamp = op.get("entry", {}).get("timestamp", "")
+                        self._apply(op, RecordLocation(number, offset, len(line), timestamp))
+                    offset += len(line)
+        except FileNotFoundError:
+            pass
+        self._scanned[number] = offset
+        self._segment_next_id[number] = dict(self._next_id)
+
+    def _apply(self, op: Dict, location: RecordLocation):
+        user = op.get("user")
+        kind = op.get("op")
+        records = self._index.setdefault(user, {})
+
+        if kind == "put":
+            entry_id = op["entry"].get("id")
+            if entry_id is None:
+                # record ใหม่: กำหนด id ตามลำดับใน log
+                entry_id = self._next_id.get(user, 1)
+                if op.get("token") in self._waiting_tokens:
+                    self._resolved_tokens[op["token"]] = entry_id
+            old = records.pop(entry_id, None)
+            if old is not None:
+                self._garbage_bytes += old.length
+                self._notify_remove(user, entry_id, old)
+            records[entry_id] = location
+            self._notify_add(user, entry_id, location)
+            if isinstance(entry_id, int):
+                self._next_id[user] = max(self._next_id.get(user, 1), entry_id + 1)
+        elif kind == "del":
+            old = records.pop(op.get("id"), None)
+            if old is not None:
+                self._garbage_bytes += old.length
+                self._notify_remove(user, op.get("id"), old)
+            self._garbage_bytes += location.length
+        elif kind == "clear":
+            self._garbage_bytes += sum(loc.length for loc in records.values()) + location.length
+            for entry_id, old in records.items():
+                self._notify_remove(user, entry_id, old)
+            records.clear()
+        elif kind == "seq":
+            self._next_id[user] = max(self._next_id.get(user, 1), op.get("next_id", 1))
+
+    def _notify_add(self, user: str, entry_id, location: RecordLocation):
+        for index in self._indexes.values():
+            index.add(user, entry_id, location)
+
+    def _notify_remove(self, user: str, entry_id, location: RecordLocation):
+        for index in self._indexes.values():
+            index.remove(user, entry_id, location)
+
+    def _write_op(self, op: Dict):
+        """เขียน operation ต่อท้าย log (ผ่าน group commit) แล้วอัพเดท index"""
+        self._committer.append(self._encode(op))
+        with self._dir_lock, self._lock:
+            self._refresh()
+
+    def _read_locations(self, items: List[tuple]) -> List[Dict]:
+        """อ่าน record ตามรายการ (id, ตำแหน่ง) โดยเปิดแต่ละ segment เพียงครั้งเดียว"""
+        handles = {}
+        entries = []
+        try:
+            for entry_id, loc in items:
+                if loc.segment not in handles:
+                    handles[loc.segment] = open(self._segment_path(loc.segment), 'rb')
+                f = handles[loc.segment]
+                f.seek(loc.offset)
+                entry = json.loads(f.read(loc.length))["entry"]
+                entry["id"] = entry_id
+                entries.append(entry)
+        finally:
+            for f in handles.values():
+                f.close()
+        return entries
+
+    # ---------- StorageEngine API ----------
+
+    def refresh(self):
+        with self._dir_lock, self._lock:
+            self._refresh()
+
+    def register_index(self, name: str, index: SecondaryIndex) -> SecondaryIndex:
+        with self._dir_lock, self._lock:
+            if name not in self._indexes:
+                self._refresh()
+                self._indexes[name] = index
+                index.reset()
+                for user, records in self._index.items():
+                    for entry_id, location in records.items():
+                        index.add(user, entry_id, location)
+            return self._indexes[name]
+
+    def read_all(self) -> Dict[str, List[Dict]]:
+        with self._dir_lock, self._lock:
+            self._refresh()
+            return {
+                user: self._read_locations(list(records.items()))
+                for user, records in self._index.items()
+            }
+
+    def write_all(self, data: Dict[str, List[Dict]]):
+        with self._dir_lock, self._lock:
+            self._refresh()
+            old_segments = self._list_segments()
+            target = (old_segments[-1] + 1) if old_segments else 1
+            self._write_snapshot(target, data, self._next_id)
+            for number in old_segments:
+                os.remove(self._segment_path(number))
+            self._bump_generation()
+            self._rebuild()
+
+    def _write_snapshot(self, number: int, data: Dict[str, List[Dict]], next_ids: Dict[str, int]):
+        """เขียน segment ใหม่ทั้งไฟล์ผ่านไฟล์ชั่วคราวแล้ว rename"""
+        tmp_path = self._segment_path(number) + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            for user, entries in data.items():
+                f.write(self._encode({"op": "clear", "user": user}))
+                for entry in entries:
+                    f.write(self._encode({"op": "put", "user": user, "entry": entry}))
+                if next_ids.get(user):
+                    f.write(self._encode({"op": "seq", "user": user, "next_id": next_ids[user]}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._segment_path(number))
+
+    def _import_legacy(self, legacy_json: str):
+        """นำเข้าข้อมูลจากไฟล์ JSON เดิมเป็น segment แรก"""
+        try:
+            with open(legacy_json, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return
+        data = {u: entries for u, entries in legacy.items() if isinstance(entries, list)}
+        if data:
+            self._write_snapshot(1, data, {})
+            print(f"✅ Imported {sum(len(e) for e in data.values())} records from {legacy_json}")
+
+    def append(self, username: str, entry: Dict) -> Dict:
+        entry = {k: v for k, v in entry.items() if k != "id"}
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._waiting_tokens.add(token)
+        try:
+            self._write_op({"op": "put", "user": username, "token": token, "entry": entry})
+            with self._lock:
+                entry_id = self._resolved_tokens.pop(token, None)
+        finally:
+            with self._lock:
+                self._waiting_tokens.discard(token)
+        if entry_id is None:
+            # log ถูกเขียนใหม่ทั้งหมด (compaction/write_all ของ process อื่น) ก่อนได้อ่าน token
+            entry_id = self._find_written_id(username, entry)
+        return dict(entry, id=entry_id)
+
+    def _find_written_id(self, username: str, entry: Dict):
+        for saved in reversed(self.get_user_records(username)):
+            if {k: v for k, v in saved.items() if k != "id"} == entry:
+                return saved["id"]
+        return None
+
+    def get_user_records(self, username: str) -> List[Dict]:
+        with self._dir_lock, self._lock:
+            self._refresh()
+            # อ่านภายใต้ lock เพื่อไม่ให้ชนกับ compaction ที่ลบ segment
+            return self._read_locations(list(self._index.get(username, {}).items()))
+
+    def get_record(self, username: str, analysis_id) -> Optional[Dict]:
+        with self._dir_lock, self._lock:
+            self._refresh()
+            location = self._index.get(username, {}).get(analysis_id)
+            if location is None:
+                return None
+            return self._read_locations([(analysis_id, location)])[0]
+
+    def get_records(self, keys: List[tuple]) -> List[Dict]:
+        with self._dir_lock, self._lock:
+            self._refresh()
+            items = [
+                (entry_id, self._index[user][entry_id])
+                for user, entry_id in keys
+                if entry_id in self._index.get(user, {})
+            ]
+            return self._read_locations(items)
+
+    def delete(self, username: str, analysis_id) -> bool:
+        with self._dir_lock, self._lock:
+            self._refresh()
+            if username not in self._index:
+                return False
+            if analysis_id not in self._index[username]:
+                return True
+        self._write_op({"op": "del", "user": username, "id": analysis_id})
+        return True
+
+    def clear_user(self, username: str):
+        self._write_op({"op": "clear", "user": username})
+
+    def user_counts(self) -> Dict[str, int]:
+        with self._dir_lock, self._lock:
+            self._refresh()
+            return {user: len(records) for user, records in self._index.items()}
+
+    # ---------- compaction ----------
+
+    def compact(self) -> bool:
+        """
+        รวม segment ที่ปิดแล้วทั้งหมดเป็นไฟล์เดียว เก็บเฉพาะ record ที่ยังใช้อยู่
+
+        segment ใหม่ใช้หมายเลขของ segment ปิดล่าสุด จึงยังเรียงก่อน segment ที่กำลังเขียน
+
+        Returns:
+            True ถ้ามีการ compaction
+        """
+        with self._dir_lock, self._lock:
+            self._refresh()
+            segments = self._list_segments()
+            active = self._active_segment()
+            closed = [n for n in segments if n != active]
+            if not closed or (len(closed) == 1 and self._garbage_bytes == 0):
+                return False
+
+            closed_set = set(closed)
+            live = {}
+            for user, records in self._index.items():
+                items = [(entry_id, loc) for entry_id, loc in records.items() if loc.segment in closed_set]
+                live[user] = self._read_locations(items)
+
+            target = closed[-1]
+            self._write_snapshot(target, live, self._segment_next_id.get(target, {}))
+            for number in closed[:-1]:
+                os.remove(self._segment_path(number))
+            self._bump_generation()
+            self._rebuild()
+            return True
+
+    def _compaction_loop(self):
+        while not self._stop_event.wait(self.compaction_interval):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting segments: {e}")
+
+    def close(self):
+        self._stop_event.set()
+
+
+# engine ที่เปิดอยู่ในแต่ละ process (ใช้ index และ compactor ร่วมกันทุก instance)
+_open_engines: Dict[str, StorageEngine] = {}
+_open_engines_lock = threading.Lock()
+
+
+def open_engine(db_file: str, engine: Optional[str] = None) -> StorageEngine:
+    """
+    เปิด storage engine สำหรับไฟล์ฐานข้อมูล
+
+    Args:
+        db_file: ไฟล์ฐานข้อมูล เช่น history.json
+        engine: "log" หรือ "json" (default: ตัวแปร STORAGE_ENGINE หรือ "log")
+
+    Returns:
+        StorageEngine ที่ใช้ร่วมกันภายใน process
+    """
+    engine = (engine or os.getenv("STORAGE_ENGINE", "log")).lower()
+    key = f"{engine}:{os.path.abspath(db_file)}"
+
+    with _open_engines_lock:
+        if key not in _open_engines:
+            if engine == "json":
+                _open_engines[key] = JsonFileEngine(db_file)
+            elif engine == "log":
+                data_dir = os.path.splitext(db_file)[0] + "_segments"
+                _open_engines[key] = LogStructuredEngine(data_dir, legacy_json=db_file)
+            else:
+                raise ValueError(f"Unknown storage engine: {engine}")
+        return _open_engines[key]
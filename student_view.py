@@ -43,13 +43,20 @@ except Exception as e:
     import google.generativeai as genai
 
 import streamlit as st
-import PyPDF2
-from docx import Document
 import time
 from datetime import datetime
-from database import AnalysisDatabase
-from report_generator import ReportGenerator
-from email_notifier import EmailNotifier
+from analysis_repository import get_repository
+from analysis_cache import get_analysis_cache
+from document_reader import extract_text
+from prompt_builder import condense_document_sync, get_prompt_budget, model_generator
+from rate_limiter import RateLimitTimeout
+from api_key_pool import NoApiKeyError, get_api_key_pool
+from model_registry import get_model_registry
+from model_router import get_model_router
+from report_cache import REPORT_FORMATS, get_report_cache
+from report_store import get_report_store
+from report_generator import get_report_generator
+from email_notifier import get_email_notifier
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -152,54 +159,31 @@ def login_page():
         st.markdown("<p style='text-align: center; color: #B8879F; font-size: 12px; font-family: Prompt, sans-serif;'>© 2024 AI Project Grader System</p>", unsafe_allow_html=True)
 
 # ========== MAIN APP ==========
-# Load API Key from environment variable
-API_KEY = os.getenv("GOOGLE_API_KEY")
+# API Keys จาก .env (GOOGLE_API_KEY / GOOGLE_API_KEYS) และหน้า Admin ใช้ร่วมกันเป็น pool
+key_pool = get_api_key_pool()
+API_KEYS = key_pool.keys()
 
 # Check if API Key is configured
-if not API_KEY or API_KEY == "":
-    st.error("❌ API Key ยังไม่ได้ตั้งค่า! โปรดเพิ่ม GOOGLE_API_KEY ใน .env file")
+if not API_KEYS:
+    st.error("❌ API Key ยังไม่ได้ตั้งค่า! โปรดเพิ่ม GOOGLE_API_KEY ใน .env file หรือเพิ่ม key ในหน้า Admin")
     st.stop()
 
 # Initialize Database
-db = AnalysisDatabase(os.getenv("DATABASE_FILE", "history.json"))
-
-# ตั้งค่า AI
-model = None
-model_name = None
-try:
-    genai.configure(api_key=API_KEY)
-    
-    # List available models for debugging
-    try:
-        available_models = genai.list_models()
-        available_names = [m.name.split('/')[-1] for m in available_models if 'generateContent' in m.supported_generation_methods]
-    except:
-        available_names = []
-    
-    # Try models in order of preference
-    model_candidates = ['gemini-2.0-flash', 'gemini-1.5-pro', 'gemini-1.5-flash', 'gemini-pro']
-    
-    for candidate in model_candidates:
-        try:
-            model = genai.GenerativeModel(candidate)
-            model_name = candidate
-            break
-        except Exception:
-            continue
-    
-    if model is None:
-        # Try any available model
-        if available_names:
-            model = genai.GenerativeModel(available_names[0])
-            model_name = available_names[0]
-        else:
-            raise Exception("ไม่พบ Model ที่ใช้ได้")
-            
-except Exception as e:
-    st.error(f"❌ เชื่อมต่อ AI ไม่ได้: {e}")
-    if available_names:
-        st.info(f"💡 Models ที่พบ: {', '.join(available_names)}")
-    model = None
+db = get_repository(os.getenv("DATABASE_FILE", "history.json"))
+analysis_cache = get_analysis_cache()
+
+# เวอร์ชันของ prompt ตรวจความสอดคล้อง (เปลี่ยนเมื่อแก้ prompt เพื่อไม่ใช้ผลใน cache เดิม)
+CONSISTENCY_PROMPT_VERSION = "consistency-v2"
+
+# ตั้งค่า AI (ค้นหา model ครั้งเดียวต่อ process แล้วรีเฟรชเบื้องหลังตาม TTL
+# แทนการเรียก genai.list_models() ทุกครั้งที่ Streamlit rerun)
+# ค้นหาด้วย key ที่ pool เลือก: key แรกที่ไม่ถูกต้องจะถูกพักและใช้ key อื่นแทน
+model_registry = get_model_registry()
+model_name = model_registry.get_model_name()
+if model_name is None:
+    st.error(f"❌ เชื่อมต่อ AI ไม่ได้: {model_registry.last_error}")
+    if model_registry.available_names:
+        st.info(f"💡 Models ที่พบ: {', '.join(model_registry.available_names)}")
 
 # ========== CUSTOM CSS STYLING - K-MINIMAL DESIGN ==========
 # K-Minimal Color Palette:
@@ -483,26 +467,95 @@ a:hover {
 st.markdown(custom_css, unsafe_allow_html=True)
 
 # Initialize Email Notifier
-email_notifier = EmailNotifier()
+email_notifier = get_email_notifier()
 
 # --- 2. ฟังก์ชันช่วยอ่านไฟล์ (Helper Functions) ---
-def read_pdf(file):
+# งบ token ของ prompt (เอกสารที่ยาวเกินงบจะสรุปทีละส่วนก่อน แทนการตัดท้ายเอกสารทิ้ง)
+PROMPT_BUDGET = get_prompt_budget()
+
+def read_document(file):
+    """อ่านไฟล์ PDF/Word ทีละหน้าจนครบ PROMPT_BUDGET.max_document_chars (คืน None ถ้าอ่านไม่ได้)"""
     try:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        return text
-    except:
-        return ""
-
-def read_docx(file):
+        return extract_text(file, file.name, max_chars=PROMPT_BUDGET.max_document_chars)
+    except Exception:
+        return None
+
+def build_consistency_prompt(content):
+    """prompt ตรวจความสอดคล้อง (content = ข้อความเต็ม หรือสรุปทีละส่วนเมื่อเอกสารยาวเกินงบ)"""
+    return f"""
+        Role: คุณคือครูที่ปรึกษาโครงงานผู้เชี่ยวชาญ
+        Task: วิเคราะห์ "ความสอดคล้อง" ของโครงงานจากข้อความที่แนบมานี้
+        
+        Text Content:
+        {content}
+        
+        คำสั่ง:
+        1. ค้นหา "วัตถุประสงค์" และ "สรุปผลการดำเนินงาน/อภิปรายผล" จากข้อความ
+        2. เปรียบเทียบว่า สรุปผล ตอบโจทย์ วัตถุประสงค์ ครบทุกข้อไหม?
+        3. ตรวจสอบจุดสำคัญ: ถ้าวัตถุประสงค์มีเรื่อง "ความพึงพอใจ" หรือ "ประสิทธิภาพ" ในสรุปผลมี "ตัวเลข/ค่าสถิติ" ไหม?
+        
+        Output Format (ตอบเป็น Markdown ภาษาไทย):
+        ## 📊 ผลการวิเคราะห์ความสอดคล้อง
+        
+        **1. วัตถุประสงค์ที่พบ:**
+        (ลิสต์วัตถุประสงค์ที่ AI จับใจความได้)
+        
+        **2. การตรวจสอบรายข้อ:**
+        - 🎯 **ข้อ 1:** [ผ่าน/ไม่ผ่าน] เพราะ...
+        - 🎯 **ข้อ 2:** [ผ่าน/ไม่ผ่าน] เพราะ...
+        
+        **3. ข้อแนะนำเพิ่มเติม:**
+        (แนะนำจุดที่ควรแก้)
+        """
+
+# จำนวนรายการประวัติต่อหน้า
+HISTORY_PAGE_SIZE = 10
+
+def load_history_page(history, query, oldest_first, page):
+    """
+    อ่านประวัติหนึ่งหน้า (เนื้อหาอ่านจาก blob store เฉพาะรายการในหน้านี้)
+
+    Args:
+        history: ประวัติของผู้ใช้แบบ metadata (ใช้เมื่อไม่มีคำค้น)
+        query: คำค้น ("" = แสดงทั้งหมด) ผลการค้นหาเรียงตามความเกี่ยวข้อง
+        oldest_first: True = เรียงจากเก่าไปใหม่ (เมื่อไม่มีคำค้น)
+        page: หน้าที่ต้องการ (เริ่มที่ 1)
+
+    Returns:
+        (จำนวนรายการทั้งหมด, รายการในหน้านี้)
+
+    Raises:
+        ValueError ถ้าคำค้นไม่ถูกต้อง
+    """
+    page_start = (page - 1) * HISTORY_PAGE_SIZE
+    if query:
+        found = db.search(query, username=st.session_state.username, limit=HISTORY_PAGE_SIZE,
+                          offset=page_start, include_result=True)
+        return found["total"], found["items"]
+    if oldest_first:
+        history = sorted(history, key=lambda x: x['timestamp'])
+    return len(history), db.load_bodies(history[page_start:page_start + HISTORY_PAGE_SIZE])
+
+def report_download_button(entry, fmt, label):
+    """ปุ่มดาวน์โหลดรายงานที่สร้างไฟล์เมื่อผู้ใช้ขอเท่านั้น (ครั้งต่อไปใช้ไฟล์จาก report cache)"""
+    username = st.session_state.username
+    report_cache = get_report_cache()
+    requested_key = f"report_requested_{fmt}_{entry['id']}"
+    if not st.session_state.get(requested_key) and not report_cache.contains(username, entry, fmt):
+        if not st.button(f"⚙️ {label}", key=f"prepare_{fmt}_{entry['id']}", help="สร้างไฟล์รายงาน"):
+            return
+        st.session_state[requested_key] = True
     try:
-        doc = Document(file)
-        text = "\n".join([para.text for para in doc.paragraphs])
-        return text
-    except:
-        return ""
+        data, file_name = report_cache.render(username, entry, fmt)
+        st.download_button(
+            label=f"📥 {label}",
+            data=data,
+            file_name=file_name,
+            mime=REPORT_FORMATS[fmt][0],
+            key=f"download_{fmt}_{entry['id']}"
+        )
+    except Exception as e:
+        st.error(f"❌ {e}")
 
 # ========== CHECK LOGIN STATUS ==========
 if "logged_in" not in st.session_state:
@@ -575,19 +628,18 @@ with tab1:
         # ปุ่มกดเริ่ม
         if st.button("🚀 เริ่มวิเคราะห์ด้วย AI", type="primary", key="analyze_btn_tab1"):
             
-            # Check if model is available
-            if model is None:
+            # Check if model is available (ค้นหาใหม่ทันทีถ้ายังไม่มี เช่น key ที่ถูกพักกลับมาใช้ได้แล้ว)
+            if model_name is None and not model_registry.refresh():
                 st.error("❌ ไม่สามารถเชื่อมต่อ AI Model ได้ โปรดตรวจสอบ API Key")
                 st.stop()
+            model_name = model_registry.model_name
             
             # 1. อ่านไฟล์
             with st.status("🤖 AI กำลังทำงาน...", expanded=True) as status:
                 st.write("📖 กำลังอ่านไฟล์...")
                 
-                if uploaded_file.name.endswith('.pdf'):
-                    content_text = read_pdf(uploaded_file)
-                else:
-                    content_text = read_docx(uploaded_file)
+                extraction = read_document(uploaded_file)
+                content_text = extraction.text if extraction else ""
                 
                 # เช็คว่าอ่านเจอไหม
                 if len(content_text) < 100:
@@ -595,47 +647,39 @@ with tab1:
                     st.stop()
                     
                 st.write(f"✅ อ่านไฟล์สำเร็จ ({len(content_text)} ตัวอักษร)")
-                time.sleep(1)
+                st.caption(f"⏱️ {extraction.summary()}")
                 
                 # 2. ส่งให้ AI วิเคราะห์ (Prompt ขั้นเทพ)
                 st.write("🧠 กำลังวิเคราะห์ตรรกะ (Logical Consistency)...")
                 
-                prompt = f"""
-                Role: คุณคือครูที่ปรึกษาโครงงานผู้เชี่ยวชาญ
-                Task: วิเคราะห์ "ความสอดคล้อง" ของโครงงานจากข้อความที่แนบมานี้
-                
-                Text Content:
-                {content_text[:30000]}  (ตัดมาบางส่วนเพื่อไม่ให้เกินโควต้า)
-                
-                คำสั่ง:
-                1. ค้นหา "วัตถุประสงค์" และ "สรุปผลการดำเนินงาน/อภิปรายผล" จากข้อความ
-                2. เปรียบเทียบว่า สรุปผล ตอบโจทย์ วัตถุประสงค์ ครบทุกข้อไหม?
-                3. ตรวจสอบจุดสำคัญ: ถ้าวัตถุประสงค์มีเรื่อง "ความพึงพอใจ" หรือ "ประสิทธิภาพ" ในสรุปผลมี "ตัวเลข/ค่าสถิติ" ไหม?
-                
-                Output Format (ตอบเป็น Markdown ภาษาไทย):
-                ## 📊 ผลการวิเคราะห์ความสอดคล้อง
-                
-                **1. วัตถุประสงค์ที่พบ:**
-                (ลิสต์วัตถุประสงค์ที่ AI จับใจความได้)
-                
-                **2. การตรวจสอบรายข้อ:**
-                - 🎯 **ข้อ 1:** [ผ่าน/ไม่ผ่าน] เพราะ...
-                - 🎯 **ข้อ 2:** [ผ่าน/ไม่ผ่าน] เพราะ...
-                
-                **3. ข้อแนะนำเพิ่มเติม:**
-                (แนะนำจุดที่ควรแก้)
-                """
-                
                 try:
-                    response = model.generate_content(prompt)
+                    # ไฟล์เดิมที่เคยวิเคราะห์แล้วใช้ผลจาก cache (ไม่ใช้โควต้า API)
+                    cache_key = analysis_cache.make_key(content_text, "all", CONSISTENCY_PROMPT_VERSION, model_name)
+                    analysis_text = analysis_cache.get(cache_key)
+                    if analysis_text is None:
+                        # โควต้าต่อนาทีของแต่ละ key ใช้ร่วมกันทุก session/process (เกินแล้วเข้าคิวแทน error)
+                        queued = key_pool.queue_depth()
+                        if queued:
+                            st.write(f"⏳ มีคำขอรอคิว AI อยู่ {queued} รายการ ระบบจะส่งให้อัตโนมัติเมื่อถึงคิว")
+                        # map: สรุปแต่ละส่วนพร้อมกันเมื่อเอกสารเกินงบ, reduce: ตรวจความสอดคล้องจากสรุป
+                        condensed = condense_document_sync(content_text, model_generator(model_name), PROMPT_BUDGET)
+                        st.write(f"🧩 {condensed.summary()}")
+                        consistency_prompt = build_consistency_prompt(condensed.content)
+                        # แสดงผลทีละส่วนทันทีที่ model เริ่มตอบ (ผลเต็มแสดงอีกครั้งด้านล่างเมื่อเสร็จ)
+                        live_output = st.empty()
+                        # model ที่เลือกไว้เป็นตัวหลัก ช้าเกิน p95 หรือล้มเหลวจะ hedge/fallback ไป candidate ถัดไป
+                        model_router = get_model_router(model_registry.usable_candidates())
+                        analysis_text = live_output.write_stream(model_router.stream_text(consistency_prompt))
+                        live_output.empty()
+                        model_registry.record_success()
+                        analysis_cache.put(cache_key, analysis_text, model_name, CONSISTENCY_PROMPT_VERSION)
+                    else:
+                        st.write("⚡ พบผลการวิเคราะห์ของไฟล์นี้ใน cache")
                     status.update(label="✅ วิเคราะห์เสร็จสิ้น!", state="complete", expanded=False)
                     
-                    # บันทึกผลลัพธ์ลงฐานข้อมูล
-                    db.save_analysis(
-                        username=st.session_state.username,
-                        file_name=uploaded_file.name,
-                        analysis_result=response.text
-                    )
+                    # บันทึกผลลัพธ์ลงฐานข้อมูล แล้วสร้างรายงาน Word/PDF ล่วงหน้าเบื้องหลัง
+                    saved = db.add_analysis(st.session_state.username, uploaded_file.name, analysis_text)
+                    get_report_store().schedule_prerender(st.session_state.username, saved)
                     
                     st.success("✅ บันทึกผลการวิเคราะห์สำเร็จ!")
                     
@@ -646,21 +690,26 @@ with tab1:
                         #     recipient_email=student_email,
                         #     username=st.session_state.username,
                         #     file_name=uploaded_file.name,
-                        #     analysis_result=response.text
+                        #     analysis_result=analysis_text
                         # )
                         st.info("📧 ข้อมูลการวิเคราะห์จะถูกส่งไปยังอีเมลของคุณ (ถ้ามีการตั้งค่า)")
                     
                     # แสดงผลลัพธ์
                     st.divider()
-                    st.markdown(response.text)
+                    st.markdown(analysis_text)
                     
                 except Exception as e:
+                    model_registry.record_failure(e)
                     status.update(label="❌ เกิดข้อผิดพลาด", state="error")
                     error_msg = str(e)
                     st.error(f"❌ ข้อผิดพลาด API: {error_msg}")
                     
                     # Provide helpful suggestions
-                    if "404" in error_msg or "not found" in error_msg.lower():
+                    if isinstance(e, RateLimitTimeout):
+                        st.warning("⏳ ขณะนี้มีผู้ใช้ส่งงานจำนวนมาก คิว AI ยาวเกินกำหนด โปรดลองใหม่ในอีกไม่กี่นาที")
+                    elif isinstance(e, NoApiKeyError):
+                        st.error("🔑 API Key ทุกตัวใช้งานไม่ได้ โปรดให้ผู้ดูแลระบบตรวจสอบในหน้า Admin")
+                    elif "404" in error_msg or "not found" in error_msg.lower():
                         st.info(f"💡 Model ที่ใช้: {model_name}\n\nลองตรวจสอบ:\n1. API Key ถูกต้องหรือไม่\n2. Model นี้ใช้ได้กับ API Key นี้หรือไม่")
                     elif "quota" in error_msg.lower():
                         st.warning("⚠️ เกิน Quota การใช้งาน API โปรดรอสักครู่แล้วลองใหม่")
@@ -673,8 +722,8 @@ with tab2:
     st.header("📜 ประวัติการวิเคราะห์")
     st.markdown("---")
     
-    # ดึงประวัติของผู้ใช้
-    history = db.get_user_history(st.session_state.username)
+    # ดึงประวัติของผู้ใช้ (metadata เท่านั้น เนื้อหาอ่านเฉพาะหน้าที่แสดง)
+    history = db.get_user_history(st.session_state.username, include_result=False)
     
     if not history:
         st.info("📭 ยังไม่มีประวัติการวิเคราะห์")
@@ -684,24 +733,32 @@ with tab2:
         # Search/Filter
         col_search, col_sort = st.columns([2, 1])
         with col_search:
-            search_term = st.text_input("🔍 ค้นหาตามชื่อไฟล์", placeholder="ใส่ชื่อไฟล์ที่ต้องการ...")
+            search_term = st.text_input("🔍 ค้นหาชื่อไฟล์หรือผลการวิเคราะห์", placeholder="เช่น สถิติความพึงพอใจ...")
         with col_sort:
             sort_by = st.selectbox("เรียงลำดับตาม", ["ล่าสุด", "เก่าสุด"])
         
-        # Filter history
-        filtered_history = history
-        if search_term:
-            filtered_history = [h for h in history if search_term.lower() in h['file_name'].lower()]
-        
-        if sort_by == "เก่าสุด":
-            filtered_history = sorted(filtered_history, key=lambda x: x['timestamp'])
+        # Filter history (full-text search เรียงตามความเกี่ยวข้อง อ่านจาก index ทีละหน้า)
+        query = search_term.strip()
+        if st.session_state.get("history_query") != query:
+            st.session_state.history_query = query
+            st.session_state.history_page = 1
+        page = st.session_state.get("history_page", 1)
+        try:
+            total_entries, page_entries = load_history_page(history, query, sort_by == "เก่าสุด", page)
+            total_pages = max((total_entries - 1) // HISTORY_PAGE_SIZE + 1, 1)
+            if page > total_pages:
+                # หน้าที่เลือกไว้หายไป (เช่น ลบรายการสุดท้ายของหน้า)
+                page = st.session_state.history_page = total_pages
+                total_entries, page_entries = load_history_page(history, query, sort_by == "เก่าสุด", page)
+        except ValueError:
+            total_entries, page_entries, total_pages = 0, [], 1
         
         st.divider()
         
         # Download Summary Report Button
         if st.button("📥 ดาวน์โหลดรายงานสรุป (Word)", type="primary", key="download_summary"):
             try:
-                gen = ReportGenerator()
+                gen = get_report_generator()
                 doc_buffer = gen.generate_summary_report(st.session_state.username, history)
                 st.download_button(
                     label="💾 ดาวน์โหลด (Word Document)",
@@ -716,12 +773,19 @@ with tab2:
         
         st.divider()
         
-        # Display history items
-        if not filtered_history:
+        # Display history items (แสดงทีละหน้า เพื่อให้เวลาแสดงผลขึ้นกับจำนวนรายการที่เห็น)
+        if not page_entries:
             st.warning("❌ ไม่พบผลการค้นหา")
         else:
-            for idx, entry in enumerate(filtered_history):
+            if query:
+                st.caption(f"พบ {total_entries} รายการ (เรียงตามความเกี่ยวข้อง)")
+            if total_pages > 1:
+                st.number_input(f"หน้า (จาก {total_pages})", min_value=1, max_value=total_pages, step=1, key="history_page")
+            page_start = (page - 1) * HISTORY_PAGE_SIZE
+            for idx, entry in enumerate(page_entries, start=page_start):
                 st.markdown(f"#### 📄 {entry['file_name']} (ID: {entry['id']})")
+                if entry.get('snippet'):
+                    st.caption(entry['snippet'])
                 with st.container():
                     col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
                     
@@ -736,45 +800,11 @@ with tab2:
                     
                     with col3:
                         st.write("")  # spacing
-                        # Download individual report button
-                        try:
-                            gen = ReportGenerator()
-                            doc_buffer = gen.generate_word_report(
-                                username=st.session_state.username,
-                                file_name=entry['file_name'],
-                                analysis_result=entry['result'],
-                                timestamp=entry['timestamp']
-                            )
-                            st.download_button(
-                                label="📥 ดาวน์โหลด",
-                                data=doc_buffer.getvalue(),
-                                file_name=gen.get_word_filename(entry['file_name'], st.session_state.username),
-                                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                                key=f"download_{entry['id']}"
-                            )
-                        except Exception as e:
-                            st.error(f"❌ {e}")
+                        report_download_button(entry, "docx", "Word")
                     
                     with col4:
                         st.write("")  # spacing
-                        # PDF Download button
-                        try:
-                            gen = ReportGenerator()
-                            pdf_buffer = gen.generate_pdf_report(
-                                username=st.session_state.username,
-                                file_name=entry['file_name'],
-                                analysis_result=entry['result'],
-                                timestamp=entry['timestamp']
-                            )
-                            st.download_button(
-                                label="📄 PDF",
-                                data=pdf_buffer.getvalue(),
-                                file_name=gen.get_pdf_filename(entry['file_name'], st.session_state.username),
-                                mime="application/pdf",
-                                key=f"download_pdf_{entry['id']}"
-                            )
-                        except Exception as e:
-                            st.error(f"❌ {e}")
+                        report_download_button(entry, "pdf", "PDF")
                     
                     # Delete button
                     col_delete = st.columns([3, 1])[1]
@@ -882,7 +912,7 @@ with tab4:
     from collections import Counter
     
     # ดึงข้อมูลประวัติ
-    history = db.get_user_history(st.session_state.username)
+    history = db.get_user_history(st.session_state.username, include_result=False)
     
     if not history:
         st.info("📭 ยังไม่มีข้อมูลสำหรับสร้างกราฟ")
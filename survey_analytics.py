@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Survey analytics - วิเคราะห์แบบสอบถามความพึงพอใจด้วย NumPy
+
+โหลดคำตอบทั้งหมดเป็น response matrix (ผู้ตอบ × คำถาม, NaN = ไม่ได้ตอบ) ในรอบเดียว
+แล้วคำนวณแบบ vectorized:
+- ค่าเฉลี่ย / SD ต่อคำถามและต่อหมวด (หมวด = prefix ของ key เช่น usability_, benefits_)
+- Cronbach's alpha ของแต่ละหมวด (ความเชื่อมั่นของแบบสอบถาม)
+- เปรียบเทียบครูกับนักเรียน (ผลต่างค่าเฉลี่ย, Welch's t)
+- การกระจายของคะแนน 1-5
+
+ผลถูก cache ต่อ snapshot ของไฟล์ (get_survey_analytics) คำนวณใหม่เมื่อมีคำตอบใหม่เท่านั้น
+
+Usage:
+    python survey_analytics.py [satisfaction_data.json]
+"""
+
+import functools
+import math
+import os
+import sys
+import threading
+import warnings
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from survey_statistics import is_score
+
+# หมวดของแบบสอบถาม (ตามลำดับที่แสดง)
+CATEGORY_LABELS = {
+    "usability": "การใช้งาน",
+    "effectiveness": "ประสิทธิภาพ",
+    "benefits": "ประโยชน์",
+    "adoption": "การนำไปใช้",
+    "overall": "โดยรวม"
+}
+
+# คะแนน Likert ที่ใช้ใน histogram
+LIKERT_SCALE = (1, 2, 3, 4, 5)
+
+
+def _memoized(method):
+    """เก็บผลของเมธอดไว้ใน instance (ข้อมูลของ SurveyAnalytics ไม่เปลี่ยนหลังสร้าง)"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        if key not in self._memo:
+            self._memo[key] = method(self, *args, **kwargs)
+        return self._memo[key]
+    return wrapper
+
+
+def category_of(question_key: str) -> str:
+    """หมวดของคำถาม (ส่วนก่อน "_" แรก)"""
+    return question_key.split("_", 1)[0]
+
+
+class SurveyAnalytics:
+    """สถิติของแบบสอบถามจาก response matrix (สร้างครั้งเดียว อ่านอย่างเดียว)"""
+
+    def __init__(self, surveys: List[Dict]):
+        """
+        Args:
+            surveys: รายการแบบสอบถาม (จาก SatisfactionDatabase.get_all_surveys())
+        """
+        question_index: Dict[str, int] = {}
+        user_types = []
+        rows, columns, values = [], [], []
+
+        for row, survey in enumerate(surveys):
+            user_types.append(survey.get("user_type", ""))
+            for question_key, value in survey.get("responses", {}).items():
+                if is_score(value):
+                    rows.append(row)
+                    columns.append(question_index.setdefault(question_key, len(question_index)))
+                    values.append(value)
+
+        # เรียงคำถามตามหมวดแล้วตามลำดับที่พบ
+        order = sorted(question_index, key=lambda key: (self._category_rank(key), question_index[key]))
+        remap = np.empty(len(question_index), dtype=np.intp)
+        remap[[question_index[key] for key in order]] = np.arange(len(order))
+
+        self.questions: List[str] = order
+        self.user_types = np.array(user_types, dtype=object)
+        self.matrix = np.full((len(user_types), len(order)), np.nan)
+        if values:
+            self.matrix[np.array(rows), remap[np.array(columns)]] = values
+        self.categories: List[str] = list(dict.fromkeys(category_of(key) for key in order))
+        self._memo: Dict[tuple, Any] = {}
+
+    @staticmethod
+    def _category_rank(question_key: str) -> int:
+        category = category_of(question_key)
+        ranks = list(CATEGORY_LABELS)
+        return ranks.index(category) if category in ranks else len(ranks)
+
+    @property
+    def respondents(self) -> int:
+        return self.matrix.shape[0]
+
+    def _select(self, user_type: Optional[str] = None, category: Optional[str] = None) -> np.ndarray:
+        """sub-matrix ของประเภทผู้ใช้/หมวด (ตัดผู้ตอบที่ไม่ได้ตอบข้อใดในส่วนนั้นออก)"""
+        matrix = self.matrix
+        if user_type:
+            matrix = matrix[self.user_types == user_type]
+        if category:
+            matrix = matrix[:, [i for i, key in enumerate(self.questions) if category_of(key) == category]]
+        return matrix[~np.isnan(matrix).all(axis=1)] if matrix.size else matrix
+
+    @staticmethod
+    def _column_stats(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(จำนวนผู้ตอบ, ค่าเฉลี่ย, SD ของตัวอย่าง) ต่อคอลัมน์ โดยไม่นับ NaN"""
+        counts = np.sum(~np.isnan(matrix), axis=0)
+        with warnings.catch_warnings():
+            # คอลัมน์ที่ไม่มีผู้ตอบ / มีผู้ตอบคนเดียว
+            warnings.simplefilter("ignore", RuntimeWarning)
+            means = np.nanmean(matrix, axis=0)
+            stds = np.nanstd(matrix, axis=0, ddof=1)
+        return counts, means, np.where(counts > 1, stds, 0.0)
+
+    @_memoized
+    def question_summary(self, user_type: Optional[str] = None) -> Dict[str, Dict]:
+        """
+        ค่าเฉลี่ย/SD/จำนวนผู้ตอบต่อคำถาม
+
+        Returns:
+            {question_key: {"mean", "std", "count"}} เฉพาะคำถามที่มีผู้ตอบ
+        """
+        matrix = self._select(user_type)
+        if not matrix.size:
+            return {}
+        counts, means, stds = self._column_stats(matrix)
+        return {
+            key: {"mean": float(means[i]), "std": float(stds[i]), "count": int(counts[i])}
+            for i, key in enumerate(self.questions) if counts[i]
+        }
+
+    @_memoized
+    def cronbach_alpha(self, category: Optional[str] = None, user_type: Optional[str] = None) -> Optional[float]:
+        """
+        Cronbach's alpha ของคำถามในหมวด (None = ทุกคำถาม)
+
+        ใช้เฉพาะผู้ตอบที่ตอบครบทุกข้อในหมวด
+
+        Returns:
+            alpha หรือ None ถ้ามีคำถามน้อยกว่า 2 ข้อ ผู้ตอบครบน้อยกว่า 2 คน หรือคะแนนรวมไม่แปรผัน
+        """
+        matrix = self._select(user_type, category)
+        # ตัดคำถามที่กลุ่มนี้ไม่ได้ตอบเลย (เช่น คำถามเฉพาะของอีกกลุ่ม)
+        matrix = matrix[:, ~np.isnan(matrix).all(axis=0)]
+        if matrix.shape[1] < 2:
+            return None
+        complete = matrix[~np.isnan(matrix).any(axis=1)]
+        if complete.shape[0] < 2:
+            return None
+        k = complete.shape[1]
+        item_variance = complete.var(axis=0, ddof=1).sum()
+        total_variance = complete.sum(axis=1).var(ddof=1)
+        if total_variance == 0:
+            return None
+        return float(k / (k - 1) * (1 - item_variance / total_variance))
+
+    def _respondent_scores(self, user_type: Optional[str] = None, category: Optional[str] = None) -> np.ndarray:
+        """คะแนนเฉลี่ยของผู้ตอบแต่ละคนในหมวด (เฉพาะข้อที่ตอบ)"""
+        matrix = self._select(user_type, category)
+        if not matrix.size:
+            return np.empty(0)
+        return np.nanmean(matrix, axis=1)
+
+    @_memoized
+    def category_summary(self, user_type: Optional[str] = None) -> Dict[str, Dict]:
+        """
+        สถิติต่อหมวด
+
+        Returns:
+            {category: {"label", "mean", "std", "respondents", "questions", "alpha"}}
+            mean/std คำนวณจากคะแนนเฉลี่ยของผู้ตอบแต่ละคนในหมวด
+        """
+        summary = {}
+        for category in self.categories:
+            scores = self._respondent_scores(user_type, category)
+            if not scores.size:
+                continue
+            summary[category] = {
+                "label": CATEGORY_LABELS.get(category, category),
+                "mean": float(scores.mean()),
+                "std": float(scores.std(ddof=1)) if scores.size > 1 else 0.0,
+                "respondents": int(scores.size),
+                "questions": sum(1 for key in self.questions if category_of(key) == category),
+                "alpha": self.cronbach_alpha(category, user_type)
+            }
+        return summary
+
+    @_memoized
+    def overall_mean(self, user_type: Optional[str] = None) -> float:
+        """ค่าเฉลี่ยของคะแนนทุกข้อ"""
+        matrix = self._select(user_type)
+        return float(np.nanmean(matrix)) if matrix.size else 0.0
+
+    @_memoized
+    def score_distribution(self, user_type: Optional[str] = None) -> Dict[int, int]:
+        """จำนวนคะแนนแต่ละระดับ (1-5)"""
+        matrix = self._select(user_type)
+        values = matrix[~np.isnan(matrix)]
+        counts = np.bincount(np.rint(values).astype(np.intp), minlength=max(LIKERT_SCALE) + 1)
+        return {score: int(counts[score]) for score in LIKERT_SCALE}
+
+    @_memoized
+    def compare_groups(self, group_a: str = "teacher", group_b: str = "student") -> Dict[str, Dict]:
+        """
+        เปรียบเทียบสองกลุ่มผู้ใช้ในหมวดที่ทั้งสองกลุ่มตอบ (และ "all" = ทุกข้อ)
+
+        Returns:
+            {category: {"mean_a", "mean_b", "difference", "t", "df"}}
+            t และ df เป็นของ Welch's t-test (None ถ้าข้อมูลไม่พอ)
+        """
+        comparison = {}
+        for category in self.categories + ["all"]:
+            selected = None if category == "all" else category
+            a = self._respondent_scores(group_a, selected)
+            b = self._respondent_scores(group_b, selected)
+            if not a.size or not b.size:
+                continue
+            t, df = self._welch(a, b)
+            comparison[category] = {
+                "label": CATEGORY_LABELS.get(category, "ทั้งหมด" if category == "all" else category),
+                "mean_a": float(a.mean()),
+                "mean_b": float(b.mean()),
+                "difference": float(a.mean() - b.mean()),
+                "t": t,
+                "df": df
+            }
+        return comparison
+
+    @staticmethod
+    def _welch(a: np.ndarray, b: np.ndarray) -> Tuple[Optional[float], Optional[float]]:
+        if a.size < 2 or b.size < 2:
+            return None, None
+        va, vb = a.var(ddof=1) / a.size, b.var(ddof=1) / b.size
+        if va + vb == 0:
+            return None, None
+        t = (a.mean() - b.mean()) / math.sqrt(va + vb)
+        df = (va + vb) ** 2 / (va ** 2 / (a.size - 1) + vb ** 2 / (b.size - 1))
+        return float(t), float(df)
+
+
+_analytics: Dict[str, Tuple[Any, SurveyAnalytics]] = {}
+_analytics_lock = threading.Lock()
+
+
+def get_survey_analytics(db) -> SurveyAnalytics:
+    """
+    คืน SurveyAnalytics ของฐานข้อมูล (cache ภายใน process)
+
+    รายการ surveys มาจาก snapshot ของไฟล์ (read_json_snapshot) ซึ่งเป็น object เดิม
+    ตราบที่ไฟล์ไม่เปลี่ยน จึงใช้เป็น data version ได้โดยตรง
+
+    Args:
+        db: SatisfactionDatabase
+    """
+    surveys = db.get_all_surveys()
+    key = os.path.abspath(db.db_file)
+    with _analytics_lock:
+        cached = _analytics.get(key)
+        if cached is not None and cached[0] is surveys:
+            return cached[1]
+
+    analytics = SurveyAnalytics(surveys)
+    with _analytics_lock:
+        _analytics[key] = (surveys, analytics)
+    return analytics
+
+
+if __name__ == "__main__":
+    from satisfaction_database import SatisfactionDatabase
+
+    db_file = sys.argv[1] if len(sys.argv) >= 2 else "satisfaction_data.json"
+    analytics = get_survey_analytics(SatisfactionDatabase(db_file))
+    print(f"📋 {analytics.respondents} respondents, {len(analytics.questions)} questions")
+    for user_type in ("teacher", "student"):
+        print(f"\n[{user_type}] overall mean {analytics.overall_mean(user_type):.2f}")
+        for category, stats in analytics.category_summary(user_type).items():
+            alpha = f"{stats['alpha']:.3f}" if stats["alpha"] is not None else "-"
+            print(f"  {stats['label']:<12} mean {stats['mean']:.2f}  SD {stats['std']:.2f}  "
+                  f"n={stats['respondents']}  alpha={alpha}")
+    print("\n[teacher vs student]")
+    for category, stats in analytics.compare_groups().items():
+        t = f"{stats['t']:.2f}" if stats["t"] is not None else "-"
+        print(f"  {stats['label']:<12} {stats['mean_a']:.2f} vs {stats['mean_b']:.2f}  t={t}")
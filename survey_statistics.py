@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Survey statistics - สถิติแบบสอบถามแบบสะสม (running aggregates) ที่รวมกันได้
+
+เก็บต่อคำถาม: count, sum, sum of squares, min, max และ histogram ตามคะแนน Likert
+- อัพเดททีละคำตอบ ไม่ต้องเก็บรายการคะแนนทั้งหมด
+- รวมหลายชุดเข้าด้วยกันได้ (merge) เช่น ครู + นักเรียน หรือข้อมูลจากหลาย shard
+- ค่าเฉลี่ย, ส่วนเบี่ยงเบนมาตรฐาน และช่วงความเชื่อมั่น 95% คำนวณจาก aggregate โดยตรง
+
+รูปแบบที่บันทึกในไฟล์ (ต่อประเภทผู้ใช้):
+    {"responses": 12, "questions": {"usability_1": {"count": .., "sum": .., "sumsq": ..,
+                                                    "min": .., "max": .., "histogram": {"5": ..}}}}
+"""
+
+import math
+from typing import Dict, Iterable, Optional, Tuple
+
+# ค่าวิกฤต t (two-tailed, 95%) ตาม degrees of freedom; df มากกว่านี้ใช้ 1.96
+_T_CRITICAL_95 = (
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042
+)
+
+
+def is_score(value) -> bool:
+    """ค่าที่นับเป็นคะแนน (ตัวเลขที่มากกว่า 0 ตามเกณฑ์เดิมของแบบสอบถาม)"""
+    return isinstance(value, (int, float)) and value > 0
+
+
+class RunningStats:
+    """สถิติสะสมของคะแนนชุดหนึ่ง (ไม่เก็บคะแนนรายตัว)"""
+
+    __slots__ = ("count", "total", "sumsq", "minimum", "maximum", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.sumsq = 0.0
+        self.minimum: Optional[float] = None
+        self.maximum: Optional[float] = None
+        self.histogram: Dict[str, int] = {}
+
+    def add(self, value: float):
+        """เพิ่มคะแนนหนึ่งค่า"""
+        self.count += 1
+        self.total += value
+        self.sumsq += value * value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        # histogram นับเฉพาะคะแนนจำนวนเต็ม (ระดับ Likert)
+        if float(value).is_integer():
+            key = str(int(value))
+            self.histogram[key] = self.histogram.get(key, 0) + 1
+
+    def merge(self, other: "RunningStats") -> "RunningStats":
+        """รวมสถิติอีกชุดเข้ามา (แก้ไขตัวเองและคืนตัวเอง)"""
+        if not other.count:
+            return self
+        self.count += other.count
+        self.total += other.total
+        self.sumsq += other.sumsq
+        self.minimum = other.minimum if self.minimum is None else min(self.minimum, other.minimum)
+        self.maximum = other.maximum if self.maximum is None else max(self.maximum, other.maximum)
+        for key, n in other.histogram.items():
+            self.histogram[key] = self.histogram.get(key, 0) + n
+        return self
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def variance(self) -> float:
+        """ความแปรปรวนของตัวอย่าง (n - 1)"""
+        if self.count < 2:
+            return 0.0
+        # ปัดค่าติดลบเล็กน้อยจาก floating point
+        return max((self.sumsq - self.total * self.total / self.count) / (self.count - 1), 0.0)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    def confidence_interval(self) -> Tuple[float, float]:
+        """ช่วงความเชื่อมั่น 95% ของค่าเฉลี่ย (t-distribution)"""
+        if self.count < 2:
+            return (self.mean, self.mean)
+        df = self.count - 1
+        t = _T_CRITICAL_95[df - 1] if df <= len(_T_CRITICAL_95) else 1.96
+        margin = t * self.std / math.sqrt(self.count)
+        return (self.mean - margin, self.mean + margin)
+
+    def to_dict(self) -> Dict:
+        """รูปแบบสำหรับบันทึกลงไฟล์"""
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "sumsq": self.sumsq,
+            "min": self.minimum,
+            "max": self.maximum,
+            "histogram": dict(self.histogram)
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RunningStats":
+        stats = cls()
+        stats.count = data.get("count", 0)
+        stats.total = data.get("sum", 0.0)
+        stats.sumsq = data.get("sumsq", 0.0)
+        stats.minimum = data.get("min")
+        stats.maximum = data.get("max")
+        stats.histogram = dict(data.get("histogram", {}))
+        return stats
+
+    def summary(self) -> Dict:
+        """สถิติสำหรับแสดงผล/ส่งออก"""
+        low, high = self.confidence_interval()
+        return {
+            "mean": self.mean,
+            "std": self.std,
+            "ci95": [low, high],
+            "min": self.minimum,
+            "max": self.maximum,
+            "count": self.count,
+            "histogram": dict(self.histogram)
+        }
+
+
+def empty_group() -> Dict:
+    """aggregate ว่างของผู้ใช้หนึ่งประเภท"""
+    return {"responses": 0, "questions": {}}
+
+
+def add_response(group: Dict, responses: Dict):
+    """
+    เพิ่มคำตอบหนึ่งชุดลงใน aggregate (แก้ไข group โดยตรง)
+
+    Args:
+        group: aggregate ของประเภทผู้ใช้ (รูปแบบ empty_group())
+        responses: คำตอบ {question_key: value}
+    """
+    group["responses"] = group.get("responses", 0) + 1
+    questions = group.setdefault("questions", {})
+    for question_key, value in responses.items():
+        if is_score(value):
+            stats = RunningStats.from_dict(questions.get(question_key, {}))
+            stats.add(value)
+            questions[question_key] = stats.to_dict()
+
+
+def merge_groups(groups: Iterable[Dict]) -> Dict:
+    """
+    รวม aggregate หลายชุด (เช่น หลายประเภทผู้ใช้ หรือหลาย shard)
+
+    Returns:
+        aggregate ใหม่รูปแบบเดียวกับ empty_group()
+    """
+    responses = 0
+    merged: Dict[str, RunningStats] = {}
+    for group in groups:
+        responses += group.get("responses", 0)
+        for question_key, data in group.get("questions", {}).items():
+            merged.setdefault(question_key, RunningStats()).merge(RunningStats.from_dict(data))
+    return {
+        "responses": responses,
+        "questions": {key: stats.to_dict() for key, stats in merged.items()}
+    }
+
+
+def build_aggregates(surveys: Iterable[Dict]) -> Dict[str, Dict]:
+    """
+    สร้าง aggregate ใหม่ทั้งหมดจากรายการแบบสอบถาม (ใช้ตอนย้ายไฟล์เดิม/ซ่อมข้อมูล)
+
+    Returns:
+        {user_type: aggregate}
+    """
+    aggregates: Dict[str, Dict] = {}
+    for survey in surveys:
+        group = aggregates.setdefault(survey.get("user_type", ""), empty_group())
+        add_response(group, survey.get("responses", {}))
+    return aggregates
+
+
+def summarize(group: Dict) -> Dict:
+    """
+    แปลง aggregate เป็นสถิติสำหรับแสดงผล (O(จำนวนคำถาม))
+
+    Returns:
+        {"total_responses", "categories": {question_key: summary}, "overall_mean", "overall_std"}
+        หรือ {} ถ้ายังไม่มีคำตอบ
+    """
+    if not group.get("responses"):
+        return {}
+
+    overall = RunningStats()
+    categories = {}
+    for question_key, data in group.get("questions", {}).items():
+        stats = RunningStats.from_dict(data)
+        if stats.count:
+            categories[question_key] = stats.summary()
+            overall.merge(stats)
+
+    return {
+        "total_responses": group["responses"],
+        "categories": categories,
+        "overall_mean": overall.mean,
+        "overall_std": overall.std
+    }
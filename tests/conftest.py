@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""โมดูลของโปรเจกต์อยู่ที่โฟลเดอร์หลัก (รันด้วย python -m pytest tests)"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
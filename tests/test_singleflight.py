@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""คำขอเหมือนกันที่มาพร้อมกันต้องเรียก upstream ครั้งเดียว และ error ต้องถึงผู้รอทุกคน"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight, flight_key
+
+N = 50
+KEY = flight_key("fake-model", "template.pdf")
+
+
+class Upstream:
+    """model จำลองที่นับจำนวนครั้งที่ถูกเรียก"""
+
+    def __init__(self, delay: float = 0.2, error: BaseException = None):
+        self.calls = 0
+        self.delay = delay
+        self.error = error
+        self._lock = threading.Lock()
+
+    def _count(self):
+        with self._lock:
+            self.calls += 1
+
+    def call(self) -> str:
+        self._count()
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return "result"
+
+    async def call_async(self) -> str:
+        self._count()
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return "result"
+
+    def stream(self):
+        self._count()
+        for word in ("a ", "b ", "c "):
+            time.sleep(self.delay / 3)
+            yield word
+        if self.error is not None:
+            raise self.error
+
+    async def stream_async(self):
+        self._count()
+        for word in ("a ", "b ", "c "):
+            await asyncio.sleep(self.delay / 3)
+            yield word
+        if self.error is not None:
+            raise self.error
+
+
+def run_threads(target):
+    """รัน target() พร้อมกัน N thread คืนผลหรือ exception ของแต่ละ thread"""
+    barrier = threading.Barrier(N)
+    outcomes = []
+    lock = threading.Lock()
+
+    def worker():
+        barrier.wait()
+        try:
+            outcome = target()
+        except Exception as e:
+            outcome = e
+        with lock:
+            outcomes.append(outcome)
+
+    threads = [threading.Thread(target=worker) for _ in range(N)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(outcomes) == N
+    return outcomes
+
+
+@pytest.fixture(autouse=True)
+def no_executor_threads(monkeypatch):
+    """ผู้รอแบบ async ต้องไม่ใช้ thread ของ default executor"""
+    def forbidden(*args, **kwargs):
+        raise AssertionError("singleflight waiter used asyncio.to_thread")
+    monkeypatch.setattr(asyncio, "to_thread", forbidden)
+
+
+def test_do_threads_single_upstream_call():
+    flight, upstream = SingleFlight(), Upstream()
+    outcomes = run_threads(lambda: flight.do(KEY, upstream.call))
+    assert upstream.calls == 1
+    assert outcomes == ["result"] * N
+    assert flight.get_stats() == {"in_flight": 0, "leaders": 1, "coalesced": N - 1}
+
+
+def test_do_error_reaches_every_waiter():
+    flight, upstream = SingleFlight(), Upstream(error=RuntimeError("quota"))
+    outcomes = run_threads(lambda: flight.do(KEY, upstream.call))
+    assert upstream.calls == 1
+    assert all(isinstance(o, RuntimeError) and str(o) == "quota" for o in outcomes)
+
+
+def test_do_async_single_upstream_call():
+    flight, upstream = SingleFlight(), Upstream()
+
+    async def main():
+        return await asyncio.gather(*[flight.do_async(KEY, upstream.call_async) for _ in range(N)])
+
+    assert asyncio.run(main()) == ["result"] * N
+    assert upstream.calls == 1
+
+
+def test_do_async_error_reaches_every_waiter():
+    flight, upstream = SingleFlight(), Upstream(error=RuntimeError("quota"))
+
+    async def main():
+        return await asyncio.gather(*[flight.do_async(KEY, upstream.call_async) for _ in range(N)],
+                                    return_exceptions=True)
+
+    outcomes = asyncio.run(main())
+    assert upstream.calls == 1
+    assert all(isinstance(o, RuntimeError) for o in outcomes)
+
+
+def test_stream_threads_single_upstream_call():
+    flight, upstream = SingleFlight(), Upstream()
+    outcomes = run_threads(lambda: "".join(flight.stream(KEY, upstream.stream)))
+    assert upstream.calls == 1
+    assert outcomes == ["a b c "] * N
+
+
+def test_stream_error_reaches_every_reader():
+    flight, upstream = SingleFlight(), Upstream(error=RuntimeError("model broke"))
+    outcomes = run_threads(lambda: list(flight.stream(KEY, upstream.stream)))
+    assert upstream.calls == 1
+    assert all(isinstance(o, RuntimeError) for o in outcomes)
+
+
+def test_stream_async_single_upstream_call():
+    flight, upstream = SingleFlight(), Upstream()
+
+    async def read():
+        return "".join([chunk async for chunk in flight.stream_async(KEY, upstream.stream_async)])
+
+    async def main():
+        return await asyncio.gather(*[read() for _ in range(N)])
+
+    assert asyncio.run(main()) == ["a b c "] * N
+    assert upstream.calls == 1
+
+
+def test_stream_async_error_reaches_every_reader():
+    flight, upstream = SingleFlight(), Upstream(error=RuntimeError("model broke"))
+
+    async def read():
+        return [chunk async for chunk in flight.stream_async(KEY, upstream.stream_async)]
+
+    async def main():
+        return await asyncio.gather(*[read() for _ in range(N)], return_exceptions=True)
+
+    outcomes = asyncio.run(main())
+    assert upstream.calls == 1
+    assert all(isinstance(o, RuntimeError) for o in outcomes)
+
+
+def test_async_readers_on_other_loops_follow_thread_leader():
+    """ผู้อ่าน async หลาย event loop ตามการ stream ของ leader ที่ผลิตใน thread"""
+    flight, upstream = SingleFlight(), Upstream(delay=0.3)
+    leader = flight.stream(KEY, upstream.stream)
+
+    async def read():
+        return "".join([chunk async for chunk in flight.stream_async(KEY, upstream.stream_async)])
+
+    outcomes = run_threads(lambda: asyncio.run(read()))
+    assert "".join(leader) == "a b c "
+    assert upstream.calls == 1
+    assert outcomes == ["a b c "] * N
+
+
+def test_cancelled_async_reader_does_not_block_others():
+    flight, upstream = SingleFlight(), Upstream(delay=0.3)
+
+    async def read():
+        return "".join([chunk async for chunk in flight.stream_async(KEY, upstream.stream_async)])
+
+    async def main():
+        quitter = asyncio.ensure_future(read())
+        readers = [asyncio.ensure_future(read()) for _ in range(N - 1)]
+        await asyncio.sleep(0.05)
+        quitter.cancel()
+        return await asyncio.gather(*readers)
+
+    assert asyncio.run(main()) == ["a b c "] * (N - 1)
+    assert upstream.calls == 1
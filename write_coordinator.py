@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Write coordination for JSON / log files shared between processes
+
+หลาย Streamlit session และ process ของ api_server เขียนไฟล์เดียวกันพร้อมกัน
+โมดูลนี้รวมเครื่องมือกันข้อมูลหาย:
+- FileLock: advisory lock ข้าม process (fcntl บน Linux/macOS, msvcrt บน Windows)
+- atomic_write_json: เขียนไฟล์ชั่วคราวแล้ว os.replace (ไม่มีไฟล์ครึ่งๆ กลางๆ)
+- update_json: read-modify-write ภายใต้ lock
+- GroupCommitter: รวมการเขียนต่อท้ายจากหลาย thread เป็น write + fsync ครั้งเดียว
+- read_json_snapshot: cache ของไฟล์ที่ parse แล้ว (parse ใหม่เมื่อ mtime/size/inode เปลี่ยนเท่านั้น)
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    Advisory lock ข้าม process บนไฟล์ <path>.lock
+
+    ใช้ซ้อนกันใน thread เดียวกันได้ (re-entrant) และกัน thread อื่นใน process เดียวกันด้วย
+    ควรสร้างผ่าน file_lock() เพื่อให้ทุกส่วนของ process ใช้ lock ตัวเดียวกัน
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        """
+        Args:
+            path: ไฟล์ที่ต้องการป้องกัน (lock จริงอยู่ที่ <path>.lock)
+            timeout: เวลารอสูงสุด (วินาที) ก่อนยกเลิกด้วย TimeoutError
+        """
+        self.lock_path = path + ".lock"
+        self.timeout = timeout
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._handle = None
+
+    def acquire(self):
+        if not self._thread_lock.acquire(timeout=self.timeout):
+            raise TimeoutError(f"Timed out waiting for {self.lock_path}")
+        if self._depth == 0:
+            try:
+                self._acquire_os_lock()
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._release_os_lock()
+        self._thread_lock.release()
+
+    def _acquire_os_lock(self):
+        lock_dir = os.path.dirname(self.lock_path)
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        handle = open(self.lock_path, 'a+b')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                self._handle = handle
+                return
+            except OSError:
+                if time.monotonic() >= deadline:
+                    handle.close()
+                    raise TimeoutError(f"Timed out waiting for {self.lock_path}")
+                time.sleep(0.005)
+
+    def _release_os_lock(self):
+        handle, self._handle = self._handle, None
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            handle.close()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+_locks: Dict[str, FileLock] = {}
+_locks_guard = threading.Lock()
+
+
+def file_lock(path: str) -> FileLock:
+    """คืน FileLock ที่ใช้ร่วมกันภายใน process สำหรับไฟล์นี้"""
+    key = os.path.abspath(path)
+    with _locks_guard:
+        if key not in _locks:
+            _locks[key] = FileLock(key)
+        return _locks[key]
+
+
+def read_json(path: str, default: Any = None) -> Any:
+    """อ่านไฟล์ JSON (คืน default ถ้าไม่มีไฟล์หรือไฟล์เสีย)"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, FileNotFoundError):
+        return default
+
+
+class ReadOnlyDict(dict):
+    """dict ที่แก้ไขไม่ได้ (ข้อมูลใน snapshot ใช้ร่วมกันทุก session) ใช้ thaw() เมื่อต้องการแก้"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("JSON snapshot is read-only; use thaw() to get a mutable copy")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+class ReadOnlyList(list):
+    """list ที่แก้ไขไม่ได้ (ข้อมูลใน snapshot ใช้ร่วมกันทุก session) ใช้ thaw() เมื่อต้องการแก้"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("JSON snapshot is read-only; use thaw() to get a mutable copy")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return ReadOnlyDict((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return ReadOnlyList(_freeze(v) for v in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """สำเนาที่แก้ไขได้ของข้อมูลจาก read_json_snapshot"""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
+
+
+class JsonSnapshotCache:
+    """
+    cache ของไฟล์ JSON ที่ parse แล้วภายใน process
+
+    ตรวจทุกครั้งด้วย os.stat: ถ้า (mtime, size, inode) ไม่เปลี่ยนจะคืน snapshot เดิมโดยไม่อ่านไฟล์
+    atomic_write_json ใช้ os.replace (inode ใหม่) การเขียนจาก process อื่นจึงถูกตรวจพบเสมอ
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[tuple, Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _signature(path: str) -> Optional[tuple]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def get(self, path: str, default: Any = None) -> Any:
+        """
+        คืนข้อมูลของไฟล์แบบอ่านอย่างเดียว (ReadOnlyDict / ReadOnlyList)
+
+        Args:
+            path: ไฟล์ JSON
+            default: ค่าที่คืนถ้าไม่มีไฟล์หรือไฟล์เสีย (ไม่ถูก cache)
+        """
+        key = os.path.abspath(path)
+        signature = self._signature(key)
+        if signature is None:
+            return default
+
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached[0] == signature:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        data = read_json(key, None)
+        if data is None:
+            return default
+        snapshot = _freeze(data)
+        with self._lock:
+            # ไฟล์อาจถูกเขียนระหว่างอ่าน: เก็บเฉพาะเมื่อ signature ยังตรงกับที่อ่านได้
+            if self._signature(key) == signature:
+                self._entries[key] = (signature, snapshot)
+        return snapshot
+
+    def invalidate(self, path: Optional[str] = None):
+        """ลบ snapshot ของไฟล์ (None = ทุกไฟล์)"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(path), None)
+
+    def get_stats(self) -> Dict:
+        """สถิติของ cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "files": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+
+_snapshot_cache = JsonSnapshotCache()
+
+
+def get_snapshot_cache() -> JsonSnapshotCache:
+    """คืน JsonSnapshotCache ที่ใช้ร่วมกันภายใน process"""
+    return _snapshot_cache
+
+
+def read_json_snapshot(path: str, default: Any = None) -> Any:
+    """
+    อ่านไฟล์ JSON ผ่าน cache ของ process (parse ใหม่เมื่อไฟล์เปลี่ยนเท่านั้น)
+
+    ข้อมูลที่ได้แก้ไขไม่ได้ สำหรับ read-modify-write ให้ใช้ update_json หรือ read_json
+    """
+    return _snapshot_cache.get(path, default)
+
+
+def atomic_write_json(path: str, data: Any, indent: Optional[int] = 2):
+    """
+    เขียน JSON แบบ atomic: เขียนไฟล์ชั่วคราวในโฟลเดอร์เดียวกัน fsync แล้ว os.replace
+
+    ผู้อ่านจะเห็นไฟล์เก่าทั้งไฟล์หรือไฟล์ใหม่ทั้งไฟล์เท่านั้น
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    _replace(tmp_path, path)
+    _snapshot_cache.invalidate(path)
+
+
+def _replace(src: str, dst: str, attempts: int = 20):
+    """os.replace ที่ลองซ้ำ (บน Windows จะล้มเหลวชั่วคราวถ้ามีผู้อ่านเปิดไฟล์ค้างไว้)"""
+    for attempt in range(attempts):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.01 * (attempt + 1))
+
+
+def update_json(path: str, mutate: Callable[[Any], Any], default: Any = None) -> Any:
+    """
+    read-modify-write ไฟล์ JSON ภายใต้ file lock
+
+    Args:
+        path: ไฟล์ JSON
+        mutate: ฟังก์ชันที่แก้ไขข้อมูล (แก้ในที่ได้) ค่าที่คืนจะถูกส่งต่อให้ผู้เรียก
+        default: ข้อมูลเริ่มต้นถ้ายังไม่มีไฟล์
+
+    Returns:
+        ค่าที่ mutate คืนมา
+    """
+    with file_lock(path):
+        data = read_json(path, default)
+        result = mutate(data)
+        atomic_write_json(path, data)
+        return result
+
+
+class GroupCommitter:
+    """
+    รวมการเขียนต่อท้ายไฟล์จากหลาย thread เป็น batch เดียว (group commit)
+
+    thread แรกที่เข้ามาเป็น leader: ถือ file lock, เขียนทุกรายการที่รอคิวด้วย write ครั้งเดียว
+    แล้ว fsync ครั้งเดียว; thread อื่นที่มาระหว่างนั้นรอผลจาก batch ถัดไป
+    """
+
+    def __init__(self, lock: FileLock, path_provider: Callable[[], str], fsync: bool = True):
+        """
+        Args:
+            lock: lock ข้าม process ที่ต้องถือขณะเขียน
+            path_provider: ฟังก์ชันคืน path ไฟล์ที่จะเขียน (เรียกภายใต้ lock)
+            fsync: fsync หลังเขียนแต่ละ batch
+        """
+        self.lock = lock
+        self.path_provider = path_provider
+        self.fsync = fsync
+        self._cond = threading.Condition()
+        self._pending: List[bytes] = []
+        # หมายเลข batch ที่รายการใน _pending จะถูกเขียน และจำนวน batch ที่เขียนเสร็จแล้ว
+        self._pending_batch = 0
+        self._completed = 0
+        self._leader_active = False
+        self._errors: Dict[int, BaseException] = {}
+        self.batches = 0
+        self.records = 0
+
+    def append(self, data: bytes):
+        """เขียนต่อท้ายและรอจนข้อมูลลงดิสก์ (fsync) แล้ว"""
+        with self._cond:
+            self._pending.append(data)
+            ticket = self._pending_batch
+            while True:
+                if self._completed > ticket:
+                    error = self._errors.get(ticket)
+                    if error is not None:
+                        raise error
+                    return
+                if not self._leader_active:
+                    self._leader_active = True
+                    batch, self._pending = self._pending, []
+                    self._pending_batch += 1
+                    break
+                self._cond.wait()
+
+        # leader: batch นี้มีรายการของตัวเอง (ticket) และของทุก thread ที่รออยู่
+        error = None
+        try:
+            self._write_batch(batch)
+        except BaseException as e:
+            error = e
+        finally:
+            with self._cond:
+                if error is not None:
+                    self._errors[ticket] = error
+                self._errors.pop(ticket - 8, None)
+                self._completed = ticket + 1
+                self._leader_active = False
+                self._cond.notify_all()
+        if error is not None:
+            raise error
+
+    def _write_batch(self, batch: List[bytes]):
+        with self.lock:
+            with open(self.path_provider(), 'ab') as f:
+                f.write(b"".join(batch))
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+        self.batches += 1
+        self.records += len(batch)